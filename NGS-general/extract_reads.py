@@ -28,19 +28,15 @@ Recognises FASTQ, CSFASTA and QUAL files.
 
 import sys
 import os
-import gzip
 import optparse
-import random
-import re
-from bcftbx.ngsutils import getreads
-from bcftbx.ngsutils import getreads_subset
 from bcftbx.ngsutils import getreads_regex
+from bcftbx.ngsutils import getreads_sample
 
 #######################################################################
 # Module metadata
 #######################################################################
 
-__version__ = "0.2.0"
+__version__ = "0.3.1"
 
 __description__ = """Extract subsets of reads from each of the
 supplied files according to specified criteria (e.g. random,
@@ -67,7 +63,8 @@ def main(args=None):
                  "If multiple files are supplied (e.g. R1/R2 pair) then "
                  "the same subsets will be extracted for each. "
                  "(Optionally a percentage can be supplied instead e.g. "
-                 "'50%' to extract a subset of half the reads.)")
+                 "'50%' to extract a subset of approximately half the "
+                 "reads.) The input files are only read once.")
     p.add_option('-s','--seed',action='store',dest='seed',default=None,
                  help="specify seed for random number generator (used "
                  "for -n option; using the same seed should produce the "
@@ -91,41 +88,61 @@ def main(args=None):
                 for read in getreads_regex(f,opts.pattern):
                     fp.write('\n'.join(read) + '\n')
     else:
-        # Seed random number generator
-        if opts.seed is not None:
-            random.seed(opts.seed)
-        # Count the reads
-        nreads = sum(1 for i in getreads(args[0]))
-        print "Number of reads: %s" % nreads
-        if len(args) > 1:
-            print "Verifying read numbers match between files"
-        for f in args[1:]:
-            if sum(1 for i in getreads(f)) != nreads:
-                print "Inconsistent numbers of reads between files"
-                sys.exit(1)
-        # Generate a subset of read indices to extract
+        # Set the size of the sample
+        nsubset = None
+        fraction = None
         try:
             nsubset = int(opts.n)
         except ValueError:
             if str(opts.n).endswith('%'):
-                nsubset = int(float(opts.n[:-1])*nreads/100.0)
-        if nsubset > nreads:
-            print "Requested subset (%s) is larger than file (%s)" % (nsubset,
-                                                                      nreads)
-            sys.exit(1)
-        print "Generating set of %s random indices" % nsubset
-        subset_indices = random.sample(xrange(nreads),nsubset)
-        # Extract the reads to separate files
+                fraction = float(opts.n[:-1])/100.0
+            else:
+                p.error("Bad value for -n: '%s'" % opts.n)
+        # Open the output files
+        # (for a percentage the number of reads isn't known until
+        # they have been extracted, so write to temporary files
+        # which are renamed at the end)
+        outfiles = []
         for f in args:
             if f.endswith('.gz'):
                 outfile = os.path.basename(os.path.splitext(f[:-3])[0])
             else:
                 outfile = os.path.basename(os.path.splitext(f)[0])
-            outfile += '.subset_%s.fq' % nsubset
-            print "Extracting to %s" % outfile
-            with open(outfile,'w') as fp:
-                for read in getreads_subset(f,subset_indices):
+            if nsubset is not None:
+                outfile += '.subset_%s.fq' % nsubset
+            else:
+                outfile += '.subset.fq.part'
+            outfiles.append(outfile)
+        if len(args) > 1:
+            print "Sampling the same reads from each file"
+        if nsubset is not None:
+            print "Sampling %s random reads" % nsubset
+        else:
+            print "Sampling %s%% of reads at random" % opts.n[:-1]
+        # Extract the reads to separate files in a single pass
+        fps = [open(filen,'w') for filen in outfiles]
+        nreads = 0
+        try:
+            for reads in getreads_sample(args,n=nsubset,fraction=fraction,
+                                         seed=opts.seed):
+                for fp,read in zip(fps,reads):
                     fp.write('\n'.join(read) + '\n')
+                nreads += 1
+        except Exception as ex:
+            for fp,outfile in zip(fps,outfiles):
+                fp.close()
+                os.remove(outfile)
+            print "%s" % ex
+            sys.exit(1)
+        for fp,outfile in zip(fps,outfiles):
+            fp.close()
+            if nsubset is None:
+                # Rename to reflect the actual number of reads
+                filen = outfile
+                outfile = "%s.subset_%s.fq" % (filen[:-len('.subset.fq.part')],
+                                               nreads)
+                os.rename(filen,outfile)
+            print "Extracted %s reads to %s" % (nreads,outfile)
 
 if __name__ == "__main__":
     main()
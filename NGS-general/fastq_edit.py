@@ -9,7 +9,7 @@
 #
 ########################################################################
 
-__version__ = "0.0.2"
+__version__ = "0.0.4"
 
 """fastq_edit.py
 
@@ -21,6 +21,8 @@ Options:
   --version             show program's version number and exit
   -h, --help            show this help message and exit
   --stats               Generate basic stats for input FASTQ
+  -n N_PROCESSORS       specify number of cores to use for --stats
+                        (default: all available)
   --instrument-name=INSTRUMENT_NAME
                         Update the 'instrument name' in the sequence
                         identifier part of each read record and write updated
@@ -41,6 +43,7 @@ SHARE_DIR = os.path.abspath(
         os.path.join(os.path.dirname(sys.argv[0]),'..')))
 sys.path.append(SHARE_DIR)
 import bcftbx.FASTQFile as FASTQFile
+import bcftbx.fastqmapreduce as fastqmapreduce
 
 #######################################################################
 # Functions
@@ -62,14 +65,72 @@ def edit_instrument_name(fastq_file,new_instrument_name):
         # Echo updated read to stdout
         print read
 
-def stats(fastq_file):
+def stats(fastq_file,n_processors=None):
     """Generate basic stats from FASTQ file
+
+    The FASTQ is split into chunks which are processed in
+    parallel, using the batched (numpy-based) FASTQ reader if
+    numpy is available, otherwise looping over the reads one by
+    one.
     """
-    # Loop over all reads in the FASTQ
+    n_reads,read_lengths,index_sequences = \
+        fastqmapreduce.fastq_map_reduce(fastq_file,
+                                        stats_for_chunk,
+                                        merge_stats,
+                                        nprocs=n_processors)
+    # Finished
+    print "Total reads: %d" % n_reads
+    print "Read lengths"
+    for len_ in sorted(read_lengths):
+        print "\t%d: %d" % (len_,read_lengths[len_])
+    print "Index sequences"
+    for seq in sorted(index_sequences):
+        print "\t%s: %d" % (seq,index_sequences[seq])
+
+def stats_for_chunk(chunk):
+    """Collect basic stats for a chunk of reads from a FASTQ file
+
+    Returns:
+      Tuple (n_reads,read_lengths,index_sequences) where
+      'read_lengths' and 'index_sequences' are dictionaries
+      mapping lengths and index sequences to read counts.
+    """
+    try:
+        return stats_from_batches(chunk.batches())
+    except ImportError:
+        return stats_from_reads(chunk.reads())
+
+def merge_stats(stats1,stats2):
+    """Combine two sets of stats from 'stats_for_chunk'
+
+    Returns:
+      Tuple (n_reads,read_lengths,index_sequences) with the
+      combined counts.
+    """
+    n_reads = stats1[0] + stats2[0]
+    read_lengths = dict(stats1[1])
+    for read_len,count in stats2[1].iteritems():
+        read_lengths[read_len] = read_lengths.get(read_len,0) + count
+    index_sequences = dict(stats1[2])
+    for index_seq,count in stats2[2].iteritems():
+        index_sequences[index_seq] = index_sequences.get(index_seq,0) + count
+    return (n_reads,read_lengths,index_sequences)
+
+def stats_from_reads(reads):
+    """Collect basic stats by looping over reads one by one
+
+    Arguments:
+      reads: iterable returning FastqRead instances
+
+    Returns:
+      Tuple (n_reads,read_lengths,index_sequences), as for the
+      'stats_for_chunk' function.
+    """
+    # Loop over all reads
     n_reads = 0
     read_lengths = {}
     index_sequences = {}
-    for read in FASTQFile.FastqIterator(fastq_file):
+    for read in reads:
         # Count of reads
         n_reads += 1
         # Read length distribution
@@ -85,14 +146,34 @@ def stats(fastq_file):
                 index_sequences[index_seq] += 1
             else:
                 index_sequences[index_seq] = 1
-    # Finished
-    print "Total reads: %d" % n_reads
-    print "Read lengths"
-    for len_ in read_lengths:
-        print "\t%d: %d" % (len_,read_lengths[len_])
-    print "Index sequences"
-    for seq in index_sequences:
-        print "\t%s: %d" % (seq,index_sequences[seq])
+    return (n_reads,read_lengths,index_sequences)
+
+def stats_from_batches(batches):
+    """Collect basic stats using batches of reads
+
+    Arguments:
+      batches: iterable returning FastqBatch instances
+
+    Returns:
+      Tuple (n_reads,read_lengths,index_sequences), as for the
+      'stats_for_chunk' function.
+    """
+    n_reads = 0
+    read_lengths = {}
+    index_sequences = {}
+    for batch in batches:
+        n_reads += batch.nreads
+        # Read length distribution
+        for read_len,count in enumerate(batch.length_counts()):
+            if count:
+                read_lengths[read_len] = read_lengths.get(read_len,0) + \
+                                         int(count)
+        # Tag name distribution
+        for index_seq,count in batch.index_sequence_counts().iteritems():
+            if index_seq is not None:
+                index_sequences[index_seq] = \
+                    index_sequences.get(index_seq,0) + count
+    return (n_reads,read_lengths,index_sequences)
 
 #######################################################################
 # Main program
@@ -107,6 +188,10 @@ if __name__ == "__main__":
                               "Perform various operations on FASTQ file.")
     p.add_option('--stats',action='store_true',dest='do_stats',default=False,
                  help="Generate basic stats for input FASTQ")
+    p.add_option('-n',action='store',dest='n_processors',
+                 default=None,type='int',
+                 help="specify number of cores to use for --stats "
+                 "(default: all available)")
     p.add_option('--instrument-name',action='store',dest='instrument_name',default=None,
                  help="Update the 'instrument name' in the sequence identifier part of each read "
                  "record and write updated FASTQ file to stdout")
@@ -130,4 +215,4 @@ if __name__ == "__main__":
 
     # Generate the stats
     if do_stats:
-        stats(fastq)
+        stats(fastq,n_processors=options.n_processors)
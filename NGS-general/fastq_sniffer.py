@@ -9,11 +9,11 @@
 #
 ########################################################################
 
-__version__ = "0.0.2"
+__version__ = "0.0.5"
 
 """fastq_sniffer.py
 
-Usage: fastq_sniffer.py [ --subset N ] <fastq_file>
+Usage: fastq_sniffer.py [ --subset N ] [ -n N_PROCESSORS ] <fastq_file>
 
 "Sniff" FASTQ file to try and determine likely format and quality encoding.
 
@@ -33,6 +33,103 @@ SHARE_DIR = os.path.abspath(
         os.path.join(os.path.dirname(sys.argv[0]),'..')))
 sys.path.append(SHARE_DIR)
 import bcftbx.FASTQFile as FASTQFile
+import bcftbx.fastqmeta as fastqmeta
+
+#######################################################################
+# Functions
+#######################################################################
+
+def quality_range(fastq_file,n_subset=None,n_processors=None):
+    """Determine min/max quality for a FASTQ file
+
+    If all the reads are to be examined then the values are
+    taken from the cached metadata for the FASTQ (which is
+    generated by processing the file in parallel chunks if
+    necessary; see the 'fastqmeta' module).
+
+    Arguments:
+      fastq_file: FASTQ file to examine
+      n_subset: if not None then only examine this number of
+        reads from the start of the file
+      n_processors: number of cores to use (default: all
+        available)
+
+    Returns:
+      Tuple (n_reads,(min_qual,max_qual)) where the min and max
+      quality values are integer character codes.
+    """
+    if n_subset is None:
+        metadata = fastqmeta.get_metadata(fastq_file,nprocs=n_processors)
+        return (metadata.nreads,(metadata.min_quality,
+                                 metadata.max_quality))
+    try:
+        return quality_range_from_batches(fastq_file,n_subset)
+    except ImportError:
+        return quality_range_from_reads(fastq_file,n_subset)
+
+def quality_range_from_reads(fastq_file=None,n_subset=None,fp=None):
+    """Determine min/max quality by looping over reads one by one
+
+    Arguments:
+      fastq_file: FASTQ file to examine
+      n_subset: if not None then only examine this number of
+        reads from the start of the file
+      fp: file-like object to read FASTQ data from (alternative
+        to 'fastq_file')
+
+    Returns:
+      Tuple (n_reads,(min_qual,max_qual)) where the min and max
+      quality values are integer character codes.
+    """
+    n_reads = 0
+    min_max_qual = (None,None)
+    for read in FASTQFile.FastqIterator(fastq_file=fastq_file,fp=fp):
+        n_reads += 1
+        if min_max_qual == (None,None):
+            min_max_qual = (ord(read.minquality),ord(read.maxquality))
+        else:
+            min_max_qual = (min(min_max_qual[0],ord(read.minquality)),
+                            max(min_max_qual[1],ord(read.maxquality)))
+        if n_subset is not None and n_reads == n_subset:
+            break
+    return (n_reads,min_max_qual)
+
+def quality_range_from_batches(fastq_file=None,n_subset=None,fp=None):
+    """Determine min/max quality using batches of reads
+
+    Raises ImportError if numpy isn't available.
+
+    Arguments:
+      fastq_file: FASTQ file to examine
+      n_subset: if not None then only examine this number of
+        reads from the start of the file
+      fp: file-like object to read FASTQ data from (alternative
+        to 'fastq_file')
+
+    Returns:
+      Tuple (n_reads,(min_qual,max_qual)), as for the
+      'quality_range_from_reads' function.
+    """
+    n_reads = 0
+    min_max_qual = (None,None)
+    batch_size = FASTQFile.BATCHSIZE
+    if n_subset is not None:
+        batch_size = max(min(batch_size,n_subset),1)
+    for batch in FASTQFile.iter_batches(fastq_file,fp=fp,
+                                        batch_size=batch_size):
+        if n_subset is not None and n_reads + batch.nreads > n_subset:
+            batch = batch.head(n_subset - n_reads)
+        n_reads += batch.nreads
+        qmin,qmax = batch.quality_range()
+        if qmin is not None:
+            if min_max_qual == (None,None):
+                min_max_qual = (qmin,qmax)
+            else:
+                min_max_qual = (min(min_max_qual[0],qmin),
+                                max(min_max_qual[1],qmax))
+        if n_subset is not None and n_reads == n_subset:
+            break
+    return (n_reads,min_max_qual)
 
 #######################################################################
 # Main program
@@ -49,6 +146,10 @@ if __name__ == "__main__":
                  help="try to determine encoding from a subset of consisting of the first "
                  "N_SUBSET reads. (Quicker than using all reads but may not be accurate "
                  "if subset is not representative of the file as a whole.)")
+    p.add_option('-n',action='store',dest='n_processors',
+                 default=None,type='int',
+                 help="specify number of cores to use when examining all "
+                 "reads (default: all available)")
 
     # Process the command line
     options,arguments = p.parse_args()
@@ -75,17 +176,8 @@ if __name__ == "__main__":
         n_subset = int(options.n_subset)
     except TypeError:
         n_subset = None
-    n_reads = 0
-    min_max_qual = (None,None)
-    for read in FASTQFile.FastqIterator(fastq_file):
-        n_reads += 1
-        if min_max_qual == (None,None):
-            min_max_qual = (ord(read.minquality),ord(read.maxquality))
-        else:
-            min_max_qual = (min(min_max_qual[0],ord(read.minquality)),
-                            max(min_max_qual[1],ord(read.maxquality)))
-        if n_subset is not None and n_reads == n_subset:
-            break
+    n_reads,min_max_qual = quality_range(fastq_file,n_subset,
+                                         n_processors=options.n_processors)
 
     # Number of reads
     print "\nProcessed %d reads" % n_reads
@@ -1,9 +1,32 @@
 #!/usr/bin/env python
 #
-# Remove "singleton" reads from fastq file
+#     remove_mispairs.py: remove "singleton" reads from fastq file
+#
+########################################################################
+#
+# remove_mispairs.py
+#
+#########################################################################
+
+"""remove_mispairs.py
+
+Remove "singleton" reads (i.e. reads whose mate is missing) from
+paired-end fastq data, either in a single fastq file (with the reads
+in any order) or in an R1/R2 pair of fastq files sorted by read name.
+
+"""
+
+__version__ = "0.1.0"
+
+#######################################################################
+# Import modules that this module depends on
+#######################################################################
+
 import sys
 import os
+import optparse
 import logging
+logging.basicConfig(format="%(levelname)s %(message)s")
 
 # Put .. onto Python search path for modules
 SHARE_DIR = os.path.abspath(
@@ -11,53 +34,68 @@ SHARE_DIR = os.path.abspath(
         os.path.join(os.path.dirname(sys.argv[0]),'..')))
 sys.path.append(SHARE_DIR)
 import bcftbx.FASTQFile as FASTQFile
+import bcftbx.fastqpairs as fastqpairs
 
+#######################################################################
 # Main program
+#######################################################################
+
 if __name__ == "__main__":
-    # Collect input fastq file name
-    if len(sys.argv) < 2:
-        print "Usage: %s fastq" % os.path.basename(sys.argv[0])
+    # Process command line
+    p = optparse.OptionParser(usage="%prog [OPTIONS] FASTQ [R2_FASTQ]",
+                              version="%prog "+__version__,
+                              description="Remove 'singleton' reads from "
+                              "FASTQ (a single file with the reads from both "
+                              "ends in any order), or from the pair of "
+                              "FASTQ and R2_FASTQ (which must both be sorted "
+                              "by read name).")
+    p.add_option('--max-memory',action='store',dest='max_memory',type='int',
+                 default=fastqpairs.DEFAULT_MAX_MEMORY//(1024*1024),
+                 help="approximate memory (in Mb) to use for holding read "
+                 "names before spilling to disk (default %default)")
+    p.add_option('--tmp-dir',action='store',dest='tmp_dir',default=None,
+                 help="directory to write temporary files to when "
+                 "read names are spilled to disk")
+    options,args = p.parse_args()
+    if len(args) not in (1,2):
+        p.error("expected one or two FASTQ files")
+    fastq = args[0]
+    if len(args) == 2:
+        # R1/R2 pair of name-sorted fastqs
+        fastq2 = args[1]
+        try:
+            npairs,nsingles = fastqpairs.resync_pairs(fastq,fastq2,
+                                                      fastq+".paired",
+                                                      fastq2+".paired",
+                                                      fastq+".singles")
+        except Exception,ex:
+            logging.error("Failed to remove mispairs: %s" % ex)
+            sys.exit(1)
+        print "%d pairs, %d singletons" % (npairs,nsingles)
         sys.exit()
-    fastq = sys.argv[1]
     # Output file names
     fastq_out = fastq+".paired"
     singles_header = fastq+".single.header"
     pairs_header = fastq+".pair.header"
-    # Loop over file and collect read names
-    headers = set()
-    pairs = set()
-    n = 1
-    for read in FASTQFile.FastqIterator(fastq):
-        seqid = str(read.seqid)
-        if seqid in headers:
-            # Part of a pair
-            pairs.add(seqid)
-        else:
-            headers.add(seqid)
-        n += 1
-        if not (n % 1000000): print "%s" % n
-    # Loop again outputing only paired reads
+    # Locate the singletons
+    singles = fastqpairs.find_singletons(
+        fastq,
+        max_memory=options.max_memory*1024*1024,
+        tmp_dir=options.tmp_dir)
+    # Output only paired reads
     fp = open(fastq_out,'w')
     fp_singles = open(singles_header,'w')
     fp_pairs = open(pairs_header,'w')
-    n = 1
-    for read in FASTQFile.FastqIterator(fastq):
-        seqid = str(read.seqid)
-        if seqid in pairs:
+    for i,read in enumerate(FASTQFile.FastqIterator(fastq)):
+        if i in singles:
+            # Singleton read
+            fp_singles.write(read.raw_seqid+"\n")
+        else:
             # Output one read from pair
             fp.write(str(read)+"\n")
-            fp_pairs.write(seqid+"\n")
-        else:
-            # Singleton read
-            fp_singles.write(seqid+"\n")
-        n += 1
-        if not (n % 1000000): print "%s" % n
+            fp_pairs.write(read.raw_seqid+"\n")
     # Close files
     fp.close()
     fp_singles.close()
     fp_pairs.close()
-    
-                
-    
-    
-    
+    print "%d reads, %d singletons" % (singles.nreads,len(singles))
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+#
+#     sort_fastq.py: sort the reads in a FASTQ file by read name
+#     Copyright (C) University of Manchester 2018 Peter Briggs
+#
+########################################################################
+#
+# sort_fastq.py
+#
+#########################################################################
+#
+"""sort_fastq.py
+
+Sort the read records in a FASTQ file by read name, using an
+external merge sort so that files larger than the available
+memory can be sorted.
+
+Usage: sort_fastq.py [OPTIONS] infile outfile
+
+"""
+
+#######################################################################
+# Imports
+#######################################################################
+
+import sys
+import optparse
+from bcftbx.fastqsort import sort_fastq
+from bcftbx.fastqsort import RUN_SIZE
+
+#######################################################################
+# Module metadata
+#######################################################################
+
+__version__ = "0.0.1"
+
+__description__ = """Sort the reads in a FASTQ file by read name,
+writing the sorted reads to a new FASTQ file (which is compressed if
+the name ends with '.gz'). The reads are sorted in fixed-size runs
+which are written to temporary files and then merged, so files which
+are larger than the available memory can be sorted."""
+
+#######################################################################
+# Main
+#######################################################################
+
+def main(args=None):
+    # Command line processing
+    if args is None:
+        args = sys.argv[1:]
+    p = optparse.OptionParser(usage="%prog [OPTIONS] infile outfile",
+                              version="%prog "+__version__,
+                              description=__description__)
+    p.add_option('-k','--key',action='store',dest='key',default='name',
+                 choices=('name','illumina'),
+                 help="sort order: either 'name' (lexical order of read "
+                 "names) or 'illumina' (natural order of the fields in "
+                 "Illumina read names, i.e. by lane, tile and x and y "
+                 "coordinates) (default: '%default')")
+    p.add_option('-n','--nprocs',action='store',dest='nprocs',type='int',
+                 default=1,
+                 help="number of processes to use for sorting runs "
+                 "(default: %default)")
+    p.add_option('--run-size',action='store',dest='run_size',type='int',
+                 default=RUN_SIZE//(1024*1024),
+                 help="size of each sorted run in Mb of uncompressed "
+                 "data (default: %default)")
+    p.add_option('--tmp-dir',action='store',dest='tmp_dir',default=None,
+                 help="directory to write temporary run files to")
+    opts,args = p.parse_args(args)
+    if len(args) != 2:
+        p.error("Need to supply input and output files")
+    nreads = sort_fastq(args[0],args[1],
+                        key=opts.key,
+                        run_size=opts.run_size*1024*1024,
+                        nprocs=opts.nprocs,
+                        tmp_dir=opts.tmp_dir)
+    print "Sorted %d reads" % nreads
+
+if __name__ == "__main__":
+    main()
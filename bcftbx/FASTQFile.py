@@ -12,15 +12,27 @@ A set of classes for reading through FASTQ files and manipulating
 the data within them:
 
 * FastqIterator: enables looping through all read records in FASTQ file
+* PairedFastqIterator: loops through R1/R2 FASTQs in step, returning pairs
+* InterleavedFastqIterator: loops through interleaved FASTQ, returning pairs
 * FastqRead: provides access to a single FASTQ read record
+* FastqReader: low-level engine which scans FASTQ data for records
+* FastqRecordView: lightweight view onto a record found by FastqReader
+* FastqBatch: block of FASTQ records held as packed numpy arrays
 * SequenceIdentifier: provides access to sequence identifier info in a read
 * FastqAttributes: provides access to gross attributes of FASTQ file
+* FastqValidation: results of checking the records in a FASTQ file
 
 Additionally there are a few utility functions:
 
 * get_fastq_file_handle: return a file handled opened for reading a FASTQ file
+* iter_batches: iterate over blocks of reads as FastqBatch objects
 * nreads: return the number of reads in a FASTQ file
+* validate_fastq: check the records in a FASTQ file and count the reads
+* headers_are_pair: check whether two read headers form an R1/R2 pair
 * fastqs_are_pair: check whether two FASTQs form an R1/R2 pair
+* is_interleaved: check whether a FASTQ holds interleaved R1/R2 pairs
+* interleave_fastqs: write R1/R2 FASTQs as a single interleaved FASTQ
+* deinterleave_fastq: split interleaved FASTQ into R1/R2 FASTQs
 
 Information on the FASTQ file format: http://en.wikipedia.org/wiki/FASTQ_format
 
@@ -29,6 +41,19 @@ Information on the FASTQ file format: http://en.wikipedia.org/wiki/FASTQ_format
 __version__ = "1.0.0"
 
 CHUNKSIZE = 102400
+BATCHSIZE = 100000
+
+# Longest sequence which can be packed into a 64-bit key
+PACKED_MAX_LENGTH = 32
+# Longest packed sequence to count using bincount
+PACKED_BINCOUNT_LENGTH = 8
+
+# Maximum number of blocks of records held in the queue for
+# each of the FASTQs read by PairedFastqIterator
+PAIRED_QUEUE_SIZE = 8
+
+# Number of pairs to examine when checking if a FASTQ is interleaved
+INTERLEAVED_CHECK_PAIRS = 1000
 
 #######################################################################
 # Import modules that this module depends on
@@ -36,9 +61,21 @@ CHUNKSIZE = 102400
 from collections import Iterator
 import os
 import re
+import sys
 import logging
-import gzip
 import itertools
+import operator
+import functools
+import zlib
+import threading
+import Queue
+import bgzf
+import mmapfile
+try:
+    import numpy
+except ImportError:
+    # No numpy module: FastqBatch/iter_batches are unavailable
+    numpy = None
 
 #######################################################################
 # Precompiled regular expressions
@@ -67,8 +104,9 @@ class FastqIterator(Iterator):
     >>> for read in FastqIterator(fastq_file):
     >>>    print read
 
-    Input FASTQ can be in gzipped format; FASTQ data can also be supplied
-    as a file-like object opened for reading, for example:
+    Input FASTQ can be in gzipped format (uncompressed files are read
+    via memory mapping); FASTQ data can also be supplied as a file-like
+    object opened for reading, for example:
 
     >>> fp = open(fastq_file,'rU')
     >>> for read in FastqIterator(fp=fp):
@@ -92,59 +130,1093 @@ class FastqIterator(Iterator):
 
         """
         self.__fastq_file = fastq_file
-        self.__bufsize = bufsize
+        self.__fp = fp
         if fp is None:
-            self.__fp = get_fastq_file_handle(self.__fastq_file)
+            reader = FastqReader(self.__fastq_file,bufsize=bufsize)
         else:
-            self.__fp = fp
-        self._buf = ''
-        self._lines = []
-        self._ip = 0
+            reader = FastqReader(fp=self.__fp,bufsize=bufsize)
+        self.__reads = reader.reads()
 
     def next(self):
         """Return next record from FASTQ file as a FastqRead object
         """
-        # Convenience variables
-        lines = self._lines
-        buf = self._buf
-        ip = self._ip
-        bufsize = self.__bufsize
-        # Do we already have a read to return?
-        while len(lines) < 4:
-            # Fetch more data
-            data = self.__fp.read(bufsize)
-            if not data:
-                # Reached EOF
-                if self.__fastq_file is None:
-                    self.__fp.close()
-                raise StopIteration
-            # Add to buffer and split into lines
-            buf = buf + data
-            if buf[-1] != '\n':
-                i = buf.rfind('\n')
-                if i == -1:
-                    continue
+        try:
+            return self.__reads.next()
+        except StopIteration:
+            # Reached EOF
+            if self.__fastq_file is None:
+                self.__fp.close()
+            raise StopIteration
+
+class PairedFastqIterator(Iterator):
+    """PairedFastqIterator
+
+    Class to loop over the records in a pair of R1/R2 FASTQ files in
+    step, returning a tuple of FastqRead objects (r1,r2) for each
+    pair of records.
+
+    Example checking that the reads form pairs:
+
+    >>> for r1,r2 in PairedFastqIterator(fastq_r1,fastq_r2):
+    >>>    if not headers_are_pair(r1.raw_seqid,r2.raw_seqid):
+    >>>       print "Not a pair: %s %s" % (r1.seqid,r2.seqid)
+
+    Each FASTQ is read (and decompressed, for gzipped input) in a
+    separate background thread, so that the two files are processed
+    concurrently; blocks of records are passed back to the iterator
+    via bounded queues.
+
+    If one FASTQ has more records than the other then the extra
+    records are returned paired with None (in the same way as
+    'itertools.izip_longest').
+
+    The 'headers' method can be used to loop over just the raw
+    header lines of each pair, without creating FastqRead objects.
+
+    """
+
+    def __init__(self,fastq1=None,fastq2=None,fp1=None,fp2=None,
+                 bufsize=CHUNKSIZE,queue_size=PAIRED_QUEUE_SIZE):
+        """Create a new PairedFastqIterator
+
+        Each input FASTQ can be either a text file or a compressed
+        (gzipped) FASTQ, specified via a file name or a file-like
+        object opened for reading.
+
+        Args:
+           fastq1: name of the R1 FASTQ file
+           fastq2: name of the R2 FASTQ file
+           fp1: file-like object opened for reading R1 data
+           fp2: file-like object opened for reading R2 data
+           bufsize: optional; integer specifying number of bytes to
+             read as a single 'chunk' from disk
+           queue_size: optional; maximum number of blocks of
+             records to read ahead for each FASTQ
+
+        """
+        self._readers = [_BackgroundReader(fastq1,fp1,bufsize,queue_size),
+                         _BackgroundReader(fastq2,fp2,bufsize,queue_size)]
+        self.__reads = self._reads()
+
+    def _blocks(self):
+        """Internal: yield aligned blocks of lines from the two FASTQs
+
+        Yields tuples (lines1,offset1,lines2,offset2,n), where 'n'
+        is the number of lines from each of the offsets which
+        belong to the same records in the two FASTQs. When one
+        FASTQ is exhausted before the other, the list of lines
+        for the exhausted FASTQ is empty.
+
+        """
+        reader1,reader2 = self._readers
+        lines1 = lines2 = []
+        i1 = i2 = 0
+        eof1 = eof2 = False
+        while True:
+            if i1 == len(lines1) and not eof1:
+                lines1 = self._get(reader1)
+                i1 = 0
+                eof1 = not lines1
+            if i2 == len(lines2) and not eof2:
+                lines2 = self._get(reader2)
+                i2 = 0
+                eof2 = not lines2
+            if eof1 and eof2:
+                return
+            elif eof1:
+                n = len(lines2) - i2
+                yield ([],0,lines2,i2,n)
+            elif eof2:
+                n = len(lines1) - i1
+                yield (lines1,i1,[],0,n)
+            else:
+                n = min(len(lines1)-i1,len(lines2)-i2)
+                yield (lines1,i1,lines2,i2,n)
+            i1 += n
+            i2 += n
+
+    def _reads(self):
+        """Internal: yield FastqRead pairs for the records
+        """
+        new_read = FastqRead.__new__
+        for lines1,i1,lines2,i2,n in self._blocks():
+            for i in xrange(0,n,4):
+                if lines1:
+                    r1 = new_read(FastqRead)
+                    r1.raw_seqid = lines1[i1+i]
+                    r1.sequence = lines1[i1+i+1]
+                    r1.optid = lines1[i1+i+2]
+                    r1.quality = lines1[i1+i+3]
+                else:
+                    r1 = None
+                if lines2:
+                    r2 = new_read(FastqRead)
+                    r2.raw_seqid = lines2[i2+i]
+                    r2.sequence = lines2[i2+i+1]
+                    r2.optid = lines2[i2+i+2]
+                    r2.quality = lines2[i2+i+3]
                 else:
-                    lines.extend(buf[:i].split('\n'))
-                    buf = buf[i+1:]
+                    r2 = None
+                yield (r1,r2)
+
+    def headers(self):
+        """Yield the raw header lines for each pair of records
+
+        Yields tuples (header1,header2) of the sequence
+        identifier lines (i.e. FastqRead.raw_seqid) for each
+        pair, with None for records which are missing from one
+        of the FASTQs.
+
+        This should only be used instead of (rather than
+        mixed with) iteration over the reads.
+
+        """
+        for lines1,i1,lines2,i2,n in self._blocks():
+            if lines1 and lines2:
+                for pair in itertools.izip(lines1[i1:i1+n:4],
+                                           lines2[i2:i2+n:4]):
+                    yield pair
+            elif lines1:
+                for header in lines1[i1:i1+n:4]:
+                    yield (header,None)
+            else:
+                for header in lines2[i2:i2+n:4]:
+                    yield (None,header)
+
+    def close(self):
+        """Stop the background threads reading the FASTQs
+
+        Only needs to be called if iteration is abandoned
+        before the FASTQs are exhausted.
+
+        """
+        for reader in self._readers:
+            reader.close()
+
+    def _get(self,reader):
+        """Internal: get the next block of lines from a reader
+
+        If reading fails then both readers are closed before
+        the exception is raised.
+
+        """
+        try:
+            return reader.get()
+        except Exception:
+            self.close()
+            raise
+
+    def next(self):
+        """Return next pair of records as a tuple of FastqRead objects
+        """
+        return self.__reads.next()
+
+class InterleavedFastqIterator(Iterator):
+    """InterleavedFastqIterator
+
+    Class to loop over the records in an interleaved FASTQ file
+    (i.e. where the R1 and R2 reads of each pair are adjacent
+    records), returning a tuple of FastqRead objects (r1,r2) for
+    each pair of records.
+
+    Example:
+
+    >>> for r1,r2 in InterleavedFastqIterator(fastq):
+    >>>    print "%s\t%s" % (r1.seqid,r2.seqid)
+
+    The FASTQ is read (and decompressed, for gzipped input) in
+    a background thread.
+
+    An exception is raised if the file has an odd number of
+    records. Note that the records aren't checked to see if
+    they form pairs (use 'headers_are_pair' to do this).
+
+    """
+
+    def __init__(self,fastq_file=None,fp=None,bufsize=CHUNKSIZE,
+                 queue_size=PAIRED_QUEUE_SIZE):
+        """Create a new InterleavedFastqIterator
+
+        Args:
+           fastq_file: name of the FASTQ file to iterate through
+           fp: file-like object opened for reading
+           bufsize: optional; integer specifying number of bytes to
+             read as a single 'chunk' from disk
+           queue_size: optional; maximum number of blocks of
+             records to read ahead
+
+        """
+        self._reader = _BackgroundReader(fastq_file,fp,bufsize,queue_size)
+        self.__reads = self._reads()
+
+    def _blocks(self):
+        """Internal: yield blocks of lines holding complete pairs
+
+        The number of lines in each block is a multiple of
+        eight (i.e. two records).
+
+        """
+        partial = []
+        while True:
+            lines = self._reader.get()
+            if not lines:
+                break
+            if partial:
+                lines = partial + lines
+            if len(lines)%8:
+                partial = lines[-4:]
+                del lines[-4:]
+            else:
+                partial = []
+            if lines:
+                yield lines
+        if partial:
+            raise Exception("Odd number of records in interleaved FASTQ")
+
+    def _reads(self):
+        """Internal: yield FastqRead pairs for the records
+        """
+        new_read = FastqRead.__new__
+        for lines in self._blocks():
+            for i in xrange(0,len(lines),8):
+                r1 = new_read(FastqRead)
+                r1.raw_seqid = lines[i]
+                r1.sequence = lines[i+1]
+                r1.optid = lines[i+2]
+                r1.quality = lines[i+3]
+                r2 = new_read(FastqRead)
+                r2.raw_seqid = lines[i+4]
+                r2.sequence = lines[i+5]
+                r2.optid = lines[i+6]
+                r2.quality = lines[i+7]
+                yield (r1,r2)
+
+    def close(self):
+        """Stop the background thread reading the FASTQ
+
+        Only needs to be called if iteration is abandoned
+        before the FASTQ is exhausted.
+
+        """
+        self._reader.close()
+
+    def next(self):
+        """Return next pair of records as a tuple of FastqRead objects
+        """
+        return self.__reads.next()
+
+class _BackgroundReader(object):
+    """Internal: read blocks of FASTQ records in a background thread
+
+    Blocks of record lines (see 'FastqReader._record_lines')
+    are read from the FASTQ in a background thread and passed
+    back via a bounded queue; the 'get' method returns the next
+    block.
+
+    """
+
+    def __init__(self,fastq=None,fp=None,bufsize=CHUNKSIZE,
+                 queue_size=PAIRED_QUEUE_SIZE):
+        self._stop = threading.Event()
+        self._queue = Queue.Queue(maxsize=max(int(queue_size),1))
+        self._thread = threading.Thread(target=self._read_blocks,
+                                        args=(fastq,fp,bufsize))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _read_blocks(self,fastq,fp,bufsize):
+        """Internal: put blocks of record lines from a FASTQ onto the queue
+
+        Runs in the background thread. The lines for each block of
+        records are put onto the queue as a list; None is put
+        onto the queue when the FASTQ is exhausted, or the
+        exception if reading fails.
+
+        """
+        try:
+            if fp is None:
+                reader = FastqReader(fastq,bufsize=bufsize)
             else:
-                lines.extend(buf[:-1].split('\n'))
-                buf = ''
-        # Return a read
-        read = lines[ip:ip + 4]
-        ip = ip + 4
-        if (len(lines) - ip) < 4:
-            # Not enough lines for another read so
-            # reset the buffer
-            lines = lines[ip:]
-            ip = 0
-        # Update internals
-        self._lines = lines
+                reader = FastqReader(fp=fp,bufsize=bufsize)
+            for lines in reader._record_lines():
+                if not self._put(lines):
+                    return
+            if fastq is None:
+                fp.close()
+            self._put(None)
+        except Exception,ex:
+            self._put(ex)
+
+    def _put(self,item):
+        """Internal: put an item onto the queue unless reading stops
+
+        Returns:
+          True if the item was queued, False if the reader was
+          closed while waiting.
+
+        """
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item,timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def get(self):
+        """Get the next block of lines
+
+        Raises the exception from the background thread if
+        reading failed.
+
+        Returns:
+          List of lines, or an empty list if the FASTQ is
+          exhausted.
+
+        """
+        lines = self._queue.get()
+        if lines is None:
+            # Leave the end marker for any further calls
+            self._queue.put(None)
+            return []
+        if isinstance(lines,Exception):
+            self.close()
+            raise lines
+        return lines
+
+    def close(self):
+        """Stop the background thread
+        """
+        self._stop.set()
+        self._thread.join()
+
+class _BackgroundWriter(object):
+    """Internal: write data to an output file in a background thread
+
+    Data passed to 'write' is queued and written (and compressed,
+    for outputs with names ending in '.gz') by a background
+    thread, so that output for several files can be compressed
+    at the same time.
+
+    """
+
+    def __init__(self,filen,threads=None,queue_size=PAIRED_QUEUE_SIZE):
+        if filen.endswith('.gz'):
+            self._fp = bgzf.BgzfWriter(filen,threads=threads)
+        else:
+            self._fp = open(filen,'wb')
+        self._filen = filen
+        self._queue = Queue.Queue(maxsize=max(int(queue_size),1))
+        self._error = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._write_data)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _write_data(self):
+        """Internal: write queued data until None is received
+        """
+        while True:
+            data = self._queue.get()
+            if data is None:
+                break
+            if self._error is None:
+                try:
+                    self._fp.write(data)
+                except Exception,ex:
+                    self._error = ex
+        try:
+            self._fp.close()
+        except Exception,ex:
+            if self._error is None:
+                self._error = ex
+
+    def write(self,data):
+        """Queue data to be written
+        """
+        if self._error is not None:
+            raise self._error
+        self._queue.put(data)
+
+    def close(self):
+        """Write out any queued data and close the output
+        """
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+            self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def discard(self):
+        """Close the output (ignoring any errors) and remove it
+        """
+        try:
+            self.close()
+        except Exception:
+            pass
+        if os.path.exists(self._filen):
+            os.remove(self._filen)
+
+class FastqReader(object):
+    """FastqReader
+
+    Low-level engine for locating the records in FASTQ data.
+
+    Data is read into a single reusable buffer, which is then
+    scanned for the newline offsets which delimit each record.
+    Records are returned as FastqRecordView objects, which only
+    create strings for the record fields when they are accessed.
+
+    Example counting reads and bases without creating FastqRead
+    objects:
+
+    >>> nreads = nbases = 0
+    >>> for rec in FastqReader(fastq_file):
+    >>>    nreads += 1
+    >>>    nbases += rec.seqlen
+
+    Note that views refer directly to the reader's buffer, so
+    they are only valid until the next record is fetched. Use
+    the 'as_read' method of a view to get a FastqRead object
+    which can be kept.
+
+    Uncompressed files specified by name are read via memory
+    mapping (see the 'mmapfile' module); the 'reads' and
+    'batches' methods then split the mapped data directly
+    into lines, without first copying it into the buffer.
+
+    """
+
+    def __init__(self,fastq_file=None,fp=None,bufsize=CHUNKSIZE):
+        """Create a new FastqReader
+
+        The input FASTQ can be either a text file or a compressed (gzipped)
+        FASTQ, specified via a file name (using the 'fastq' argument), or a
+        file-like object opened for reading (using the 'fp' argument).
+
+        Args:
+           fastq_file: name of the FASTQ file to scan
+           fp: file-like object opened for reading
+           bufsize: optional; initial size of the buffer (in bytes).
+             The buffer will grow if a single record doesn't fit
+
+        """
+        self.__fastq_file = fastq_file
+        if fp is None:
+            if os.path.splitext(self.__fastq_file)[1] == '.gz':
+                self.__fp = get_fastq_file_handle(self.__fastq_file)
+            else:
+                self.__fp = mmapfile.open_mapped(self.__fastq_file)
+        else:
+            self.__fp = fp
+        self.__readinto = getattr(self.__fp,'readinto',None)
+        self.__blocks = getattr(self.__fp,'blocks',None)
+        self._bufsize = max(int(bufsize),1)
+        self._buf = bytearray(self._bufsize)
+        self._mv = memoryview(self._buf)
+        self._start = 0
+        self._end = 0
+        self._eof = False
+
+    def __iter__(self):
+        return self.records()
+
+    def _fill(self):
+        """Internal: read more data into the buffer
+
+        Any unconsumed data (i.e. from 'start' onwards) is moved
+        to the start of the buffer, which is enlarged if it is
+        already full, before the remainder is filled from the
+        input.
+
+        On reaching EOF a newline is supplied if the final line
+        is unterminated.
+
+        Returns:
+          True if there is unconsumed data in the buffer, False
+          if the input is exhausted.
+
+        """
+        if self._eof:
+            return False
+        buf = self._buf
+        mv = self._mv
+        start = self._start
+        end = self._end
+        # Move any partial record to the start of the buffer
+        if start:
+            n = end - start
+            buf[0:n] = mv[start:end]
+            start = 0
+            end = n
+        # Grow the buffer if it's full
+        if end == len(buf):
+            buf = buf + bytearray(len(buf))
+            mv = memoryview(buf)
+        # Fill the rest of the buffer
+        if self.__readinto is not None:
+            n = self.__readinto(mv[end:])
+        else:
+            data = self.__fp.read(len(buf) - end)
+            n = len(data)
+            buf[end:end+n] = data
+        if n:
+            end += n
+        else:
+            # Reached EOF
+            self._eof = True
+            if self.__fastq_file is not None:
+                self.__fp.close()
+            if end and buf[end-1] != 10:
+                if end == len(buf):
+                    buf = buf + bytearray(1)
+                    mv = memoryview(buf)
+                buf[end] = 10
+                end += 1
         self._buf = buf
-        self._ip = ip
-        return FastqRead(*read)
+        self._mv = mv
+        self._start = start
+        self._end = end
+        return (end > start)
+
+    def records(self):
+        """Yield a FastqRecordView for each record in the data
+
+        A final line which lacks a trailing newline is treated as
+        though the newline were present.
+
+        """
+        while self._fill():
+            mv = self._mv
+            find = self._buf.find
+            end = self._end
+            pos = self._start
+            while True:
+                e1 = find('\n',pos,end)
+                if e1 < 0: break
+                e2 = find('\n',e1+1,end)
+                if e2 < 0: break
+                e3 = find('\n',e2+1,end)
+                if e3 < 0: break
+                e4 = find('\n',e3+1,end)
+                if e4 < 0: break
+                yield FastqRecordView(mv,pos,e1,e2,e3,e4)
+                pos = e4 + 1
+            self._start = pos
+
+    def _record_lines(self):
+        """Internal: yield the lines for blocks of complete records
+
+        All the complete lines in the buffer are split into
+        strings in a single operation; the lines belonging to
+        complete records are yielded as a list (so the number
+        of lines is always a multiple of four) and any trailing
+        partial record is left in the buffer.
+
+        Trailing whitespace is removed from the lines in the same
+        way as for FastqRead (see '_strip_record_lines').
+
+        """
+        if self.__blocks is not None:
+            for lines in self._mapped_record_lines():
+                yield lines
+            return
+        while self._fill():
+            start = self._start
+            last = self._buf.rfind('\n',start,self._end)
+            if last < 0:
+                continue
+            text = self._mv[start:last].tobytes()
+            lines = text.split('\n')
+            nlines = len(lines) - len(lines)%4
+            # Rewind to the start of the first incomplete record
+            self._start = last + 1 - sum([len(line)+1
+                                          for line in lines[nlines:]])
+            if nlines:
+                del lines[nlines:]
+                if _has_trailing_whitespace(text):
+                    _strip_record_lines(lines)
+                yield lines
+
+    def _mapped_record_lines(self):
+        """Internal: yield the lines for blocks of mapped records
+
+        Equivalent to '_record_lines' for memory mapped input,
+        where blocks of complete lines are split directly.
+
+        """
+        partial = []
+        for block in self.__blocks(self._bufsize):
+            lines = block.split('\n')
+            if not lines[-1]:
+                lines.pop()
+            if _has_trailing_whitespace(block):
+                _strip_record_lines(lines,len(partial))
+            if partial:
+                lines[0:0] = partial
+            nlines = len(lines) - len(lines)%4
+            partial = lines[nlines:]
+            if nlines:
+                del lines[nlines:]
+                yield lines
+        self._eof = True
+        if self.__fastq_file is not None:
+            self.__fp.close()
+
+    def reads(self):
+        """Yield a FastqRead object for each record in the data
+
+        This is faster than calling 'as_read' on each view when
+        every field of every record is needed.
+
+        """
+        new_read = FastqRead.__new__
+        for lines in self._record_lines():
+            for i in xrange(0,len(lines),4):
+                read = new_read(FastqRead)
+                read.raw_seqid = lines[i]
+                read.sequence = lines[i+1]
+                read.optid = lines[i+2]
+                read.quality = lines[i+3]
+                yield read
+
+    def batches(self,batch_size=BATCHSIZE):
+        """Yield FastqBatch objects holding blocks of records
+
+        Requires the numpy module.
+
+        Arguments:
+          batch_size: maximum number of reads in each batch (the
+            final batch may be smaller)
+
+        """
+        batch_lines = []
+        nlines = 4*int(batch_size)
+        for lines in self._record_lines():
+            batch_lines.extend(lines)
+            while len(batch_lines) >= nlines:
+                yield FastqBatch(batch_lines[:nlines])
+                del batch_lines[:nlines]
+        if batch_lines:
+            yield FastqBatch(batch_lines)
+
+class FastqRecordView(object):
+    """Lightweight view of a FASTQ record held in a buffer
+
+    Stores the offsets of the record lines within the
+    buffer; the fields are only turned into strings when
+    the following properties are accessed:
+
+    raw_seqid: the sequence identifier line
+    sequence: the raw sequence
+    optid: the optional sequence identifier line
+    quality: the quality values
+
+    As for FastqRead, trailing whitespace is removed from the
+    sequence, optid and quality fields.
+
+    The 'seqlen' property returns the length of the sequence
+    (excluding newline and trailing whitespace) without
+    creating a string.
+
+    Views are created by FastqReader and are only valid until
+    the reader fetches the next record.
+
+    """
+    __slots__ = ('_buf','_start','_e1','_e2','_e3','_end')
+
+    def __init__(self,buf,start,e1,e2,e3,end):
+        """Create a new FastqRecordView
+
+        Arguments:
+          buf: memoryview of the buffer holding the record
+          start: offset of the start of the record
+          e1: offset of the newline ending the seqid line
+          e2: offset of the newline ending the sequence line
+          e3: offset of the newline ending the optid line
+          end: offset of the newline ending the quality line
+
+        """
+        self._buf = buf
+        self._start = start
+        self._e1 = e1
+        self._e2 = e2
+        self._e3 = e3
+        self._end = end
+
+    @property
+    def raw_seqid(self):
+        return self._buf[self._start:self._e1].tobytes()
+
+    @property
+    def sequence(self):
+        return self._buf[self._e1+1:self._e2].tobytes().rstrip()
+
+    @property
+    def optid(self):
+        return self._buf[self._e2+1:self._e3].tobytes().rstrip()
+
+    @property
+    def quality(self):
+        return self._buf[self._e3+1:self._end].tobytes().rstrip()
+
+    @property
+    def seqlen(self):
+        buf = self._buf
+        start = self._e1 + 1
+        end = self._e2
+        while end > start and buf[end-1].isspace():
+            end -= 1
+        return end - start
+
+    def fields(self):
+        """Return the four record lines as a tuple of strings
+
+        """
+        return self._buf[self._start:self._end].tobytes().split('\n')
+
+    def as_read(self):
+        """Return a FastqRead object holding a copy of the record
+
+        """
+        text = self._buf[self._start:self._end].tobytes()
+        if _has_trailing_whitespace(text):
+            # Let FastqRead strip the trailing whitespace
+            read = FastqRead(*text.split('\n'))
+            read.raw_seqid = read.raw_seqid.rstrip('\r')
+            return read
+        return FastqRead._from_fields(*text.split('\n'))
+
+class FastqBatch(object):
+    """Block of FASTQ records held as packed numpy arrays
+
+    The records are stored in columnar form, so that statistics
+    can be computed for the whole batch using array operations
+    rather than looping over reads in Python:
+
+    nreads: number of reads in the batch
+    headers: uint8 array with the concatenated seqid lines
+    header_offsets: offset of each seqid line in 'headers'
+    header_lengths: length of each seqid line
+    seq: uint8 array with the concatenated sequences
+    seq_offsets: offset of each sequence in 'seq'
+    seq_lengths: length of each sequence
+    qual: uint8 array with the concatenated quality strings
+    qual_offsets: offset of each quality string in 'qual'
+    qual_lengths: length of each quality string
+
+    Note that the sequence and quality offsets are kept
+    separately, as their lengths differ for colorspace reads.
+
+    Methods are provided for common per-batch statistics
+    (e.g. 'length_counts', 'quality_range' and
+    'quality_by_position'). Individual records can be recovered
+    as strings or FastqRead objects via 'header', 'sequence',
+    'quality' and 'read'.
+
+    Batches are normally obtained from the 'iter_batches'
+    function; requires the numpy module.
+
+    """
+
+    def __init__(self,lines):
+        """Create a new FastqBatch
+
+        Arguments:
+          lines: list of strings with the lines (without
+            newlines) of one or more complete FASTQ records
+
+        """
+        self.nreads = len(lines)//4
+        self.headers,self.header_offsets,self.header_lengths = \
+            self._pack(lines[0::4])
+        self.seq,self.seq_offsets,self.seq_lengths = \
+            self._pack(lines[1::4])
+        self.qual,self.qual_offsets,self.qual_lengths = \
+            self._pack(lines[3::4])
+
+    @staticmethod
+    def _pack(strings):
+        """Internal: pack list of strings into (data,offsets,lengths)
+
+        """
+        lengths = numpy.fromiter(itertools.imap(len,strings),
+                                 dtype=numpy.int64,
+                                 count=len(strings))
+        offsets = numpy.zeros(len(strings),dtype=numpy.int64)
+        if len(strings) > 1:
+            numpy.cumsum(lengths[:-1],out=offsets[1:])
+        data = numpy.frombuffer(''.join(strings),dtype=numpy.uint8)
+        return (data,offsets,lengths)
+
+    def __len__(self):
+        return self.nreads
+
+    def head(self,n):
+        """Return a new batch with just the first n reads
+
+        The new batch shares its data with this one.
+
+        """
+        n = min(int(n),self.nreads)
+        batch = FastqBatch.__new__(FastqBatch)
+        batch.nreads = n
+        for data,prefix in (('headers','header'),
+                            ('seq','seq'),
+                            ('qual','qual')):
+            offsets = getattr(self,prefix+'_offsets')[:n]
+            lengths = getattr(self,prefix+'_lengths')[:n]
+            setattr(batch,prefix+'_offsets',offsets)
+            setattr(batch,prefix+'_lengths',lengths)
+            setattr(batch,data,getattr(self,data)[:int(lengths.sum())])
+        return batch
+
+    def _string(self,data,offsets,lengths,i):
+        start = offsets[i]
+        return data[start:start+lengths[i]].tostring()
+
+    def header(self,i):
+        """Return the seqid line for the i'th read
+
+        """
+        return self._string(self.headers,self.header_offsets,
+                            self.header_lengths,i)
+
+    def sequence(self,i):
+        """Return the sequence for the i'th read
+
+        """
+        return self._string(self.seq,self.seq_offsets,
+                            self.seq_lengths,i)
+
+    def quality(self,i):
+        """Return the quality string for the i'th read
+
+        """
+        return self._string(self.qual,self.qual_offsets,
+                            self.qual_lengths,i)
 
-class FastqRead:
+    def read(self,i):
+        """Return the i'th read as a FastqRead object
+
+        Note that the optional sequence identifier line is
+        not stored in the batch, so is always returned as '+'.
+
+        """
+        return FastqRead._from_fields(self.header(i),
+                                      self.sequence(i),
+                                      '+',
+                                      self.quality(i))
+
+    def length_counts(self):
+        """Return the distribution of sequence lengths
+
+        Returns:
+          numpy array where the value at index i is the number
+          of reads with sequence length i.
+
+        """
+        return numpy.bincount(self.seq_lengths)
+
+    def quality_range(self):
+        """Return the minimum and maximum quality characters
+
+        Returns:
+          Tuple (min,max) with the smallest and largest quality
+          values (as integer character codes) over all reads in
+          the batch, or (None,None) if there are no quality
+          values.
+
+        """
+        if not len(self.qual):
+            return (None,None)
+        return (int(self.qual.min()),int(self.qual.max()))
+
+    def quality_by_position(self,offset=33):
+        """Return per-position quality score totals
+
+        Arguments:
+          offset: value to subtract from character codes to
+            get quality scores (default: 33 i.e. Phred+33)
+
+        Returns:
+          Tuple (totals,counts) of numpy arrays where index i
+          holds the sum of the quality scores and the number of
+          reads with a quality value at position i (so the mean
+          quality at each position is totals/counts).
+
+        """
+        positions = numpy.arange(len(self.qual),dtype=numpy.int64) - \
+                    numpy.repeat(self.qual_offsets,self.qual_lengths)
+        totals = numpy.bincount(positions,
+                                weights=self.qual.astype(numpy.int64)-offset)
+        counts = numpy.bincount(positions)
+        return (totals,counts)
+
+    def index_sequences(self):
+        """Return the index sequence for each read
+
+        The index sequence is taken to be the text after the
+        third colon following the first space in the seqid line,
+        as for Illumina 1.8+ headers (see SequenceIdentifier).
+
+        Returns:
+          numpy array of strings with one index sequence per read,
+          and a boolean numpy array which is False for reads where
+          no index sequence could be located.
+
+        """
+        n = self.nreads
+        hdr = self.headers
+        starts = self.header_offsets
+        ends = starts + self.header_lengths
+        # First space in each header
+        spaces = numpy.flatnonzero(hdr == ord(' '))
+        sp_hdr = numpy.searchsorted(starts,spaces,side='right') - 1
+        first_space = numpy.full(n,-1,dtype=numpy.int64)
+        uniq,idx = numpy.unique(sp_hdr,return_index=True)
+        first_space[uniq] = spaces[idx]
+        # Colons following the first space
+        colons = numpy.flatnonzero(hdr == ord(':'))
+        cl_hdr = numpy.searchsorted(starts,colons,side='right') - 1
+        keep = (first_space[cl_hdr] >= 0) & (colons > first_space[cl_hdr])
+        colons = colons[keep]
+        cl_hdr = cl_hdr[keep]
+        # Locate the third of these colons in each header
+        uniq,idx = numpy.unique(cl_hdr,return_index=True)
+        rank = numpy.arange(len(colons)) - numpy.repeat(idx,numpy.diff(
+            numpy.append(idx,len(colons))))
+        third = (rank == 2)
+        index_start = numpy.full(n,-1,dtype=numpy.int64)
+        index_start[cl_hdr[third]] = colons[third] + 1
+        found = (index_start >= 0)
+        index_lengths = numpy.where(found,ends - index_start,0)
+        # Gather into a fixed-width string array
+        width = max(int(index_lengths.max()) if n else 0,1)
+        cols = numpy.arange(width,dtype=numpy.int64)
+        mask = cols < index_lengths[:,None]
+        pos = numpy.where(mask,index_start[:,None] + cols,0)
+        chars = numpy.where(mask,hdr[pos] if len(hdr) else 0,0)
+        seqs = numpy.ascontiguousarray(chars.astype(numpy.uint8)).view(
+            'S%d' % width).reshape(n)
+        return (seqs,found)
+
+    def index_sequence_counts(self):
+        """Return the number of reads for each index sequence
+
+        Index sequences are located as described for the
+        'index_sequences' method.
+
+        Returns:
+          Dictionary where keys are index sequences and values
+          are the number of reads with that sequence; reads where
+          no index sequence was located are counted under the key
+          None.
+
+        """
+        seqs,found = self.index_sequences()
+        uniq,counts = numpy.unique(seqs[found],return_counts=True)
+        index_counts = dict(zip(uniq.tolist(),counts.tolist()))
+        nmissing = int(self.nreads - found.sum())
+        if nmissing:
+            index_counts[None] = nmissing
+        return index_counts
+
+    def sequence_counts(self,other=None,separator='+'):
+        """Return the number of reads for each sequence
+
+        Intended for counting index sequences in FASTQs which
+        contain the index reads (e.g. 'I1' and 'I2' FASTQs from
+        bcl2fastq), where the sequence of each read is the index
+        sequence.
+
+        Sequences consisting only of A, C, G and T are packed
+        into integer keys using 2 bits per base and counted
+        using array operations; any other sequences (e.g. those
+        containing 'N') are counted separately.
+
+        Arguments:
+          other: (optional) FastqBatch with the same number of
+            reads (e.g. the 'I2' reads matching the 'I1' reads in
+            this batch); if supplied then the sequences from the
+            two batches are joined for each read
+          separator: (optional) string used to join sequences
+            from the two batches (default: '+', as for dual
+            index sequences in Illumina 1.8+ headers)
+
+        Returns:
+          Dictionary where keys are sequences and values are
+          the number of reads with that sequence.
+
+        """
+        if other is not None and other.nreads != self.nreads:
+            raise Exception("Batches have different numbers of reads "
+                            "(%d and %d)" % (self.nreads,other.nreads))
+        lengths = self.seq_lengths
+        if other is not None:
+            # Combine the lengths for each read into a single key
+            maxlen = int(other.seq_lengths.max()) + 1 if self.nreads else 1
+            lengths = lengths*maxlen + other.seq_lengths
+        counts = {}
+        for length in numpy.unique(lengths).tolist():
+            reads = numpy.flatnonzero(lengths == length)
+            if other is not None:
+                length1,length2 = divmod(length,maxlen)
+                bases = numpy.hstack((self._seq_matrix(reads,length1),
+                                      other._seq_matrix(reads,length2)))
+                join = lambda s: s[:length1] + separator + s[length1:]
+            else:
+                bases = self._seq_matrix(reads,length)
+                join = None
+            length = bases.shape[1]
+            # Pack sequences which only contain ACGT
+            codes = _base_codes()[bases]
+            packable = (codes != 255).all(axis=1)
+            if length > PACKED_MAX_LENGTH:
+                packable[:] = False
+            if packable.any():
+                keys = _pack_bases(codes[packable])
+                if length <= PACKED_BINCOUNT_LENGTH:
+                    bins = numpy.bincount(keys.astype(numpy.intp))
+                    uniq = numpy.flatnonzero(bins)
+                    nreads = bins[uniq]
+                    uniq = uniq.astype(numpy.uint64)
+                else:
+                    uniq,nreads = numpy.unique(keys,return_counts=True)
+                for seq,n in itertools.izip(_unpack_bases(uniq,length),
+                                            nreads.tolist()):
+                    if join is not None:
+                        seq = join(seq)
+                    counts[seq] = n
+            if not packable.all():
+                # Count the remaining sequences as strings
+                other_seqs = numpy.ascontiguousarray(
+                    bases[~packable]).view('S%d' % length).reshape(-1)
+                uniq,nreads = numpy.unique(other_seqs,return_counts=True)
+                for seq,n in itertools.izip(uniq.tolist(),nreads.tolist()):
+                    if join is not None:
+                        seq = join(seq)
+                    counts[seq] = counts.get(seq,0) + n
+        return counts
+
+    def _seq_matrix(self,reads,length):
+        """Internal: return sequences as a 2D array of bases
+
+        Arguments:
+          reads: array with the indices of the reads to fetch
+            (which must all have the specified length)
+          length: length of the sequences
+
+        Returns:
+          uint8 numpy array with one row for each read.
+
+        """
+        positions = self.seq_offsets[reads][:,None] + \
+                    numpy.arange(length,dtype=numpy.int64)
+        return self.seq[positions]
+
+class FastqRead(object):
     """Class to store a FASTQ record with information about a read
 
     Provides the following properties for accessing the read data:
@@ -169,7 +1241,13 @@ class FastqRead:
     is_colorspace: returns True if the read looks like a colorspace read, False
       otherwise
 
+    The attributes are held in slots rather than an instance dictionary
+    to reduce the memory used by each read; the SequenceIdentifier is
+    only created when the 'seqid' property is first accessed.
+
     """
+    __slots__ = ('raw_seqid','sequence','optid','quality',
+                 '_seqid','_seqlen','_maxqual','_minqual','_is_colorspace')
 
     def __init__(self,seqid_line=None,seq_line=None,optid_line=None,quality_line=None):
         """Create a new FastqRead object
@@ -185,12 +1263,37 @@ class FastqRead:
         self.optid = str(optid_line).rstrip()
         self.quality = str(quality_line).rstrip()
 
+    @classmethod
+    def _from_fields(cls,seqid,sequence,optid,quality):
+        """Internal: create a FastqRead from already-clean strings
+
+        Bypasses the conversion and stripping done by __init__,
+        so the arguments must be strings without trailing
+        newlines or whitespace.
+
+        """
+        read = cls.__new__(cls)
+        read.raw_seqid = seqid
+        read.sequence = sequence
+        read.optid = optid
+        read.quality = quality
+        return read
+
+    def __getstate__(self):
+        return _get_slots_state(self)
+
+    def __setstate__(self,state):
+        _set_slots_state(self,state)
+
     @property
     def seqid(self):
         try:
             return self._seqid
         except AttributeError:
+            # Parse straight away, as the identifier is only
+            # needed to access its data items
             self._seqid = SequenceIdentifier(self.raw_seqid)
+            self._seqid._parse()
             return self._seqid
 
     @property
@@ -236,25 +1339,23 @@ class FastqRead:
             return self._is_colorspace
         except AttributeError:
             pass
-        if self.seqid.format is None:
-            # Check if it looks like colorspace
-            # Sequence starts with 'T' and only contains characters
-            # 0-3 or '.'
-            sequence = self.sequence
-            if sequence.startswith('T'):
-                for c in sequence[1:]:
-                    if c not in '.0123':
-                        self._is_colorspace = False
-                        return self._is_colorspace
-                # Passed colorspace tests
-                self._is_colorspace = True
-                return self._is_colorspace
-        # Not colorspace
-        self._is_colorspace = False
+        # Looks like colorspace if the sequence starts with 'T'
+        # and otherwise only contains characters 0-3 or '.',
+        # and the sequence identifier isn't in an Illumina format
+        # (the sequence tests are cheaper so are done first)
+        sequence = self.sequence
+        self._is_colorspace = bool(sequence.startswith('T') and
+                                   not sequence[1:].translate(None,'.0123')
+                                   and self.seqid.format is None)
         return self._is_colorspace
 
     def __repr__(self):
-        return '\n'.join((str(self.seqid),
+        try:
+            seqid = str(self._seqid)
+        except AttributeError:
+            # Identifier not accessed so is unchanged from the input
+            seqid = str(self.raw_seqid).rstrip()
+        return '\n'.join((seqid,
                           self.sequence,
                           self.optid,
                           self.quality))
@@ -262,12 +1363,62 @@ class FastqRead:
     def __eq__(self,other):
         return (str(self) == str(other))
 
-class SequenceIdentifier:
+# Names of the SequenceIdentifier data items
+_SEQID_FIELDS = frozenset(('instrument_name',
+                           'run_id',
+                           'flowcell_id',
+                           'flowcell_lane',
+                           'tile_no',
+                           'x_coord',
+                           'y_coord',
+                           'multiplex_index_no',
+                           'pair_id',
+                           'bad_read',
+                           'control_bit_flag',
+                           'index_sequence'))
+
+def _seqid_field(name):
+    """Internal: make a property for a SequenceIdentifier data item
+
+    The value is stored in the slot with the same name prefixed
+    with an underscore. Until the sequence identifier line has
+    been parsed the slot is empty, so getting the property falls
+    through to SequenceIdentifier.__getattr__ (which does the
+    parsing); setting the property also parses the line first,
+    so the new value isn't overwritten later.
+
+    """
+    slot = '_' + name
+    def fset(self,value):
+        if self._format is False:
+            self._parse()
+        setattr(self,slot,value)
+    return property(operator.attrgetter(slot),fset)
+
+class SequenceIdentifier(object):
     """Class to store/manipulate sequence identifier information from a FASTQ record
 
     Provides access to the data items in the sequence identifier line of a FASTQ
     record.
+
+    The line isn't parsed until one of the data items (or the format) is
+    first accessed, and the data are held in slots rather than an instance
+    dictionary, so creating the object is cheap.
     """
+    __slots__ = ('_seqid',
+                 '_format',
+                 '_instrument_name',
+                 '_run_id',
+                 '_flowcell_id',
+                 '_flowcell_lane',
+                 '_tile_no',
+                 '_x_coord',
+                 '_y_coord',
+                 '_multiplex_index_no',
+                 '_pair_id',
+                 '_bad_read',
+                 '_control_bit_flag',
+                 '_index_sequence')
 
     def __init__(self,seqid):
         """Create a new SequenceIdentifier object
@@ -276,51 +1427,91 @@ class SequenceIdentifier:
           seqid: the sequence identifier line (i.e. first line) from the
             FASTQ read record
         """
-        # Initialise
-        self.__seqid = str(seqid).rstrip()
-        self.instrument_name = None
-        self.run_id = None
-        self.flowcell_id = None
-        self.flowcell_lane = None
-        self.tile_no = None
-        self.x_coord = None
-        self.y_coord = None
-        self.multiplex_index_no = None
-        self.pair_id =  None
-        self.bad_read = None
-        self.control_bit_flag = None
-        self.index_sequence = None
-        self._format = None
-        # Identify sequence id line elements
-        m = RE_ILLUMINA18.match(self.__seqid)
+        self._seqid = str(seqid).rstrip()
+        # False indicates the line hasn't been parsed yet
+        self._format = False
+
+    def __getattr__(self,name):
+        # Only reached for data items before the line is parsed
+        if name in _SEQID_FIELDS and self._format is False:
+            self._parse()
+            return getattr(self,name)
+        raise AttributeError("'%s' object has no attribute '%s'" %
+                             (self.__class__.__name__,name))
+
+    def __getstate__(self):
+        return _get_slots_state(self)
+
+    def __setstate__(self,state):
+        _set_slots_state(self,state)
+
+    def _parse(self):
+        """Internal: identify the elements of the sequence id line
+
+        """
+        m = RE_ILLUMINA18.match(self._seqid)
         if m:
             # example of Illumina 1.8+ format:
             # @EAS139:136:FC706VJ:2:2104:15343:197393 1:Y:18:ATCACG
             self._format = 'illumina18'
-            self.instrument_name = m.group(1)
-            self.run_id = m.group(2)
-            self.flowcell_id = m.group(3)
-            self.flowcell_lane = m.group(4)
-            self.tile_no = m.group(5)
-            self.x_coord = m.group(6)
-            self.y_coord = m.group(7)
-            self.pair_id = m.group(8)
-            self.bad_read = m.group(9)
-            self.control_bit_flag = m.group(10)
-            self.index_sequence = m.group(11)
-        else:
-            # Example of earlier Illumina format (1.3/1.5):
-            # @HWUSI-EAS100R:6:73:941:1973#0/1
-            m = RE_ILLUMINA.match(self.__seqid)
-            if m:
-                self._format = 'illumina'
-                self.instrument_name = m.group(1)
-                self.flowcell_lane = m.group(2)
-                self.tile_no = m.group(3)
-                self.x_coord = m.group(4)
-                self.y_coord = m.group(5)
-                self.multiplex_index_no = m.group(6)
-                self.pair_id = m.group(7)
+            (self._instrument_name,
+             self._run_id,
+             self._flowcell_id,
+             self._flowcell_lane,
+             self._tile_no,
+             self._x_coord,
+             self._y_coord,
+             self._pair_id,
+             self._bad_read,
+             self._control_bit_flag,
+             self._index_sequence) = m.groups()
+            self._multiplex_index_no = None
+            return
+        # Example of earlier Illumina format (1.3/1.5):
+        # @HWUSI-EAS100R:6:73:941:1973#0/1
+        m = RE_ILLUMINA.match(self._seqid)
+        if m:
+            self._format = 'illumina'
+            (self._instrument_name,
+             self._flowcell_lane,
+             self._tile_no,
+             self._x_coord,
+             self._y_coord,
+             self._multiplex_index_no,
+             self._pair_id) = m.groups()
+            self._run_id = None
+            self._flowcell_id = None
+            self._bad_read = None
+            self._control_bit_flag = None
+            self._index_sequence = None
+            return
+        # Unrecognised format
+        self._format = None
+        self._instrument_name = None
+        self._run_id = None
+        self._flowcell_id = None
+        self._flowcell_lane = None
+        self._tile_no = None
+        self._x_coord = None
+        self._y_coord = None
+        self._multiplex_index_no = None
+        self._pair_id = None
+        self._bad_read = None
+        self._control_bit_flag = None
+        self._index_sequence = None
+
+    instrument_name = _seqid_field('instrument_name')
+    run_id = _seqid_field('run_id')
+    flowcell_id = _seqid_field('flowcell_id')
+    flowcell_lane = _seqid_field('flowcell_lane')
+    tile_no = _seqid_field('tile_no')
+    x_coord = _seqid_field('x_coord')
+    y_coord = _seqid_field('y_coord')
+    multiplex_index_no = _seqid_field('multiplex_index_no')
+    pair_id = _seqid_field('pair_id')
+    bad_read = _seqid_field('bad_read')
+    control_bit_flag = _seqid_field('control_bit_flag')
+    index_sequence = _seqid_field('index_sequence')
 
     @property
     def format(self):
@@ -331,10 +1522,9 @@ class SequenceIdentifier:
           String: 'illumina18', 'illumina' or None
 
         """
-        try:
-            return self._format
-        except AttributeError:
-            pass
+        if self._format is False:
+            self._parse()
+        return self._format
 
     def is_pair_of(self,seqid):
         """Check if this forms a pair with another SequenceIdentifier
@@ -362,7 +1552,11 @@ class SequenceIdentifier:
             return False
         
     def __repr__(self):
-        if self.format == 'illumina18':
+        format_ = self._format
+        if format_ is False:
+            # Not parsed yet
+            return self._seqid
+        if format_ == 'illumina18':
             return "@%s:%s:%s:%s:%s:%s:%s %s:%s:%s:%s" % (self.instrument_name, 
                                                           self.run_id,
                                                           self.flowcell_id,
@@ -374,7 +1568,7 @@ class SequenceIdentifier:
                                                           self.bad_read,
                                                           self.control_bit_flag,
                                                           self.index_sequence)
-        elif self.format == 'illumina':
+        elif format_ == 'illumina':
             return "@%s:%s:%s:%s:%s#%s/%s" % (self.instrument_name,
                                               self.flowcell_lane,
                                               self.tile_no,
@@ -384,7 +1578,7 @@ class SequenceIdentifier:
                                               self.pair_id)
         else:
             # Return what was put in
-            return self.__seqid
+            return self._seqid
 
 class FastqAttributes:
     """Class to provide access to gross attributes of a FASTQ file
@@ -394,7 +1588,11 @@ class FastqAttributes:
 
     nreads: number of reads in the FASTQ file
     fsize:  size of the file (in bytes)
-    
+    metadata: FastqMetadata object with summary statistics
+      for the file (see the 'fastqmeta' module)
+
+    Where possible the values are taken from the cached metadata
+    for the file.
 
     """
     def __init__(self,fastq_file=None,fp=None):
@@ -406,10 +1604,7 @@ class FastqAttributes:
           
         """
         self.__fastq_file = fastq_file
-        if fp is None:
-            self.__fp = get_fastq_file_handle(self.__fastq_file)
-        else:
-            self.__fp = fp
+        self.__fp = fp
         self.__nreads = None
 
     @property
@@ -428,6 +1623,73 @@ class FastqAttributes:
         """
         return os.path.getsize(self.__fastq_file)
 
+    @property
+    def metadata(self):
+        """Return the summary metadata for the FASTQ file
+
+        The metadata is generated (and cached) if necessary.
+
+        """
+        # Avoid circular import
+        import fastqmeta
+        return fastqmeta.get_metadata(self.__fastq_file)
+
+class FastqValidation(object):
+    """Class to store the results of checking a FASTQ file
+
+    Instances are returned by the 'validate_fastq' function, and
+    provide the following properties:
+
+    fastq: the FASTQ file that was checked
+    nreads: number of reads in the file (i.e. number of lines
+      divided by 4)
+    valid: True if no problems were found, False otherwise
+    error: description of the first problem found (or None)
+    read_number: position of the first bad read record in the
+      file, starting from 1 (or None)
+    offset: offset of the start of the first bad read record in
+      the (uncompressed) data, in bytes (or None)
+    metadata: FastqMetadata object with summary statistics for
+      the file (see the 'fastqmeta' module), or None if the
+      file isn't valid
+
+    """
+    def __init__(self,fastq=None,nreads=0,error=None,read_number=None,
+                 offset=None,metadata=None):
+        """Create a new FastqValidation object
+
+        Arguments:
+          fastq: name of the FASTQ file
+          nreads: number of reads
+          error: description of the first problem
+          read_number: position of the first bad read
+          offset: offset of the first bad read
+          metadata: summary statistics for the file
+
+        """
+        self.fastq = fastq
+        self.nreads = nreads
+        self.error = error
+        self.read_number = read_number
+        self.offset = offset
+        self.metadata = metadata
+
+    @property
+    def valid(self):
+        """Return True if no problems were found
+        """
+        return (self.error is None)
+
+    def __repr__(self):
+        if self.valid:
+            return "%s: %d reads" % (self.fastq,self.nreads)
+        if self.offset is None:
+            return "%s: %s (read #%s)" % (self.fastq,self.error,
+                                          self.read_number)
+        return "%s: %s (read #%s, offset %s)" % (self.fastq,self.error,
+                                                 self.read_number,
+                                                 self.offset)
+
 #######################################################################
 # Functions
 #######################################################################
@@ -436,7 +1698,8 @@ def get_fastq_file_handle(fastq):
     """Return a file handle opened for reading for a FASTQ file
 
     Deals with both compressed (gzipped) and uncompressed FASTQ
-    files.
+    files. BGZF-format files are decompressed in parallel on
+    background threads.
 
     Arguments:
       fastq: name (including path, if required) of FASTQ file.
@@ -447,11 +1710,129 @@ def get_fastq_file_handle(fastq):
 
     """
     if os.path.splitext(fastq)[1] == '.gz':
-        return gzip.open(fastq,'rb')
+        return bgzf.open_gzipped(fastq)
     else:
         return open(fastq,'rb')
 
-def nreads(fastq=None,fp=None):
+def iter_batches(fastq=None,fp=None,batch_size=BATCHSIZE):
+    """Return an iterator over blocks of reads in a FASTQ file
+
+    Each block is returned as a FastqBatch object, where the
+    reads are held as packed numpy arrays suitable for computing
+    statistics using array operations. For example, to get the
+    overall quality range:
+
+    >>> qmin,qmax = (None,None)
+    >>> for batch in iter_batches(fastq_file):
+    >>>    bmin,bmax = batch.quality_range()
+    >>>    ...
+
+    The FASTQ file can be specified either as a file name (using
+    the 'fastq' argument) or as a file-like object opened for
+    reading (using the 'fp' argument).
+
+    Requires the numpy module; ImportError is raised if it is
+    not available (so callers can fall back to FastqIterator).
+
+    Arguments:
+      fastq: fastq(.gz) file
+      fp: open file descriptor for fastq file
+      batch_size: maximum number of reads in each batch
+
+    Returns:
+      Iterator yielding FastqBatch objects.
+
+    """
+    if numpy is None:
+        raise ImportError("numpy is required for FASTQ batches")
+    return FastqReader(fastq_file=fastq,fp=fp).batches(batch_size)
+
+def _base_codes():
+    """Internal: return lookup table for 2-bit base codes
+
+    Returns:
+      uint8 numpy array of 256 elements, mapping the
+      character codes for A, C, G and T to 0-3, and all
+      other characters to 255.
+
+    """
+    codes = numpy.full(256,255,dtype=numpy.uint8)
+    for i,base in enumerate('ACGT'):
+        codes[ord(base)] = i
+    return codes
+
+def _pack_bases(codes):
+    """Internal: pack 2-bit base codes into integer keys
+
+    Arguments:
+      codes: 2D uint8 numpy array with the base codes (0-3)
+        for one sequence per row (at most PACKED_MAX_LENGTH
+        bases)
+
+    Returns:
+      uint64 numpy array with the key for each sequence.
+
+    """
+    keys = numpy.zeros(codes.shape[0],dtype=numpy.uint64)
+    two = numpy.uint64(2)
+    for i in xrange(codes.shape[1]):
+        keys <<= two
+        keys |= codes[:,i].astype(numpy.uint64)
+    return keys
+
+def _unpack_bases(keys,length):
+    """Internal: convert integer keys back into sequences
+
+    Arguments:
+      keys: uint64 numpy array of keys from '_pack_bases'
+      length: length of the sequences
+
+    Returns:
+      List of sequence strings.
+
+    """
+    if length == 0:
+        return ['']*len(keys)
+    codes = numpy.empty((len(keys),length),dtype=numpy.uint8)
+    three = numpy.uint64(3)
+    for i in xrange(length):
+        codes[:,length-1-i] = (keys >> numpy.uint64(2*i)) & three
+    bases = numpy.frombuffer('ACGT',dtype=numpy.uint8)[codes]
+    return numpy.ascontiguousarray(bases).view(
+        'S%d' % length).reshape(len(keys)).tolist()
+
+def _has_trailing_whitespace(text):
+    """Internal: check if lines in text may have trailing whitespace
+
+    Looks for carriage returns, and for spaces or tabs either
+    before a newline or at the end of the text.
+
+    """
+    return ('\r' in text or ' \n' in text or '\t\n' in text or
+            text[-1:] in (' ','\t'))
+
+def _strip_record_lines(lines,offset=0):
+    """Internal: remove trailing whitespace from FASTQ record lines
+
+    The lines are updated in place: carriage returns are removed
+    from the end of the sequence identifier lines, and all
+    trailing whitespace from the sequence, optid and quality
+    lines (matching what FastqRead does).
+
+    Arguments:
+      lines: list of record lines
+      offset: (optional) position within a record of the
+        first line in the list (0 for the sequence identifier
+        line)
+
+    """
+    for i in xrange(len(lines)):
+        if (i+offset)%4:
+            lines[i] = lines[i].rstrip()
+        else:
+            lines[i] = lines[i].rstrip('\r')
+
+def nreads(fastq=None,fp=None,nprocs=None):
     """Return number of reads in a FASTQ file
 
     Performs a simple-minded read count, by counting the number of lines
@@ -464,38 +1845,365 @@ def nreads(fastq=None,fp=None):
     This function can handle gzipped FASTQ files supplied via the 'fastq'
     argument.
 
+    For FASTQ files supplied via the 'fastq' argument:
+
+    - if there is up-to-date cached metadata for the file then the
+      read count is taken from that (see the 'fastqmeta' module);
+    - for ordinary gzipped files the count is taken from the
+      checkpoint index (see the 'gzindex' module), which is built
+      if it doesn't already exist;
+    - otherwise if 'nprocs' is more than one then the file is split
+      into chunks which are counted in parallel (see the
+      'fastqmapreduce' module).
+
     Line counting uses a variant of the "buf count" method outlined here:
     http://stackoverflow.com/a/850962/579925
 
     Arguments:
       fastq: fastq(.gz) file
       fp: open file descriptor for fastq file
+      nprocs: (optional) number of processes to use when counting
+        reads in an uncompressed or BGZF file supplied via 'fastq'
+        (default is to count them in the current process)
 
     Returns:
       Number of reads
 
     """
-    nlines = 0
     if fp is None:
+        # Avoid circular imports
+        import fastqmeta
+        import fastqmapreduce
+        import gzindex
+        metadata = fastqmeta.cached_metadata(fastq)
+        if metadata is not None:
+            return metadata.nreads
+        nlines = None
+        if fastq.endswith('.gz') and not bgzf.is_bgzf(fastq):
+            # Building the index is a single pass through the file
+            # which also counts the lines
+            try:
+                nlines = gzindex.get_index(fastq).nlines
+            except gzindex.GzipIndexError,ex:
+                logging.debug("%s: not using index: %s" % (fastq,ex))
+        elif nprocs is not None and nprocs > 1:
+            nlines = fastqmapreduce.fastq_map_reduce(fastq,_count_lines,
+                                                     operator.add,
+                                                     nprocs=nprocs)
+        if nlines is not None:
+            if (nlines%4) != 0:
+                raise Exception,"Bad read count (not fastq file, or corrupted?)"
+            return nlines/4
         fp = get_fastq_file_handle(fastq)
+        try:
+            return nreads(fp=fp)
+        finally:
+            fp.close()
+    nlines = 0
     buf_size = 1024 * 1024
     read_fp = fp.read # optimise the loop
     buf = read_fp(buf_size)
     while buf:
         nlines += buf.count('\n')
         buf = read_fp(buf_size)
-    if fastq is not None:
-        fp.close()
     if (nlines%4) != 0:
         raise Exception,"Bad read count (not fastq file, or corrupted?)"
     return nlines/4
 
+def _count_lines(chunk):
+    """Internal: count the lines in a FastqChunk
+    """
+    return chunk.data().count('\n')
+
+def validate_fastq(fastq,quality_range=None,nprocs=None,chunk_size=None):
+    """Check the records in a FASTQ file and count the reads
+
+    Unlike 'nreads' (which only counts lines), this checks that
+    each record has the expected structure (an identifier line
+    starting with '@', and a separator line starting with '+')
+    and that the sequence and quality lines are the same length;
+    optionally it also checks the quality values are within a
+    specified range of characters. Corrupted compressed data and
+    truncated files are also detected (in which case the read count
+    is the number of reads in the chunks before the one which
+    couldn't be read, independent of the number of processes).
+
+    The checks are performed in bulk on large blocks of lines,
+    with the file split into chunks which are checked in
+    parallel (see the 'fastqmapreduce' module); records which
+    straddle chunk boundaries are put back together and checked
+    when the results are combined.
+
+    Summary statistics are gathered at the same time, and if the
+    file is valid then these are cached as the metadata for the
+    file (see the 'fastqmeta' module).
+
+    Example:
+
+    >>> result = validate_fastq('reads.fastq.gz',quality_range=(33,74))
+    >>> if not result.valid:
+    >>> ... print "Bad read #%d: %s" % (result.read_number,result.error)
+
+    Arguments:
+      fastq: fastq(.gz) file
+      quality_range: (optional) tuple (min,max) with the smallest
+        and largest allowed quality values, as integer character
+        codes (e.g. (33,126) for Phred+33); if None then the
+        quality values aren't checked
+      nprocs: (optional) number of processes to use (defaults to
+        the number of CPUs)
+      chunk_size: (optional) approximate size of each chunk (in
+        bytes of uncompressed data)
+
+    Returns:
+      FastqValidation instance with the read count and details
+      of the first problem found (if any).
+
+    """
+    # Avoid circular imports
+    import fastqmeta
+    import fastqmapreduce
+    if chunk_size is None:
+        chunk_size = fastqmapreduce.CHUNK_SIZE
+    if quality_range is not None:
+        quality_chars = ''.join([chr(i) for i in xrange(quality_range[0],
+                                                         quality_range[1]+1)])
+    else:
+        quality_chars = None
+    validation = FastqValidation(fastq)
+    metadata = fastqmeta.FastqMetadata()
+    nlines = 0
+    offset = 0
+    partial = []
+    partial_offset = 0
+    try:
+        for chunk in fastqmapreduce.fastq_map(
+                fastq,
+                functools.partial(_validate_chunk,
+                                  quality_chars=quality_chars),
+                nprocs=nprocs,
+                chunk_size=chunk_size):
+            if chunk['error']:
+                validation.nreads = nlines//4
+                validation.error = chunk['error']
+                validation.read_number = nlines//4 + 1
+                return validation
+            # Get the results for the records which start in the
+            # chunk, given the number of lines which precede it
+            head,error,tail,stats = chunk['phases'][(-nlines)%4]
+            if stats:
+                metadata.add_stats(*stats)
+            if head:
+                # Complete the partial record from the previous chunks
+                if not partial:
+                    partial_offset = offset
+                partial.extend(head)
+                if len(partial) == 4:
+                    reason = _check_record(partial,quality_chars)
+                    if reason and validation.valid:
+                        validation.error = reason
+                        validation.read_number = (nlines + len(head))//4
+                        validation.offset = partial_offset
+                    elif not reason:
+                        metadata.add_read(FastqRead._from_fields(*partial))
+                    partial = []
+            if error and validation.valid:
+                index,error_offset,reason = error
+                validation.error = reason
+                validation.read_number = (nlines + len(head))//4 + index + 1
+                validation.offset = offset + error_offset
+            if tail:
+                partial = tail
+                partial_offset = offset + chunk['nbytes'] - \
+                                 sum([len(line)+1 for line in tail])
+            nlines += chunk['nlines']
+            offset += chunk['nbytes']
+    except (IOError,EOFError,zlib.error) as ex:
+        validation.nreads = nlines//4
+        validation.error = "Error reading data: %s" % ex
+        validation.read_number = nlines//4 + 1
+        return validation
+    validation.nreads = nlines//4
+    if partial and validation.valid:
+        validation.error = "Incomplete record at end of file"
+        validation.read_number = nlines//4 + 1
+        validation.offset = partial_offset
+    if validation.valid:
+        fastqmeta.save_metadata(fastq,metadata)
+        validation.metadata = metadata
+    return validation
+
+def _validate_chunk(chunk,quality_chars=None):
+    """Internal: check the records in a FastqChunk
+
+    As the number of lines before the chunk isn't known, the
+    records are checked for each of the four possible positions
+    of the first record start within the chunk's lines.
+
+    Arguments:
+      chunk: FastqChunk instance
+      quality_chars: (optional) string with the allowed quality
+        characters
+
+    Returns:
+      Dictionary with keys 'nlines' (number of lines), 'nbytes'
+      (size of the data), 'error' (description of an error
+      reading the data, or None), and 'phases' (list with an
+      item for each of the possible positions of the first
+      record start). Each item is a tuple (head,error,tail,stats),
+      where 'head' is the list of lines before the first record
+      start, 'tail' is the list of lines of the final partial
+      record, 'error' is None or a tuple (index,offset,reason)
+      describing the first bad record in the chunk, and 'stats'
+      is None or a tuple (nreads,nbases,min_length,max_length,
+      min_quality,max_quality) for the complete records (if
+      there are no bad records).
+
+    """
+    try:
+        data = chunk.raw_data()
+    except (IOError,EOFError,zlib.error) as ex:
+        return dict(nlines=0,nbytes=0,phases=None,
+                    error="Error reading data: %s" % ex)
+    lines = data.split('\n')
+    if data.endswith('\n'):
+        lines.pop()
+    nlines = len(lines)
+    # Bulk checks are done on the first characters and lengths
+    # of the lines
+    firsts = [line[:1] for line in lines]
+    lengths = map(len,lines)
+    phases = []
+    for start in xrange(4):
+        nrecords = max((nlines - start)//4,0)
+        end = start + 4*nrecords
+        ok = (firsts[start:end:4].count('@') == nrecords and
+              firsts[start+2:end:4].count('+') == nrecords and
+              lengths[start+1:end:4] == lengths[start+3:end:4])
+        if ok and quality_chars is not None:
+            ok = not ''.join(lines[start+3:end:4]).translate(None,
+                                                             quality_chars)
+        error = None
+        stats = None
+        if not ok:
+            # Locate the first bad record
+            for i in xrange(nrecords):
+                j = start + 4*i
+                reason = _check_record(lines[j:j+4],quality_chars)
+                if reason:
+                    error = (i,sum(lengths[:j])+j,reason)
+                    break
+        elif nrecords:
+            stats = _record_stats(lengths[start+1:end:4],
+                                  lines[start+3:end:4])
+        phases.append((lines[:start],error,lines[end:],stats))
+    return dict(nlines=nlines,nbytes=len(data),phases=phases,error=None)
+
+def _record_stats(seq_lengths,qualities):
+    """Internal: get summary statistics for a set of records
+
+    Arguments:
+      seq_lengths: list of the sequence lengths
+      qualities: list of the quality strings
+
+    Returns:
+      Tuple (nreads,nbases,min_length,max_length,min_quality,
+      max_quality).
+
+    """
+    quality = ''.join(qualities)
+    if not quality:
+        qmin,qmax = (None,None)
+    elif numpy is not None:
+        quality = numpy.frombuffer(quality,dtype=numpy.uint8)
+        qmin,qmax = (int(quality.min()),int(quality.max()))
+    else:
+        qmin,qmax = (ord(min(quality)),ord(max(quality)))
+    return (len(seq_lengths),sum(seq_lengths),
+            min(seq_lengths),max(seq_lengths),qmin,qmax)
+
+def _check_record(lines,quality_chars=None):
+    """Internal: check a single FASTQ record
+
+    Arguments:
+      lines: list of the four lines in the record
+      quality_chars: (optional) string with the allowed quality
+        characters
+
+    Returns:
+      Description of the problem with the record, or None if
+      there are no problems.
+
+    """
+    seqid,sequence,optid,quality = lines
+    if not seqid.startswith('@'):
+        return "Identifier line doesn't start with '@'"
+    if not optid.startswith('+'):
+        return "Separator line doesn't start with '+'"
+    if len(sequence) != len(quality):
+        return "Sequence and quality lengths differ (%d != %d)" % \
+            (len(sequence),len(quality))
+    if quality_chars is not None:
+        bad = quality.translate(None,quality_chars)
+        if bad:
+            return "Quality value out of range ('%s')" % bad[0]
+    return None
+
+def headers_are_pair(header1,header2):
+    """Check that two read headers form an R1/R2 pair
+
+    The headers are compared as raw strings (i.e. without being
+    parsed into SequenceIdentifiers): they must be identical except
+    for the read number, which is the first character after the
+    first space (for Illumina 1.8+ format headers, e.g.
+    '@EAS139:136:FC706VJ:2:2104:15343:197393 1:Y:18:ATCACG') or
+    otherwise the character after the last '/' (for earlier Illumina
+    format headers, e.g. '@HWUSI-EAS100R:6:73:941:1973#0/1'). One
+    read number must be 1 and the other 2.
+
+    This gives the same result as SequenceIdentifier.is_pair_of for
+    the Illumina formats, but is much faster.
+
+    Arguments:
+      header1: sequence identifier line for the first read
+      header2: sequence identifier line for the second read
+
+    Returns:
+      True if the headers form an R1/R2 pair, False otherwise.
+
+    """
+    if header1 is None or header2 is None:
+        return False
+    if len(header1) != len(header2):
+        return False
+    i = header1.find(' ')
+    if i < 0:
+        i = header1.rfind('/')
+        if i < 0:
+            return False
+    i += 1
+    n1 = header1[i:i+1]
+    n2 = header2[i:i+1]
+    if not ((n1 == '1' and n2 == '2') or (n1 == '2' and n2 == '1')):
+        return False
+    return (header1[:i] == header2[:i] and
+            header1[i+1:] == header2[i+1:])
+
 def fastqs_are_pair(fastq1=None,fastq2=None,verbose=True,fp1=None,fp2=None):
     """Check that two FASTQs form an R1/R2 pair
 
+    The FASTQs are read concurrently using a PairedFastqIterator
+    and the headers are compared using 'headers_are_pair'.
+
     Arguments:
       fastq1: first FASTQ
       fastq2: second FASTQ
+      verbose: if True then report progress and the first pair
+        of unpaired headers (if any)
+      fp1: file-like object opened for reading the first FASTQ
+        (instead of 'fastq1')
+      fp2: file-like object opened for reading the second FASTQ
+        (instead of 'fastq2')
 
     Returns:
       True if each read in fastq1 forms an R1/R2 pair with the equivalent
@@ -504,18 +2212,188 @@ def fastqs_are_pair(fastq1=None,fastq2=None,verbose=True,fp1=None,fp2=None):
       than the other).
 
     """
-    # Use itertools.izip_longest, which will return None if either of
+    # The paired iterator returns None for a header if either of
     # the fastqs is exhausted before the other
+    pairs = PairedFastqIterator(fastq1=fastq1,fastq2=fastq2,fp1=fp1,fp2=fp2)
     i = 0
-    for r1,r2 in itertools.izip_longest(FastqIterator(fastq_file=fastq1,fp=fp1),
-                                        FastqIterator(fastq_file=fastq2,fp=fp2)):
+    for header1,header2 in pairs.headers():
         i += 1
         if verbose:
             if i%100000 == 0:
                 print "Examining pair #%d" % i
-        if not r1.seqid.is_pair_of(r2.seqid):
+        if not headers_are_pair(header1,header2):
+            pairs.close()
             if verbose:
                 print "Unpaired headers for read position #%d:" % i
-                print "%s\n%s" % (r1.seqid,r2.seqid)
+                print "%s\n%s" % (header1,header2)
             return False
     return True
+
+def is_interleaved(fastq=None,fp=None,npairs=INTERLEAVED_CHECK_PAIRS):
+    """Check whether a FASTQ holds interleaved R1/R2 pairs
+
+    The FASTQ is interleaved if each odd-numbered record forms
+    an R1/R2 pair with the following record (see
+    'headers_are_pair'). Only the first 'npairs' pairs of
+    records are examined.
+
+    Note that if a file-like object is supplied then the
+    records which are examined are consumed.
+
+    Arguments:
+      fastq: name of the FASTQ file
+      fp: file-like object opened for reading (instead of
+        'fastq')
+      npairs: optional, maximum number of pairs of records to
+        examine
+
+    Returns:
+      True if the FASTQ appears to be interleaved, False if
+      not (or if it's empty).
+
+    """
+    reads = FastqIterator(fastq_file=fastq,fp=fp)
+    headers = [r.raw_seqid for r in itertools.islice(reads,2*npairs)]
+    if not headers or len(headers)%2:
+        return False
+    for i in xrange(0,len(headers)-1,2):
+        if not headers_are_pair(headers[i],headers[i+1]):
+            return False
+    return True
+
+def interleave_fastqs(fastq1,fastq2,interleaved_fastq,check_pairs=True,
+                      threads=None):
+    """Write R1/R2 FASTQs as a single interleaved FASTQ
+
+    The inputs are read concurrently (see PairedFastqIterator)
+    and each R1 record is written followed by its R2 mate. The
+    output is compressed on a background thread if its name
+    ends with '.gz'.
+
+    An exception is raised if the FASTQs have different numbers
+    of records or (if 'check_pairs' is True) if any records
+    don't form a pair (see 'headers_are_pair'); in this case
+    the partial output is removed.
+
+    Arguments:
+      fastq1: name of the R1 FASTQ file
+      fastq2: name of the R2 FASTQ file
+      interleaved_fastq: name of the output FASTQ
+      check_pairs: optional, if True (the default) then check
+        that the records form pairs
+      threads: optional, number of threads to use to compress
+        the output (defaults to the number of CPUs)
+
+    Returns:
+      Number of pairs of records written.
+
+    """
+    pairs = PairedFastqIterator(fastq1=fastq1,fastq2=fastq2)
+    fp = _BackgroundWriter(interleaved_fastq,threads=threads)
+    npairs = 0
+    try:
+        for lines1,i1,lines2,i2,n in pairs._blocks():
+            if not lines1 or not lines2:
+                raise Exception("%s and %s have different numbers of "
+                                "reads" % (fastq1,fastq2))
+            data = []
+            for i in xrange(0,n,4):
+                if check_pairs and not headers_are_pair(lines1[i1+i],
+                                                        lines2[i2+i]):
+                    raise Exception("Reads #%d are not a pair:\n%s\n%s" %
+                                    (npairs+i//4+1,
+                                     lines1[i1+i],lines2[i2+i]))
+                data.extend(lines1[i1+i:i1+i+4])
+                data.extend(lines2[i2+i:i2+i+4])
+            data.append('')
+            fp.write('\n'.join(data))
+            npairs += n//4
+        fp.close()
+    except Exception:
+        exc_info = sys.exc_info()
+        pairs.close()
+        fp.discard()
+        raise exc_info[0],exc_info[1],exc_info[2]
+    return npairs
+
+def deinterleave_fastq(interleaved_fastq,fastq1,fastq2,check_pairs=True,
+                       threads=None):
+    """Split an interleaved FASTQ into R1/R2 FASTQs
+
+    The input is read on a background thread (see
+    InterleavedFastqIterator), and the outputs are written on
+    separate background threads so that they can be compressed
+    concurrently (outputs are compressed if their names end with
+    '.gz').
+
+    An exception is raised if the FASTQ has an odd number of
+    records or (if 'check_pairs' is True) if any adjacent
+    records don't form a pair (see 'headers_are_pair'); in
+    this case the partial outputs are removed.
+
+    Arguments:
+      interleaved_fastq: name of the interleaved FASTQ
+      fastq1: name of the output R1 FASTQ file
+      fastq2: name of the output R2 FASTQ file
+      check_pairs: optional, if True (the default) then check
+        that the records form pairs
+      threads: optional, number of threads to use to compress
+        each output (defaults to the number of CPUs)
+
+    Returns:
+      Number of pairs of records written.
+
+    """
+    reads = InterleavedFastqIterator(interleaved_fastq)
+    fp1 = _BackgroundWriter(fastq1,threads=threads)
+    fp2 = _BackgroundWriter(fastq2,threads=threads)
+    npairs = 0
+    try:
+        for lines in reads._blocks():
+            if check_pairs:
+                for i in xrange(0,len(lines),8):
+                    if not headers_are_pair(lines[i],lines[i+4]):
+                        raise Exception("Reads #%d are not a pair:\n%s\n%s" %
+                                        (npairs+i//8+1,lines[i],lines[i+4]))
+            data1 = []
+            data2 = []
+            for i in xrange(0,len(lines),8):
+                data1.extend(lines[i:i+4])
+                data2.extend(lines[i+4:i+8])
+            data1.append('')
+            data2.append('')
+            fp1.write('\n'.join(data1))
+            fp2.write('\n'.join(data2))
+            npairs += len(lines)//8
+        fp1.close()
+        fp2.close()
+    except Exception:
+        exc_info = sys.exc_info()
+        reads.close()
+        fp1.discard()
+        fp2.discard()
+        raise exc_info[0],exc_info[1],exc_info[2]
+    return npairs
+
+def _get_slots_state(obj):
+    """Internal: return the state of an object which uses slots
+
+    Used to pickle objects (e.g. FastqRead) with protocols
+    which don't support slots.
+
+    """
+    state = {}
+    for cls in type(obj).__mro__:
+        for name in getattr(cls,'__slots__',()):
+            try:
+                state[name] = getattr(obj,name)
+            except AttributeError:
+                pass
+    return state
+
+def _set_slots_state(obj,state):
+    """Internal: restore the state of an object which uses slots
+
+    """
+    for name in state:
+        setattr(obj,name,state[name])
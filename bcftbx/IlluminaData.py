@@ -26,8 +26,10 @@ import xml.dom.minidom
 import shutil
 import platforms
 import utils
+import fswalker
 import TabFile
 import cStringIO
+from barcodes import BarcodeDistances
 
 #######################################################################
 # Module constants
@@ -333,9 +335,10 @@ class IlluminaData:
 
         """
         # Look for projects
-        for f in os.listdir(self.unaligned_dir):
-            dirn = os.path.join(self.unaligned_dir,f)
-            if f.startswith("Project_") and os.path.isdir(dirn):
+        for entry in fswalker.scandir(self.unaligned_dir):
+            f = entry.name
+            dirn = entry.path
+            if f.startswith("Project_") and entry.is_dir():
                 logging.debug("Project dirn: %s" % f)
                 self.projects.append(IlluminaProject(dirn))
             elif f == "Undetermined_indices":
@@ -373,22 +376,21 @@ class IlluminaData:
         got_reports = os.path.isdir(os.path.join(self.unaligned_dir,'Reports'))
         # Look for potential projects
         project_dirs = []
-        for d in os.listdir(self.unaligned_dir):
-            dirn = os.path.join(self.unaligned_dir,d)
-            if not os.path.isdir(dirn):
+        for entry in fswalker.scandir(self.unaligned_dir):
+            dirn = entry.path
+            if not entry.is_dir():
                 continue
             # Get a list of fastq files
+            entries = fswalker.scandir(dirn)
             fqs = filter(lambda f: f.endswith('.fastq.gz') and
                          IlluminaFastq(f).sample_number is not None,
-                         os.listdir(dirn))
+                         [e.name for e in entries])
             if fqs:
                 # Looks like a project
                 project_dirs.append(dirn)
             else:
                 # Look in subdirs
-                subdirs = filter(lambda d:
-                                 os.path.isdir(os.path.join(dirn,d)),
-                                 os.listdir(dirn))
+                subdirs = [e.name for e in entries if e.is_dir()]
                 if subdirs:
                     for sd in subdirs:
                         fqs = filter(lambda f: f.endswith('.fastq.gz') and
@@ -485,17 +487,19 @@ class IlluminaProject:
             logging.debug("CASAVA/bcl2fastq 1.8 project: %s" % self.name)
             # Look for samples
             self.sample_prefix = "Sample_"
-            for f in os.listdir(self.dirn):
-                sample_dirn = os.path.join(self.dirn,f)
+            for entry in fswalker.scandir(self.dirn):
+                f = entry.name
+                sample_dirn = entry.path
                 if f.startswith(self.sample_prefix) and \
-                   os.path.isdir(sample_dirn):
+                   entry.is_dir():
                     self.samples.append(IlluminaSample(sample_dirn))
         else:
             # Examine fastq files in top-level dir to see if naming scheme
             # follows bcl2fastq v2 convention
+            entries = fswalker.scandir(self.dirn)
             fastqs = filter(lambda f: f.endswith('.fastq.gz') and
                             IlluminaFastq(f).sample_number is not None,
-                            os.listdir(self.dirn))
+                            [e.name for e in entries])
             if fastqs:
                 # Check if this is the top level bcl2fastq v2 output
                 # i.e. does it contain undetermined reads
@@ -507,9 +511,7 @@ class IlluminaProject:
             if not self.undetermined:
                 # Even if we already have fastqs, we need to check
                 # subdirs for more bcl2fastq v2 style fastqs
-                subdirs = filter(lambda d:
-                                 os.path.isdir(os.path.join(self.dirn,d)),
-                                 os.listdir(self.dirn))
+                subdirs = [e.name for e in entries if e.is_dir()]
                 for subdir in subdirs:
                     items = [os.path.join(subdir,x)
                              for x in
@@ -1292,7 +1294,7 @@ class SampleSheet:
             else:
                 samples[name].append(line)
         duplicates = filter(lambda s: len(s) > 1,
-                            [samples[name] for name in samples])
+                            [samples[s] for s in samples])
         return duplicates
 
     @property
@@ -1338,6 +1340,47 @@ class SampleSheet:
                 empty_names.append(line)
         return empty_names
 
+    def barcode_distances(self,length=None):
+        """
+        Find the minimum distances between barcodes in each lane
+
+        For each lane, computes the minimum Hamming distance
+        between the index sequences of the samples in that lane,
+        which determines the number of mismatches that can be
+        allowed when demultiplexing (see 'BarcodeDistances' in
+        the 'barcodes' module). Samples without index sequences
+        are ignored.
+
+        Arguments:
+          length: (optional) if set then truncate the index
+            sequences to this number of bases before comparing
+            them (see 'truncate_barcode' in the 'barcodes'
+            module)
+
+        Returns:
+          Dictionary where the keys are lane numbers (or None if
+          the sample sheet doesn't define lanes) and the values
+          are BarcodeDistances instances.
+
+        """
+        if self._data is None: return {}
+        lanes = {}
+        for line in self._data:
+            index = samplesheet_index_sequence(line)
+            if index is None:
+                continue
+            if self.has_lanes:
+                lane = line['Lane']
+            else:
+                lane = None
+            if lane not in lanes:
+                lanes[lane] = []
+            lanes[lane].append(index)
+        distances = {}
+        for lane in lanes:
+            distances[lane] = BarcodeDistances(lanes[lane],length=length)
+        return distances
+
     def fix_duplicated_names(self):
         """
         Rename samples to remove duplicated sample names within a project
@@ -37,6 +37,31 @@ There is also a high-level class 'Md5Checker' which implements various
 class methods for running MD5 checks across all files in a directory, and
 a wrapper class 'Md5Reporter' which
 
+The Md5Checker methods which operate on many files compute the MD5 sums
+for several files at once on a pool of threads (the hashlib module releases
+the GIL while digesting large blocks of data), although the results are
+always returned in the same order as for sequential operation.
+
+The 'Md5Cache' class provides an optional persistent cache of MD5 sums
+(stored in an SQLite database), which can be passed to 'md5sum' and to the
+Md5Checker methods so that files which haven't changed since they were
+last checksummed don't have to be read again. For example:
+
+>>> cache = Md5Cache("md5sums.db")
+>>> for f,md5 in Md5Checker.compute_md5sums("/data/run",cache=cache):
+...     print "%s  %s" % (md5,f)
+>>> cache.close()
+
+Checksums other than MD5 can also be generated using the 'checksums'
+function and the Md5Checker 'compute_checksums' and 'verify_checksums'
+methods, which compute the digests for several algorithms (see
+'DIGEST_ALGORITHMS') in a single pass through each file, e.g.:
+
+>>> checksums("myfile.txt",('md5','sha256'))
+... ('eacc9c036025f0e64fb724cacaadd8b4', '9f86d08...')
+
+Note that CRC-32C checksums need the 'crc32c' module to be installed.
+
 """
 
 #######################################################################
@@ -51,13 +76,27 @@ __version__ = "1.1.0"
 
 import sys
 import os
+import io
+import stat
+import time
+import zlib
+import sqlite3
 import logging
+import threading
+import collections
+from multiprocessing.pool import ThreadPool
+import fswalker
 try:
     # Preferentially use hashlib module
     import hashlib
 except ImportError:
     # hashlib not available, use deprecated md5 module
     import md5
+try:
+    import crc32c
+except ImportError:
+    # No crc32c module: CRC-32C checksums are unavailable
+    crc32c = None
 
 #######################################################################
 # Modules constants
@@ -65,6 +104,28 @@ except ImportError:
 
 BLOCKSIZE = 1024*1024
 
+# Size of the (reusable) read buffers used by the Md5Checker methods
+READ_BUFFER_SIZE = 8*1024*1024
+
+# Default number of threads used by the Md5Checker methods
+MD5_THREADS = 4
+
+# Files modified less than this many seconds before they are
+# checksummed are not added to an Md5Cache (as they might be
+# modified again without their modification time changing)
+CACHE_MIN_AGE = 2
+
+# Number of new entries added to an Md5Cache between commits
+CACHE_COMMIT_INTERVAL = 1000
+
+# Files at least this size are read concurrently when comparing
+# pairs of files
+CONCURRENT_READ_SIZE = READ_BUFFER_SIZE
+
+# Algorithms supported by 'checksums' and the Md5Checker
+# 'compute_checksums' and 'verify_checksums' methods
+DIGEST_ALGORITHMS = ('md5','sha1','sha256','sha512','crc32','crc32c')
+
 #######################################################################
 # Classes
 #######################################################################
@@ -92,7 +153,7 @@ class Md5Checker:
     IGNORE_LINKS=1
 
     @classmethod
-    def walk(self,dirn,links=FOLLOW_LINKS):
+    def walk(self,dirn,links=FOLLOW_LINKS,threads=None):
         """Traverse all files found in a directory structure
 
         Given a directory, traverses the structure underneath (including
@@ -110,23 +171,24 @@ class Md5Checker:
         Arguments:
           dirn: name of the top-level directory
           links: (optional) specify how symbolic links are handled
+          threads: (optional) number of threads to use to scan
+            directories in parallel (see 'fswalker.walk')
 
         Returns:
           Yields the name and full path for each file under 'dirn'.
           
         """
-        for d in os.walk(dirn):
-            if os.path.islink(d[0]) and links != self.FOLLOW_LINKS:
-                continue
-            for f in d[2]:
-                path = os.path.join(d[0],f)
-                if os.path.islink(path) and links != self.FOLLOW_LINKS:
+        if os.path.islink(dirn) and links != self.FOLLOW_LINKS:
+            return
+        for dirpath,dirs,files in fswalker.walk(dirn,threads=threads):
+            for f in files:
+                if f.is_symlink() and links != self.FOLLOW_LINKS:
                     continue
                 else:
-                    yield os.path.normpath(path)
+                    yield os.path.normpath(f.path)
 
     @classmethod
-    def md5_walk(self,dirn,links=FOLLOW_LINKS):
+    def md5_walk(self,dirn,links=FOLLOW_LINKS,threads=None,cache=None):
         """Calculate MD5 sums for all files in directory
 
         Given a directory, traverses the structure underneath (including
@@ -139,17 +201,23 @@ class Md5Checker:
         Arguments:
           dirn: name of the top-level directory
           links: (optional) specify how symbolic links are handled
+          threads: (optional) number of files to compute MD5 sums for
+            concurrently (defaults to MD5_THREADS)
+          cache: (optional) Md5Cache instance to look up and store
+            MD5 sums
 
         Returns:
           Yields a tuple (f,md5) where f is the path of a file relative to
           the top-level directory, and md5 is the calculated MD5 sum.
 
         """
-        for f in self.walk(dirn,links=links):
-            yield (os.path.relpath(f,dirn),md5sum(f))
+        for f,digest in _pool_imap(lambda f: (f,_md5sum_file(f,cache)),
+                                   self.walk(dirn,links=links),
+                                   threads):
+            yield (os.path.relpath(f,dirn),digest)
 
     @classmethod
-    def md5cmp_files(self,f1,f2):
+    def md5cmp_files(self,f1,f2,cache=None,stream=False):
         """Compares the MD5 sums of two files 
 
         Given two file names, attempts to compute and compare their
@@ -158,6 +226,16 @@ class Md5Checker:
         If the MD5s match then returns MD5_OK, if they don't match
         then returns MD5_FAILED.
 
+        If both files are regular files of different sizes then
+        MD5_FAILED is returned without computing the MD5 sums.
+        Otherwise the MD5 sums for large files are computed at the
+        same time on separate threads.
+
+        If 'stream' is True then the contents of the two files are
+        compared block by block instead of computing the MD5 sums,
+        stopping at the first block which differs (MD5_OK or
+        MD5_FAILED are returned as before).
+
         If one or both MD5 sums cannot be computed then returns
         MD5_ERROR.
 
@@ -168,15 +246,41 @@ class Md5Checker:
         Arguments:
           f1: name and path for reference file
           f2: name and path for file to be checked
+          cache: (optional) Md5Cache instance to look up and store
+            MD5 sums (ignored if 'stream' is True)
+          stream: (optional) if True then compare the file contents
+            directly rather than computing MD5 sums
 
         Returns:
           Md5Checker constant representing the outcome of the
           comparison.
 
         """
-        # Compute and compare MD5 sums
+        # Check the file sizes first
         try:
-            if md5sum(f1) == md5sum(f2):
+            st1 = os.stat(f1)
+            st2 = os.stat(f2)
+            if stat.S_ISREG(st1.st_mode) and stat.S_ISREG(st2.st_mode):
+                if st1.st_size != st2.st_size:
+                    logging.debug("%s: sizes differ (%d != %d)" %
+                                  (f1,st1.st_size,st2.st_size))
+                    return self.MD5_FAILED
+                concurrent = (st1.st_size >= CONCURRENT_READ_SIZE)
+            else:
+                concurrent = False
+        except OSError:
+            # Let the comparison report the error
+            concurrent = False
+        # Compare the contents
+        try:
+            if stream:
+                identical = _cmp_file_contents(f1,f2)
+            elif concurrent:
+                md5_f2 = _BackgroundCall(_md5sum_file,f2,cache)
+                identical = (_md5sum_file(f1,cache) == md5_f2.get())
+            else:
+                identical = (_md5sum_file(f1,cache) == _md5sum_file(f2,cache))
+            if identical:
                 status = self.MD5_OK
             else:
                 status = self.MD5_FAILED
@@ -187,7 +291,8 @@ class Md5Checker:
         return status
 
     @classmethod
-    def md5cmp_dirs(self,d1,d2,links=FOLLOW_LINKS):
+    def md5cmp_dirs(self,d1,d2,links=FOLLOW_LINKS,threads=None,cache=None,
+                    stream=False):
         """Compares the contents of one directory with another using MD5 sums
 
         Given two directory names 'd1' and 'd2', compares the MD5 sum of
@@ -216,6 +321,13 @@ class Md5Checker:
           d1: 'reference' directory
           d2: 'target' directory to be compared with the reference
           links: (optional) specify how symbolic links are handled.
+          threads: (optional) number of file pairs to compare
+            concurrently (defaults to MD5_THREADS)
+          cache: (optional) Md5Cache instance to look up and store
+            MD5 sums
+          stream: (optional) if True then compare the contents of
+            each pair of files directly rather than computing MD5
+            sums (see 'md5cmp_files')
 
         Returns:
           Yields a tuple (f,status) where f is the relative path of the
@@ -223,23 +335,48 @@ class Md5Checker:
           representing the outcome of the comparison.
 
         """
-        for f1 in self.walk(d1,links=links):
-            f2 = os.path.join(d2,os.path.relpath(f1,d1))
-            if not os.path.exists(f2):
-                result = self.MISSING_TARGET
-            else:
-                try:
-                    result = self.md5cmp_files(f1,f2)
-                except Exception,ex:
-                    logging.debug("Failed to compute one or both checksums:")
-                    logging.debug("Reference file: %s" % f1)
-                    logging.debug("Target file   : %s" % f2)
-                    logging.debug("Exception     : %s" % ex)
-                    result = self.MD5_ERROR
-            yield (os.path.relpath(f1,d1),result)
+        for f,result in _pool_imap(lambda f1: self._md5cmp_target(f1,d1,d2,
+                                                                  cache,
+                                                                  stream),
+                                   self.walk(d1,links=links),
+                                   threads):
+            yield (f,result)
+
+    @classmethod
+    def _md5cmp_target(self,f1,d1,d2,cache=None,stream=False):
+        """Internal: compare a file with its equivalent in another directory
+
+        Arguments:
+          f1: path of the file in the 'reference' directory
+          d1: 'reference' directory
+          d2: 'target' directory
+          cache: (optional) Md5Cache instance
+          stream: (optional) if True then compare the contents
+            directly
+
+        Returns:
+          Tuple (f,status) where f is the relative path of the file
+          and status is the Md5Checker constant representing the
+          outcome of the comparison.
+
+        """
+        f = os.path.relpath(f1,d1)
+        f2 = os.path.join(d2,f)
+        if not os.path.exists(f2):
+            result = self.MISSING_TARGET
+        else:
+            try:
+                result = self.md5cmp_files(f1,f2,cache=cache,stream=stream)
+            except Exception,ex:
+                logging.debug("Failed to compute one or both checksums:")
+                logging.debug("Reference file: %s" % f1)
+                logging.debug("Target file   : %s" % f2)
+                logging.debug("Exception     : %s" % ex)
+                result = self.MD5_ERROR
+        return (f,result)
 
     @classmethod
-    def compute_md5sums(self,d,links=FOLLOW_LINKS):
+    def compute_md5sums(self,d,links=FOLLOW_LINKS,threads=None,cache=None):
         """Calculate MD5 sums for all files in directory
 
         Given a directory, traverses the structure underneath (including
@@ -252,21 +389,73 @@ class Md5Checker:
         Arguments:
           dirn: name of the top-level directory
           links: (optional) specify how symbolic links are handled
+          threads: (optional) number of files to compute MD5 sums for
+            concurrently (defaults to MD5_THREADS)
+          cache: (optional) Md5Cache instance to look up and store
+            MD5 sums
 
         Returns:
           Yields a tuple (f,md5) where f is the path of a file relative to
           the top-level directory, and md5 is the calculated MD5 sum.
 
         """
-        for f in self.walk(d,links=links):
+        for f,(digest,) in self.compute_checksums(d,algorithms=('md5',),
+                                                  links=links,
+                                                  threads=threads,
+                                                  cache=cache):
+            yield (f,digest)
+
+    @classmethod
+    def compute_checksums(self,d,algorithms=('md5',),links=FOLLOW_LINKS,
+                          threads=None,cache=None):
+        """Calculate checksums for all files in directory
+
+        Given a directory, traverses the structure underneath (including
+        subdirectories) and yields the path and checksums for each file
+        that is found. The checksums for all the requested algorithms
+        are computed in a single pass through each file.
+
+        The 'links' option determines how symbolic links are handled, see
+        the 'walk' function for details.
+
+        Arguments:
+          dirn: name of the top-level directory
+          algorithms: (optional) list of algorithms to compute
+            checksums for (see DIGEST_ALGORITHMS; defaults to MD5
+            only)
+          links: (optional) specify how symbolic links are handled
+          threads: (optional) number of files to compute checksums for
+            concurrently (defaults to MD5_THREADS)
+          cache: (optional) Md5Cache instance to look up and store
+            MD5 sums (only used if MD5 is the only algorithm)
+
+        Returns:
+          Yields a tuple (f,digests) where f is the path of a file
+          relative to the top-level directory, and digests is a tuple
+          with the checksum for each algorithm (in the same order).
+
+        """
+        algorithms = tuple(algorithms)
+        for algorithm in algorithms:
+            # Check the algorithms are supported before starting
+            _new_digest(algorithm)
+        def compute_digests(f):
             try:
-                md5 = md5sum(f)
-                yield (os.path.relpath(f,d),md5)
+                return (f,_digest_file(f,algorithms,cache),None)
             except IOError,ex:
-                logging.error("md5sum: %s: %s" % (f,ex))
+                return (f,None,ex)
+        for f,digests,ex in _pool_imap(compute_digests,
+                                       self.walk(d,links=links),
+                                       threads):
+            if ex is None:
+                yield (os.path.relpath(f,d),digests)
+            else:
+                logging.error("%s: %s: %s" %
+                              ('/'.join(["%ssum" % a for a in algorithms]),
+                               f,ex))
 
     @classmethod
-    def verify_md5sums(self,filen=None,fp=None):
+    def verify_md5sums(self,filen=None,fp=None,threads=None,cache=None):
         """Verify md5sums from a file
 
         Given a file (or a file-like object opened for reading), reads
@@ -293,6 +482,47 @@ class Md5Checker:
         Arguments:
           filen: name of the file containing md5sum output
           fp   : file-like object opened for reading, with md5sum output
+          threads: (optional) number of files to verify concurrently
+            (defaults to MD5_THREADS)
+          cache: (optional) Md5Cache instance to look up and store
+            MD5 sums
+
+        Returns:
+          Yields a tuple (f,status) where f is the path of the file being
+          verified (as it appears in the file), and status is the Md5Checker
+          constant representing the outcome.
+
+        """
+        return self.verify_checksums(filen=filen,fp=fp,algorithm='md5',
+                                     threads=threads,cache=cache)
+
+    @classmethod
+    def verify_checksums(self,filen=None,fp=None,algorithm='md5',
+                         threads=None,cache=None):
+        """Verify checksums from a file
+
+        Given a file (or a file-like object opened for reading), reads
+        each line and attemps to interpret as a checksum line i.e. of
+        the form
+
+        <checksum>  <path/to/file>
+
+        (as output by e.g. 'md5sum' or 'sha256sum') and verifies the
+        checksum against the file located on the file system. The
+        results are yielded in the same way as for 'verify_md5sums'
+        (i.e. MD5_OK and MD5_FAILED indicate whether the checksums
+        match or not, regardless of the algorithm).
+
+        Arguments:
+          filen: name of the file containing the checksums
+          fp   : file-like object opened for reading, with the
+            checksums
+          algorithm: (optional) algorithm used to generate the
+            checksums (see DIGEST_ALGORITHMS; defaults to 'md5')
+          threads: (optional) number of files to verify concurrently
+            (defaults to MD5_THREADS)
+          cache: (optional) Md5Cache instance to look up and store
+            MD5 sums (only used if the algorithm is MD5)
 
         Returns:
           Yields a tuple (f,status) where f is the path of the file being
@@ -300,27 +530,37 @@ class Md5Checker:
           constant representing the outcome.
 
         """
+        # Check the algorithm is supported before starting
+        _new_digest(algorithm)
         if fp is not None:
             filen=None
         else:
             fp = open(filen,'rU')
-        for line in fp:
-            items = line.strip().split()
-            if len(items) < 2:
-                raise IndexError,"Bad MD5 sum line: %s" % line.rstrip('\n')
-            chksum = items[0]
-            f = line[len(chksum):].strip()
+        def md5sum_lines():
+            for line in fp:
+                items = line.strip().split()
+                if len(items) < 2:
+                    raise IndexError,"Bad %s checksum line: %s" % \
+                        (algorithm.upper(),line.rstrip('\n'))
+                chksum = items[0]
+                f = line[len(chksum):].strip()
+                yield (f,chksum)
+        def verify_md5(item):
+            f,chksum = item
             try:
                 if not os.path.exists(f):
                     status = self.MISSING_TARGET
-                elif md5sum(f) == chksum:
+                elif _digest_file(f,(algorithm,),cache)[0] == chksum.lower():
                     status = self.MD5_OK
                 else:
                     status = self.MD5_FAILED
             except IOError, ex:
                 # Error accessing file
-                logging.error("%s: error while generating MD5 sum: '%s'" % (f,ex))
+                logging.error("%s: error while generating %s checksum: '%s'" %
+                              (f,algorithm.upper(),ex))
                 status = self.MD5_ERROR
+            return (f,status)
+        for f,status in _pool_imap(verify_md5,md5sum_lines(),threads):
             yield (f,status)
 
 class Md5CheckReporter:
@@ -464,6 +704,258 @@ class Md5CheckReporter:
         else:
             return 1
 
+class Md5Cache:
+    """Persistent cache of MD5 sums
+
+    Stores the MD5 sums of files in an SQLite database, keyed on
+    the device, inode, size and modification time of each file,
+    so that the MD5 sum of a file which hasn't changed since it
+    was last checksummed can be returned without reading it
+    again.
+
+    The 'md5sum' method returns the MD5 sum for a file, using
+    the cache where possible. If the cache was opened with
+    'verify=True' then the MD5 sums are always computed from the
+    files, and any which differ from the cached values (which
+    indicates that the file was corrupted or modified without its
+    metadata changing) are reported and replaced.
+
+    Statistics for the cache lookups are available via the
+    'hits', 'misses', 'bytes_avoided' and 'mismatches' properties
+    (and the 'summary' method).
+
+    The 'prune' method removes entries for files which no longer
+    exist or which have changed.
+
+    The cache can be used from multiple threads at once.
+
+    Example usage:
+
+    >>> cache = Md5Cache("md5sums.db")
+    >>> cache.md5sum("myfile.txt")
+    ... eacc9c036025f0e64fb724cacaadd8b4
+    >>> cache.close()
+
+    """
+    def __init__(self,db_file,verify=False):
+        """Create a new Md5Cache instance
+
+        Arguments:
+          db_file: path to the SQLite database file (will be
+            created if it doesn't already exist)
+          verify: (optional) if True then compute the MD5 sums
+            for all files and check them against the cached
+            values (default is to trust the cached values)
+
+        """
+        self._db_file = db_file
+        self._verify = bool(verify)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_file,check_same_thread=False)
+        self._conn.text_factory = str
+        self._conn.execute("CREATE TABLE IF NOT EXISTS md5sums "
+                           "(dev INTEGER, inode INTEGER, size INTEGER, "
+                           "mtime_ns INTEGER, path TEXT, md5 TEXT, "
+                           "PRIMARY KEY (dev,inode))")
+        self._conn.commit()
+        self._uncommitted = 0
+        self._hits = 0
+        self._misses = 0
+        self._bytes_avoided = 0
+        self._mismatches = 0
+
+    @property
+    def hits(self):
+        """Return number of MD5 sums returned from the cache
+        """
+        return self._hits
+
+    @property
+    def misses(self):
+        """Return number of MD5 sums which had to be computed
+        """
+        return self._misses
+
+    @property
+    def bytes_avoided(self):
+        """Return total size of the files which weren't read
+        """
+        return self._bytes_avoided
+
+    @property
+    def mismatches(self):
+        """Return number of cached MD5 sums which were wrong
+
+        Only checked if the cache was opened with 'verify=True'.
+
+        """
+        return self._mismatches
+
+    def md5sum(self,filen):
+        """Return the MD5 sum for a file
+
+        The MD5 sum is taken from the cache if the file hasn't
+        changed (unless the cache was opened with 'verify=True'),
+        otherwise it is computed and stored in the cache.
+
+        Arguments:
+          filen: name of the file to get the checksum for
+
+        Returns:
+          Md5sum digest for the named file.
+
+        """
+        try:
+            st = os.stat(filen)
+        except OSError:
+            # Let the checksum generation raise the error
+            return _md5sum_file(filen)
+        key = _cache_key(st)
+        with self._lock:
+            row = self._conn.execute("SELECT md5 FROM md5sums WHERE "
+                                     "dev=? AND inode=? AND size=? AND "
+                                     "mtime_ns=?",key).fetchone()
+        cached = None if row is None else row[0]
+        if cached is not None and not self._verify:
+            with self._lock:
+                self._hits += 1
+                self._bytes_avoided += st.st_size
+            return cached
+        chksum = _md5sum_file(filen)
+        with self._lock:
+            if cached is None:
+                self._misses += 1
+            elif cached != chksum:
+                logging.warning("%s: MD5 sum doesn't match cached value "
+                                "(%s != %s)" % (filen,chksum,cached))
+                self._mismatches += 1
+            else:
+                self._hits += 1
+        if cached != chksum:
+            self._store(filen,st,chksum)
+        return chksum
+
+    def prune(self):
+        """Remove cache entries for missing or changed files
+
+        Returns:
+          Number of entries removed from the cache.
+
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT dev,inode,size,mtime_ns,path "
+                                      "FROM md5sums").fetchall()
+        stale = []
+        for row in rows:
+            try:
+                if _cache_key(os.stat(row[4])) == tuple(row[:4]):
+                    continue
+            except OSError:
+                pass
+            stale.append(row[:2])
+        with self._lock:
+            self._conn.executemany("DELETE FROM md5sums WHERE "
+                                   "dev=? AND inode=?",stale)
+            self._conn.commit()
+            self._uncommitted = 0
+        return len(stale)
+
+    def summary(self,fp=sys.stdout):
+        """Write statistics for the cache lookups
+
+        Arguments:
+          fp: (optional) stream to write the statistics to
+            (defaults to stdout)
+
+        """
+        fp.write("Cache summary:\n")
+        fp.write("\t%d hits\n" % self.hits)
+        fp.write("\t%d misses\n" % self.misses)
+        fp.write("\t%d bytes not read\n" % self.bytes_avoided)
+        if self._verify:
+            fp.write("\t%d mismatches\n" % self.mismatches)
+
+    def close(self):
+        """Commit outstanding changes and close the cache
+        """
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
+
+    def _store(self,filen,st,chksum):
+        """Internal: add MD5 sum for a file to the cache
+
+        The MD5 sum isn't stored if the file was modified while
+        the checksum was being computed, or very recently.
+
+        """
+        try:
+            if _cache_key(os.stat(filen)) != _cache_key(st):
+                return
+        except OSError:
+            return
+        if st.st_mtime > time.time() - CACHE_MIN_AGE:
+            return
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO md5sums "
+                               "VALUES (?,?,?,?,?,?)",
+                               _cache_key(st) +
+                               (os.path.abspath(filen),chksum))
+            self._uncommitted += 1
+            if self._uncommitted >= CACHE_COMMIT_INTERVAL:
+                self._conn.commit()
+                self._uncommitted = 0
+
+class _CrcDigest:
+    """Internal: hashlib-style wrapper for CRC checksum functions
+
+    Arguments:
+      func: CRC function which takes the data and the current
+        CRC value, and returns the updated value (e.g.
+        'zlib.crc32')
+
+    """
+    def __init__(self,func):
+        self._func = func
+        self._crc = 0
+
+    def update(self,data):
+        self._crc = self._func(data,self._crc)
+
+    def hexdigest(self):
+        return "%08x" % (self._crc & 0xffffffff)
+
+class _BackgroundCall:
+    """Internal: call a function on a separate thread
+
+    The function is called as soon as the instance is created;
+    the 'get' method waits for it to finish and then returns the
+    result (or raises any exception that the function raised).
+
+    """
+    def __init__(self,func,*args):
+        self._func = func
+        self._args = args
+        self._result = None
+        self._exc_info = None
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        try:
+            self._result = self._func(*self._args)
+        except Exception:
+            self._exc_info = sys.exc_info()
+
+    def get(self):
+        """Wait for the function and return its result
+        """
+        self._thread.join()
+        if self._exc_info is not None:
+            raise self._exc_info[0],self._exc_info[1],self._exc_info[2]
+        return self._result
+
 #######################################################################
 # Functions
 #######################################################################
@@ -474,7 +966,7 @@ def hexify(s):
     """
     return ("%02x"*len(s)) % tuple(map(ord, s))
 
-def md5sum(f):
+def md5sum(f,cache=None):
     """Return md5sum digest for a file or stream
     
     This implements the md5sum checksum generation using both
@@ -489,11 +981,15 @@ def md5sum(f):
     Arguments:
       f: name of the file to generate the checksum from, or
         a file-like object opened for reading in binary mode.
+      cache: (optional) Md5Cache instance to look up and
+        store the checksum for a named file
         
     Returns:
       Md5sum digest for the named file.
 
     """
+    if cache is not None and isinstance(f,basestring):
+        return cache.md5sum(f)
     # Initialise checksum using whatever is available
     try:
         chksum = hashlib.md5()
@@ -507,3 +1003,237 @@ def md5sum(f):
     for block in iter(lambda: f.read(BLOCKSIZE), ''):
         chksum.update(block)
     return hexify(chksum.digest())
+
+def checksums(f,algorithms=('md5',),cache=None):
+    """Return digests for a file or stream for several algorithms
+
+    The data is only read once, regardless of the number of
+    algorithms.
+
+    Arguments:
+      f: name of the file to generate the checksums from, or
+        a file-like object opened for reading in binary mode.
+      algorithms: (optional) list of algorithms to generate
+        checksums for (see DIGEST_ALGORITHMS; defaults to MD5
+        only)
+      cache: (optional) Md5Cache instance to look up and store
+        the checksum for a named file (only used if MD5 is the
+        only algorithm)
+
+    Returns:
+      Tuple with the hex digest for each algorithm (in the same
+      order as the algorithms).
+
+    """
+    if isinstance(f,basestring):
+        return _digest_file(f,algorithms,cache)
+    digests = [_new_digest(a) for a in algorithms]
+    for block in iter(lambda: f.read(BLOCKSIZE), ''):
+        for d in digests:
+            d.update(block)
+    return tuple([d.hexdigest() for d in digests])
+
+def _new_digest(algorithm):
+    """Internal: return a new hash object for an algorithm
+
+    Arguments:
+      algorithm: name of the algorithm (see DIGEST_ALGORITHMS)
+
+    Returns:
+      Object with 'update' and 'hexdigest' methods.
+
+    """
+    if algorithm not in DIGEST_ALGORITHMS:
+        raise Exception("Unsupported checksum algorithm '%s'" % algorithm)
+    if algorithm == 'crc32':
+        return _CrcDigest(zlib.crc32)
+    elif algorithm == 'crc32c':
+        if crc32c is None:
+            raise Exception("CRC-32C checksums need the 'crc32c' module")
+        try:
+            return _CrcDigest(crc32c.crc32c)
+        except AttributeError:
+            # Older versions of the module
+            return _CrcDigest(crc32c.crc32)
+    return hashlib.new(algorithm)
+
+def _digest_file(filen,algorithms,cache=None):
+    """Internal: return digests for a file for several algorithms
+
+    Reads the data directly into a large buffer (which is reused
+    for every file processed by the same thread), and passes each
+    block to the hash object for every algorithm.
+
+    Arguments:
+      filen: name of the file to generate the checksums from
+      algorithms: list of algorithms
+      cache: (optional) Md5Cache instance to look up and store
+        the checksum (only used if MD5 is the only algorithm)
+
+    Returns:
+      Tuple with the hex digest for each algorithm.
+
+    """
+    if cache is not None and tuple(algorithms) == ('md5',):
+        return (cache.md5sum(filen),)
+    buf = _read_buffer()
+    digests = [_new_digest(a) for a in algorithms]
+    with io.open(filen,'rb',buffering=0) as fp:
+        while True:
+            n = fp.readinto(buf)
+            if not n:
+                break
+            block = buffer(buf,0,n)
+            for d in digests:
+                d.update(block)
+    return tuple([d.hexdigest() for d in digests])
+
+def _md5sum_file(filen,cache=None):
+    """Internal: return md5sum digest for a file
+
+    Equivalent to 'md5sum' for a file name, but reads the data
+    directly into a large buffer (which is reused for every file
+    processed by the same thread) rather than creating a new
+    string for each block.
+
+    Arguments:
+      filen: name of the file to generate the checksum from
+      cache: (optional) Md5Cache instance to look up and
+        store the checksum
+
+    Returns:
+      Md5sum digest for the named file.
+
+    """
+    return _digest_file(filen,('md5',),cache)[0]
+
+def _cache_key(st):
+    """Internal: return the Md5Cache key for a file
+
+    Arguments:
+      st: stat result for the file
+
+    Returns:
+      Tuple (device,inode,size,mtime_ns).
+
+    """
+    try:
+        mtime_ns = st.st_mtime_ns
+    except AttributeError:
+        mtime_ns = int(st.st_mtime*1000000000)
+    return (st.st_dev,st.st_ino,st.st_size,mtime_ns)
+
+_thread_data = threading.local()
+
+def _cmp_file_contents(f1,f2):
+    """Internal: compare the contents of two files
+
+    The files are read block by block and the comparison stops
+    at the first block which differs.
+
+    Arguments:
+      f1: name of the first file
+      f2: name of the second file
+
+    Returns:
+      True if the contents of the files are identical, False
+      if not.
+
+    """
+    buf1 = _read_buffer()
+    buf2 = _read_buffer(1)
+    mv1 = memoryview(buf1)
+    mv2 = memoryview(buf2)
+    with io.open(f1,'rb',buffering=0) as fp1:
+        with io.open(f2,'rb',buffering=0) as fp2:
+            while True:
+                n1 = _readinto_full(fp1,buf1)
+                n2 = _readinto_full(fp2,buf2)
+                if n1 != n2 or mv1[:n1] != mv2[:n2]:
+                    return False
+                if not n1:
+                    return True
+
+def _readinto_full(fp,buf):
+    """Internal: fill a buffer from a file, stopping only at EOF
+
+    Returns:
+      Number of bytes read into the buffer.
+
+    """
+    mv = memoryview(buf)
+    n = 0
+    while n < len(buf):
+        nread = fp.readinto(mv[n:])
+        if not nread:
+            break
+        n += nread
+    return n
+
+def _read_buffer(i=0):
+    """Internal: return a read buffer for the current thread
+
+    Arguments:
+      i: (optional) index of the buffer, for functions which
+        need more than one
+
+    """
+    try:
+        bufs = _thread_data.bufs
+    except AttributeError:
+        bufs = _thread_data.bufs = []
+    while len(bufs) <= i:
+        bufs.append(bytearray(READ_BUFFER_SIZE))
+    return bufs[i]
+
+def _pool_imap(func,items,threads=None):
+    """Internal: apply a function to items using a pool of threads
+
+    The results are yielded in the same order as the items.
+    At most 2*threads items are outstanding at any time, so
+    items are taken from the iterator as they're needed.
+
+    If getting the next item raises an exception then the
+    results for the preceeding items are yielded before the
+    exception is raised.
+
+    Arguments:
+      func: function to apply to each item
+      items: iterable yielding the items
+      threads: number of threads (defaults to MD5_THREADS); if
+        this is one then the function is applied to each item
+        in turn in the current thread
+
+    Yields:
+      Result of the function for each item, in order.
+
+    """
+    if threads is None:
+        threads = MD5_THREADS
+    if threads <= 1:
+        for item in items:
+            yield func(item)
+        return
+    pool = ThreadPool(threads)
+    try:
+        pending = collections.deque()
+        items = iter(items)
+        while True:
+            try:
+                item = items.next()
+            except StopIteration:
+                break
+            except Exception:
+                exc_info = sys.exc_info()
+                while pending:
+                    yield pending.popleft().get()
+                raise exc_info[0],exc_info[1],exc_info[2]
+            pending.append(pool.apply_async(func,(item,)))
+            if len(pending) >= 2*threads:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
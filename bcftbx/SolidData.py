@@ -58,6 +58,7 @@ import sys,os
 import string
 import logging
 import utils
+import fswalker
 
 #######################################################################
 # Class definitions
@@ -235,8 +236,10 @@ class SolidRun:
             if os.path.isdir(unassigned_dir):
                 # Collect information on unassigned read data
                 sample.unassigned = SolidLibrary("unassigned",parent_sample=sample)
-                for d in os.listdir(unassigned_dir):
-                    reads_dir = os.path.join(unassigned_dir,d,"reads")
+                for entry in fswalker.scandir(unassigned_dir):
+                    if not entry.is_dir():
+                        continue
+                    reads_dir = os.path.join(entry.path,"reads")
                     logging.debug("%s: reads dir %s" % (sample.name,reads_dir))
                     if os.path.isdir(reads_dir):
                         csfasta,qual = get_primary_data_file_pair(reads_dir)
@@ -276,7 +279,10 @@ class SolidRun:
             if this_library_dir:
                 logging.debug("Library dir: %s..." % this_library_dir)
                 # Iterate over available directories
-                for d in os.listdir(this_library_dir):
+                for entry in fswalker.scandir(this_library_dir):
+                    if not entry.is_dir():
+                        continue
+                    d = entry.name
                     logging.debug("--> Library %s subdir: %s" % (library_name,d))
                     reject = os.path.join(this_library_dir,d,"reject")
                     reads = os.path.join(this_library_dir,d,"reads")
@@ -1183,8 +1189,9 @@ def list_run_directories(solid_run_dir):
         return []
     # List all directories in the base dir and look for matches
     dirs = []
-    for f in os.listdir(base_dir):
-        if os.path.isdir(os.path.join(base_dir,f)):
+    for entry in fswalker.scandir(base_dir):
+        f = entry.name
+        if entry.is_dir():
             try:
                 # Check if instrument name and datestamp match
                 run_info = SolidRunInfo(f)
@@ -0,0 +1,739 @@
+#!/usr/bin/env python
+#
+#     barcodes.py: classes and functions for matching barcode sequences
+#     Copyright (C) University of Manchester 2018 Peter Briggs
+#
+########################################################################
+#
+# barcodes.py
+#
+#########################################################################
+
+"""barcodes
+
+Classes and functions for matching index sequences from sequencer
+reads against a set of expected barcodes, allowing for mismatches.
+
+Rather than comparing each index sequence against every barcode,
+a lookup table is built once, containing every sequence within the
+allowed number of mismatches of each barcode (its "mismatch
+neighbourhood"); each index sequence can then be assigned to a
+barcode with a single dictionary lookup.
+
+The size of the neighbourhoods grows rapidly with the number of
+mismatches: for an 8 base index with 2 mismatches each barcode has
+481 neighbours, and for an 8+8 base dual index this becomes
+481*481 (over 230,000) sequences per barcode. If the table would
+be larger than MAX_TABLE_SIZE sequences then it isn't built, and
+index sequences are instead compared against each barcode in turn
+(which is slower, but uses very little memory).
+
+The minimum distance between a set of barcodes (which determines
+how many mismatches can be allowed when demultiplexing) can be found
+using BarcodeDistances.
+
+Classes:
+
+- BarcodeTable: lookup table for assigning index sequences to
+  barcodes
+- BarcodeDistances: minimum Hamming distances between barcodes
+
+Functions:
+
+- split_barcode: split a barcode into its component index sequences
+- truncate_barcode: truncate a barcode to a number of bases
+- mismatch_neighbourhood: generate all sequences within a number of
+  mismatches of a sequence
+- neighbourhood_size: number of sequences within a number of
+  mismatches of a sequence
+
+Example usage:
+
+>>> table = BarcodeTable(['ATTAGA','CGATGT-TTAGGC'],max_mismatches=1)
+>>> table.lookup('ATTCGA')
+'ATTAGA'
+>>> table.lookup('CGATGT+TTAGGA')
+'CGATGT-TTAGGC'
+
+"""
+
+#######################################################################
+# Imports
+#######################################################################
+
+import re
+import logging
+import itertools
+try:
+    import numpy
+except ImportError:
+    # No numpy module: BarcodeDistances falls back to pure Python
+    numpy = None
+
+#######################################################################
+# Module constants
+#######################################################################
+
+# Bases used when generating mismatched sequences
+BASES = 'ACGTN'
+
+# Separators between the components of dual index sequences
+INDEX_SEPARATORS = re.compile(r'[-+]')
+
+# Maximum number of sequences in a BarcodeTable lookup table
+# (each takes roughly 200 bytes); above this barcodes are
+# matched by comparing against each one in turn
+MAX_TABLE_SIZE = 1000000
+
+# Maximum number of base comparisons in each block of the
+# distance calculation
+DISTANCE_BLOCK_SIZE = 16*1024*1024
+
+# Maximum number of distinct sequences in a barcode component for
+# precomputing the distances between them
+MAX_DISTANCE_TABLE_SIZE = 4096
+
+# Maximum number of closest pairs reported by BarcodeDistances
+MAX_CLOSEST_PAIRS = 100
+
+#######################################################################
+# Classes
+#######################################################################
+
+class BarcodeTable(object):
+    """Lookup table for assigning index sequences to barcodes
+
+    The table is built from a list of barcodes, each of which
+    can be either a single index sequence (e.g. 'ATTAGA') or a
+    dual index (i7 and i5) sequence with the components separated
+    by '-' or '+' (e.g. 'CGATGT-TTAGGC'). Up to 'max_mismatches'
+    mismatches are allowed in each component.
+
+    Index sequences are matched as described for the 'match'
+    method; an 'N' in an index sequence counts as a mismatch
+    (unless the barcode also has an 'N' at that position).
+
+    Each sequence in the table is assigned to the barcode which
+    it matches with the fewest mismatches. Sequences which are
+    equally close to two or more barcodes can't be assigned
+    unambiguously: these "collisions" are recorded when the
+    table is built (and are available via the 'collisions'
+    property), and such sequences are not assigned to any
+    barcode.
+
+    The memory needed for the table grows rapidly with the number
+    of mismatches and the length of the barcodes (see
+    'neighbourhood_size'). If the table would hold more than
+    'max_table_size' sequences then it isn't built: instead index
+    sequences are compared against each barcode in turn (with the
+    same results, but more slowly), and collisions aren't
+    recorded.
+
+    Provides the following properties:
+
+    - barcodes: list of the barcodes in the table
+    - max_mismatches: maximum number of mismatches allowed in
+      each component
+    - collisions: list of tuples (sequence,barcodes) for each
+      sequence which is equally close to more than one barcode
+    - scanning: True if index sequences are matched by comparing
+      against each barcode rather than via the lookup table
+
+    """
+    def __init__(self,barcodes,max_mismatches=1,
+                 max_table_size=MAX_TABLE_SIZE):
+        """Create a new BarcodeTable
+
+        Arguments:
+          barcodes: list of barcode sequences
+          max_mismatches: maximum number of mismatches allowed
+            in each component of the barcodes (default: 1)
+          max_table_size: maximum number of sequences to hold
+            in the lookup table (default: MAX_TABLE_SIZE)
+
+        """
+        self.barcodes = []
+        self.max_mismatches = max_mismatches
+        # Tables of (barcode,nmismatches) keyed by sequence, for
+        # each "layout" (i.e. tuple of component lengths)
+        self._tables = {}
+        self._collisions = {}
+        # Lists of (barcode,components) for each layout, when
+        # scanning rather than using the tables
+        self._scan_barcodes = None
+        barcodes = [str(b).upper() for b in barcodes]
+        table_size = sum([reduce(lambda x,y: x*y,
+                                 [neighbourhood_size(len(c),max_mismatches)
+                                  for c in split_barcode(b)])
+                          for b in set(barcodes)])
+        if table_size > max_table_size:
+            logging.debug("BarcodeTable: %d sequences needed for lookup "
+                          "table, comparing with each barcode instead" %
+                          table_size)
+            self._scan_barcodes = {}
+            for barcode in barcodes:
+                if barcode in self.barcodes:
+                    continue
+                self.barcodes.append(barcode)
+                components = split_barcode(barcode)
+                layout = tuple([len(c) for c in components])
+                self._scan_barcodes.setdefault(layout,[]).append(
+                    (barcode,components))
+            self._layouts = sorted(self._scan_barcodes.keys())
+            return
+        for barcode in barcodes:
+            self._add(barcode)
+        self._layouts = sorted(self._tables.keys())
+
+    def _add(self,barcode):
+        """Internal: add the neighbourhood for a barcode to the table
+
+        """
+        barcode = str(barcode).upper()
+        if barcode in self.barcodes:
+            return
+        self.barcodes.append(barcode)
+        components = split_barcode(barcode)
+        layout = tuple([len(c) for c in components])
+        table = self._tables.setdefault(layout,{})
+        collisions = self._collisions
+        neighbourhoods = [mismatch_neighbourhood(c,self.max_mismatches)
+                          for c in components]
+        for combination in itertools.product(*neighbourhoods):
+            seq = '+'.join([s for s,n in combination])
+            nmismatches = sum([n for s,n in combination])
+            try:
+                barcode0,nmismatches0 = table[seq]
+            except KeyError:
+                table[seq] = (barcode,nmismatches)
+                continue
+            if nmismatches < nmismatches0:
+                table[seq] = (barcode,nmismatches)
+                if seq in collisions:
+                    del(collisions[seq])
+            elif nmismatches == nmismatches0:
+                if barcode0 is not None:
+                    collisions[seq] = [barcode0]
+                    table[seq] = (None,nmismatches)
+                collisions[seq].append(barcode)
+
+    def _scan(self,layout,seq):
+        """Internal: find the closest barcode by comparing with each
+
+        Arguments:
+          layout: tuple with the lengths of the barcode components
+          seq: lookup key for the layout (see '_key_for_layout')
+
+        Returns:
+          Tuple (barcode,nmismatches) as stored in the lookup
+          table for the sequence (i.e. with None for the barcode
+          if it's equally close to more than one), or None if no
+          barcode is within the allowed number of mismatches.
+
+        """
+        components = seq.split('+')
+        max_mismatches = self.max_mismatches
+        best = None
+        for barcode,barcode_components in self._scan_barcodes[layout]:
+            nmismatches = 0
+            for component,barcode_component in \
+                itertools.izip(components,barcode_components):
+                n = _count_mismatches(component,barcode_component,
+                                      max_mismatches)
+                if n is None:
+                    break
+                nmismatches += n
+            else:
+                if best is None or nmismatches < best[1]:
+                    best = (barcode,nmismatches)
+                elif nmismatches == best[1]:
+                    best = (None,nmismatches)
+        return best
+
+    @property
+    def scanning(self):
+        """Check if index sequences are matched by scanning barcodes
+
+        """
+        return (self._scan_barcodes is not None)
+
+    @property
+    def collisions(self):
+        """Return list of sequences which match multiple barcodes
+
+        Note that collisions aren't recorded when scanning
+        (in which case the list is always empty).
+
+        Returns:
+          Sorted list of tuples (sequence,barcodes) where
+          'barcodes' is the list of barcodes which 'sequence'
+          is equally close to.
+
+        """
+        return sorted([(seq,self._collisions[seq])
+                       for seq in self._collisions])
+
+    def match(self,index):
+        """Find the barcode matching an index sequence
+
+        The index sequence from a read can be longer than the
+        barcodes (in which case only the leading bases are
+        compared, so e.g. 'ATTAGAAT' matches the barcode
+        'ATTAGA'). Dual index sequences can be supplied either
+        with the components separated by '-' or '+', or
+        concatenated (e.g. 'CGATGTTTAGGC'). For single index
+        barcodes only the first component of a dual index
+        sequence is compared.
+
+        Arguments:
+          index: index sequence to look up
+
+        Returns:
+          Tuple (barcode,nmismatches) for the matching barcode,
+          or None if no barcode matches (or the index sequence
+          matches more than one).
+
+        """
+        if len(self._layouts) == 1 and index.find('+') < 0 and \
+           index.find('-') < 0 and self._scan_barcodes is None:
+            # Fast path for single layout and undivided index
+            layout = self._layouts[0]
+            if len(layout) == 1:
+                result = self._tables[layout].get(index[:layout[0]])
+                if result is None or result[0] is None:
+                    return None
+                return result
+        components = INDEX_SEPARATORS.split(index)
+        best = None
+        for layout in self._layouts:
+            seq = _key_for_layout(components,layout)
+            if seq is None:
+                continue
+            if self._scan_barcodes is None:
+                result = self._tables[layout].get(seq)
+            else:
+                result = self._scan(layout,seq)
+            if result is None:
+                continue
+            if best is None or result[1] < best[1]:
+                best = result
+            elif result[1] == best[1] and result[0] != best[0]:
+                # Matches barcodes in different layouts equally well
+                best = (None,result[1])
+        if best is None or best[0] is None:
+            return None
+        return best
+
+    def lookup(self,index):
+        """Return the barcode matching an index sequence
+
+        Arguments:
+          index: index sequence to look up (see 'match')
+
+        Returns:
+          Matching barcode, or None if no barcode matches (or
+          the index sequence matches more than one).
+
+        """
+        result = self.match(index)
+        if result is None:
+            return None
+        return result[0]
+
+    def __len__(self):
+        return sum([len(self._tables[layout]) for layout in self._tables])
+
+class BarcodeDistances(object):
+    """Minimum Hamming distances between a set of barcodes
+
+    For each barcode, finds the minimum Hamming distance to any
+    of the other barcodes in the set. For dual index barcodes
+    the distance between two barcodes is the larger of the
+    distances between their components, since mismatches are
+    allowed in each component separately when demultiplexing
+    (see BarcodeTable): two barcodes can't be distinguished
+    when allowing up to 'm' mismatches if every component is
+    within 2*'m' mismatches of the corresponding component of
+    the other barcode.
+
+    Components of different lengths are compared over the
+    length of the shorter one, and a missing component (e.g.
+    when comparing a single index barcode with a dual index
+    barcode) matches any sequence.
+
+    If numpy is available then the distances are computed in
+    blocks of rows of the full distance matrix using array
+    operations, so that large sets of barcodes (e.g. thousands
+    of dual index combinations) can be handled; otherwise each
+    pair of barcodes is compared in turn. Where a component has
+    relatively few distinct sequences (e.g. the i7 and i5
+    indexes in combinatorial dual indexing) the distances
+    between those sequences are computed once and looked up.
+
+    Provides the following properties:
+
+    - barcodes: list of the barcodes (after truncation)
+    - distances: list with the minimum distance from each
+      barcode to any other (None if there is only one barcode)
+    - nearest: list with the index of the nearest barcode to
+      each barcode (None if there is only one barcode)
+    - min_distance: minimum distance between any two barcodes
+      (None if there are fewer than two barcodes)
+    - closest_pairs: list of tuples (barcode1,barcode2) for
+      the pairs of barcodes separated by the minimum distance
+      (at most 'max_pairs' pairs are stored)
+    - max_mismatches: maximum number of mismatches which can be
+      allowed when demultiplexing without the barcodes becoming
+      ambiguous (None if there are fewer than two barcodes,
+      negative if barcodes are duplicated)
+
+    """
+    def __init__(self,barcodes,length=None,max_pairs=MAX_CLOSEST_PAIRS):
+        """Create a new BarcodeDistances instance
+
+        Arguments:
+          barcodes: list of barcode sequences (dual index
+            barcodes should have the components separated by
+            '-' or '+')
+          length: (optional) if set then truncate the barcodes
+            to this number of bases before comparing them (see
+            'truncate_barcode')
+          max_pairs: (optional) maximum number of pairs to store
+            in 'closest_pairs'
+
+        """
+        if length is not None:
+            barcodes = [truncate_barcode(b,length) for b in barcodes]
+        self.barcodes = [str(b).upper() for b in barcodes]
+        self.distances = [None]*len(self.barcodes)
+        self.nearest = [None]*len(self.barcodes)
+        self.closest_pairs = []
+        self._max_pairs = max_pairs
+        if len(self.barcodes) < 2:
+            return
+        if numpy is not None:
+            self._compare_numpy()
+        else:
+            self._compare()
+
+    @property
+    def min_distance(self):
+        """Return the minimum distance between any two barcodes
+
+        """
+        if len(self.barcodes) < 2:
+            return None
+        return min(self.distances)
+
+    @property
+    def max_mismatches(self):
+        """Return the maximum number of mismatches allowed
+
+        """
+        if len(self.barcodes) < 2:
+            return None
+        return (self.min_distance - 1)//2
+
+    def _compare(self):
+        """Internal: compare each pair of barcodes in turn
+
+        """
+        n = len(self.barcodes)
+        components = [split_barcode(b) for b in self.barcodes]
+        min_distance = None
+        for i in xrange(n):
+            for j in xrange(i+1,n):
+                d = 0
+                for c1,c2 in itertools.izip(components[i],components[j]):
+                    dc = 0
+                    for b1,b2 in itertools.izip(c1,c2):
+                        if b1 != b2:
+                            dc += 1
+                    d = max(d,dc)
+                if self.distances[i] is None or d < self.distances[i]:
+                    self.distances[i] = d
+                    self.nearest[i] = j
+                if self.distances[j] is None or d < self.distances[j]:
+                    self.distances[j] = d
+                    self.nearest[j] = i
+                if min_distance is None or d < min_distance:
+                    min_distance = d
+                    self.closest_pairs = []
+                if d == min_distance and \
+                   len(self.closest_pairs) < self._max_pairs:
+                    self.closest_pairs.append((self.barcodes[i],
+                                               self.barcodes[j]))
+
+    def _compare_numpy(self):
+        """Internal: compare barcodes using numpy arrays
+
+        """
+        n = len(self.barcodes)
+        barcode_components = [split_barcode(b) for b in self.barcodes]
+        ncomponents = max([len(c) for c in barcode_components])
+        components = []
+        width = 0
+        for k in xrange(ncomponents):
+            seqs = [c[k] if k < len(c) else '' for c in barcode_components]
+            unique = sorted(set(seqs))
+            if len(unique) <= MAX_DISTANCE_TABLE_SIZE:
+                # Precompute distances between distinct sequences
+                ids = dict([(seq,i) for i,seq in enumerate(unique)])
+                ids = numpy.array([ids[seq] for seq in seqs],
+                                  dtype=numpy.int64)
+                bases = _base_array(unique)
+                table = numpy.zeros((len(unique),len(unique)),
+                                    dtype=numpy.uint8)
+                block_size = max(DISTANCE_BLOCK_SIZE//
+                                 (len(unique)*bases.shape[1]),1)
+                for start in xrange(0,len(unique),block_size):
+                    rows = numpy.arange(start,min(start+block_size,
+                                                  len(unique)))
+                    table[rows] = _mismatches(bases,rows)
+                components.append((table,ids))
+            else:
+                bases = _base_array(seqs)
+                components.append((None,bases))
+                width += bases.shape[1]
+        block_size = max(DISTANCE_BLOCK_SIZE//(n*max(width,16)),1)
+        # Find the nearest barcode to each barcode
+        distances = numpy.zeros(n,dtype=numpy.int64)
+        nearest = numpy.zeros(n,dtype=numpy.int64)
+        for start in xrange(0,n,block_size):
+            rows = numpy.arange(start,min(start+block_size,n))
+            d = _distance_matrix(components,rows)
+            # Exclude comparison of each barcode with itself
+            d[numpy.arange(len(rows)),rows] = numpy.iinfo(numpy.int64).max
+            nearest[rows] = d.argmin(axis=1)
+            distances[rows] = d[numpy.arange(len(rows)),nearest[rows]]
+        self.distances = distances.tolist()
+        self.nearest = nearest.tolist()
+        # Find the pairs separated by the minimum distance
+        min_distance = distances.min()
+        closest = numpy.flatnonzero(distances == min_distance)
+        for start in xrange(0,len(closest),block_size):
+            rows = closest[start:start+block_size]
+            d = _distance_matrix(components,rows)
+            for i,row in itertools.izip(rows.tolist(),d):
+                for j in numpy.flatnonzero(row == min_distance).tolist():
+                    if j <= i:
+                        continue
+                    if len(self.closest_pairs) == self._max_pairs:
+                        return
+                    self.closest_pairs.append((self.barcodes[i],
+                                               self.barcodes[j]))
+
+#######################################################################
+# Functions
+#######################################################################
+
+def split_barcode(barcode):
+    """Split a barcode into its component index sequences
+
+    Arguments:
+      barcode: barcode sequence, with dual index components
+        separated by '-' or '+'
+
+    Returns:
+      List of the component sequences.
+
+    """
+    return INDEX_SEPARATORS.split(barcode)
+
+def truncate_barcode(seq,length):
+    """Return barcode sequence truncated to requested length
+
+    'seq' is a barcode sequence (note that dual index sequences
+    are of the form e.g. 'AGGTAC-GGCCTT' i.e. the name includes
+    a hyphen) and 'length' is the desired length (i.e. number of
+    bases to keep).
+
+    """
+    try:
+        i = seq.index('-')
+        # Dual index barcode
+        if i >= length:
+            return seq[:length]
+        else:
+            return seq[:length+1]
+    except ValueError:
+        # No hyphen: single index barcode
+        return seq[:length]
+
+def neighbourhood_size(length,max_mismatches=1,bases=BASES):
+    """Return the number of sequences in a mismatch neighbourhood
+
+    Arguments:
+      length: length of the sequence
+      max_mismatches: maximum number of mismatched positions
+      bases: (optional) string with the bases to substitute at
+        mismatched positions (default: 'ACGTN')
+
+    Returns:
+      Number of sequences which would be generated by
+      'mismatch_neighbourhood' for a sequence of this length.
+
+    """
+    size = 0
+    for n in xrange(0,min(max_mismatches,length)+1):
+        # Number of ways to choose n positions from length
+        npositions = 1
+        for i in xrange(n):
+            npositions = npositions*(length-i)//(i+1)
+        size += npositions*(len(bases)-1)**n
+    return size
+
+def mismatch_neighbourhood(seq,max_mismatches=1,bases=BASES):
+    """Generate all sequences within a number of mismatches
+
+    Note that the number of sequences grows rapidly with the
+    number of mismatches and the length of the sequence (see
+    'neighbourhood_size').
+
+    Arguments:
+      seq: sequence to generate the neighbourhood for
+      max_mismatches: maximum number of mismatched positions
+      bases: (optional) string with the bases to substitute at
+        mismatched positions (default: 'ACGTN')
+
+    Returns:
+      Iterator yielding tuples (sequence,nmismatches) for each
+      sequence within 'max_mismatches' of 'seq' (including 'seq'
+      itself), where 'nmismatches' is the number of positions
+      where they differ.
+
+    """
+    yield (seq,0)
+    seq = list(seq)
+    for n in xrange(1,max_mismatches+1):
+        for positions in itertools.combinations(xrange(len(seq)),n):
+            substitutions = [[b for b in bases if b != seq[i]]
+                             for i in positions]
+            for bases_ in itertools.product(*substitutions):
+                mismatched = list(seq)
+                for i,b in itertools.izip(positions,bases_):
+                    mismatched[i] = b
+                yield (''.join(mismatched),n)
+
+def _count_mismatches(seq,barcode,max_mismatches):
+    """Internal: count mismatches between a sequence and a barcode
+
+    Positions where the sequence has a character which isn't one
+    of BASES only match if the barcode has the same character (as
+    for the sequences generated by 'mismatch_neighbourhood').
+
+    Arguments:
+      seq: sequence to compare
+      barcode: barcode to compare against (same length as 'seq')
+      max_mismatches: maximum number of mismatches allowed
+
+    Returns:
+      Number of mismatches, or None if there are more than
+      'max_mismatches' (or a non-matching position can't be
+      a mismatch).
+
+    """
+    if seq == barcode:
+        return 0
+    n = 0
+    for s,b in itertools.izip(seq,barcode):
+        if s != b:
+            if s not in BASES:
+                return None
+            n += 1
+            if n > max_mismatches:
+                return None
+    return n
+
+def _base_array(seqs):
+    """Internal: convert sequences to a 2D array of bases
+
+    Arguments:
+      seqs: list of sequences
+
+    Returns:
+      uint8 numpy array with the bases for each sequence in
+      a row, padded with nulls (which match any base).
+
+    """
+    width = max(max([len(seq) for seq in seqs]),1)
+    data = ''.join([seq.ljust(width,'\0') for seq in seqs])
+    return numpy.frombuffer(data,dtype=numpy.uint8).reshape(len(seqs),width)
+
+def _mismatches(bases,rows):
+    """Internal: count mismatches between sequences
+
+    Arguments:
+      bases: 2D uint8 numpy array from '_base_array'
+      rows: numpy array with the indices of the sequences to
+        count the mismatches for
+
+    Returns:
+      numpy array with one row for each sequence in 'rows',
+      giving the number of mismatches with all the sequences.
+
+    """
+    block = bases[rows,None,:]
+    mismatches = (block != bases[None,:,:]) & \
+                 (block != 0) & (bases[None,:,:] != 0)
+    return mismatches.sum(axis=2)
+
+def _distance_matrix(components,rows):
+    """Internal: compute distances for a block of barcodes
+
+    Arguments:
+      components: list of tuples (table,data) for each
+        component of the barcodes, where either 'table' is
+        an array of distances between the distinct sequences
+        and 'data' is an array mapping each barcode to a row
+        of 'table', or 'table' is None and 'data' is the
+        array from '_base_array' for the component
+      rows: numpy array with the indices of the barcodes to
+        compute the distances for
+
+    Returns:
+      numpy array with one row for each barcode in 'rows',
+      giving the distances to all the barcodes.
+
+    """
+    d = None
+    for table,data in components:
+        if table is not None:
+            dk = table[data[rows][:,None],data[None,:]]
+        else:
+            dk = _mismatches(data,rows)
+        if d is None:
+            d = dk.astype(numpy.int64)
+        else:
+            numpy.maximum(d,dk,out=d)
+    return d
+
+def _key_for_layout(components,layout):
+    """Internal: make lookup key from index components
+
+    Arguments:
+      components: list of the components of the index sequence
+      layout: tuple with the lengths of the components in the
+        table being searched
+
+    Returns:
+      Key for the table, or None if the index sequence is too
+      short for the layout.
+
+    """
+    if len(components) == 1 and len(layout) > 1:
+        # Concatenated dual index
+        seq = components[0]
+        components = []
+        start = 0
+        for length in layout:
+            components.append(seq[start:start+length])
+            start += length
+    elif len(components) < len(layout):
+        return None
+    key = []
+    for component,length in itertools.izip(components,layout):
+        if len(component) < length:
+            return None
+        key.append(component[:length])
+    return '+'.join(key)
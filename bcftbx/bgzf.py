@@ -0,0 +1,585 @@
+#!/usr/bin/env python
+#
+#     bgzf.py: read and write blocked gzip (BGZF) files
+#     Copyright (C) University of Manchester 2018 Peter Briggs
+#
+########################################################################
+#
+# bgzf.py
+#
+#########################################################################
+
+"""bgzf
+
+Classes and functions for reading and writing BGZF ("blocked gzip")
+files, and for reading gzipped files using background threads.
+
+A BGZF file is a series of gzip members ("blocks") each holding at
+most 64Kb of uncompressed data, and with the size of the compressed
+block recorded in the gzip header; see the SAM/BAM specification at
+https://samtools.github.io/hts-specs/SAMv1.pdf. BGZF files are valid
+gzip files and can be read by 'gzip', 'zcat' etc, but as each block
+can be located without decompressing the preceeding data, the blocks
+can be compressed and decompressed independently in parallel.
+
+Classes:
+
+- BgzfWriter: write data to a BGZF file, compressing blocks in
+  parallel on a thread pool
+- BgzfReader: read data from a gzipped file, decompressing BGZF
+  blocks in parallel on a thread pool (other gzip files are
+  decompressed on a single background thread)
+
+Functions:
+
+- is_bgzf: check if a file is in BGZF format
+- open_gzipped: return a file-like object for reading a gzipped file
+- read_block: read the next complete BGZF block from a file
+- block_offsets: return the offsets of the blocks in a BGZF file
+
+Note that the zlib compression and decompression functions release
+the Python GIL, so using threads gives a real speed up.
+
+"""
+
+#######################################################################
+# Imports
+#######################################################################
+
+import zlib
+import gzip
+import struct
+import threading
+import Queue
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+#######################################################################
+# Module constants
+#######################################################################
+
+# Maximum amount of uncompressed data in a block
+# (as used by htslib)
+BGZF_BLOCK_SIZE = 0xff00
+
+# Empty block used to mark the end of a BGZF file
+BGZF_EOF = "\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00\x42\x43" \
+           "\x02\x00\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00"
+
+# Size of the BGZF block header
+BGZF_HEADER_SIZE = 18
+
+# Default size of reads from ordinary gzipped files
+CHUNKSIZE = 1024*1024
+
+#######################################################################
+# Classes
+#######################################################################
+
+class BgzfWriter(object):
+    """Write data to a BGZF file
+
+    Data is collected into blocks of up to 64Kb which are then
+    compressed in parallel on a thread pool, and written out in
+    the correct order.
+
+    Example usage:
+
+    >>> fp = BgzfWriter("reads.fastq.gz")
+    >>> fp.write(data)
+    >>> fp.close()
+
+    Closing the writer appends the BGZF end-of-file marker.
+
+    When writing many files at once, a single thread pool can
+    be shared between the writers (via the 'pool' argument) to
+    limit the total number of threads, for example:
+
+    >>> pool = ThreadPool(4)
+    >>> writers = [BgzfWriter(f,threads=4,pool=pool) for f in files]
+
+    """
+    def __init__(self,filen=None,mode='wb',fp=None,compresslevel=6,
+                 threads=None,pool=None):
+        """Create a new BgzfWriter
+
+        Arguments:
+          filen: name of the file to write to
+          mode: mode to open the file with ('wb' or 'ab')
+          fp: (optional) file-like object opened for writing
+            in binary mode, to use instead of 'filen'
+          compresslevel: (optional) compression level (1-9,
+            default is 6)
+          threads: (optional) number of threads to use for
+            compression (defaults to the number of CPUs)
+          pool: (optional) ThreadPool to use for compression
+            instead of creating a new one; it can be shared
+            with other writers and isn't closed by the writer
+            ('threads' should be the number of threads in the
+            pool)
+
+        """
+        if fp is None:
+            fp = open(filen,mode)
+            self._close_fp = True
+        else:
+            self._close_fp = False
+        self._fp = fp
+        self._compresslevel = compresslevel
+        if threads is None:
+            threads = multiprocessing.cpu_count()
+        self._threads = max(int(threads),1)
+        self._pool = pool
+        self._close_pool = (pool is None)
+        self._buf = []
+        self._buflen = 0
+        self._blocks = []
+        self.closed = False
+
+    def write(self,data):
+        """Write data to the file
+
+        Arguments:
+          data: string with the data to write
+
+        """
+        self._buf.append(data)
+        self._buflen += len(data)
+        if self._buflen >= BGZF_BLOCK_SIZE:
+            data = ''.join(self._buf)
+            nblocks = len(data)//BGZF_BLOCK_SIZE
+            for i in xrange(0,nblocks*BGZF_BLOCK_SIZE,BGZF_BLOCK_SIZE):
+                self._blocks.append(data[i:i+BGZF_BLOCK_SIZE])
+            data = data[nblocks*BGZF_BLOCK_SIZE:]
+            self._buf = [data]
+            self._buflen = len(data)
+            if len(self._blocks) >= 4*self._threads:
+                self._write_blocks()
+
+    def _write_blocks(self):
+        """Internal: compress and write the pending blocks
+
+        """
+        if not self._blocks:
+            return
+        if self._threads > 1 and len(self._blocks) > 1:
+            if self._pool is None:
+                self._pool = ThreadPool(self._threads)
+            level = self._compresslevel
+            blocks = self._pool.map(lambda b: compress_block(b,level),
+                                    self._blocks)
+        else:
+            blocks = [compress_block(b,self._compresslevel)
+                      for b in self._blocks]
+        self._fp.write(''.join(blocks))
+        self._blocks = []
+
+    def flush(self):
+        """Write out all pending data
+
+        Any partial block is written out as a (short) block.
+
+        """
+        if self._buflen:
+            self._blocks.append(''.join(self._buf))
+            self._buf = []
+            self._buflen = 0
+        self._write_blocks()
+        self._fp.flush()
+
+    def close(self):
+        """Write out pending data and the EOF marker, and close
+
+        """
+        if self.closed:
+            return
+        self.flush()
+        self._fp.write(BGZF_EOF)
+        if self._close_fp:
+            self._fp.close()
+        if self._pool is not None and self._close_pool:
+            self._pool.close()
+            self._pool.join()
+        self._pool = None
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        self.close()
+
+class BgzfReader(object):
+    """Read data from a gzipped file using background threads
+
+    Implements a read-only file-like object for gzipped data,
+    which can be used wherever the handle returned by 'gzip.open'
+    is used.
+
+    For BGZF files, the compressed blocks are read on a
+    background thread and decompressed in parallel on a thread
+    pool; for other gzip files (including those with multiple
+    members, e.g. from concatenating gzipped files) the data is
+    decompressed sequentially on a single background thread.
+
+    In both cases the decompressed data is queued in order for
+    reading, so decompression overlaps with whatever processing
+    is being done by the caller.
+
+    """
+    def __init__(self,filen=None,fp=None,threads=None,queue_size=8):
+        """Create a new BgzfReader
+
+        Arguments:
+          filen: name of the gzipped file to read
+          fp: (optional) file-like object opened for reading in
+            binary mode, to use instead of 'filen'
+          threads: (optional) number of threads to use for
+            decompressing BGZF blocks (defaults to the number of
+            CPUs)
+          queue_size: (optional) maximum number of decompressed
+            chunks to hold in the queue waiting to be read
+
+        """
+        self.name = filen
+        if fp is None:
+            fp = open(filen,'rb')
+            self._close_fp = True
+        else:
+            self._close_fp = False
+        self._fp = fp
+        if threads is None:
+            threads = multiprocessing.cpu_count()
+        self._threads = max(int(threads),1)
+        self._queue = Queue.Queue(maxsize=max(int(queue_size),1))
+        self._stop = threading.Event()
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+        self.closed = False
+        self._thread = threading.Thread(target=_decompress_to_queue,
+                                        args=(self._fp,
+                                              self._queue,
+                                              self._stop,
+                                              self._threads))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _next_chunk(self):
+        """Internal: fetch the next chunk of decompressed data
+
+        Returns:
+          False if there is no more data, True otherwise.
+
+        """
+        if self._eof:
+            return False
+        chunk = self._queue.get()
+        if chunk is None:
+            self._eof = True
+            return False
+        if isinstance(chunk,Exception):
+            self._eof = True
+            raise chunk
+        if self._pos < len(self._buf):
+            self._buf = self._buf[self._pos:] + chunk
+        else:
+            self._buf = chunk
+        self._pos = 0
+        return True
+
+    def read(self,size=-1):
+        """Read up to 'size' bytes (or all data if 'size' is negative)
+
+        """
+        if size is None or size < 0:
+            while self._next_chunk():
+                pass
+            data = self._buf[self._pos:]
+            self._buf = ''
+            self._pos = 0
+            return data
+        while (len(self._buf) - self._pos) < size:
+            if not self._next_chunk():
+                break
+        data = self._buf[self._pos:self._pos+size]
+        self._pos += len(data)
+        return data
+
+    def readinto(self,b):
+        """Read data into a pre-allocated writable buffer
+
+        Returns:
+          Number of bytes read (zero at EOF).
+
+        """
+        data = self.read(len(b))
+        n = len(data)
+        b[:n] = data
+        return n
+
+    def readline(self,size=-1):
+        """Read and return the next line (including the newline)
+
+        """
+        while True:
+            i = self._buf.find('\n',self._pos)
+            if i >= 0:
+                i += 1
+                break
+            if not self._next_chunk():
+                i = len(self._buf)
+                break
+        if size is not None and size >= 0:
+            i = min(i,self._pos+size)
+        line = self._buf[self._pos:i]
+        self._pos = i
+        return line
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    def close(self):
+        """Stop the background threads and close the file
+
+        """
+        if self.closed:
+            return
+        self._stop.set()
+        # Drain the queue so the background thread can finish
+        while self._thread.is_alive():
+            try:
+                self._queue.get(timeout=0.1)
+            except Queue.Empty:
+                pass
+        self._thread.join()
+        if self._close_fp:
+            self._fp.close()
+        self._buf = ''
+        self.closed = True
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        self.close()
+
+#######################################################################
+# Functions
+#######################################################################
+
+def compress_block(data,compresslevel=6):
+    """Compress data into a single BGZF block
+
+    Arguments:
+      data: string of up to BGZF_BLOCK_SIZE bytes
+      compresslevel: compression level (1-9)
+
+    Returns:
+      String with the complete BGZF block (i.e. gzip member).
+
+    """
+    c = zlib.compressobj(compresslevel,zlib.DEFLATED,-zlib.MAX_WBITS)
+    cdata = c.compress(data) + c.flush()
+    bsize = BGZF_HEADER_SIZE + len(cdata) + 8
+    header = struct.pack("<BBBBIBBHBBHH",
+                         0x1f,0x8b,8,4,0,0,0xff,6,
+                         ord('B'),ord('C'),2,bsize-1)
+    trailer = struct.pack("<II",
+                          zlib.crc32(data) & 0xffffffff,
+                          len(data) & 0xffffffff)
+    return header + cdata + trailer
+
+def decompress_block(block):
+    """Decompress a single gzip member (e.g. a BGZF block)
+
+    Arguments:
+      block: string with the complete gzip member
+
+    Returns:
+      String with the decompressed data.
+
+    """
+    return zlib.decompress(block,16+zlib.MAX_WBITS)
+
+def bgzf_block_size(header):
+    """Return the total size of a BGZF block from its header
+
+    Arguments:
+      header: string with (at least) the first 18 bytes of the
+        block
+
+    Returns:
+      Size of the compressed block in bytes (including the
+      header), or None if the header isn't a BGZF block header.
+
+    """
+    if len(header) < BGZF_HEADER_SIZE:
+        return None
+    if header[:4] != "\x1f\x8b\x08\x04" or header[12:14] != "BC":
+        return None
+    return struct.unpack("<H",header[16:18])[0] + 1
+
+def is_bgzf(filen):
+    """Check if a file is in BGZF format
+
+    Only the header of the first block is examined.
+
+    Arguments:
+      filen: name of the file to check
+
+    Returns:
+      True if the file starts with a BGZF block, False if not.
+
+    """
+    with open(filen,'rb') as fp:
+        return (bgzf_block_size(fp.read(BGZF_HEADER_SIZE)) is not None)
+
+def open_gzipped(filen,threads=None):
+    """Return a file-like object for reading a gzipped file
+
+    If the file is in BGZF format then a BgzfReader is returned,
+    so that the blocks are decompressed in parallel; otherwise the
+    file is opened using 'gzip.open'.
+
+    Arguments:
+      filen: name of the gzipped file
+      threads: (optional) number of threads to use for BGZF
+        decompression (defaults to the number of CPUs)
+
+    Returns:
+      File-like object opened for reading.
+
+    """
+    if is_bgzf(filen):
+        return BgzfReader(filen,threads=threads)
+    return gzip.open(filen,'rb')
+
+def read_block(fp):
+    """Read the next complete BGZF block from a file
+
+    Arguments:
+      fp: file object opened for reading, positioned at the
+        start of a BGZF block
+
+    Returns:
+      String with the compressed block, or an empty string at
+      EOF.
+
+    """
+    header = fp.read(BGZF_HEADER_SIZE)
+    if not header:
+        return ''
+    bsize = bgzf_block_size(header)
+    if bsize is None:
+        raise IOError("Not a BGZF block header")
+    block = header + fp.read(bsize - BGZF_HEADER_SIZE)
+    if len(block) != bsize:
+        raise IOError("Truncated BGZF block")
+    return block
+
+def block_offsets(filen):
+    """Return the offsets of the blocks in a BGZF file
+
+    Only the block headers are read, so this is much quicker
+    than decompressing the file.
+
+    Arguments:
+      filen: name of the BGZF file
+
+    Returns:
+      List of the offsets of the start of each block in the
+      file, in order.
+
+    """
+    offsets = []
+    offset = 0
+    with open(filen,'rb') as fp:
+        while True:
+            header = fp.read(BGZF_HEADER_SIZE)
+            if not header:
+                break
+            bsize = bgzf_block_size(header)
+            if bsize is None:
+                raise IOError("%s: not a BGZF block header at offset %d" %
+                              (filen,offset))
+            offsets.append(offset)
+            offset += bsize
+            fp.seek(offset)
+    return offsets
+
+def _decompress_to_queue(fp,queue,stop,threads):
+    """Internal: decompress data from fp and put it on a queue
+
+    Target function for the BgzfReader background thread. The
+    decompressed data is put on the queue in chunks, followed by
+    None to mark the end of the data (or by an exception if an
+    error was encountered).
+
+    Arguments:
+      fp: file-like object with the gzipped data
+      queue: Queue to put the decompressed chunks on
+      stop: threading.Event which is set to request an early
+        finish
+      threads: number of threads for decompressing BGZF blocks
+
+    """
+    pool = None
+    try:
+        if bgzf_block_size(_peek(fp,BGZF_HEADER_SIZE)) is not None:
+            # BGZF: decompress groups of blocks in parallel
+            if threads > 1:
+                pool = ThreadPool(threads)
+                mapper = pool.map
+            else:
+                mapper = map
+            nblocks = 4*threads
+            while not stop.is_set():
+                blocks = []
+                while len(blocks) < nblocks:
+                    block = read_block(fp)
+                    if not block:
+                        break
+                    blocks.append(block)
+                if not blocks:
+                    break
+                data = ''.join(mapper(decompress_block,blocks))
+                if data:
+                    queue.put(data)
+        else:
+            # Other gzip: use GzipFile, which handles multiple
+            # members and checks the CRC and size of each one
+            gz = gzip.GzipFile(fileobj=fp,mode='rb')
+            while not stop.is_set():
+                data = gz.read(CHUNKSIZE)
+                if not data:
+                    break
+                queue.put(data)
+        queue.put(None)
+    except Exception,ex:
+        queue.put(IOError("Error decompressing data: %s" % ex))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+def _peek(fp,size):
+    """Internal: return the next 'size' bytes from fp without consuming
+
+    """
+    pos = fp.tell()
+    data = fp.read(size)
+    fp.seek(pos)
+    return data
@@ -0,0 +1,592 @@
+#!/usr/bin/env python
+#
+#     fastqmapreduce.py: process FASTQ files in parallel chunks
+#     Copyright (C) University of Manchester 2018 Peter Briggs
+#
+########################################################################
+#
+# fastqmapreduce.py
+#
+#########################################################################
+
+"""fastqmapreduce
+
+Classes and functions for processing FASTQ files in parallel, by
+splitting them into chunks of complete read records which are
+handled by separate processes.
+
+The chunks are located without reading the whole file where
+possible:
+
+- uncompressed FASTQs are split into byte ranges, with each
+  chunk starting at the first read record in its range
+- BGZF-compressed FASTQs are split into groups of BGZF blocks,
+  in the same way
+- other gzipped FASTQs are split into ranges of lines using the
+  checkpoint index from the 'gzindex' module, if one already
+  exists
+
+Otherwise a gzipped file is read sequentially and the chunks are
+passed to the worker processes (building an index would mean
+decompressing the whole file an extra time).
+
+Classes:
+
+- FastqChunk: chunk of read records from a FASTQ file
+
+Functions:
+
+- get_chunks: split a FASTQ file into chunks
+- fastq_map: apply a function to each chunk of a FASTQ file in
+  parallel
+- fastq_map_reduce: apply a function to each chunk of a FASTQ file
+  in parallel, and combine the results
+
+Example counting the reads in a FASTQ using 4 processes:
+
+>>> def count_reads(chunk):
+...     return sum(1 for r in chunk.reads())
+>>> nreads = fastq_map_reduce('reads.fastq.gz',count_reads,
+...                           operator.add,nprocs=4)
+
+Note that functions supplied to 'fastq_map' and 'fastq_map_reduce'
+must be defined at the top level of a module, so that they can
+be passed to the worker processes.
+
+"""
+
+#######################################################################
+# Imports
+#######################################################################
+
+import os
+import sys
+import logging
+import itertools
+import collections
+import multiprocessing
+import cStringIO
+from . import FASTQFile
+from . import bgzf
+from . import gzindex
+
+#######################################################################
+# Module constants
+#######################################################################
+
+# Default chunk size (bytes of uncompressed data)
+CHUNK_SIZE = 16*1024*1024
+
+# Size of additional reads beyond the end of a chunk
+READ_SIZE = 65536
+
+#######################################################################
+# Classes
+#######################################################################
+
+class FastqChunk(object):
+    """Chunk of read records from a FASTQ file
+
+    A FastqChunk describes where its records are located in the
+    FASTQ file, rather than holding the records themselves, so it
+    can be passed cheaply to another process. The records are
+    only read when one of the 'data', 'raw_data', 'fp', 'reads'
+    or 'batches' methods is invoked.
+
+    Provides the following properties:
+
+    - fastq: path of the FASTQ file
+    - number: position of the chunk in the file (starting from
+      zero)
+
+    """
+    def __init__(self,fastq,number,kind,start=None,end=None,prev=None,
+                 checkpoint=None,skip=None,nlines=None,data=None):
+        """Create a new FastqChunk
+
+        Normally instances are created by the 'get_chunks'
+        function, rather than directly.
+
+        Arguments:
+          fastq: path of the FASTQ file
+          number: position of the chunk in the file
+          kind: how the chunk is located: 'plain' (byte range
+            in an uncompressed file), 'bgzf' (range of BGZF
+            blocks), 'lines' (range of lines via a checkpoint
+            index) or 'data' (records held in the chunk)
+          start: offset of the start of the byte or block range
+          end: offset of the end of the byte or block range
+          prev: offset of the preceeding BGZF block
+          checkpoint: gzindex Checkpoint to start from
+          skip: number of lines to skip after the checkpoint
+          nlines: number of lines in the chunk
+          data: the records in the chunk
+
+        """
+        self.fastq = fastq
+        self.number = number
+        self._kind = kind
+        self._start = start
+        self._end = end
+        self._prev = prev
+        self._checkpoint = checkpoint
+        self._skip = skip
+        self._nlines = nlines
+        self._data = data
+
+    def data(self):
+        """Return the read records in the chunk as a string
+
+        """
+        if self._kind == 'data':
+            return self._data
+        elif self._kind == 'lines':
+            return gzindex.read_lines(self.fastq,self._checkpoint,
+                                      self._skip,self._nlines)
+        elif self._kind == 'plain':
+            return self._plain_data()
+        elif self._kind == 'bgzf':
+            return self._bgzf_data()
+        raise Exception("Unknown chunk type '%s'" % self._kind)
+
+    def raw_data(self):
+        """Return the complete lines in the chunk as a string
+
+        Unlike 'data', the start of the first read record isn't
+        located (which relies on the records being well-formed):
+        instead the lines which start within the chunk's range
+        of the file are returned. So the raw data for all the
+        chunks together is exactly the contents of the file,
+        even if it's corrupted (which makes it suitable for
+        checking the file).
+
+        Note that the data won't necessarily start or end on a
+        read record boundary.
+
+        """
+        if self._kind == 'plain':
+            return self._plain_data(_extract_lines)
+        elif self._kind == 'bgzf':
+            return self._bgzf_data(_extract_lines)
+        return self.data()
+
+    def fp(self):
+        """Return a file-like object for reading the chunk
+
+        """
+        return cStringIO.StringIO(self.data())
+
+    def reads(self):
+        """Return an iterator over the reads in the chunk
+
+        Returns:
+          FastqIterator which returns a FastqRead instance for
+          each read in the chunk.
+
+        """
+        return FASTQFile.FastqIterator(fp=self.fp())
+
+    def batches(self,batch_size=FASTQFile.BATCHSIZE):
+        """Return an iterator over batches of reads in the chunk
+
+        Raises ImportError if numpy isn't available.
+
+        Returns:
+          Iterator which returns FastqBatch instances.
+
+        """
+        return FASTQFile.iter_batches(fp=self.fp(),batch_size=batch_size)
+
+    def _plain_data(self,extract=None):
+        """Internal: fetch records for a byte range in a plain file
+
+        'extract' is the function used to extract the data
+        from the range (defaults to '_extract_records').
+
+        """
+        if extract is None:
+            extract = _extract_records
+        with open(self.fastq,'rb') as fp:
+            if self._start > 0:
+                fp.seek(self._start-1)
+                at_line_start = (fp.read(1) == '\n')
+            else:
+                at_line_start = True
+            data = fp.read(self._end - self._start)
+            return extract(data,
+                           lambda: fp.read(READ_SIZE),
+                           at_line_start)
+
+    def _bgzf_data(self,extract=None):
+        """Internal: fetch records for a range of BGZF blocks
+
+        'extract' is the function used to extract the data
+        from the range (defaults to '_extract_records').
+
+        """
+        if extract is None:
+            extract = _extract_records
+        with open(self.fastq,'rb') as fp:
+            if self._prev is not None:
+                fp.seek(self._prev)
+                data = bgzf.decompress_block(bgzf.read_block(fp))
+                at_line_start = (not data or data[-1] == '\n')
+            else:
+                at_line_start = True
+            fp.seek(self._start)
+            blocks = []
+            while fp.tell() < self._end:
+                blocks.append(bgzf.decompress_block(bgzf.read_block(fp)))
+            def more():
+                while True:
+                    block = bgzf.read_block(fp)
+                    if not block:
+                        return ''
+                    data = bgzf.decompress_block(block)
+                    if data:
+                        return data
+            return extract(''.join(blocks),more,at_line_start)
+
+#######################################################################
+# Functions
+#######################################################################
+
+def get_chunks(fastq,chunk_size=CHUNK_SIZE):
+    """Split a FASTQ file into chunks of read records
+
+    Arguments:
+      fastq: path of the FASTQ file (can be gzipped)
+      chunk_size: (optional) approximate size of each chunk
+        (in bytes of uncompressed data)
+
+    Returns:
+      Iterator returning FastqChunk instances, in order.
+
+    """
+    chunk_size = max(int(chunk_size),1)
+    if os.path.splitext(fastq)[1] != '.gz':
+        return _plain_chunks(fastq,chunk_size)
+    if bgzf.is_bgzf(fastq):
+        return _bgzf_chunks(fastq,chunk_size)
+    index = gzindex.cached_index(fastq)
+    if index is None:
+        logging.debug("%s: no index, reading sequentially" % fastq)
+        return _data_chunks(fastq,chunk_size)
+    return _indexed_chunks(fastq,index,chunk_size)
+
+def fastq_map(fastq,func,nprocs=None,chunk_size=CHUNK_SIZE):
+    """Apply a function to each chunk of a FASTQ file in parallel
+
+    The function is invoked with a FastqChunk instance and can
+    return any (picklable) value. The results are returned in
+    the same order as the chunks appear in the file, so
+    results which depend on the order of the reads can be
+    combined correctly.
+
+    If there is only one chunk, or only one process is
+    requested, then the function is run in the current
+    process.
+
+    Arguments:
+      fastq: path of the FASTQ file (can be gzipped)
+      func: function to apply to each chunk (must be defined
+        at the top level of a module)
+      nprocs: (optional) number of processes to use (defaults
+        to the number of CPUs)
+      chunk_size: (optional) approximate size of each chunk
+        (in bytes of uncompressed data)
+
+    Returns:
+      Iterator returning the result for each chunk.
+
+    """
+    if nprocs is None:
+        nprocs = multiprocessing.cpu_count()
+    chunks = get_chunks(fastq,chunk_size=chunk_size)
+    if nprocs > 1 and not multiprocessing.current_process().daemon:
+        # Check there's more than one chunk
+        first = list(itertools.islice(chunks,2))
+        chunks = itertools.chain(first,chunks)
+        if len(first) > 1:
+            return _pool_map(func,chunks,nprocs)
+    return itertools.imap(func,chunks)
+
+def fastq_map_reduce(fastq,map_func,reduce_func,initial=None,nprocs=None,
+                     chunk_size=CHUNK_SIZE):
+    """Apply a function to chunks of a FASTQ file and combine the results
+
+    'map_func' is applied to each chunk of the FASTQ file in
+    parallel (see 'fastq_map'), and then 'reduce_func' is used
+    to combine the results (in chunk order) in the same way as
+    the built-in 'reduce' function.
+
+    Arguments:
+      fastq: path of the FASTQ file (can be gzipped)
+      map_func: function to apply to each chunk (must be
+        defined at the top level of a module)
+      reduce_func: function which takes two results and
+        returns the combined result
+      initial: (optional) if not None then used as the initial
+        value for the reduction
+      nprocs: (optional) number of processes to use (defaults
+        to the number of CPUs)
+      chunk_size: (optional) approximate size of each chunk
+        (in bytes of uncompressed data)
+
+    Returns:
+      The combined result.
+
+    """
+    results = fastq_map(fastq,map_func,nprocs=nprocs,chunk_size=chunk_size)
+    if initial is None:
+        return reduce(reduce_func,results)
+    return reduce(reduce_func,results,initial)
+
+def _pool_map(func,chunks,nprocs):
+    """Internal: apply function to chunks using a pool of processes
+
+    At most 2*nprocs chunks are outstanding at any time, so
+    chunks which hold their data don't all end up in memory.
+
+    If getting the next chunk raises an exception (e.g. because
+    a gzipped file is truncated) then the results for the
+    preceeding chunks are yielded before the exception is
+    raised, so that the results up to the error are the same
+    for any number of processes.
+
+    Yields:
+      Result for each chunk, in order.
+
+    """
+    pool = multiprocessing.Pool(nprocs)
+    try:
+        pending = collections.deque()
+        chunks = iter(chunks)
+        while True:
+            try:
+                chunk = chunks.next()
+            except StopIteration:
+                break
+            except Exception:
+                exc_info = sys.exc_info()
+                while pending:
+                    yield pending.popleft().get()
+                raise exc_info[0],exc_info[1],exc_info[2]
+            pending.append(pool.apply_async(func,(chunk,)))
+            if len(pending) >= 2*nprocs:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+def _plain_chunks(fastq,chunk_size):
+    """Internal: split uncompressed FASTQ into byte ranges
+
+    """
+    size = os.path.getsize(fastq)
+    for i,start in enumerate(xrange(0,max(size,1),chunk_size)):
+        yield FastqChunk(fastq,i,'plain',start=start,
+                         end=min(start+chunk_size,size))
+
+def _bgzf_chunks(fastq,chunk_size):
+    """Internal: split BGZF-compressed FASTQ into ranges of blocks
+
+    """
+    offsets = bgzf.block_offsets(fastq)
+    offsets.append(os.path.getsize(fastq))
+    nblocks = max(chunk_size//bgzf.BGZF_BLOCK_SIZE,1)
+    for i,j in enumerate(xrange(0,max(len(offsets)-1,1),nblocks)):
+        if j > 0:
+            prev = offsets[j-1]
+        else:
+            prev = None
+        yield FastqChunk(fastq,i,'bgzf',start=offsets[j],
+                         end=offsets[min(j+nblocks,len(offsets)-1)],
+                         prev=prev)
+
+def _indexed_chunks(fastq,index,chunk_size):
+    """Internal: split gzipped FASTQ into line ranges using an index
+
+    """
+    bounds = [0]
+    last = 0
+    for checkpoint in index.checkpoints:
+        if checkpoint.out_offset - last >= chunk_size:
+            # First read starting after the checkpoint
+            line = 4*((checkpoint.nlines + 4)//4)
+            if bounds[-1] < line < index.nlines:
+                bounds.append(line)
+                last = checkpoint.out_offset
+    bounds.append(index.nlines)
+    for i in xrange(len(bounds)-1):
+        checkpoint = index.checkpoint_for_line(bounds[i])
+        if checkpoint is None:
+            skip = bounds[i]
+        else:
+            skip = bounds[i] - checkpoint.nlines
+        yield FastqChunk(fastq,i,'lines',checkpoint=checkpoint,skip=skip,
+                         nlines=bounds[i+1]-bounds[i])
+
+def _data_chunks(fastq,chunk_size):
+    """Internal: split FASTQ by reading it sequentially
+
+    The chunks hold their data.
+
+    """
+    fp = FASTQFile.get_fastq_file_handle(fastq)
+    buf = ''
+    i = 0
+    try:
+        while True:
+            data = fp.read(chunk_size)
+            if not data:
+                break
+            buf += data
+            # Split after the last complete record
+            nlines = buf.count('\n')
+            j = len(buf)
+            for k in xrange(nlines%4+1):
+                j = buf.rfind('\n',0,j)
+            if j < 0:
+                continue
+            yield FastqChunk(fastq,i,'data',data=buf[:j+1])
+            buf = buf[j+1:]
+            i += 1
+    finally:
+        fp.close()
+    if buf or i == 0:
+        if buf and not buf.endswith('\n'):
+            buf += '\n'
+        yield FastqChunk(fastq,i,'data',data=buf)
+
+def _extract_records(data,more,at_line_start):
+    """Internal: extract the records which start in a block of data
+
+    The first record is located by looking for a line starting
+    with '@' where the line after next starts with '+' (which
+    can't happen if the '@' line is a quality line). Records are
+    then taken four lines at a time up to and including the last
+    record which starts within the data, fetching more data to
+    complete it if necessary.
+
+    Arguments:
+      data: string with the data for the chunk
+      more: function which returns the data following on
+        from 'data' in chunks (empty string at EOF)
+      at_line_start: True if the first byte of the data is the
+        start of a line
+
+    Returns:
+      String with the complete records.
+
+    """
+    buf = _Buffer(data,more)
+    n = len(data)
+    # Locate the start of the first record
+    if at_line_start:
+        start = 0
+    else:
+        start = data.find('\n') + 1
+        if start == 0:
+            return ''
+    while start < n:
+        if buf.data[start] == '@':
+            i = buf.find_newline(start)
+            if i >= 0:
+                i = buf.find_newline(i+1)
+            if i < 0:
+                # Not enough lines left for a complete record
+                return ''
+            if buf.startswith('+',i+1):
+                break
+        i = buf.find_newline(start)
+        if i < 0:
+            return ''
+        start = i + 1
+    if start >= n:
+        return ''
+    # Count the lines starting within the data
+    nnewlines = buf.data.count('\n',start,n-1)
+    nrecords = (nnewlines + 4)//4
+    # Find the end of the last record
+    pos = n - 1
+    for i in xrange(4*nrecords - nnewlines):
+        i = buf.find_newline(pos)
+        if i < 0:
+            pos = len(buf.data)
+            break
+        pos = i + 1
+    records = buf.data[start:pos]
+    if not records.endswith('\n'):
+        records += '\n'
+    return records
+
+def _extract_lines(data,more,at_line_start):
+    """Internal: extract the lines which start in a block of data
+
+    Arguments:
+      data: string with the data for the chunk
+      more: function which returns the data following on
+        from 'data' in chunks (empty string at EOF)
+      at_line_start: True if the first byte of the data is the
+        start of a line
+
+    Returns:
+      String with the complete lines (the final line won't
+      end with a newline if it's the unterminated last line
+      of the file).
+
+    """
+    if at_line_start:
+        start = 0
+    else:
+        start = data.find('\n') + 1
+        if start == 0:
+            return ''
+    n = len(data)
+    if start >= n or data[-1] == '\n':
+        return data[start:]
+    # Complete the last line
+    buf = _Buffer(data,more)
+    end = buf.find_newline(n)
+    if end < 0:
+        return buf.data[start:]
+    return buf.data[start:end+1]
+
+class _Buffer(object):
+    """Internal: string buffer which is extended on demand
+
+    """
+    def __init__(self,data,more):
+        self.data = data
+        self._more = more
+        self._eof = False
+
+    def _extend(self):
+        if self._eof:
+            return False
+        data = self._more()
+        if not data:
+            self._eof = True
+            return False
+        self.data += data
+        return True
+
+    def find_newline(self,pos):
+        """Return position of next newline at or after pos (-1 at EOF)
+        """
+        while True:
+            i = self.data.find('\n',pos)
+            if i >= 0 or not self._extend():
+                return i
+
+    def startswith(self,prefix,pos):
+        """Check if the data at pos starts with prefix
+        """
+        while len(self.data) < pos + len(prefix):
+            if not self._extend():
+                break
+        return self.data.startswith(prefix,pos)
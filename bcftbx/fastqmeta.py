@@ -0,0 +1,492 @@
+#!/usr/bin/env python
+#
+#     fastqmeta.py: persistent cache of FASTQ file metadata
+#     Copyright (C) University of Manchester 2018 Peter Briggs
+#
+########################################################################
+#
+# fastqmeta.py
+#
+#########################################################################
+
+"""fastqmeta
+
+Classes and functions for caching summary metadata about FASTQ files
+(number of reads, total bases, sequence length and quality ranges,
+and likely quality encoding), so that it doesn't have to be
+recomputed by reading the whole file each time it's needed.
+
+The metadata for a file is stored as JSON in a "sidecar" file next
+to the FASTQ (with the extension '.fqmeta' appended), or in the
+user's cache directory if that's not possible. It records the
+size, modification time and inode of the FASTQ when it was
+generated, and is ignored if any of these no longer match.
+
+Classes:
+
+- FastqMetadata: summary metadata for a FASTQ file
+
+Functions:
+
+- get_metadata: fetch the metadata for a file, generating it if
+  necessary
+- cached_metadata: fetch the metadata for a file only if it's
+  already cached
+- build_metadata: generate new metadata for a file
+- save_metadata: store the metadata for a file
+- metadata_file: return the location of the cached metadata for
+  a file
+- detect_encoding: guess quality encoding from a quality range
+
+Example usage:
+
+>>> meta = get_metadata('reads.fastq.gz')
+>>> print "%d reads (%s)" % (meta.nreads,meta.encoding)
+
+Programs which already read or write all the records in a FASTQ
+can store the metadata without an additional pass over the data,
+by adding the reads to a FastqMetadata instance as they go and
+then calling 'save_metadata' once the file has been closed:
+
+>>> meta = FastqMetadata()
+>>> for read in reads:
+>>> ... fp.write(str(read)+'\\n')
+>>> ... meta.add_read(read)
+>>> fp.close()
+>>> save_metadata('out.fastq',meta)
+
+"""
+
+#######################################################################
+# Imports
+#######################################################################
+
+import os
+import json
+import hashlib
+import logging
+
+#######################################################################
+# Module constants
+#######################################################################
+
+# Extension used for metadata files
+META_EXT = ".fqmeta"
+
+# Version of the metadata file format
+META_VERSION = 1
+
+#######################################################################
+# Classes
+#######################################################################
+
+class FastqMetadata(object):
+    """Summary metadata for a FASTQ file
+
+    Provides the following properties:
+
+    - filen: path of the FASTQ file (or None)
+    - size: size of the FASTQ file when the metadata was stored
+    - mtime: modification time of the FASTQ file when the
+      metadata was stored
+    - inode: inode number of the FASTQ file when the metadata
+      was stored
+    - nreads: number of reads
+    - nbases: total length of all the sequences
+    - min_length: length of the shortest sequence (or None)
+    - max_length: length of the longest sequence (or None)
+    - min_quality: smallest quality value, as an integer
+      character code (or None)
+    - max_quality: largest quality value, as an integer
+      character code (or None)
+    - encoding: likely quality encoding (see 'detect_encoding')
+
+    Sequence lengths are the lengths of the sequence lines
+    (so include the primer base for colorspace reads).
+
+    Statistics can be accumulated using the 'add_read',
+    'add_batch' and 'merge' methods.
+
+    """
+    def __init__(self,filen=None,size=None,mtime=None,inode=None,
+                 nreads=0,nbases=0,min_length=None,max_length=None,
+                 min_quality=None,max_quality=None):
+        """Create a new FastqMetadata instance
+
+        Normally instances are created using the 'get_metadata',
+        'build_metadata' or 'FastqMetadata.load' functions, or
+        created empty and then populated using 'add_read' etc.
+
+        """
+        self.filen = filen
+        self.size = size
+        self.mtime = mtime
+        self.inode = inode
+        self.nreads = nreads
+        self.nbases = nbases
+        self.min_length = min_length
+        self.max_length = max_length
+        self.min_quality = min_quality
+        self.max_quality = max_quality
+
+    @property
+    def encoding(self):
+        """Return the likely quality encoding
+        """
+        return detect_encoding(self.min_quality,self.max_quality)
+
+    def add_stats(self,nreads,nbases,min_length,max_length,
+                  min_quality,max_quality):
+        """Add statistics for a set of reads
+
+        Arguments:
+          nreads: number of reads
+          nbases: total sequence length
+          min_length: shortest sequence length (or None)
+          max_length: longest sequence length (or None)
+          min_quality: smallest quality value (or None)
+          max_quality: largest quality value (or None)
+
+        """
+        if not nreads:
+            return
+        self.nreads += nreads
+        self.nbases += nbases
+        self.min_length = _min(self.min_length,min_length)
+        self.max_length = _max(self.max_length,max_length)
+        self.min_quality = _min(self.min_quality,min_quality)
+        self.max_quality = _max(self.max_quality,max_quality)
+
+    def add_read(self,read):
+        """Add a read to the statistics
+
+        Arguments:
+          read: FastqRead instance
+
+        """
+        length = len(read.sequence)
+        quality = read.quality
+        if quality:
+            qmin,qmax = (ord(min(quality)),ord(max(quality)))
+        else:
+            qmin,qmax = (None,None)
+        self.add_stats(1,length,length,length,qmin,qmax)
+
+    def add_batch(self,batch):
+        """Add a batch of reads to the statistics
+
+        Arguments:
+          batch: FastqBatch instance
+
+        """
+        if not batch.nreads:
+            return
+        lengths = batch.seq_lengths
+        qmin,qmax = batch.quality_range()
+        self.add_stats(batch.nreads,int(lengths.sum()),
+                       int(lengths.min()),int(lengths.max()),
+                       qmin,qmax)
+
+    def merge(self,metadata):
+        """Add the statistics from another FastqMetadata instance
+
+        Arguments:
+          metadata: FastqMetadata instance
+
+        Returns:
+          This instance (so that 'merge' can be used as a
+          reduction function).
+
+        """
+        self.add_stats(metadata.nreads,
+                       metadata.nbases,
+                       metadata.min_length,
+                       metadata.max_length,
+                       metadata.min_quality,
+                       metadata.max_quality)
+        return self
+
+    def stamp(self,filen):
+        """Associate the metadata with the current state of a file
+
+        Arguments:
+          filen: path of the FASTQ file
+
+        """
+        st = os.stat(filen)
+        self.filen = filen
+        self.size = st.st_size
+        self.mtime = st.st_mtime
+        self.inode = st.st_ino
+
+    def is_current(self):
+        """Check if the metadata is up to date with the FASTQ file
+
+        Returns:
+          True if the size, modification time and inode of the
+          file match those recorded in the metadata, False if
+          not.
+
+        """
+        try:
+            st = os.stat(self.filen)
+        except (OSError,TypeError):
+            return False
+        return (st.st_size == self.size and
+                st.st_mtime == self.mtime and
+                st.st_ino == self.inode)
+
+    def save(self,meta_file):
+        """Write the metadata to a file
+
+        Arguments:
+          meta_file: path of the file to write the metadata to
+
+        """
+        tmp_file = "%s.%d.tmp" % (meta_file,os.getpid())
+        with open(tmp_file,'w') as fp:
+            json.dump(dict(version=META_VERSION,
+                           size=self.size,
+                           mtime=self.mtime,
+                           inode=self.inode,
+                           nreads=self.nreads,
+                           nbases=self.nbases,
+                           min_length=self.min_length,
+                           max_length=self.max_length,
+                           min_quality=self.min_quality,
+                           max_quality=self.max_quality,
+                           encoding=self.encoding),
+                      fp,sort_keys=True)
+        os.rename(tmp_file,meta_file)
+
+    @classmethod
+    def load(cls,filen,meta_file):
+        """Read metadata from a file
+
+        Arguments:
+          filen: path of the FASTQ file
+          meta_file: path of the file to read the metadata from
+
+        Returns:
+          FastqMetadata instance.
+
+        Raises:
+          ValueError: if the file doesn't contain valid metadata.
+
+        """
+        with open(meta_file,'r') as fp:
+            data = json.load(fp)
+        try:
+            if data['version'] != META_VERSION:
+                raise ValueError("%s: unsupported version '%s'" %
+                                 (meta_file,data['version']))
+            return cls(filen,
+                       size=data['size'],
+                       mtime=data['mtime'],
+                       inode=data['inode'],
+                       nreads=data['nreads'],
+                       nbases=data['nbases'],
+                       min_length=data['min_length'],
+                       max_length=data['max_length'],
+                       min_quality=data['min_quality'],
+                       max_quality=data['max_quality'])
+        except (KeyError,TypeError),ex:
+            raise ValueError("%s: bad metadata file: %s" % (meta_file,ex))
+
+    def __repr__(self):
+        return "%s: %d reads, %d bases" % (self.filen,self.nreads,
+                                           self.nbases)
+
+#######################################################################
+# Functions
+#######################################################################
+
+def metadata_file(filen,cache_dir=None):
+    """Return the location of the metadata file for a FASTQ file
+
+    The metadata is located next to the FASTQ file if the
+    directory is writable (or metadata already exists there);
+    otherwise it is located in the cache directory.
+
+    Arguments:
+      filen: path of the FASTQ file
+      cache_dir: (optional) directory to use for metadata which
+        can't be stored next to the FASTQ file (defaults to
+        '$BCFTBX_CACHE_DIR' if set, or '~/.cache/bcftbx')
+
+    Returns:
+      Path of the metadata file.
+
+    """
+    filen = os.path.abspath(filen)
+    sidecar = filen + META_EXT
+    if os.path.exists(sidecar) or \
+       os.access(os.path.dirname(filen),os.W_OK):
+        return sidecar
+    if cache_dir is None:
+        cache_dir = os.environ.get('BCFTBX_CACHE_DIR',
+                                   os.path.join(os.path.expanduser('~'),
+                                                '.cache','bcftbx'))
+    return os.path.join(cache_dir,
+                        "%s%s" % (hashlib.md5(filen).hexdigest(),META_EXT))
+
+def cached_metadata(filen,cache_dir=None):
+    """Return the cached metadata for a FASTQ file
+
+    Arguments:
+      filen: path of the FASTQ file
+      cache_dir: (optional) directory to use for metadata which
+        can't be stored next to the FASTQ file
+
+    Returns:
+      FastqMetadata instance, or None if there is no cached
+      metadata or it's out of date.
+
+    """
+    meta_file = metadata_file(filen,cache_dir=cache_dir)
+    if not os.path.exists(meta_file):
+        return None
+    try:
+        metadata = FastqMetadata.load(filen,meta_file)
+    except (ValueError,IOError),ex:
+        logging.debug("%s: ignoring metadata: %s" % (filen,ex))
+        return None
+    if not metadata.is_current():
+        logging.debug("%s: metadata is out of date" % filen)
+        return None
+    return metadata
+
+def get_metadata(filen,nprocs=None,cache_dir=None):
+    """Return the metadata for a FASTQ file
+
+    If there is existing metadata for the file which is up to
+    date then this is loaded; otherwise the metadata is
+    generated and saved for subsequent use (failure to save
+    the metadata is not an error).
+
+    Arguments:
+      filen: path of the FASTQ file
+      nprocs: (optional) number of processes to use if the
+        metadata has to be generated
+      cache_dir: (optional) directory to use for metadata which
+        can't be stored next to the FASTQ file
+
+    Returns:
+      FastqMetadata instance.
+
+    """
+    metadata = cached_metadata(filen,cache_dir=cache_dir)
+    if metadata is not None:
+        return metadata
+    metadata = build_metadata(filen,nprocs=nprocs)
+    save_metadata(filen,metadata,cache_dir=cache_dir)
+    return metadata
+
+def build_metadata(filen,nprocs=None):
+    """Generate the metadata for a FASTQ file
+
+    The file is split into chunks which are processed in
+    parallel (see the 'fastqmapreduce' module).
+
+    Arguments:
+      filen: path of the FASTQ file
+      nprocs: (optional) number of processes to use (defaults
+        to the number of CPUs)
+
+    Returns:
+      FastqMetadata instance.
+
+    """
+    # Avoid circular import
+    from . import fastqmapreduce
+    metadata = fastqmapreduce.fastq_map_reduce(filen,
+                                               _metadata_for_chunk,
+                                               FastqMetadata.merge,
+                                               initial=FastqMetadata(),
+                                               nprocs=nprocs)
+    metadata.stamp(filen)
+    return metadata
+
+def _metadata_for_chunk(chunk):
+    """Internal: generate the metadata for a FastqChunk
+    """
+    metadata = FastqMetadata()
+    try:
+        for batch in chunk.batches():
+            metadata.add_batch(batch)
+    except ImportError:
+        for read in chunk.reads():
+            metadata.add_read(read)
+    return metadata
+
+def save_metadata(filen,metadata,cache_dir=None):
+    """Store the metadata for a FASTQ file
+
+    The metadata is associated with the current size,
+    modification time and inode of the file, so this should
+    be called after the file has been completely written.
+
+    Failure to save the metadata is not an error (a warning
+    is logged).
+
+    Arguments:
+      filen: path of the FASTQ file
+      metadata: FastqMetadata instance
+      cache_dir: (optional) directory to use for metadata which
+        can't be stored next to the FASTQ file
+
+    Returns:
+      True if the metadata was saved, False if not.
+
+    """
+    meta_file = metadata_file(filen,cache_dir=cache_dir)
+    try:
+        metadata.stamp(filen)
+        dirn = os.path.dirname(meta_file)
+        if not os.path.isdir(dirn):
+            os.makedirs(dirn)
+        metadata.save(meta_file)
+    except (IOError,OSError),ex:
+        logging.warning("%s: unable to save metadata: %s" % (filen,ex))
+        return False
+    return True
+
+def detect_encoding(min_quality,max_quality):
+    """Guess the quality encoding from the range of quality values
+
+    Arguments:
+      min_quality: smallest quality value (integer character code)
+      max_quality: largest quality value (integer character code)
+
+    Returns:
+      'Phred+33', 'Solexa+64' or 'Phred+64', or None if the
+      encoding can't be determined unambiguously.
+
+    """
+    if min_quality is None or max_quality is None:
+        return None
+    if min_quality < ord(';'):
+        return 'Phred+33'
+    if min_quality < ord('@'):
+        return 'Solexa+64'
+    if max_quality > ord('J'):
+        return 'Phred+64'
+    return None
+
+def _min(x,y):
+    """Internal: return the smaller of two values which may be None
+    """
+    if x is None:
+        return y
+    if y is None:
+        return x
+    return min(x,y)
+
+def _max(x,y):
+    """Internal: return the larger of two values which may be None
+    """
+    if x is None:
+        return y
+    if y is None:
+        return x
+    return max(x,y)
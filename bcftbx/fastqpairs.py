@@ -0,0 +1,535 @@
+#!/usr/bin/env python
+#
+#     fastqpairs.py: find and remove unpaired reads in FASTQ files
+#     Copyright (C) University of Manchester 2018 Peter Briggs
+#
+########################################################################
+#
+# fastqpairs.py
+#
+#########################################################################
+
+"""fastqpairs
+
+Classes and functions for locating "singleton" reads (i.e. reads
+whose mate is missing) in paired-end FASTQ data, and for writing
+copies of the data with the singletons removed.
+
+Two cases are handled:
+
+- a single FASTQ holding the reads from both ends (for example
+  interleaved data from solid2fastq), where the reads can be in
+  any order; and
+- an R1/R2 pair of FASTQ files which are both sorted by read name,
+  where some reads are missing from one file or the other.
+
+For a single FASTQ, 'find_singletons' reads the file once, keying
+each read on a 64-bit hash of its name (plus a 32-bit check value
+used to detect hash collisions) rather than on the name itself.
+The keys are held in compact arrays; if there are more than will
+fit into the specified memory budget then they are written out to
+a set of partition files on disk (by key), which are processed one
+at a time (the keys are grouped using numpy if it's available,
+which needs much less memory than the pure Python fallback). The
+few keys which turn out to be shared by different names are
+resolved by an additional pass over the reads with those names.
+The result is a ReadIndexSet holding the positions of the
+singletons in the file, which requires one bit per read.
+
+For a pair of name-sorted FASTQs, 'resync_pairs' merges the two
+files in a single pass, writing matching reads to new R1/R2
+files and unmatched reads to a singles file.
+
+Classes:
+
+- ReadIndexSet: compact set of read positions within a FASTQ
+
+Functions:
+
+- read_name: return the name part of a read header
+- find_singletons: locate singleton reads in a FASTQ
+- remove_singletons: copy a FASTQ with singleton reads removed
+- resync_pairs: re-synchronise a pair of name-sorted R1/R2 FASTQs
+
+Example usage:
+
+>>> npaired,nsingles = remove_singletons('reads.fastq',
+...                                      'reads.paired.fastq',
+...                                      'reads.singles.fastq')
+
+"""
+
+#######################################################################
+# Imports
+#######################################################################
+
+import os
+import zlib
+import array
+import shutil
+import tempfile
+import logging
+import FASTQFile
+import bgzf
+try:
+    import numpy
+except ImportError:
+    # No numpy module: keys are grouped using pure Python
+    numpy = None
+
+#######################################################################
+# Module constants
+#######################################################################
+
+# Default memory budget for holding read keys (bytes)
+DEFAULT_MAX_MEMORY = 512*1024*1024
+
+# Approximate memory needed per read key when the keys are
+# grouped (arrays plus the temporary sort order), using numpy
+# and using pure Python (where the sort needs Python objects
+# for every key)
+KEY_RECORD_SIZE = 64
+KEY_RECORD_SIZE_NO_NUMPY = 160
+
+# Default number of partition files used when keys are spilled
+# to disk
+DEFAULT_PARTITIONS = 64
+
+# Mask for read name hashes (64 bits, if that's the size of the
+# array type used to store them)
+KEY_MASK = (1 << 8*min(array.array('L').itemsize,8)) - 1
+
+# Number of keys buffered for each partition before writing
+PARTITION_BUFFER_SIZE = 65536
+
+#######################################################################
+# Classes
+#######################################################################
+
+class ReadIndexSet(object):
+    """Compact set of read positions within a FASTQ
+
+    Positions are the zero-based indices of reads in the file,
+    and are stored as a bitmap requiring one bit for each read.
+
+    Example:
+
+    >>> singles = ReadIndexSet(1000)
+    >>> singles.add(12)
+    >>> 12 in singles
+    True
+    >>> len(singles)
+    1
+
+    """
+
+    def __init__(self,nreads):
+        """Create a new ReadIndexSet
+
+        Arguments:
+          nreads: total number of reads in the FASTQ (i.e. one
+            more than the largest position which can be stored)
+
+        """
+        self.nreads = nreads
+        self._bits = bytearray((nreads+7)//8)
+        self._count = 0
+
+    def add(self,i):
+        """Add a read position to the set
+
+        Arguments:
+          i: zero-based index of the read
+        """
+        byte = i >> 3
+        bit = 1 << (i & 7)
+        if not (self._bits[byte] & bit):
+            self._bits[byte] |= bit
+            self._count += 1
+
+    def __contains__(self,i):
+        return bool(self._bits[i >> 3] & (1 << (i & 7)))
+
+    def __len__(self):
+        return self._count
+
+class _KeyStore(object):
+    """Internal: accumulate read keys, spilling to disk if necessary
+
+    Stores a 64-bit key, 32-bit check value and read index for
+    each read. Keys are held in memory up to 'max_keys'; after
+    that all keys are written to partition files (chosen by the
+    key) in a temporary directory.
+
+    The 'groups' method then returns the keys (in arrays of keys,
+    checks and indices) either for all reads (if the keys weren't
+    spilled) or for one partition at a time.
+
+    """
+
+    def __init__(self,max_keys,partitions=DEFAULT_PARTITIONS,tmp_dir=None):
+        self._max_keys = max(int(max_keys),1)
+        self._npartitions = max(int(partitions),1)
+        self._tmp_dir = tmp_dir
+        self._partition_dir = None
+        self._partitions = None
+        self._keys,self._checks,self._indices = self._new_arrays()
+
+    def _new_arrays(self):
+        return (array.array('L'),array.array('I'),array.array('L'))
+
+    def add(self,key,check,index):
+        if self._partitions is None:
+            self._keys.append(key)
+            self._checks.append(check)
+            self._indices.append(index)
+            if len(self._keys) > self._max_keys:
+                self._spill()
+        else:
+            keys,checks,indices = self._partitions[key % self._npartitions]
+            keys.append(key)
+            checks.append(check)
+            indices.append(index)
+            if len(keys) >= PARTITION_BUFFER_SIZE:
+                self._flush(key % self._npartitions)
+
+    @property
+    def spilled(self):
+        return (self._partitions is not None)
+
+    def _partition_files(self,i):
+        return [os.path.join(self._partition_dir,"part%04d.%s" % (i,ext))
+                for ext in ('keys','checks','indices')]
+
+    def _spill(self):
+        # Start writing keys to partition files on disk
+        self._partition_dir = tempfile.mkdtemp(prefix="fastqpairs.",
+                                               dir=self._tmp_dir)
+        logging.debug("Spilling read keys to %s" % self._partition_dir)
+        self._partitions = [self._new_arrays()
+                            for i in xrange(self._npartitions)]
+        keys,checks,indices = self._keys,self._checks,self._indices
+        self._keys,self._checks,self._indices = self._new_arrays()
+        for j in xrange(len(keys)):
+            self.add(keys[j],checks[j],indices[j])
+        for i in xrange(self._npartitions):
+            self._flush(i)
+
+    def _flush(self,i):
+        for a,filen in zip(self._partitions[i],self._partition_files(i)):
+            with open(filen,'ab') as fp:
+                a.tofile(fp)
+            del a[:]
+
+    def groups(self):
+        """Yield the (keys,checks,indices) arrays for each partition
+        """
+        if self._partitions is None:
+            yield (self._keys,self._checks,self._indices)
+            return
+        for i in xrange(self._npartitions):
+            self._flush(i)
+        for i in xrange(self._npartitions):
+            arrays = self._new_arrays()
+            for a,filen in zip(arrays,self._partition_files(i)):
+                if os.path.exists(filen):
+                    with open(filen,'rb') as fp:
+                        a.fromfile(fp,os.path.getsize(filen)//a.itemsize)
+                    os.remove(filen)
+            yield arrays
+
+    def cleanup(self):
+        """Remove any partition files
+        """
+        if self._partition_dir is not None:
+            shutil.rmtree(self._partition_dir,ignore_errors=True)
+            self._partition_dir = None
+
+#######################################################################
+# Functions
+#######################################################################
+
+def read_name(header):
+    """Return the name part of a read header
+
+    The name is the header up to the first whitespace, with
+    any trailing '/1' or '/2' read number removed. For example
+    both '@HWI-ST1:1:FC:1:1:1:1 1:N:0:ACG' and
+    '@HWI-ST1:1:FC:1:1:1:1 2:N:0:ACG' give the name
+    '@HWI-ST1:1:FC:1:1:1:1', while '@HWUSI-EAS100R:6:73:941:1973#0/1'
+    gives '@HWUSI-EAS100R:6:73:941:1973#0'.
+
+    Arguments:
+      header: sequence identifier line for the read
+
+    Returns:
+      String with the read name.
+
+    """
+    name = header.split(None,1)[0] if header else header
+    if name[-2:] in ('/1','/2'):
+        name = name[:-2]
+    return name
+
+def find_singletons(fastq,max_memory=DEFAULT_MAX_MEMORY,
+                    partitions=DEFAULT_PARTITIONS,tmp_dir=None):
+    """Locate the singleton reads in a FASTQ
+
+    A singleton is a read whose name (see 'read_name') isn't
+    shared by any other read in the file. The reads can be
+    in any order.
+
+    Arguments:
+      fastq: name of the FASTQ file
+      max_memory: optional, approximate maximum number of bytes
+        to use for holding read keys in memory before they are
+        spilled to partition files on disk
+      partitions: optional, number of partition files to use
+        if keys are spilled to disk
+      tmp_dir: optional, directory to create the partition files
+        in (defaults to the system temporary directory)
+
+    Returns:
+      ReadIndexSet with the (zero-based) positions of the
+      singleton reads.
+
+    """
+    if numpy is not None:
+        record_size = KEY_RECORD_SIZE
+    else:
+        record_size = KEY_RECORD_SIZE_NO_NUMPY
+    store = _KeyStore(max_memory//record_size,
+                      partitions=partitions,
+                      tmp_dir=tmp_dir)
+    try:
+        # Collect the keys for each read name
+        nreads = 0
+        for read in FASTQFile.FastqIterator(fastq):
+            name = read_name(read.raw_seqid)
+            store.add(hash(name) & KEY_MASK,
+                      zlib.crc32(name) & 0xffffffff,
+                      nreads)
+            nreads += 1
+        if store.spilled:
+            logging.debug("Read keys were spilled to disk")
+        # Group the keys to find singletons
+        singles = ReadIndexSet(nreads)
+        collisions = set()
+        for keys,checks,indices in store.groups():
+            _group_keys(keys,checks,indices,singles,collisions)
+    finally:
+        store.cleanup()
+    if collisions:
+        # Resolve collisions by comparing the actual names
+        logging.debug("Checking %d reads with colliding keys" %
+                      len(collisions))
+        names = {}
+        for i,read in enumerate(FASTQFile.FastqIterator(fastq)):
+            if i in collisions:
+                names.setdefault(read_name(read.raw_seqid),[]).append(i)
+        for name in names:
+            if len(names[name]) == 1:
+                singles.add(names[name][0])
+    return singles
+
+def remove_singletons(fastq,paired_fastq,singles_fastq=None,
+                      max_memory=DEFAULT_MAX_MEMORY,
+                      partitions=DEFAULT_PARTITIONS,tmp_dir=None):
+    """Copy a FASTQ with the singleton reads removed
+
+    The reads which form pairs are written to 'paired_fastq'
+    (in their original order), and the singletons are written
+    to 'singles_fastq' (if specified). Outputs with names
+    ending in '.gz' are compressed.
+
+    Arguments:
+      fastq: name of the input FASTQ file
+      paired_fastq: name of the output FASTQ for paired reads
+      singles_fastq: optional, name of the output FASTQ for
+        singleton reads
+      max_memory: optional, approximate maximum number of bytes
+        to use for holding read keys (see 'find_singletons')
+      partitions: optional, number of partition files to use
+        if keys are spilled to disk
+      tmp_dir: optional, directory to create the partition files
+        in
+
+    Returns:
+      Tuple (npaired,nsingles) with the number of reads written
+      to each output.
+
+    """
+    singles = find_singletons(fastq,max_memory=max_memory,
+                              partitions=partitions,tmp_dir=tmp_dir)
+    fp_paired = _open_output(paired_fastq)
+    fp_singles = _open_output(singles_fastq) if singles_fastq else None
+    npaired = 0
+    for i,read in enumerate(FASTQFile.FastqIterator(fastq)):
+        if i in singles:
+            if fp_singles is not None:
+                fp_singles.write(str(read)+'\n')
+        else:
+            fp_paired.write(str(read)+'\n')
+            npaired += 1
+    fp_paired.close()
+    if fp_singles is not None:
+        fp_singles.close()
+    return (npaired,len(singles))
+
+def resync_pairs(fastq1,fastq2,paired_fastq1,paired_fastq2,
+                 singles_fastq=None,key=None):
+    """Re-synchronise a pair of name-sorted R1/R2 FASTQs
+
+    Reads which appear in both FASTQs (i.e. which have the same
+    name, see 'read_name') are written to 'paired_fastq1' and
+    'paired_fastq2' respectively; those which only appear in one
+    of the inputs are written to 'singles_fastq' (if specified).
+    Outputs with names ending in '.gz' are compressed.
+
+    The inputs are merged in a single pass, so both FASTQs must
+    be sorted into the same order by read name; an exception is
+    raised if a read is found out of order. (FASTQs can be sorted
+    using the 'fastqsort' module, in which case the same key
+    should be used here, e.g. 'fastqsort.illumina_key'.)
+
+    Arguments:
+      fastq1: name of the R1 FASTQ file
+      fastq2: name of the R2 FASTQ file
+      paired_fastq1: name of the output FASTQ for paired R1 reads
+      paired_fastq2: name of the output FASTQ for paired R2 reads
+      singles_fastq: optional, name of the output FASTQ for
+        unpaired reads from either input
+      key: optional, function which takes a read name and returns
+        the value it is sorted by (defaults to the name itself)
+
+    Returns:
+      Tuple (npairs,nsingles) with the number of read pairs and
+      the number of singletons.
+
+    """
+    if key is None:
+        key = lambda name: name
+    reads1 = _sorted_reads(fastq1,key)
+    reads2 = _sorted_reads(fastq2,key)
+    fp1 = _open_output(paired_fastq1)
+    fp2 = _open_output(paired_fastq2)
+    fp_singles = _open_output(singles_fastq) if singles_fastq else None
+    npairs = 0
+    nsingles = 0
+    k1,r1 = next(reads1,(None,None))
+    k2,r2 = next(reads2,(None,None))
+    while r1 is not None or r2 is not None:
+        if r1 is not None and r2 is not None and k1 == k2:
+            fp1.write(str(r1)+'\n')
+            fp2.write(str(r2)+'\n')
+            npairs += 1
+            k1,r1 = next(reads1,(None,None))
+            k2,r2 = next(reads2,(None,None))
+        elif r2 is None or (r1 is not None and k1 < k2):
+            if fp_singles is not None:
+                fp_singles.write(str(r1)+'\n')
+            nsingles += 1
+            k1,r1 = next(reads1,(None,None))
+        else:
+            if fp_singles is not None:
+                fp_singles.write(str(r2)+'\n')
+            nsingles += 1
+            k2,r2 = next(reads2,(None,None))
+    for fp in (fp1,fp2,fp_singles):
+        if fp is not None:
+            fp.close()
+    return (npairs,nsingles)
+
+def _group_keys(keys,checks,indices,singles,collisions):
+    """Internal: find singletons from arrays of read keys
+
+    Reads whose key is unique are added to 'singles'; reads
+    which share a key with reads with a different check value
+    (i.e. where different names gave the same key) are added
+    to 'collisions'.
+
+    If numpy is available then the arrays are sorted and grouped
+    using numpy (see '_group_keys_numpy').
+
+    """
+    if numpy is not None:
+        return _group_keys_numpy(keys,checks,indices,singles,collisions)
+    order = sorted(xrange(len(keys)),key=keys.__getitem__)
+    n = len(order)
+    j = 0
+    while j < n:
+        key = keys[order[j]]
+        k = j + 1
+        while k < n and keys[order[k]] == key:
+            k += 1
+        if k - j == 1:
+            singles.add(indices[order[j]])
+        else:
+            check = checks[order[j]]
+            for m in xrange(j+1,k):
+                if checks[order[m]] != check:
+                    collisions.update([indices[order[m]]
+                                       for m in xrange(j,k)])
+                    break
+        j = k
+
+def _group_keys_numpy(keys,checks,indices,singles,collisions):
+    """Internal: find singletons from arrays of read keys using numpy
+
+    Equivalent to '_group_keys', but the arrays are sorted in
+    place by numpy (via buffers onto the arrays, rather than by
+    creating Python objects for each key), so the additional
+    memory is a few numpy arrays of fixed-size values.
+
+    """
+    n = len(keys)
+    if n == 0:
+        return
+    dtype = numpy.dtype("uint%d" % (8*keys.itemsize))
+    keys = numpy.frombuffer(keys,dtype=dtype)
+    checks = numpy.frombuffer(checks,dtype=numpy.uint32)
+    indices = numpy.frombuffer(indices,dtype=dtype)
+    # Sort by key, and by check value within each key
+    order = numpy.lexsort((checks,keys))
+    sorted_keys = keys[order]
+    # Flag the first read with each key
+    first = numpy.ones(n,dtype=bool)
+    numpy.not_equal(sorted_keys[1:],sorted_keys[:-1],out=first[1:])
+    # Reads with unique keys are singletons
+    unique = first.copy()
+    unique[:-1] &= first[1:]
+    for start in xrange(0,n,PARTITION_BUFFER_SIZE):
+        pos = numpy.flatnonzero(unique[start:start+PARTITION_BUFFER_SIZE])
+        for i in indices[order[pos+start]].tolist():
+            singles.add(i)
+    del unique
+    # Keys with more than one check value are collisions
+    sorted_checks = checks[order]
+    differ = ~first[1:]
+    differ &= (sorted_checks[1:] != sorted_checks[:-1])
+    if differ.any():
+        colliding = numpy.unique(sorted_keys[1:][differ])
+        pos = numpy.flatnonzero(numpy.in1d(sorted_keys,colliding))
+        collisions.update(indices[order[pos]].tolist())
+
+def _sorted_reads(fastq,key):
+    """Internal: yield (key,read) for reads in a name-sorted FASTQ
+
+    Raises an exception if the reads aren't in sorted order.
+
+    """
+    last = None
+    for read in FASTQFile.FastqIterator(fastq):
+        k = key(read_name(read.raw_seqid))
+        if last is not None and k < last:
+            raise Exception("%s: reads are not sorted by name ('%s' follows "
+                            "'%s')" % (fastq,read.raw_seqid,last))
+        last = k
+        yield (k,read)
+
+def _open_output(filen):
+    """Internal: open an output file, compressing '.gz' files
+    """
+    if filen.endswith('.gz'):
+        return bgzf.BgzfWriter(filen)
+    return open(filen,'w')
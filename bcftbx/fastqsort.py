@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+#
+#     fastqsort.py: sort FASTQ files by read name
+#     Copyright (C) University of Manchester 2018 Peter Briggs
+#
+########################################################################
+#
+# fastqsort.py
+#
+#########################################################################
+
+"""fastqsort
+
+Functions for sorting the records in FASTQ files by read name, for
+files which are too large to sort in memory.
+
+The sort is a standard external merge sort:
+
+- the FASTQ is split into chunks of a fixed size (see the
+  'fastqmapreduce' module), and the records in each chunk are
+  sorted in memory and written to a compressed temporary "run"
+  file (the chunks can be sorted in parallel by separate
+  processes);
+- the runs are then merged using a heap, to produce the sorted
+  output (if there are a very large number of runs then they
+  are first merged in groups to produce fewer, longer runs).
+
+Records are sorted on a key derived from the read name (see
+'fastqpairs.read_name'), so the R1 and R2 reads from a pair of
+FASTQs end up in the same order. Two keys are provided:
+
+- 'name': plain lexical order of the read names
+- 'illumina': "natural" order for Illumina read names, where the
+  numeric fields (lane, tile, x and y coordinates) are compared as
+  numbers, so that (for example) reads from the same tile are
+  sorted by their coordinates
+
+The sort is stable, so records with the same key are output in
+the same order as they appear in the input.
+
+Functions:
+
+- sort_fastq: sort a FASTQ file by read name
+- name_key: lexical sort key for a read name
+- illumina_key: natural sort key for an Illumina read name
+
+Example sorting a FASTQ using 4 processes:
+
+>>> sort_fastq('reads.fastq.gz','reads.sorted.fastq.gz',
+...            key='illumina',nprocs=4)
+
+"""
+
+#######################################################################
+# Imports
+#######################################################################
+
+import os
+import heapq
+import shutil
+import tempfile
+import operator
+import logging
+import bgzf
+import fastqmapreduce
+from fastqpairs import read_name
+
+#######################################################################
+# Module constants
+#######################################################################
+
+# Default size of the sorted runs (bytes of uncompressed data)
+RUN_SIZE = 32*1024*1024
+
+# Maximum number of runs to merge at once
+MAX_MERGE_RUNS = 64
+
+# Compression level for the temporary run files
+RUN_COMPRESSLEVEL = 1
+
+# Size of reads from run files when merging (bytes)
+RUN_READ_SIZE = 1024*1024
+
+#######################################################################
+# Classes
+#######################################################################
+
+class _RunSorter(object):
+    """Internal: sort a chunk of a FASTQ and write it to a run file
+
+    Instances are callables which take a FastqChunk, so they
+    can be passed to 'fastqmapreduce.fastq_map' (and on to
+    worker processes).
+
+    """
+
+    def __init__(self,key,run_dir):
+        self._key = key
+        self._run_dir = run_dir
+
+    def __call__(self,chunk):
+        key = _get_key(self._key)
+        lines = chunk.data().replace('\r','').split('\n')
+        del lines[len(lines) - len(lines)%4:]
+        records = [(key(read_name(lines[i])),i)
+                   for i in xrange(0,len(lines),4)]
+        records.sort(key=operator.itemgetter(0))
+        run = os.path.join(self._run_dir,"run%06d.fastq.gz" % chunk.number)
+        fp = bgzf.BgzfWriter(run,compresslevel=RUN_COMPRESSLEVEL,threads=1)
+        for k,i in records:
+            fp.write('\n'.join(lines[i:i+4])+'\n')
+        fp.close()
+        return (run,len(records))
+
+#######################################################################
+# Functions
+#######################################################################
+
+def sort_fastq(fastq,sorted_fastq,key='name',run_size=RUN_SIZE,
+               nprocs=1,tmp_dir=None,max_merge=MAX_MERGE_RUNS):
+    """Sort the records in a FASTQ file by read name
+
+    Outputs with names ending in '.gz' are compressed.
+
+    Arguments:
+      fastq: path of the input FASTQ (can be gzipped)
+      sorted_fastq: path of the output FASTQ
+      key: (optional) either 'name' (lexical order, the default)
+        or 'illumina' (natural order for Illumina read names),
+        or a function which takes a read name and returns the
+        value to sort on (must be defined at the top level of a
+        module if 'nprocs' is more than one)
+      run_size: (optional) approximate size of each sorted run
+        (in bytes of uncompressed data); this determines how
+        much memory is used by each process
+      nprocs: (optional) number of processes to use for sorting
+        the runs (default is 1)
+      tmp_dir: (optional) directory to create the run files in
+        (defaults to the system temporary directory)
+      max_merge: (optional) maximum number of runs to merge at
+        once
+
+    Returns:
+      The number of records in the sorted FASTQ.
+
+    """
+    max_merge = max(int(max_merge),2)
+    run_dir = tempfile.mkdtemp(prefix="fastqsort.",dir=tmp_dir)
+    try:
+        # Sort runs
+        runs = []
+        nreads = 0
+        for run,n in fastqmapreduce.fastq_map(fastq,
+                                              _RunSorter(key,run_dir),
+                                              nprocs=nprocs,
+                                              chunk_size=run_size):
+            runs.append(run)
+            nreads += n
+        logging.debug("%s: sorted %d reads into %d runs" % (fastq,nreads,
+                                                            len(runs)))
+        # Reduce the number of runs if necessary
+        level = 0
+        while len(runs) > max_merge:
+            level += 1
+            merged = []
+            for i in xrange(0,len(runs),max_merge):
+                run = os.path.join(run_dir,"merge%02d.%06d.fastq.gz" %
+                                   (level,len(merged)))
+                fp = bgzf.BgzfWriter(run,compresslevel=RUN_COMPRESSLEVEL)
+                _merge_runs(runs[i:i+max_merge],fp,key)
+                fp.close()
+                for r in runs[i:i+max_merge]:
+                    os.remove(r)
+                merged.append(run)
+            runs = merged
+        # Final merge
+        if sorted_fastq.endswith('.gz'):
+            fp = bgzf.BgzfWriter(sorted_fastq)
+        else:
+            fp = open(sorted_fastq,'w')
+        _merge_runs(runs,fp,key)
+        fp.close()
+    finally:
+        shutil.rmtree(run_dir,ignore_errors=True)
+    return nreads
+
+def name_key(name):
+    """Lexical sort key for a read name
+
+    Arguments:
+      name: read name
+
+    Returns:
+      The name itself.
+
+    """
+    return name
+
+def illumina_key(name):
+    """Natural sort key for an Illumina read name
+
+    The name is split into fields on ':' and '#', and fields
+    consisting of digits are converted to integers, so for
+    example '@EAS139:136:FC706VJ:2:2104:15343:197393' gives the
+    key ('@EAS139',136,'FC706VJ',2,2104,15343,197393). Reads are
+    then ordered by instrument, run, flowcell, lane, tile and x
+    and y coordinates (for Illumina 1.8+ names), or by
+    instrument, lane, tile, x and y coordinates and index (for
+    earlier Illumina names).
+
+    Arguments:
+      name: read name
+
+    Returns:
+      Tuple with the key.
+
+    """
+    fields = name.split(':')
+    if len(fields) == 7:
+        # Illumina 1.8+ format
+        try:
+            return (fields[0],int(fields[1]),fields[2],int(fields[3]),
+                    int(fields[4]),int(fields[5]),int(fields[6]))
+        except ValueError:
+            pass
+    return tuple([int(f) if f.isdigit() else f
+                  for f in name.replace('#',':').split(':')])
+
+def _get_key(key):
+    """Internal: return the key function for a key name or function
+    """
+    if key == 'name':
+        return name_key
+    elif key == 'illumina':
+        return illumina_key
+    elif callable(key):
+        return key
+    raise Exception("Unknown sort key '%s'" % key)
+
+def _merge_runs(runs,fp,key):
+    """Internal: merge sorted run files and write the records
+
+    Arguments:
+      runs: list of paths to the (gzipped) run files, in the
+        order they appear in the input
+      fp: file-like object to write the merged records to
+      key: key name or function used to sort the runs
+
+    """
+    key = _get_key(key)
+    iterators = [_run_records(run,i,key) for i,run in enumerate(runs)]
+    for record in heapq.merge(*iterators):
+        fp.write(record[2])
+
+def _run_records(run,number,key):
+    """Internal: yield (key,run number,record) for reads in a run
+
+    Including the run number means that records with the same
+    key are merged in input order, and the records themselves
+    are never compared.
+
+    """
+    partial = ''
+    with bgzf.BgzfReader(run,threads=1) as fp:
+        while True:
+            data = fp.read(RUN_READ_SIZE)
+            if not data:
+                break
+            # Run files hold well-formed records of exactly four
+            # lines, so split into lines and keep any incomplete
+            # record for the next block
+            lines = (partial + data).split('\n')
+            nlines = len(lines) - 1
+            nlines -= nlines%4
+            partial = '\n'.join(lines[nlines:])
+            for i in xrange(0,nlines,4):
+                yield (key(read_name(lines[i])),number,
+                       '\n'.join(lines[i:i+4])+'\n')
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+#
+#     fswalker.py: fast directory scanning and tree walking
+#     Copyright (C) University of Manchester 2018 Peter Briggs
+#
+########################################################################
+#
+# fswalker.py
+#
+#########################################################################
+
+"""fswalker
+
+Functions for scanning directories and walking directory trees which
+minimise the number of 'stat' system calls that are needed (which can
+be slow on network filesystems such as NFS).
+
+The entries in each directory are returned as 'DirEntry' objects (as
+returned by 'os.scandir' in Python 3.5+) which cache the type
+information for the entry, so for example checking whether an entry
+is a directory or a symbolic link doesn't require another system call
+each time:
+
+- if 'os.scandir' is available then it is used, otherwise the
+  'scandir' module (a backport of 'os.scandir' to earlier Python
+  versions) is used if it's installed; in both cases the type
+  information is usually obtained at no extra cost when the
+  directory is read;
+- otherwise a fallback implementation is used which calls 'lstat'
+  once for each entry (plus 'stat' for symbolic links).
+
+The 'walk' function can optionally scan directories in parallel using
+a pool of threads, which can greatly speed up scans of large directory
+trees on network filesystems (since the time is dominated by waiting
+for the filesystem rather than by Python code).
+
+Functions:
+
+- scandir: return the entries in a directory
+- walk: walk a directory tree, returning the entries in each
+  directory
+
+Example listing the files in a directory tree using 8 threads:
+
+>>> for dirpath,dirs,files in walk('/data/run',threads=8):
+...     for f in files:
+...         print f.path
+
+"""
+
+#######################################################################
+# Imports
+#######################################################################
+
+import os
+import stat
+from multiprocessing.pool import ThreadPool
+try:
+    # Python 3.5+
+    from os import scandir as _scandir
+except ImportError:
+    try:
+        # Backport of os.scandir
+        from scandir import scandir as _scandir
+    except ImportError:
+        # No scandir module: use fallback
+        _scandir = None
+
+#######################################################################
+# Classes
+#######################################################################
+
+class _DirEntry(object):
+    """Internal: fallback implementation of 'os.DirEntry'
+
+    Provides the same attributes and methods as the
+    'DirEntry' objects returned by 'os.scandir', using
+    'lstat' (and 'stat' for symbolic links) to get the type
+    information for the entry. The results are cached, so
+    each system call is made at most once.
+
+    """
+    def __init__(self,dirn,name):
+        self.name = name
+        self.path = os.path.join(dirn,name)
+        self._lstat = None
+        self._stat = None
+
+    def inode(self):
+        return self.stat(follow_symlinks=False).st_ino
+
+    def is_symlink(self):
+        try:
+            return stat.S_ISLNK(self.stat(follow_symlinks=False).st_mode)
+        except OSError:
+            return False
+
+    def is_dir(self,follow_symlinks=True):
+        try:
+            return stat.S_ISDIR(self.stat(follow_symlinks).st_mode)
+        except OSError:
+            return False
+
+    def is_file(self,follow_symlinks=True):
+        try:
+            return stat.S_ISREG(self.stat(follow_symlinks).st_mode)
+        except OSError:
+            return False
+
+    def stat(self,follow_symlinks=True):
+        if self._lstat is None:
+            self._lstat = os.lstat(self.path)
+        if not follow_symlinks or not stat.S_ISLNK(self._lstat.st_mode):
+            return self._lstat
+        if self._stat is None:
+            self._stat = os.stat(self.path)
+        return self._stat
+
+    def __repr__(self):
+        return "<DirEntry '%s'>" % self.name
+
+class _Deferred(object):
+    """Internal: defer a call until its result is needed
+
+    Has the same 'get' method as the results returned by
+    'ThreadPool.apply_async', for sequential operation.
+
+    """
+    def __init__(self,func,*args):
+        self._func = func
+        self._args = args
+
+    def get(self):
+        return self._func(*self._args)
+
+#######################################################################
+# Functions
+#######################################################################
+
+def scandir(dirn):
+    """Return the entries in a directory
+
+    Arguments:
+      dirn: path of the directory to scan
+
+    Returns:
+      List of DirEntry objects (in the same order as they
+      would be returned by 'os.listdir'), each with 'name'
+      and 'path' attributes, and 'is_dir', 'is_file',
+      'is_symlink', 'stat' and 'inode' methods.
+
+    """
+    if _scandir is not None:
+        return list(_scandir(dirn))
+    return [_DirEntry(dirn,name) for name in os.listdir(dirn)]
+
+def walk(top,followlinks=False,threads=None,onerror=None):
+    """Walk a directory tree
+
+    Equivalent to 'os.walk' (top-down), except that the lists of
+    subdirectories and files in each directory are lists of
+    DirEntry objects (see 'scandir') rather than names.
+
+    The subdirectories are those entries which are directories
+    (including symbolic links to directories), and the files are
+    all the other entries (including broken symbolic links).
+
+    Entries can be removed from the list of subdirectories to
+    prevent them being walked (as with 'os.walk').
+
+    If 'threads' is more than one then subdirectories are scanned
+    in parallel ahead of being walked; the results are always
+    yielded in the same order as for sequential operation.
+
+    Arguments:
+      top: top-level directory to start walking from
+      followlinks: (optional) if True then walk into symbolic
+        links to directories (default is not to)
+      threads: (optional) number of threads to use to scan
+        directories in parallel (default is to scan them in
+        turn in the current thread)
+      onerror: (optional) function which is called with the
+        OSError if a directory can't be scanned (by default
+        errors are ignored)
+
+    Yields:
+      Tuples (dirpath,dirs,files) for each directory in the
+      tree.
+
+    """
+    if threads is not None and threads > 1:
+        pool = ThreadPool(threads)
+        submit = lambda dirn: pool.apply_async(_scan_dir,(dirn,))
+    else:
+        pool = None
+        submit = lambda dirn: _Deferred(_scan_dir,dirn)
+    try:
+        stack = [(top,submit(top))]
+        while stack:
+            dirpath,result = stack.pop()
+            try:
+                dirs,files = result.get()
+            except OSError,ex:
+                if onerror is not None:
+                    onerror(ex)
+                continue
+            yield (dirpath,dirs,files)
+            # Queue the subdirectories (in reverse, so that they're
+            # walked in order)
+            subdirs = [(d.path,submit(d.path)) for d in dirs
+                       if followlinks or not d.is_symlink()]
+            stack.extend(subdirs[::-1])
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+def _scan_dir(dirn):
+    """Internal: scan a directory and split into subdirs and files
+
+    Returns:
+      Tuple (dirs,files) with lists of DirEntry objects.
+
+    """
+    dirs = []
+    files = []
+    for entry in scandir(dirn):
+        if entry.is_dir():
+            dirs.append(entry)
+        else:
+            files.append(entry)
+    return (dirs,files)
@@ -0,0 +1,711 @@
+#!/usr/bin/env python
+#
+#     gzindex.py: random access to gzipped files via checkpoint indexes
+#     Copyright (C) University of Manchester 2018 Peter Briggs
+#
+########################################################################
+#
+# gzindex.py
+#
+#########################################################################
+
+"""gzindex
+
+Classes and functions for random access into ordinary gzipped files
+(e.g. '.fastq.gz'), using an index of decompressor "checkpoints".
+
+The approach is based on the 'zran.c' example from the zlib
+distribution: the file is decompressed once, and at intervals of
+(approximately) 'span' bytes of uncompressed data the state needed
+to restart decompression is recorded, i.e. the offset of a deflate
+block boundary in the compressed data (to the bit), the preceeding
+32Kb of uncompressed data (the "window"), and the number of lines
+that precede that point. Reading can then start from the nearest
+checkpoint before the data of interest rather than from the start
+of the file.
+
+Multi-member gzip files (e.g. produced by concatenating gzipped
+files, or BGZF files) are also handled.
+
+The Python 'zlib' module doesn't expose the parts of the zlib API
+that are needed for this, so the zlib shared library is accessed
+directly via 'ctypes'. If it can't be loaded then a GzipIndexError
+is raised when trying to build or use an index.
+
+Classes:
+
+- GzipIndex: checkpoint index for a gzipped file
+- Checkpoint: single decompressor checkpoint in an index
+- GzipIndexError: exception raised for errors building or
+  using an index
+
+Functions:
+
+- get_index: fetch the index for a file, building it if necessary
+- cached_index: fetch the existing index for a file (if any)
+- build_index: build a new index for a file
+- index_file: return the location of the cached index for a file
+- read_lines: fetch a block of lines starting from a checkpoint
+
+Example usage:
+
+>>> idx = get_index('reads.fastq.gz')
+>>> print "%d lines" % idx.nlines
+>>> for line in idx.getlines(4000000):
+>>> ... print line
+
+Indexes are stored next to the gzipped file (with the extension
+'.gzidx' appended), or in the user's cache directory if that's not
+possible, and are rebuilt automatically if the size or modification
+time of the gzipped file changes.
+
+"""
+
+#######################################################################
+# Imports
+#######################################################################
+
+import os
+import zlib
+import struct
+import hashlib
+import logging
+import ctypes
+import ctypes.util
+from collections import namedtuple
+
+#######################################################################
+# Module constants
+#######################################################################
+
+# Default spacing between checkpoints (bytes of uncompressed data)
+SPAN = 4*1024*1024
+
+# Size of the deflate window
+WINSIZE = 32768
+
+# Size of reads from the compressed file
+CHUNKSIZE = 16384
+
+# Size of the buffer for decompressed data when reading
+OUTSIZE = 256*1024
+
+# Extension used for index files
+INDEX_EXT = ".gzidx"
+
+# Magic string identifying index files
+INDEX_MAGIC = "BCFGZIX1"
+
+# zlib constants
+Z_NO_FLUSH = 0
+Z_BLOCK = 5
+Z_OK = 0
+Z_STREAM_END = 1
+Z_NEED_DICT = 2
+Z_BUF_ERROR = -5
+
+#######################################################################
+# Classes
+#######################################################################
+
+class GzipIndexError(Exception):
+    """Base class for errors building or using gzip indexes
+    """
+
+class Checkpoint(namedtuple('Checkpoint',('in_offset','bits','out_offset',
+                                           'nlines','window'))):
+    """Decompressor checkpoint
+
+    Fields are:
+
+    - in_offset: offset of the first complete byte of the deflate
+      block in the compressed file
+    - bits: number of bits of the block in the preceeding byte
+    - out_offset: offset of the block in the uncompressed data
+    - nlines: number of newlines in the uncompressed data before
+      the block
+    - window: up to 32Kb of uncompressed data preceeding the block
+
+    """
+    __slots__ = ()
+
+class GzipIndex(object):
+    """Checkpoint index for a gzipped file
+
+    Provides the following properties:
+
+    - filen: path of the indexed gzipped file
+    - size: size of the gzipped file when it was indexed
+    - mtime: modification time of the gzipped file when it
+      was indexed
+    - span: requested spacing between checkpoints
+    - usize: total size of the uncompressed data
+    - nlines: total number of lines in the uncompressed data
+    - checkpoints: list of Checkpoint instances, in order
+
+    Use the 'getlines' method to read lines from an arbitrary
+    position in the file.
+
+    """
+    def __init__(self,filen,size,mtime,span,usize,nlines,checkpoints):
+        """Create a new GzipIndex instance
+
+        Normally instances are created using the 'build_index',
+        'get_index' or 'GzipIndex.load' functions, rather than
+        directly.
+
+        """
+        self.filen = filen
+        self.size = size
+        self.mtime = mtime
+        self.span = span
+        self.usize = usize
+        self.nlines = nlines
+        self.checkpoints = checkpoints
+
+    def is_current(self):
+        """Check if the index is up to date with the gzipped file
+
+        Returns:
+          True if the size and modification time of the file
+          match those recorded in the index, False if not.
+
+        """
+        try:
+            st = os.stat(self.filen)
+        except OSError:
+            return False
+        return (st.st_size == self.size and st.st_mtime == self.mtime)
+
+    def checkpoint_for_line(self,line):
+        """Return the nearest checkpoint before the start of a line
+
+        Arguments:
+          line: line number (starting from zero)
+
+        Returns:
+          Checkpoint instance for the last checkpoint in the
+          index which is located before the start of the line,
+          or None if there is no such checkpoint (i.e. reading
+          should start from the beginning of the file).
+
+        """
+        # Binary search for the last checkpoint with fewer
+        # preceeding newlines than the line number
+        lo = 0
+        hi = len(self.checkpoints)
+        while lo < hi:
+            mid = (lo+hi)//2
+            if self.checkpoints[mid].nlines < line:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == 0:
+            return None
+        return self.checkpoints[lo-1]
+
+    def read_from(self,checkpoint=None):
+        """Iterate over chunks of uncompressed data from a checkpoint
+
+        Arguments:
+          checkpoint: Checkpoint to start decompressing from
+            (or None to start from the beginning of the file)
+
+        Yields:
+          String: next chunk of uncompressed data.
+
+        """
+        with open(self.filen,'rb') as fp:
+            for data in _inflate_from(fp,checkpoint):
+                yield data
+
+    def getlines(self,start=0):
+        """Fetch lines one by one starting from an arbitrary line
+
+        Decompression starts from the nearest checkpoint before
+        the requested line. As with 'utils.getlines', newline
+        characters are removed from the returned lines.
+
+        Arguments:
+          start: line number of the first line to return
+            (starting from zero)
+
+        Yields:
+          String: next line of text from the file, with any
+            newline character removed.
+
+        """
+        checkpoint = self.checkpoint_for_line(start)
+        if checkpoint is None:
+            skip = start
+        else:
+            skip = start - checkpoint.nlines
+        buf = ''
+        for data in self.read_from(checkpoint):
+            if buf:
+                data = buf + data
+                buf = ''
+            pos = 0
+            # Skip lines before the start
+            while skip:
+                i = data.find('\n',pos)
+                if i == -1:
+                    break
+                pos = i + 1
+                skip -= 1
+            if skip:
+                continue
+            i = data.rfind('\n')
+            if i < pos:
+                buf = data[pos:]
+                continue
+            for line in data[pos:i].split('\n'):
+                yield line
+            buf = data[i+1:]
+        if buf and not skip:
+            yield buf
+
+    def save(self,index_file):
+        """Write the index to a file
+
+        Arguments:
+          index_file: path of the file to write the index to
+
+        """
+        tmp_file = "%s.%d.tmp" % (index_file,os.getpid())
+        with open(tmp_file,'wb') as fp:
+            fp.write(struct.pack("<8sQdQQQQ",
+                                 INDEX_MAGIC,
+                                 self.size,
+                                 self.mtime,
+                                 self.span,
+                                 self.usize,
+                                 self.nlines,
+                                 len(self.checkpoints)))
+            for pt in self.checkpoints:
+                window = zlib.compress(pt.window)
+                fp.write(struct.pack("<QBQQI",
+                                     pt.in_offset,
+                                     pt.bits,
+                                     pt.out_offset,
+                                     pt.nlines,
+                                     len(window)))
+                fp.write(window)
+        os.rename(tmp_file,index_file)
+
+    @classmethod
+    def load(cls,filen,index_file):
+        """Read an index from a file
+
+        Arguments:
+          filen: path of the gzipped file that was indexed
+          index_file: path of the file to read the index from
+
+        Returns:
+          GzipIndex instance.
+
+        """
+        header_size = struct.calcsize("<8sQdQQQQ")
+        point_size = struct.calcsize("<QBQQI")
+        try:
+            with open(index_file,'rb') as fp:
+                magic,size,mtime,span,usize,nlines,npoints = \
+                    struct.unpack("<8sQdQQQQ",fp.read(header_size))
+                if magic != INDEX_MAGIC:
+                    raise GzipIndexError("%s: not a gzip index file" %
+                                         index_file)
+                checkpoints = []
+                for i in xrange(npoints):
+                    in_offset,bits,out_offset,nlines_,nwindow = \
+                        struct.unpack("<QBQQI",fp.read(point_size))
+                    window = zlib.decompress(fp.read(nwindow))
+                    checkpoints.append(Checkpoint(in_offset,bits,
+                                                  out_offset,nlines_,
+                                                  window))
+        except (struct.error,zlib.error),ex:
+            raise GzipIndexError("%s: bad gzip index file: %s" %
+                                 (index_file,ex))
+        return cls(filen,size,mtime,span,usize,nlines,checkpoints)
+
+#######################################################################
+# Functions
+#######################################################################
+
+def index_file(filen,cache_dir=None):
+    """Return the location of the index file for a gzipped file
+
+    The index is located next to the gzipped file if the directory
+    is writable (or an index already exists there); otherwise it
+    is located in the cache directory.
+
+    Arguments:
+      filen: path of the gzipped file
+      cache_dir: (optional) directory to use for indexes which
+        can't be stored next to the gzipped file (defaults to
+        '$BCFTBX_CACHE_DIR' if set, or '~/.cache/bcftbx')
+
+    Returns:
+      Path of the index file.
+
+    """
+    filen = os.path.abspath(filen)
+    sidecar = filen + INDEX_EXT
+    if os.path.exists(sidecar) or \
+       os.access(os.path.dirname(filen),os.W_OK):
+        return sidecar
+    if cache_dir is None:
+        cache_dir = os.environ.get('BCFTBX_CACHE_DIR',
+                                   os.path.join(os.path.expanduser('~'),
+                                                '.cache','bcftbx'))
+    return os.path.join(cache_dir,
+                        "%s%s" % (hashlib.md5(filen).hexdigest(),INDEX_EXT))
+
+def cached_index(filen,cache_dir=None):
+    """Return the existing checkpoint index for a gzipped file
+
+    Arguments:
+      filen: path of the gzipped file
+      cache_dir: (optional) directory to use for indexes which
+        can't be stored next to the gzipped file
+
+    Returns:
+      GzipIndex instance, or None if there is no existing index
+      or it's out of date.
+
+    """
+    idx_file = index_file(filen,cache_dir=cache_dir)
+    if not os.path.exists(idx_file):
+        return None
+    try:
+        idx = GzipIndex.load(filen,idx_file)
+    except (GzipIndexError,IOError),ex:
+        logging.debug("%s: ignoring index: %s" % (filen,ex))
+        return None
+    if not idx.is_current():
+        logging.debug("%s: index is out of date" % filen)
+        return None
+    return idx
+
+def get_index(filen,span=SPAN,cache_dir=None):
+    """Return the checkpoint index for a gzipped file
+
+    If there is an existing index for the file which is up to
+    date then this is loaded; otherwise a new index is built
+    and saved for subsequent use (failure to save the index is
+    not an error).
+
+    Arguments:
+      filen: path of the gzipped file
+      span: (optional) spacing between checkpoints to use if
+        a new index is built
+      cache_dir: (optional) directory to use for indexes which
+        can't be stored next to the gzipped file
+
+    Returns:
+      GzipIndex instance.
+
+    """
+    idx = cached_index(filen,cache_dir=cache_dir)
+    if idx is not None:
+        return idx
+    idx_file = index_file(filen,cache_dir=cache_dir)
+    idx = build_index(filen,span=span)
+    try:
+        dirn = os.path.dirname(idx_file)
+        if not os.path.isdir(dirn):
+            os.makedirs(dirn)
+        idx.save(idx_file)
+    except (IOError,OSError),ex:
+        logging.warning("%s: unable to save index: %s" % (filen,ex))
+    return idx
+
+def build_index(filen,span=SPAN):
+    """Build a checkpoint index for a gzipped file
+
+    The file is decompressed once from start to finish, with a
+    checkpoint recorded at the first deflate block boundary
+    after every 'span' bytes of uncompressed data.
+
+    Arguments:
+      filen: path of the gzipped file
+      span: (optional) spacing between checkpoints (bytes of
+        uncompressed data)
+
+    Returns:
+      GzipIndex instance.
+
+    """
+    zlib_ = _libz()
+    st = os.stat(filen)
+    checkpoints = []
+    strm = _ZStream()
+    inbuf = ctypes.create_string_buffer(CHUNKSIZE)
+    window = ctypes.create_string_buffer(WINSIZE)
+    window_addr = ctypes.addressof(window)
+    totin = totout = 0
+    last = 0
+    nlines = 0
+    last_char = ''
+    _inflate_init(zlib_,strm,31)
+    ret = Z_OK
+    try:
+        with open(filen,'rb') as fp:
+            while True:
+                if strm.avail_in == 0:
+                    data = fp.read(CHUNKSIZE)
+                    if not data:
+                        if ret == Z_STREAM_END:
+                            break
+                        raise GzipIndexError("%s: unexpected end of file" %
+                                             filen)
+                    ctypes.memmove(inbuf,data,len(data))
+                    strm.next_in = ctypes.addressof(inbuf)
+                    strm.avail_in = len(data)
+                if ret == Z_STREAM_END:
+                    # Check for another gzip member
+                    if ctypes.string_at(strm.next_in,1) != '\x1f':
+                        # Ignore trailing garbage
+                        break
+                    zlib_.inflateReset(ctypes.byref(strm))
+                while True:
+                    if strm.avail_out == 0:
+                        strm.avail_out = WINSIZE
+                        strm.next_out = window_addr
+                    avail_in = strm.avail_in
+                    avail_out = strm.avail_out
+                    ret = zlib_.inflate(ctypes.byref(strm),Z_BLOCK)
+                    if ret == Z_BUF_ERROR:
+                        # Need more input
+                        break
+                    if ret == Z_NEED_DICT or ret < 0:
+                        raise GzipIndexError("%s: error decompressing data "
+                                             "(%d)" % (filen,ret))
+                    totin += avail_in - strm.avail_in
+                    nout = avail_out - strm.avail_out
+                    if nout:
+                        data = ctypes.string_at(window_addr +
+                                                (WINSIZE - avail_out),nout)
+                        nlines += data.count('\n')
+                        last_char = data[-1]
+                        totout += nout
+                    if ret == Z_STREAM_END:
+                        break
+                    if (strm.data_type & 128) and \
+                       not (strm.data_type & 64) and \
+                       (totout == 0 or totout - last > span):
+                        # At a block boundary: add a checkpoint
+                        left = WINSIZE - strm.avail_out
+                        wdata = ctypes.string_at(window_addr,WINSIZE)
+                        wdata = wdata[left:] + wdata[:left]
+                        wdata = wdata[WINSIZE-min(totout,WINSIZE):]
+                        checkpoints.append(Checkpoint(totin,
+                                                      strm.data_type & 7,
+                                                      totout,
+                                                      nlines,
+                                                      wdata))
+                        last = totout
+                    if strm.avail_in == 0 and strm.avail_out != 0:
+                        break
+    finally:
+        zlib_.inflateEnd(ctypes.byref(strm))
+    if last_char and last_char != '\n':
+        # Final line has no newline
+        nlines += 1
+    return GzipIndex(filen,st.st_size,st.st_mtime,span,totout,nlines,
+                     checkpoints)
+
+def read_lines(filen,checkpoint,skip,nlines):
+    """Fetch a block of lines starting from a checkpoint
+
+    Arguments:
+      filen: path of the gzipped file
+      checkpoint: Checkpoint to start decompressing from (or
+        None to start from the beginning of the file)
+      skip: number of lines to skip after the checkpoint
+      nlines: number of lines to return
+
+    Returns:
+      String with the requested lines (each ending with a
+      newline).
+
+    """
+    parts = []
+    with open(filen,'rb') as fp:
+        for data in _inflate_from(fp,checkpoint):
+            pos = 0
+            if skip:
+                n = data.count('\n')
+                if n < skip:
+                    skip -= n
+                    continue
+                pos = _find_nth_newline(data,skip) + 1
+                skip = 0
+            n = data.count('\n',pos)
+            if n < nlines:
+                parts.append(data[pos:])
+                nlines -= n
+                continue
+            parts.append(data[pos:_find_nth_newline(data,nlines,pos)+1])
+            nlines = 0
+            break
+    text = ''.join(parts)
+    if nlines and text and not text.endswith('\n'):
+        # Final line has no newline
+        text += '\n'
+    return text
+
+def _find_nth_newline(data,n,pos=0):
+    """Internal: return the position of the n'th newline from pos
+    """
+    i = pos - 1
+    for j in xrange(n):
+        i = data.find('\n',i+1)
+    return i
+
+def _inflate_from(fp,checkpoint=None):
+    """Internal: decompress data starting from a checkpoint
+
+    Arguments:
+      fp: file object for the gzipped file
+      checkpoint: Checkpoint to start from, or None to start
+        at the beginning of the file
+
+    Yields:
+      String: next chunk of uncompressed data.
+
+    """
+    zlib_ = _libz()
+    strm = _ZStream()
+    inbuf = ctypes.create_string_buffer(CHUNKSIZE)
+    outbuf = ctypes.create_string_buffer(OUTSIZE)
+    outbuf_addr = ctypes.addressof(outbuf)
+    if checkpoint is None:
+        # Start of file including the gzip header
+        raw = False
+        _inflate_init(zlib_,strm,31)
+    else:
+        # Start of a deflate block within a member
+        raw = True
+        _inflate_init(zlib_,strm,-15)
+        if checkpoint.bits:
+            fp.seek(checkpoint.in_offset-1)
+            c = ord(fp.read(1))
+            zlib_.inflatePrime(ctypes.byref(strm),checkpoint.bits,
+                               c >> (8 - checkpoint.bits))
+        else:
+            fp.seek(checkpoint.in_offset)
+        if checkpoint.window:
+            zlib_.inflateSetDictionary(ctypes.byref(strm),
+                                       checkpoint.window,
+                                       len(checkpoint.window))
+    ret = Z_OK
+    skip = 0
+    try:
+        while True:
+            if strm.avail_in == 0:
+                data = fp.read(CHUNKSIZE)
+                if not data:
+                    if ret == Z_STREAM_END:
+                        return
+                    raise GzipIndexError("%s: unexpected end of file" %
+                                         fp.name)
+                ctypes.memmove(inbuf,data,len(data))
+                strm.next_in = ctypes.addressof(inbuf)
+                strm.avail_in = len(data)
+            if ret == Z_STREAM_END:
+                if skip:
+                    # Skip the trailer of a member started in raw mode
+                    n = min(skip,strm.avail_in)
+                    strm.next_in += n
+                    strm.avail_in -= n
+                    skip -= n
+                    continue
+                # Check for another gzip member
+                if ctypes.string_at(strm.next_in,1) != '\x1f':
+                    return
+                if raw:
+                    zlib_.inflateEnd(ctypes.byref(strm))
+                    avail_in = strm.avail_in
+                    next_in = strm.next_in
+                    _inflate_init(zlib_,strm,31)
+                    strm.next_in = next_in
+                    strm.avail_in = avail_in
+                    raw = False
+                else:
+                    zlib_.inflateReset(ctypes.byref(strm))
+                ret = Z_OK
+            while True:
+                strm.next_out = outbuf_addr
+                strm.avail_out = OUTSIZE
+                ret = zlib_.inflate(ctypes.byref(strm),Z_NO_FLUSH)
+                if ret == Z_NEED_DICT or (ret < 0 and ret != Z_BUF_ERROR):
+                    raise GzipIndexError("%s: error decompressing data "
+                                         "(%d)" % (fp.name,ret))
+                nout = OUTSIZE - strm.avail_out
+                if nout:
+                    yield ctypes.string_at(outbuf_addr,nout)
+                if ret == Z_STREAM_END:
+                    if raw:
+                        skip = 8
+                    break
+                if ret == Z_BUF_ERROR or \
+                   (strm.avail_in == 0 and strm.avail_out != 0):
+                    # Need more input
+                    break
+    finally:
+        zlib_.inflateEnd(ctypes.byref(strm))
+
+class _ZStream(ctypes.Structure):
+    """Internal: ctypes version of the zlib 'z_stream' structure
+    """
+    _fields_ = [("next_in",ctypes.c_void_p),
+                ("avail_in",ctypes.c_uint),
+                ("total_in",ctypes.c_ulong),
+                ("next_out",ctypes.c_void_p),
+                ("avail_out",ctypes.c_uint),
+                ("total_out",ctypes.c_ulong),
+                ("msg",ctypes.c_char_p),
+                ("state",ctypes.c_void_p),
+                ("zalloc",ctypes.c_void_p),
+                ("zfree",ctypes.c_void_p),
+                ("opaque",ctypes.c_void_p),
+                ("data_type",ctypes.c_int),
+                ("adler",ctypes.c_ulong),
+                ("reserved",ctypes.c_ulong)]
+
+_LIBZ = None
+
+def _libz():
+    """Internal: load and return the zlib shared library
+    """
+    global _LIBZ
+    if _LIBZ is None:
+        libz = ctypes.util.find_library('z')
+        if libz is None:
+            raise GzipIndexError("Unable to locate zlib shared library")
+        try:
+            lib = ctypes.CDLL(libz)
+            zstream_p = ctypes.POINTER(_ZStream)
+            lib.zlibVersion.restype = ctypes.c_char_p
+            lib.zlibVersion.argtypes = []
+            lib.inflateInit2_.argtypes = [zstream_p,ctypes.c_int,
+                                          ctypes.c_char_p,ctypes.c_int]
+            lib.inflate.argtypes = [zstream_p,ctypes.c_int]
+            lib.inflateEnd.argtypes = [zstream_p]
+            lib.inflateReset.argtypes = [zstream_p]
+            lib.inflatePrime.argtypes = [zstream_p,ctypes.c_int,ctypes.c_int]
+            lib.inflateSetDictionary.argtypes = [zstream_p,ctypes.c_char_p,
+                                                 ctypes.c_uint]
+        except (OSError,AttributeError),ex:
+            raise GzipIndexError("Unable to load zlib shared library: %s" %
+                                 ex)
+        _LIBZ = lib
+    return _LIBZ
+
+def _inflate_init(lib,strm,wbits):
+    """Internal: initialise a z_stream for decompression
+    """
+    ret = lib.inflateInit2_(ctypes.byref(strm),wbits,lib.zlibVersion(),
+                            ctypes.sizeof(_ZStream))
+    if ret != Z_OK:
+        raise GzipIndexError("Failed to initialise zlib stream (%d)" % ret)
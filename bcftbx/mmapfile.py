@@ -0,0 +1,349 @@
+#!/usr/bin/env python
+#
+#     mmapfile.py: read uncompressed files via memory mapping
+#     Copyright (C) University of Manchester 2018 Peter Briggs
+#
+########################################################################
+#
+# mmapfile.py
+#
+#########################################################################
+
+"""mmapfile
+
+Classes and functions for reading uncompressed sequence files (e.g.
+Fastq, csfasta and qual) via memory mapping, rather than by copying
+the data into buffers with 'read' calls.
+
+The file is mapped in a series of fixed-size windows, so only a
+bounded amount of address space is used at any time and files larger
+than the available memory can be processed. The kernel is told that
+the data will be read sequentially (where the platform supports this)
+so it can read ahead aggressively.
+
+Classes:
+
+- MappedFile: read-only file-like object backed by memory mapped
+  windows onto a file
+
+Functions:
+
+- open_mapped: open a file for reading via memory mapping, falling
+  back to an ordinary file object if the file can't be mapped
+
+"""
+
+#######################################################################
+# Imports
+#######################################################################
+
+import os
+import mmap
+import ctypes
+import ctypes.util
+import logging
+
+#######################################################################
+# Module constants
+#######################################################################
+
+# Size of the mapped window onto the file
+# (must be a multiple of mmap.ALLOCATIONGRANULARITY)
+WINDOW_SIZE = 64*1024*1024
+
+# Size of blocks returned when iterating over a file
+BLOCK_SIZE = 102400
+
+# Sequential access hint for posix_fadvise (Linux value)
+POSIX_FADV_SEQUENTIAL = 2
+
+#######################################################################
+# Classes
+#######################################################################
+
+class MappedFile(object):
+    """
+    Read-only file-like object using memory mapped windows
+
+    Data is returned as slices of the mapped window, so the
+    file contents are only copied once (when the returned
+    string is created), and no read calls are made after the
+    file has been opened.
+
+    Example splitting a file into lines:
+
+    >>> with MappedFile('illumina_R1.fastq') as fp:
+    >>> ... for line in fp:
+    >>> ...    print line
+
+    The object supports 'read', 'readinto', 'readline',
+    'seek', 'tell' and 'close' methods, iteration over
+    lines, and the context manager protocol. The 'blocks'
+    method yields the contents in large blocks ending on
+    line boundaries, which is the fastest way to process
+    the file as lines.
+    """
+    def __init__(self,filen,window_size=WINDOW_SIZE):
+        """
+        Create a new MappedFile instance
+
+        Arguments:
+          filen (str): path of the file to map
+          window_size (int): optional, size of the window
+            onto the file in bytes (will be rounded up to a
+            multiple of mmap.ALLOCATIONGRANULARITY)
+        """
+        self.name = filen
+        self.mode = 'rb'
+        granularity = mmap.ALLOCATIONGRANULARITY
+        self._window_size = max(1,(int(window_size)+granularity-1)
+                                //granularity)*granularity
+        self._fd = os.open(filen,os.O_RDONLY)
+        self._size = os.fstat(self._fd).st_size
+        self._mmap = None
+        self._offset = 0
+        self._pos = 0
+        self.closed = False
+        _fadvise_sequential(self._fd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        """
+        Return the next line (including the newline)
+        """
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    def _map(self,pos):
+        """
+        Internal: map the window containing the position
+
+        Arguments:
+          pos (int): offset in the file
+
+        Returns:
+          Tuple: the mapping and the offset of the start of
+            the window in the file, or (None,pos) if the
+            position is at or beyond the end of the file.
+        """
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        if pos >= self._size:
+            return (None,pos)
+        if self._mmap is not None:
+            if self._offset <= pos < self._offset + len(self._mmap):
+                return (self._mmap,self._offset)
+            self._mmap.close()
+            self._mmap = None
+        offset = pos - pos%self._window_size
+        length = min(self._window_size,self._size - offset)
+        self._mmap = mmap.mmap(self._fd,length,access=mmap.ACCESS_READ,
+                               offset=offset)
+        self._offset = offset
+        return (self._mmap,offset)
+
+    def read(self,size=-1):
+        """
+        Read data from the file
+
+        Arguments:
+          size (int): optional, maximum number of bytes to
+            return (default is to read to the end of the file)
+
+        Returns:
+          String: the data (empty string at end of file).
+        """
+        if size is None or size < 0:
+            size = self._size - self._pos
+        data = []
+        while size > 0:
+            m,offset = self._map(self._pos)
+            if m is None:
+                break
+            start = self._pos - offset
+            chunk = m[start:start+size]
+            data.append(chunk)
+            self._pos += len(chunk)
+            size -= len(chunk)
+        if len(data) == 1:
+            return data[0]
+        return ''.join(data)
+
+    def readinto(self,b):
+        """
+        Read data into a pre-allocated writable buffer
+
+        Arguments:
+          b (bytearray): buffer to read data into
+
+        Returns:
+          Integer: number of bytes read (zero at end of file).
+        """
+        data = self.read(len(b))
+        n = len(data)
+        b[:n] = data
+        return n
+
+    def readline(self):
+        """
+        Read a line from the file
+
+        Returns:
+          String: the next line including the newline (empty
+            string at end of file).
+        """
+        line = []
+        while True:
+            m,offset = self._map(self._pos)
+            if m is None:
+                break
+            start = self._pos - offset
+            end = m.find('\n',start)
+            if end < 0:
+                end = len(m)
+            else:
+                end += 1
+            line.append(m[start:end])
+            self._pos += end - start
+            if line[-1].endswith('\n'):
+                break
+        return ''.join(line)
+
+    def blocks(self,size=BLOCK_SIZE):
+        """
+        Yield the remaining contents of the file in blocks
+
+        Each block ends with a newline (except possibly the
+        final block, if the file doesn't end with a newline),
+        so lines are never split between blocks. A block is
+        longer than 'size' if it would otherwise not contain
+        a complete line.
+
+        Arguments:
+          size (int): optional, approximate size of each block
+            in bytes
+
+        Yields:
+          String: next block of data from the file.
+        """
+        buf = ''
+        while True:
+            data = self.read(size)
+            if not data:
+                break
+            i = data.rfind('\n')
+            if i < 0:
+                buf += data
+                continue
+            if buf:
+                yield buf + data[:i+1]
+            else:
+                yield data[:i+1]
+            buf = data[i+1:]
+        if buf:
+            yield buf
+
+    def seek(self,offset,whence=os.SEEK_SET):
+        """
+        Move to a new position in the file
+
+        Arguments:
+          offset (int): offset to move to
+          whence (int): optional, interpret offset relative to
+            the start of the file (os.SEEK_SET, the default),
+            the current position (os.SEEK_CUR) or the end of the
+            file (os.SEEK_END)
+        """
+        if whence == os.SEEK_CUR:
+            offset += self._pos
+        elif whence == os.SEEK_END:
+            offset += self._size
+        if offset < 0:
+            raise IOError("Invalid offset: %s" % offset)
+        self._pos = offset
+
+    def tell(self):
+        """
+        Return the current position in the file
+        """
+        return self._pos
+
+    def close(self):
+        """
+        Release the mapping and close the file
+        """
+        if getattr(self,'closed',True):
+            return
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        os.close(self._fd)
+        self.closed = True
+
+#######################################################################
+# Functions
+#######################################################################
+
+def open_mapped(filen,window_size=WINDOW_SIZE):
+    """
+    Open an uncompressed file for reading via memory mapping
+
+    Falls back to returning an ordinary file object if the
+    file can't be memory mapped (for example if it's empty,
+    or is a pipe or other special file).
+
+    Arguments:
+      filen (str): path of the file to open
+      window_size (int): optional, size of the window onto
+        the file in bytes
+
+    Returns:
+      File-like object opened for reading.
+    """
+    try:
+        if os.path.isfile(filen) and os.path.getsize(filen) > 0:
+            return MappedFile(filen,window_size=window_size)
+    except (EnvironmentError,ValueError) as ex:
+        logging.debug("%s: not using mmap: %s" % (filen,ex))
+    return open(filen,'rb')
+
+def _fadvise_sequential(fd):
+    """
+    Internal: tell the kernel the file will be read sequentially
+
+    Uses 'posix_fadvise' from the C library via ctypes
+    (neither 'os.posix_fadvise' nor 'mmap.madvise' are
+    available in Python 2); does nothing if the call is
+    unavailable or fails.
+
+    Arguments:
+      fd (int): file descriptor
+    """
+    global _posix_fadvise
+    if _posix_fadvise is None:
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'),use_errno=True)
+            _posix_fadvise = libc.posix_fadvise
+            _posix_fadvise.restype = ctypes.c_int
+            _posix_fadvise.argtypes = [ctypes.c_int,ctypes.c_long,
+                                       ctypes.c_long,ctypes.c_int]
+        except (OSError,AttributeError,TypeError):
+            _posix_fadvise = False
+    if _posix_fadvise:
+        _posix_fadvise(fd,0,0,POSIX_FADV_SEQUENTIAL)
+
+# Cached C library function used by _fadvise_sequential
+_posix_fadvise = None
@@ -19,6 +19,12 @@ Extracting reads from Fastq, cfasta and qual files:
 - getreads: fetch reads one-by-one from Fastq, cfasta or qual file
 - getreads_subset: fetch subset of reads specified by index
 - getreads_regexp: fetch subset of reads matching regular expression
+- getreads_sample: fetch random sample of reads in a single pass
+- count_reads: count the reads in Fastq, csfasta or qual file
+
+For gzipped files, 'getreads_subset' and 'count_reads' use a
+checkpoint index (see the 'gzindex' module) to avoid decompressing
+the whole file, which is built on first use.
 
 """
 
@@ -28,7 +34,12 @@ Extracting reads from Fastq, cfasta and qual files:
 
 import os
 import re
+import math
+import random
+import logging
+import itertools
 from .utils import getlines
+from . import gzindex
 
 #######################################################################
 # Functions
@@ -65,14 +76,7 @@ def getreads(filen):
       List: next read record from the file, as a list
         of lines.
     """
-    fields = os.path.basename(filen).split('.')
-    if fields[-1] == 'gz':
-        fields = fields[:-1]
-    ext = fields[-1]
-    if ext in ('fastq','fq'):
-        read_size = 4
-    elif ext in ('csfasta','qual'):
-        read_size = 2
+    read_size = _read_size(filen)
     header = True
     read = []
     for i,line in enumerate(getlines(filen),start=1):
@@ -124,6 +128,11 @@ def getreads_subset(filen,indices):
     indices_.sort()
     if indices_[0] < 0:
         raise Exception("One or more requested read indices out of range")
+    index = _get_index(filen)
+    if index is not None:
+        for read in _getreads_subset_indexed(filen,index,indices_):
+            yield read
+        return
     i = 0
     next_idx = indices_[i]
     for idx,read in enumerate(getreads(filen)):
@@ -139,6 +148,100 @@ def getreads_subset(filen,indices):
                 return
     raise Exception("One or more requested read indices out of range")
 
+def getreads_sample(filens,n=None,fraction=None,seed=None):
+    """
+    Fetch random sample of reads from Fastq, csfasta or qual files
+
+    This generator function reads through one or more
+    sequence files (Fastq, csfasta or qual) in lock-step in
+    a single pass, and yields a random sample of the read
+    records. The same records are selected from each file
+    (e.g. so that the sample from an R1/R2 pair is also
+    paired).
+
+    The sample is either a fixed number of reads (specified
+    via 'n'), in which case reservoir sampling is used so
+    only the sampled reads are held in memory and they are
+    returned once all the files have been read; or a fraction
+    of the reads (specified via 'fraction'), in which case
+    each read is selected independently with that probability
+    and returned as it's found (so the size of the sample is
+    only approximately the requested fraction).
+
+    In both cases the sampled reads are returned in the same
+    order as they appear in the files. Using the same 'seed'
+    produces the same sample.
+
+    The files can be gzipped; this function should handle
+    this invisibly provided that the file extension is
+    '.gz'.
+
+    Example usage (sample 1000 read pairs):
+
+    >>> for r1,r2 in getreads_sample(('R1.fq','R2.fq'),n=1000):
+    >>> ... print r1,r2
+
+    Arguments:
+      filens (list): paths of the files to fetch reads from
+      n (int): number of reads to sample
+      fraction (float): fraction of reads to sample (between
+        0 and 1; alternative to 'n')
+      seed: (optional) seed for the random number generator
+
+    Yields:
+      Tuple: next sampled read record from each file, with
+        each record as a list of lines.
+    """
+    if (n is None) == (fraction is None):
+        raise Exception("Specify one of number or fraction of reads "
+                        "to sample")
+    rng = random.Random(seed)
+    reads = _getreads_lockstep(filens)
+    if fraction is not None:
+        # Bernoulli sampling
+        for read in reads:
+            if rng.random() < fraction:
+                yield read
+        return
+    # Reservoir sampling (Algorithm L)
+    n = int(n)
+    if n < 1:
+        return
+    reservoir = [(i,read) for i,read in
+                 enumerate(itertools.islice(reads,n))]
+    if len(reservoir) < n:
+        raise Exception("Requested sample (%d) is larger than file (%d)"
+                        % (n,len(reservoir)))
+    w = math.exp(math.log(1.0-rng.random())/n)
+    next_idx = n + int(math.log(1.0-rng.random())/math.log(1.0-w))
+    for i,read in enumerate(reads,start=n):
+        if i == next_idx:
+            reservoir[rng.randrange(n)] = (i,read)
+            w *= math.exp(math.log(1.0-rng.random())/n)
+            next_idx += int(math.log(1.0-rng.random())/math.log(1.0-w)) + 1
+    reservoir.sort()
+    for i,read in reservoir:
+        yield read
+
+def count_reads(filen):
+    """
+    Count the reads in a Fastq, csfasta or qual file
+
+    The file can be gzipped; this function should handle
+    this invisibly provided that the file extension is
+    '.gz'.
+
+    Arguments:
+      filen (str): path of the file to count reads in
+
+    Returns:
+      Integer: number of reads in the file.
+    """
+    index = _get_index(filen)
+    if index is not None:
+        return (index.nlines - _count_header_lines(filen))//_read_size(filen)
+    return sum(1 for r in getreads(filen))
+
 def getreads_regex(filen,pattern):
     """
     Fetch matching reads from  Fastq, csfasta or qual file
@@ -172,3 +275,116 @@ def getreads_regex(filen,pattern):
     for read in getreads(filen):
         if regex.search(''.join(read)):
             yield read
+
+def _getreads_lockstep(filens):
+    """
+    Internal: fetch reads from multiple files in lock-step
+
+    Arguments:
+      filens (list): paths of the files to fetch reads from
+
+    Yields:
+      Tuple: next read record from each file.
+    """
+    missing = object()
+    for reads in itertools.izip_longest(*[getreads(f) for f in filens],
+                                        fillvalue=missing):
+        if missing in reads:
+            raise Exception("Inconsistent numbers of reads between files")
+        yield reads
+
+def _read_size(filen):
+    """
+    Internal: return the number of lines per read for a file
+
+    Arguments:
+      filen (str): path of a Fastq, csfasta or qual file
+
+    Returns:
+      Integer: number of lines in each read record.
+    """
+    fields = os.path.basename(filen).split('.')
+    if fields[-1] == 'gz':
+        fields = fields[:-1]
+    ext = fields[-1]
+    if ext in ('fastq','fq'):
+        return 4
+    elif ext in ('csfasta','qual'):
+        return 2
+
+def _count_header_lines(filen):
+    """
+    Internal: count comment lines at the start of a file
+
+    Arguments:
+      filen (str): path of the file
+
+    Returns:
+      Integer: number of lines starting with '#' before the
+        first line of data.
+    """
+    nheader = 0
+    for line in getlines(filen):
+        if not line.startswith('#'):
+            break
+        nheader += 1
+    return nheader
+
+def _get_index(filen):
+    """
+    Internal: return the checkpoint index for a gzipped file
+
+    Arguments:
+      filen (str): path of the file
+
+    Returns:
+      GzipIndex: index for the file, or None if the file
+        isn't gzipped or can't be indexed.
+    """
+    if not filen.endswith('.gz'):
+        return None
+    try:
+        return gzindex.get_index(filen)
+    except gzindex.GzipIndexError as ex:
+        logging.debug("%s: not using index: %s" % (filen,ex))
+        return None
+
+def _getreads_subset_indexed(filen,index,indices):
+    """
+    Internal: fetch subset of reads using a checkpoint index
+
+    Reads are fetched sequentially while the next requested
+    read is closer than the nearest checkpoint; otherwise
+    decompression restarts from the checkpoint.
+
+    Arguments:
+      filen (str): path of the file to fetch reads from
+      index (GzipIndex): checkpoint index for the file
+      indices (list): sorted list of read indices to return
+
+    Yields:
+      List: next read record from the file, as a list
+        of lines.
+    """
+    read_size = _read_size(filen)
+    nheader = _count_header_lines(filen)
+    lines = None
+    pos = 0
+    for idx in indices:
+        start = nheader + idx*read_size
+        if start + read_size > index.nlines:
+            raise Exception("One or more requested read indices out "
+                            "of range")
+        if lines is not None and start >= pos:
+            checkpoint = index.checkpoint_for_line(start)
+            if checkpoint is not None and checkpoint.nlines > pos:
+                # Faster to restart from the checkpoint
+                lines = None
+        if lines is None or start < pos:
+            lines = index.getlines(start)
+            pos = start
+        while pos < start:
+            lines.next()
+            pos += 1
+        yield [lines.next() for i in xrange(read_size)]
+        pos += read_size
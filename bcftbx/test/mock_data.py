@@ -24,6 +24,8 @@ structures, intended to be used in unit tests.
   classes that can be used to make instant test directory structures of
   varying complexity.
 
+* make_fastq_data generates reproducible random FASTQ data.
+
 
 """
 
@@ -35,6 +37,7 @@ import os
 import tempfile
 import shutil
 import copy
+import random
 import bcftbx.Md5sum
 
 #######################################################################
@@ -260,3 +263,45 @@ class ExampleDirLanguages(BaseExampleDir):
         self.add_link("countries/north_wales","../welsh/north_wales")
         self.add_link("countries/south_wales","../welsh/south_wales")
         self.add_link("countries/iceland","../icelandic")
+
+#######################################################################
+# Functions
+#######################################################################
+
+def make_fastq_data(nreads,seed=12345,lengths=(10,50),bases='ACGTN',
+                    quality='#/<AEFJ',tiles=(1101,),indexes=('CGATGT',)):
+    """
+    Generate reproducible random FASTQ data
+
+    The reads have unique names (the y coordinate is the position
+    of the read in the data), with the tile, x coordinate, index
+    sequence, sequence length, bases and quality values chosen
+    at random.
+
+    Arguments:
+      nreads: number of reads to generate
+      seed: (optional) seed for the random number generator
+      lengths: (optional) tuple (min,max) giving the range of
+        sequence lengths
+      bases: (optional) characters to use for the sequences
+      quality: (optional) characters to use for the quality
+        values
+      tiles: (optional) tile numbers to use in the read names
+      indexes: (optional) index sequences to use in the read
+        names
+
+    Returns:
+      String with the FASTQ data.
+    """
+    rng = random.Random(seed)
+    reads = []
+    for i in xrange(nreads):
+        tile = rng.choice(tiles)
+        x = rng.randint(1000,20000)
+        index = rng.choice(indexes)
+        length = rng.randint(*lengths)
+        seq = ''.join(rng.choice(bases) for j in xrange(length))
+        qual = ''.join(rng.choice(quality) for j in xrange(length))
+        reads.append("@NB500968:70:HCYMKBGX2:1:%d:%d:%d 1:N:0:%s\n"
+                     "%s\n+\n%s\n" % (tile,x,i,index,seq,qual))
+    return ''.join(reads)
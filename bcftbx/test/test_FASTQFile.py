@@ -4,6 +4,11 @@
 from bcftbx.FASTQFile import *
 import unittest
 import cStringIO
+import pickle
+import os
+import gzip
+import shutil
+import tempfile
 
 fastq_data = """@73D9FA:3:FC:1:1:7507:1000 1:N:0:
 NACAACCTGATTAGCGGCGTTGACAGATGTATCCAT
@@ -127,6 +132,320 @@ class TestFastqIterator(unittest.TestCase):
             self.assertEqual(read.quality,fastq_source.readline().rstrip('\n'))
         self.assertEqual(nreads,5)
 
+    def test_fastq_iterator_no_trailing_newline(self):
+        """Check iteration over FASTQ file where last line has no newline
+        """
+        fp = cStringIO.StringIO(fastq_data.rstrip('\n'))
+        reads = [r for r in FastqIterator(fp=fp)]
+        self.assertEqual(len(reads),5)
+        self.assertEqual(reads[-1].quality,"#--,,55777@@@@@@@CC@@C@@@@@@@@:::::<")
+
+class TestPairedFastqIterator(unittest.TestCase):
+    """Tests of the PairedFastqIterator class
+    """
+
+    def test_paired_fastq_iterator(self):
+        """Check iteration over pair of small FASTQ files
+        """
+        fp1 = cStringIO.StringIO(fastq_data)
+        fp2 = cStringIO.StringIO(fastq_data2)
+        pairs = [p for p in PairedFastqIterator(fp1=fp1,fp2=fp2)]
+        reads1 = [r for r in FastqIterator(fp=cStringIO.StringIO(fastq_data))]
+        reads2 = [r for r in FastqIterator(fp=cStringIO.StringIO(fastq_data2))]
+        self.assertEqual(len(pairs),5)
+        for (r1,r2),read1,read2 in zip(pairs,reads1,reads2):
+            self.assertEqual(str(r1),str(read1))
+            self.assertEqual(str(r2),str(read2))
+
+    def test_paired_fastq_iterator_small_buffer(self):
+        """Check iteration over pair of FASTQs with blocks out of step
+        """
+        fp1 = cStringIO.StringIO(fastq_data)
+        fp2 = cStringIO.StringIO(fastq_data2)
+        pairs = [p for p in PairedFastqIterator(fp1=fp1,fp2=fp2,bufsize=50,
+                                                queue_size=1)]
+        self.assertEqual(len(pairs),5)
+        for r1,r2 in pairs:
+            self.assertTrue(r1.seqid.is_pair_of(r2.seqid))
+
+    def test_paired_fastq_iterator_unequal_lengths(self):
+        """Check iteration over pair of FASTQs with different numbers of reads
+        """
+        fp1 = cStringIO.StringIO(fastq_data)
+        fp2 = cStringIO.StringIO('\n'.join(fastq_data2.split('\n')[:12]))
+        pairs = [p for p in PairedFastqIterator(fp1=fp1,fp2=fp2,bufsize=50)]
+        self.assertEqual(len(pairs),5)
+        self.assertEqual([r2 is None for r1,r2 in pairs],
+                         [False,False,False,True,True])
+        self.assertEqual(str(pairs[4][0].seqid),
+                         "@73D9FA:3:FC:1:1:6680:1000 1:N:0:")
+
+    def test_paired_fastq_iterator_headers(self):
+        """Check iteration over headers for pair of FASTQ files
+        """
+        fp1 = cStringIO.StringIO('\n'.join(fastq_data.split('\n')[:12]))
+        fp2 = cStringIO.StringIO(fastq_data2)
+        headers = [h for h in PairedFastqIterator(fp1=fp1,fp2=fp2).headers()]
+        self.assertEqual(len(headers),5)
+        self.assertEqual(headers[0],("@73D9FA:3:FC:1:1:7507:1000 1:N:0:",
+                                     "@73D9FA:3:FC:1:1:7507:1000 2:N:0:"))
+        self.assertEqual(headers[4],(None,"@73D9FA:3:FC:1:1:6680:1000 2:N:0:"))
+
+class TestInterleavedFastqIterator(unittest.TestCase):
+    """Tests of the InterleavedFastqIterator class
+    """
+
+    def test_interleaved_fastq_iterator(self):
+        """Check iteration over interleaved FASTQ
+        """
+        reads1 = [r for r in FastqIterator(fp=cStringIO.StringIO(fastq_data))]
+        reads2 = [r for r in FastqIterator(fp=cStringIO.StringIO(fastq_data2))]
+        interleaved = ''.join(["%s\n%s\n" % (r1,r2)
+                               for r1,r2 in zip(reads1,reads2)])
+        for bufsize in (CHUNKSIZE,50):
+            fp = cStringIO.StringIO(interleaved)
+            pairs = [p for p in InterleavedFastqIterator(fp=fp,
+                                                         bufsize=bufsize)]
+            self.assertEqual(len(pairs),5)
+            for (r1,r2),read1,read2 in zip(pairs,reads1,reads2):
+                self.assertEqual(str(r1),str(read1))
+                self.assertEqual(str(r2),str(read2))
+
+    def test_interleaved_fastq_iterator_odd_number_of_reads(self):
+        """Check iteration over interleaved FASTQ with odd number of reads
+        """
+        fp = cStringIO.StringIO(fastq_data)
+        self.assertRaises(Exception,list,InterleavedFastqIterator(fp=fp))
+
+class TestFastqReader(unittest.TestCase):
+    """Tests of the FastqReader class
+    """
+
+    def _check_records(self,data,bufsize=CHUNKSIZE):
+        fp = cStringIO.StringIO(data)
+        lines = fastq_data.split('\n')
+        nreads = 0
+        for rec in FastqReader(fp=fp,bufsize=bufsize):
+            i = nreads*4
+            self.assertTrue(isinstance(rec,FastqRecordView))
+            self.assertEqual(rec.raw_seqid,lines[i])
+            self.assertEqual(rec.sequence,lines[i+1])
+            self.assertEqual(rec.optid,lines[i+2])
+            self.assertEqual(rec.quality,lines[i+3])
+            self.assertEqual(rec.seqlen,len(lines[i+1]))
+            self.assertEqual(list(rec.fields()),lines[i:i+4])
+            nreads += 1
+        self.assertEqual(nreads,5)
+
+    def test_fastq_reader(self):
+        """FastqReader: check record views from small FASTQ file
+        """
+        self._check_records(fastq_data)
+
+    def test_fastq_reader_small_buffer(self):
+        """FastqReader: check records when buffer is smaller than a record
+        """
+        self._check_records(fastq_data,bufsize=2)
+
+    def test_fastq_reader_no_trailing_newline(self):
+        """FastqReader: handle final line with no trailing newline
+        """
+        self._check_records(fastq_data.rstrip('\n'))
+        self._check_records(fastq_data.rstrip('\n'),bufsize=7)
+
+    def test_fastq_reader_as_read(self):
+        """FastqReader: views convert to FastqRead objects
+        """
+        fp = cStringIO.StringIO(fastq_data)
+        reads = [rec.as_read() for rec in FastqReader(fp=fp,bufsize=10)]
+        fp = cStringIO.StringIO(fastq_data)
+        for r1,r2 in zip(reads,FastqIterator(fp=fp)):
+            self.assertTrue(isinstance(r1,FastqRead))
+            self.assertEqual(r1,r2)
+            self.assertEqual(r1.raw_seqid,r2.raw_seqid)
+
+    def test_fastq_reader_crlf(self):
+        """FastqReader: carriage returns are stripped by as_read
+        """
+        fp = cStringIO.StringIO(fastq_data.replace('\n','\r\n'))
+        fp_ref = cStringIO.StringIO(fastq_data)
+        for rec,ref in zip(FastqReader(fp=fp),FastqIterator(fp=fp_ref)):
+            read = rec.as_read()
+            self.assertEqual(read.sequence,ref.sequence)
+            self.assertEqual(read.quality,ref.quality)
+            self.assertEqual(str(read.seqid),str(ref.seqid))
+
+    def test_fastq_reader_trailing_whitespace(self):
+        """FastqReader: trailing spaces and tabs are stripped from fields
+        """
+        lines = fastq_data.split('\n')
+        for i in xrange(len(lines)-1):
+            lines[i] += ('',' ',' \t','\t')[i%4]
+        data = '\n'.join(lines)
+        # Record views
+        fp = cStringIO.StringIO(data)
+        fp_ref = cStringIO.StringIO(fastq_data)
+        for rec,ref in zip(FastqReader(fp=fp),FastqIterator(fp=fp_ref)):
+            self.assertEqual(rec.sequence,ref.sequence)
+            self.assertEqual(rec.optid,ref.optid)
+            self.assertEqual(rec.quality,ref.quality)
+            self.assertEqual(rec.seqlen,ref.seqlen)
+            self.assertEqual(rec.as_read(),ref)
+        # Reads from a file-like object and from a (mapped) file
+        fastq = os.path.join(tempfile.mkdtemp(),'test.fastq')
+        with open(fastq,'w') as fp:
+            fp.write(data)
+        try:
+            for reads in (FastqIterator(fp=cStringIO.StringIO(data)),
+                          FastqIterator(fastq)):
+                fp_ref = cStringIO.StringIO(fastq_data)
+                for read,ref in zip(reads,FastqIterator(fp=fp_ref)):
+                    self.assertEqual(read.sequence,ref.sequence)
+                    self.assertEqual(read.optid,'+')
+                    self.assertEqual(read.quality,ref.quality)
+                    self.assertEqual(read.seqlen,36)
+        finally:
+            shutil.rmtree(os.path.dirname(fastq))
+        # Pairs of reads
+        pairs = PairedFastqIterator(fp1=cStringIO.StringIO(data),
+                                    fp2=cStringIO.StringIO(data))
+        fp_ref = cStringIO.StringIO(fastq_data)
+        for (r1,r2),ref in zip(pairs,FastqIterator(fp=fp_ref)):
+            self.assertEqual(r1.sequence,ref.sequence)
+            self.assertEqual(r2.quality,ref.quality)
+
+class TestIterBatches(unittest.TestCase):
+    """Tests of the iter_batches function and FastqBatch class
+    """
+
+    def setUp(self):
+        import bcftbx.FASTQFile
+        if bcftbx.FASTQFile.numpy is None:
+            raise unittest.SkipTest("numpy not available")
+
+    def test_iter_batches(self):
+        """iter_batches: split reads into batches
+        """
+        fp = cStringIO.StringIO(fastq_data)
+        batches = [b for b in iter_batches(fp=fp,batch_size=2)]
+        self.assertEqual([b.nreads for b in batches],[2,2,1])
+        fp = cStringIO.StringIO(fastq_data)
+        reads = [r for r in FastqIterator(fp=fp)]
+        i = 0
+        for batch in batches:
+            for j in xrange(batch.nreads):
+                self.assertEqual(batch.header(j),reads[i].raw_seqid)
+                self.assertEqual(batch.sequence(j),reads[i].sequence)
+                self.assertEqual(batch.quality(j),reads[i].quality)
+                self.assertEqual(batch.read(j),reads[i])
+                i += 1
+        self.assertEqual(i,5)
+
+    def test_batch_length_counts(self):
+        """FastqBatch: distribution of sequence lengths
+        """
+        fp = cStringIO.StringIO(fastq_empty_sequence)
+        batch = iter_batches(fp=fp).next()
+        self.assertEqual(batch.nreads,5)
+        counts = batch.length_counts()
+        self.assertEqual(counts[0],1)
+        self.assertEqual(counts[36],4)
+        self.assertEqual(counts.sum(),5)
+
+    def test_batch_quality_range(self):
+        """FastqBatch: minimum and maximum quality values
+        """
+        fp = cStringIO.StringIO(fastq_data)
+        batch = iter_batches(fp=fp).next()
+        quals = ''.join(fastq_data.split('\n')[3::4])
+        self.assertEqual(batch.quality_range(),(ord(min(quals)),
+                                                ord(max(quals))))
+        self.assertEqual(batch.head(0).quality_range(),(None,None))
+
+    def test_batch_quality_by_position(self):
+        """FastqBatch: per-position quality totals
+        """
+        fp = cStringIO.StringIO(fastq_empty_sequence)
+        batch = iter_batches(fp=fp).next()
+        totals,counts = batch.quality_by_position()
+        quals = [q for q in fastq_empty_sequence.split('\n')[3::4] if q]
+        self.assertEqual(list(counts),[4]*36)
+        for i in xrange(36):
+            self.assertEqual(totals[i],sum([ord(q[i])-33 for q in quals]))
+
+    def test_batch_head(self):
+        """FastqBatch: take subset of reads from start of batch
+        """
+        fp = cStringIO.StringIO(fastq_data)
+        batch = iter_batches(fp=fp).next().head(2)
+        self.assertEqual(batch.nreads,2)
+        self.assertEqual(len(batch.seq),72)
+        self.assertEqual(batch.sequence(1),
+                         "NTCTTGCTGGTGGCGCCATGTCTAAATTGTTTGGAG")
+
+    def test_batch_index_sequences(self):
+        """FastqBatch: locate and count index sequences
+        """
+        fp = cStringIO.StringIO(
+"""@HWI-700511R:233:C446JACXX:6:1101:1241:2242 1:N:0:CCGTCCAT
+GAAACGCGGCACAGA
++
+<BBFFBFFBBFFF7B
+@NB500968:70:HCYMKBGX2:1:11101:22672:1659 2:N:0:1#FQST:Human:Mouse:01
+CGAGCTCGAATTCAT
++
+<0<<BFF<0BFFFII
+@HWUSI-EAS100R:6:73:941:1973#0/1
+GAAACGCGGCACAGA
++
+<BBFFBFFBBFFF7B
+@73D9FA:3:FC:1:1:7507:1000 1:N:0:
+NACAACCTGATTAGC
++
+#))))55445@@@@@
+@HWI-700511R:233:C446JACXX:6:1101:1280:2080 1:N:0:CCGTCCAT
+CGAGCTCGAATTCAT
++
+<0<<BFF<0BFFFII
+""")
+        batch = iter_batches(fp=fp).next()
+        seqs,found = batch.index_sequences()
+        self.assertEqual(list(found),[True,True,False,True,True])
+        self.assertEqual(list(seqs[found]),['CCGTCCAT',
+                                            '1#FQST:Human:Mouse:01',
+                                            '',
+                                            'CCGTCCAT'])
+        self.assertEqual(batch.index_sequence_counts(),
+                         { 'CCGTCCAT': 2,
+                           '1#FQST:Human:Mouse:01': 1,
+                           '': 1,
+                           None: 1 })
+
+    def test_batch_sequence_counts(self):
+        """FastqBatch: count sequences using packed keys
+        """
+        i1 = ['CCGTCCAT','CCGTCCAT','GTCNNCAT','CCGTCCAT','ACGT','',
+              'ACGTACGTACGTACGTACGTACGTACGTACGTACGT','CCGTCCAT']
+        i2 = ['TTAGGC','TTAGGC','TTAGGC','TTAGGA','TTAGGC','TTAGGC',
+              'A','TTAGGCN']
+        batches = []
+        for seqs in (i1,i2):
+            fp = cStringIO.StringIO(''.join(
+                ["@r%d\n%s\n+\n%s\n" % (i,seq,'E'*len(seq))
+                 for i,seq in enumerate(seqs)]))
+            batches.append(iter_batches(fp=fp).next())
+        counts = {}
+        for seq in i1:
+            counts[seq] = counts.get(seq,0) + 1
+        self.assertEqual(batches[0].sequence_counts(),counts)
+        counts = {}
+        for seq1,seq2 in zip(i1,i2):
+            seq = seq1 + '+' + seq2
+            counts[seq] = counts.get(seq,0) + 1
+        self.assertEqual(batches[0].sequence_counts(batches[1]),counts)
+        self.assertRaises(Exception,batches[0].sequence_counts,
+                          batches[1].head(2))
+
 class TestFastqRead(unittest.TestCase):
     """Tests of the FastqRead class
     """
@@ -177,6 +496,45 @@ class TestFastqRead(unittest.TestCase):
                          "+",
                          "BBA!>AA,B>;;=A%39%B8====>0?-?%9A2<)3?(4*36%A%4&+9%")
         self.assertTrue(read.is_colorspace)
+        # Illumina-style identifier isn't colorspace
+        read = FastqRead("@EAS139:136:FC706VJ:2:2104:15343:197393 1:Y:18:ATCACG",
+                         "T2210033",
+                         "+",
+                         "BBA!>AA,")
+        self.assertFalse(read.is_colorspace)
+        # Non-colorspace characters
+        read = FastqRead("@1_14_622",
+                         "T221.00A3",
+                         "+",
+                         "BBA!>AA,B")
+        self.assertFalse(read.is_colorspace)
+
+    def test_modify_seqid(self):
+        """Check FastqRead output reflects changes to the seqid
+        """
+        read = FastqRead("@EAS139:136:FC706VJ:2:2104:15343:197393 1:Y:18:ATCACG",
+                         "ACGT","+","IIII")
+        read.seqid.instrument_name = "NEW139"
+        self.assertEqual(str(read),
+                         "@NEW139:136:FC706VJ:2:2104:15343:197393 1:Y:18:ATCACG\n"
+                         "ACGT\n+\nIIII")
+
+    def test_no_instance_dict(self):
+        """Check FastqRead doesn't allow arbitrary attributes
+        """
+        read = FastqRead("@SEQID","ACGT","+","IIII")
+        self.assertRaises(AttributeError,setattr,read,'foo','bar')
+
+    def test_pickle(self):
+        """Check FastqRead can be pickled
+        """
+        read = FastqRead("@EAS139:136:FC706VJ:2:2104:15343:197393 1:Y:18:ATCACG",
+                         "ACGT","+","IIII")
+        read.seqid.index_sequence = "GGGGGG"
+        for protocol in (0,pickle.HIGHEST_PROTOCOL):
+            read2 = pickle.loads(pickle.dumps(read,protocol))
+            self.assertEqual(read2,read)
+            self.assertEqual(read2.seqid.index_sequence,"GGGGGG")
 
     def test_equality(self):
         """Check FastqRead handles equality operator ('==')
@@ -315,6 +673,39 @@ class TestSequenceIdentifier(unittest.TestCase):
         # Check the format
         self.assertEqual(None,seqid.format)
 
+    def test_read_illumina18_id_with_space_in_name(self):
+        """Process an 'illumina18'-style sequence id with spaces in the name
+        """
+        seqid_string = "@EAS 139:136:FC706VJ:2:2104:15343:197393 1:Y:18:ATCACG"
+        seqid = SequenceIdentifier(seqid_string)
+        self.assertEqual(str(seqid),seqid_string)
+        self.assertEqual('illumina18',seqid.format)
+        self.assertEqual('EAS 139',seqid.instrument_name)
+        self.assertEqual('197393',seqid.y_coord)
+        self.assertEqual('ATCACG',seqid.index_sequence)
+
+    def test_not_illumina18_id(self):
+        """Process a sequence id which is nearly 'illumina18'-style
+        """
+        for seqid_string in ("@EAS139:136:FC706VJ:2:2104:15343:197393 3:Y:18:ATCACG",
+                             "@EAS139:136:FC706VJ:2:2104:15343:X1 1:Y:18:ATCACG",
+                             "@EAS139:136:FC706VJ:2:2104:15343 1:Y:18:ATCACG",
+                             "@EAS139:136::2:2104:15343:197393 1:Y:18:ATCACG"):
+            seqid = SequenceIdentifier(seqid_string)
+            self.assertEqual(str(seqid),seqid_string)
+            self.assertEqual(None,seqid.format)
+            self.assertEqual(None,seqid.index_sequence)
+
+    def test_set_attribute_before_parsing(self):
+        """Setting an attribute isn't overwritten by parsing the id
+        """
+        seqid = SequenceIdentifier("@EAS139:136:FC706VJ:2:2104:15343:197393 1:Y:18:ATCACG")
+        seqid.index_sequence = "GGGGGG"
+        self.assertEqual('EAS139',seqid.instrument_name)
+        self.assertEqual('GGGGGG',seqid.index_sequence)
+        self.assertEqual(str(seqid),
+                         "@EAS139:136:FC706VJ:2:2104:15343:197393 1:Y:18:GGGGGG")
+
     def test_is_pair_of(self):
         """Check that paired sequence identifiers are recognised as such
         """
@@ -360,6 +751,147 @@ class TestFastqsArePair(unittest.TestCase):
         fp2 = cStringIO.StringIO(fastq_data2)
         self.assertTrue(fastqs_are_pair(fp1=fp1,fp2=fp2,verbose=False))
 
+    def test_fastqs_are_not_pair(self):
+        """Check that fastqs which are not a pair are rejected
+        """
+        fp1 = cStringIO.StringIO(fastq_data)
+        fp2 = cStringIO.StringIO(fastq_data)
+        self.assertFalse(fastqs_are_pair(fp1=fp1,fp2=fp2,verbose=False))
+
+    def test_fastqs_are_pair_different_lengths(self):
+        """Check that fastqs with different numbers of reads are rejected
+        """
+        fp1 = cStringIO.StringIO(fastq_data)
+        fp2 = cStringIO.StringIO('\n'.join(fastq_data2.split('\n')[:16]))
+        self.assertFalse(fastqs_are_pair(fp1=fp1,fp2=fp2,verbose=False))
+
+class TestInterleaving(unittest.TestCase):
+    """Tests of the is_interleaved, interleave_fastqs and deinterleave_fastq
+    functions
+    """
+
+    def setUp(self):
+        self.wd = tempfile.mkdtemp()
+        self.fastq1 = os.path.join(self.wd,"test_R1.fastq")
+        self.fastq2 = os.path.join(self.wd,"test_R2.fastq.gz")
+        with open(self.fastq1,'w') as fp:
+            fp.write(fastq_data)
+        fp = gzip.open(self.fastq2,'wb')
+        fp.write(fastq_data2)
+        fp.close()
+        self.interleaved = ''.join(
+            ["%s\n%s\n" % (r1,r2)
+             for r1,r2 in zip(FastqIterator(fp=cStringIO.StringIO(fastq_data)),
+                              FastqIterator(fp=cStringIO.StringIO(fastq_data2)))])
+
+    def tearDown(self):
+        shutil.rmtree(self.wd)
+
+    def test_is_interleaved(self):
+        """Check detection of interleaved FASTQ
+        """
+        self.assertTrue(is_interleaved(fp=cStringIO.StringIO(self.interleaved)))
+        self.assertTrue(is_interleaved(fp=cStringIO.StringIO(self.interleaved),
+                                       npairs=2))
+        self.assertFalse(is_interleaved(fp=cStringIO.StringIO(fastq_data)))
+        self.assertFalse(is_interleaved(fp=cStringIO.StringIO('')))
+
+    def test_interleave_fastqs(self):
+        """Check interleaving of R1/R2 FASTQs
+        """
+        for ext in ('','.gz'):
+            interleaved_fastq = os.path.join(self.wd,"interleaved.fastq"+ext)
+            self.assertEqual(interleave_fastqs(self.fastq1,self.fastq2,
+                                               interleaved_fastq),5)
+            with get_fastq_file_handle(interleaved_fastq) as fp:
+                self.assertEqual(fp.read(),self.interleaved)
+
+    def test_interleave_fastqs_not_pairs(self):
+        """Check interleaving fails for FASTQs which aren't pairs
+        """
+        interleaved_fastq = os.path.join(self.wd,"interleaved.fastq")
+        self.assertRaises(Exception,
+                          interleave_fastqs,
+                          self.fastq1,self.fastq1,interleaved_fastq)
+        self.assertFalse(os.path.exists(interleaved_fastq))
+        self.assertEqual(interleave_fastqs(self.fastq1,self.fastq1,
+                                           interleaved_fastq,
+                                           check_pairs=False),5)
+
+    def test_deinterleave_fastq(self):
+        """Check de-interleaving of interleaved FASTQ
+        """
+        interleaved_fastq = os.path.join(self.wd,"interleaved.fastq.gz")
+        fp = gzip.open(interleaved_fastq,'wb')
+        fp.write(self.interleaved)
+        fp.close()
+        fastq1 = os.path.join(self.wd,"out_R1.fastq.gz")
+        fastq2 = os.path.join(self.wd,"out_R2.fastq")
+        self.assertEqual(deinterleave_fastq(interleaved_fastq,fastq1,fastq2),5)
+        with get_fastq_file_handle(fastq1) as fp:
+            self.assertEqual(fp.read(),fastq_data)
+        with get_fastq_file_handle(fastq2) as fp:
+            self.assertEqual(fp.read(),fastq_data2)
+
+    def test_interleave_fastqs_different_lengths(self):
+        """Check interleaving fails for FASTQs with different numbers of reads
+        """
+        fastq2 = os.path.join(self.wd,"short_R2.fastq")
+        with open(fastq2,'w') as fp:
+            fp.write('\n'.join(fastq_data2.split('\n')[:8])+'\n')
+        for ext in ('','.gz'):
+            interleaved_fastq = os.path.join(self.wd,"interleaved.fastq"+ext)
+            self.assertRaises(Exception,
+                              interleave_fastqs,
+                              self.fastq1,fastq2,interleaved_fastq)
+            self.assertFalse(os.path.exists(interleaved_fastq))
+
+    def test_deinterleave_fastq_not_pairs(self):
+        """Check de-interleaving fails for FASTQ which isn't interleaved
+        """
+        fastq1 = os.path.join(self.wd,"out_R1.fastq")
+        fastq2 = os.path.join(self.wd,"out_R2.fastq.gz")
+        self.assertRaises(Exception,
+                          deinterleave_fastq,
+                          self.fastq1,fastq1,fastq2)
+        self.assertFalse(os.path.exists(fastq1))
+        self.assertFalse(os.path.exists(fastq2))
+
+class TestHeadersArePair(unittest.TestCase):
+    """Tests of the headers_are_pair function
+    """
+
+    def test_headers_are_pair_illumina18(self):
+        """Check pairing of Illumina 1.8+ format headers
+        """
+        seqid1 = "@HWI-700511R:183:D2C8UACXX:1:1101:1115:2123 1:N:0:GCCAAT"
+        seqid2 = "@HWI-700511R:183:D2C8UACXX:1:1101:1115:2123 2:N:0:GCCAAT"
+        seqid3 = "@HWI-700511R:183:D2C8UACXX:5:1101:1496:2199 2:N:0:GCCAAT"
+        seqid4 = "@HWI-700511R:183:D2C8UACXX:1:1101:1115:2123 2:N:0:GCCAAG"
+        self.assertTrue(headers_are_pair(seqid1,seqid2))
+        self.assertTrue(headers_are_pair(seqid2,seqid1))
+        self.assertFalse(headers_are_pair(seqid1,seqid1))
+        self.assertFalse(headers_are_pair(seqid2,seqid2))
+        self.assertFalse(headers_are_pair(seqid1,seqid3))
+        self.assertFalse(headers_are_pair(seqid1,seqid4))
+        self.assertFalse(headers_are_pair(seqid1,None))
+
+    def test_headers_are_pair_illumina(self):
+        """Check pairing of earlier Illumina format headers
+        """
+        seqid1 = "@HWUSI-EAS100R:6:73:941:1973#0/1"
+        seqid2 = "@HWUSI-EAS100R:6:73:941:1973#0/2"
+        seqid3 = "@HWUSI-EAS100R:6:73:941:1974#0/2"
+        self.assertTrue(headers_are_pair(seqid1,seqid2))
+        self.assertTrue(headers_are_pair(seqid2,seqid1))
+        self.assertFalse(headers_are_pair(seqid1,seqid1))
+        self.assertFalse(headers_are_pair(seqid1,seqid3))
+
+    def test_headers_are_pair_unrecognised(self):
+        """Check headers without read numbers are not pairs
+        """
+        self.assertFalse(headers_are_pair("@read1","@read1"))
+
 #######################################################################
 # Main program
 #######################################################################
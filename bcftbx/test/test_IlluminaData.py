@@ -1575,6 +1575,38 @@ This,isTheEnd
         # Fix and check again (should be none)
         casava.fix_duplicated_names()
         self.assertEqual(casava.duplicated_names,[])
+    def test_barcode_distances(self):
+        """
+        SampleSheet: minimum distances between barcodes in each lane
+
+        """
+        hiseq = SampleSheet(fp=cStringIO.StringIO(
+            self.hiseq_sample_sheet_content))
+        distances = hiseq.barcode_distances()
+        self.assertEqual(distances.keys(),[1])
+        self.assertEqual(distances[1].min_distance,4)
+        self.assertEqual(distances[1].max_mismatches,1)
+        self.assertEqual(distances[1].closest_pairs,
+                         [('CGATGTAT-TCTTTCCC','TGACCAAT-TCTTTCCC')])
+        # Truncated barcodes
+        distances = hiseq.barcode_distances(length=4)
+        self.assertEqual(distances[1].barcodes,['CGAT','TGAC'])
+        self.assertEqual(distances[1].min_distance,2)
+        self.assertEqual(distances[1].max_mismatches,0)
+        # One barcode per lane (and lanes without barcodes)
+        casava = SampleSheet(fp=cStringIO.StringIO(
+            self.casava_sample_sheet_content))
+        distances = casava.barcode_distances()
+        self.assertEqual(sorted(distances.keys()),[2,3,4,5,6,7])
+        for lane in distances:
+            self.assertEqual(distances[lane].min_distance,None)
+            self.assertEqual(distances[lane].max_mismatches,None)
+        # Duplicated barcodes
+        casava.data[2]['Lane'] = 2
+        casava.data[2]['Index'] = 'AGTCAA'
+        distances = casava.barcode_distances()
+        self.assertEqual(distances[2].min_distance,0)
+        self.assertTrue(distances[2].max_mismatches < 0)
     def test_illegal_names_in_casava_format(self):
         """
         SampleSheet: check for illegal characters in CASAVA sample sheet
@@ -5,6 +5,10 @@ from bcftbx.Md5sum import *
 from bcftbx.test.mock_data import ExampleDirSpiders,ExampleDirLanguages
 import unittest
 import os
+import time
+import zlib
+import shutil
+import hashlib
 import tempfile
 import cStringIO
 
@@ -50,6 +54,41 @@ class TestMd5sum(unittest.TestCase):
         """
         self.assertRaises(Exception,md5sum,None)
 
+class TestChecksums(unittest.TestCase):
+
+    def setUp(self):
+        tmpfile = tempfile.mkstemp()
+        self.filen = tmpfile[1]
+        fp = open(self.filen,'w')
+        fp.write(test_text)
+        fp.close()
+
+    def tearDown(self):
+        os.remove(self.filen)
+
+    def test_checksums_for_file(self):
+        """checksums generates correct digests for a file
+        """
+        self.assertEqual(checksums(self.filen,('md5','sha256','crc32')),
+                         ('08a6facee51e5435b9ef3744bd4dd5dc',
+                          hashlib.sha256(test_text).hexdigest(),
+                          "%08x" % (zlib.crc32(test_text) & 0xffffffff)))
+        self.assertEqual(checksums(self.filen),
+                         ('08a6facee51e5435b9ef3744bd4dd5dc',))
+
+    def test_checksums_for_stream(self):
+        """checksums generates correct digests for a stream
+        """
+        fp = cStringIO.StringIO(test_text)
+        self.assertEqual(checksums(fp,('sha1','md5')),
+                         (hashlib.sha1(test_text).hexdigest(),
+                          '08a6facee51e5435b9ef3744bd4dd5dc'))
+
+    def test_checksums_unsupported_algorithm(self):
+        """checksums raises exception for unsupported algorithm
+        """
+        self.assertRaises(Exception,checksums,self.filen,('md5','md4'))
+
 class TestMd5CheckerMd5cmpFiles(unittest.TestCase):
     """Tests for the 'md5cmp_files' method of the Md5Checker class
 
@@ -155,6 +194,56 @@ class TestMd5CheckerMd5cmpFiles(unittest.TestCase):
                          Md5Checker.md5cmp_files(self.example_dir.dirn,
                                                  self.example_dir.path('spider.txt')))
 
+    def test_cmp_files_different_sizes(self):
+        """Md5Checker.md5cmp_files with files of different sizes
+        """
+        self.example_dir.add_file("spider2.txt","The itsy bitsy spider...")
+        for stream in (False,True):
+            self.assertEqual(Md5Checker.MD5_FAILED,
+                             Md5Checker.md5cmp_files(
+                                 self.example_dir.path('spider.txt'),
+                                 self.example_dir.path('spider2.txt'),
+                                 stream=stream))
+
+    def test_cmp_large_files(self):
+        """Md5Checker.md5cmp_files with files larger than the read buffer
+        """
+        data = "spider"*(READ_BUFFER_SIZE//6 + 10)
+        self.example_dir.add_file("big1",data)
+        self.example_dir.add_file("big2",data)
+        self.example_dir.add_file("big3",data[:-1]+"S")
+        big1,big2,big3 = [self.example_dir.path(f)
+                          for f in ("big1","big2","big3")]
+        for stream in (False,True):
+            self.assertEqual(Md5Checker.MD5_OK,
+                             Md5Checker.md5cmp_files(big1,big2,stream=stream))
+            self.assertEqual(Md5Checker.MD5_FAILED,
+                             Md5Checker.md5cmp_files(big1,big3,stream=stream))
+
+    def test_cmp_files_stream(self):
+        """Md5Checker.md5cmp_files comparing file contents directly
+        """
+        spider = self.example_dir.path('spider.txt')
+        self.example_dir.add_file("spider2.txt",
+                                  open(spider).read().swapcase())
+        self.example_dir.add_file("spider3.txt",open(spider).read())
+        self.assertEqual(Md5Checker.MD5_OK,
+                         Md5Checker.md5cmp_files(
+                             spider,self.example_dir.path('spider3.txt'),
+                             stream=True))
+        self.assertEqual(Md5Checker.MD5_FAILED,
+                         Md5Checker.md5cmp_files(
+                             spider,self.example_dir.path('spider2.txt'),
+                             stream=True))
+        self.assertEqual(Md5Checker.MD5_ERROR,
+                         Md5Checker.md5cmp_files(
+                             spider,self.example_dir.path('missing.txt'),
+                             stream=True))
+        self.assertEqual(Md5Checker.MD5_ERROR,
+                         Md5Checker.md5cmp_files(
+                             spider,self.example_dir.dirn,
+                             stream=True))
+
 class TestMd5CheckerWalk(unittest.TestCase):
     """Tests for the 'walk' method of the Md5Checker class
 
@@ -302,6 +391,20 @@ class TestMd5CheckerMd5cmpDirs(unittest.TestCase):
             else:
                 self.assertEqual(Md5Checker.MD5_OK,status)
 
+    def test_cmp_dirs_threads_preserves_order(self):
+        """Md5Checker.md5cmp_dirs gives same results in same order for threads
+        """
+        self.dir2.add_file("goodbye","Goooooodbyeeee!")
+        self.dir1.add_file("portuguese/ola","Hello!")
+        expected = list(Md5Checker.md5cmp_dirs(self.dir1.dirn,
+                                               self.dir2.dirn,
+                                               threads=1))
+        for threads in (2,4,8):
+            self.assertEqual(list(Md5Checker.md5cmp_dirs(self.dir1.dirn,
+                                                         self.dir2.dirn,
+                                                         threads=threads)),
+                             expected)
+
 class TestMd5CheckerComputeMd5sms(unittest.TestCase):
     """Tests for the 'compute_md5sums' method of the Md5Checker class
 
@@ -346,6 +449,31 @@ class TestMd5CheckerComputeMd5sms(unittest.TestCase):
             self.assertTrue(f in files,"%s doesn't appear in file list?" % f)
             self.assertEqual(md5,self.example_dir.checksum_for_file(f))
 
+    def test_compute_md5sums_threads_preserves_order(self):
+        """Md5Checker.compute_md5sums gives same order for any number of threads
+
+        """
+        expected = [(os.path.relpath(f,self.example_dir.dirn),
+                     md5sum(f))
+                    for f in Md5Checker.walk(self.example_dir.dirn)]
+        self.assertNotEqual(len(expected),0)
+        for threads in (1,2,4,8):
+            self.assertEqual(list(Md5Checker.compute_md5sums(
+                self.example_dir.dirn,threads=threads)),expected)
+
+    def test_compute_checksums(self):
+        """Md5Checker.compute_checksums returns checksums for several algorithms
+
+        """
+        expected = [(os.path.relpath(f,self.example_dir.dirn),
+                     (md5sum(f),hashlib.sha256(open(f,'rb').read()).hexdigest()))
+                    for f in Md5Checker.walk(self.example_dir.dirn)]
+        self.assertNotEqual(len(expected),0)
+        for threads in (1,4):
+            self.assertEqual(list(Md5Checker.compute_checksums(
+                self.example_dir.dirn,algorithms=('md5','sha256'),
+                threads=threads)),expected)
+
 class TestMd5CheckerVerifyMd5sms(unittest.TestCase):
     """Tests for the 'verify_md5sums' method of the Md5Checker class
 
@@ -377,6 +505,186 @@ class TestMd5CheckerVerifyMd5sms(unittest.TestCase):
         # Check no files were missed
         self.assertEqual(len(files),0)
 
+    def test_verify_md5sums_threads_preserves_order(self):
+        """Md5Checker.verify_md5sums reports files in order for any number of threads
+
+        """
+        files = self.example_dir.filelist(full_path=True)
+        md5sums = '\n'.join(["%s  %s" % (md5sum(f),f) for f in files])
+        # Replace a file (also changes the link pointing to it)
+        self.example_dir.add_file("goodbye","Goooooodbyeeee!")
+        goodbye = os.path.realpath(self.example_dir.path("goodbye"))
+        expected = [(f,(Md5Checker.MD5_FAILED
+                        if os.path.realpath(f) == goodbye
+                        else Md5Checker.MD5_OK))
+                    for f in files]
+        for threads in (1,2,4,8):
+            fp = cStringIO.StringIO(md5sums)
+            self.assertEqual(list(Md5Checker.verify_md5sums(fp=fp,
+                                                            threads=threads)),
+                             expected)
+
+    def test_verify_checksums_sha256(self):
+        """Md5Checker.verify_checksums checks 'sha256sum'-format file
+
+        """
+        files = self.example_dir.filelist(full_path=True)
+        sha256sums = '\n'.join(["%s  %s" % (checksums(f,('sha256',))[0],f)
+                                for f in files])
+        self.example_dir.add_file("goodbye","Goooooodbyeeee!")
+        goodbye = os.path.realpath(self.example_dir.path("goodbye"))
+        expected = [(f,(Md5Checker.MD5_FAILED
+                        if os.path.realpath(f) == goodbye
+                        else Md5Checker.MD5_OK))
+                    for f in files]
+        fp = cStringIO.StringIO(sha256sums)
+        self.assertEqual(list(Md5Checker.verify_checksums(fp=fp,
+                                                          algorithm='sha256')),
+                         expected)
+
+    def test_verify_md5sums_bad_line(self):
+        """Md5Checker.verify_md5sums reports preceeding files before bad line
+
+        """
+        files = self.example_dir.filelist(full_path=True)[:3]
+        md5sums = ["%s  %s" % (md5sum(f),f) for f in files]
+        md5sums.append("bad_line")
+        fp = cStringIO.StringIO('\n'.join(md5sums))
+        results = []
+        try:
+            for f,status in Md5Checker.verify_md5sums(fp=fp,threads=4):
+                results.append(f)
+            self.fail("Bad line didn't raise exception")
+        except IndexError:
+            pass
+        self.assertEqual(results,files)
+
+class TestMd5Cache(unittest.TestCase):
+    """Tests for the Md5Cache class
+
+    """
+    def setUp(self):
+        self.example_dir = ExampleDirLanguages()
+        self.example_dir.create_directory()
+        # Make the files old enough to be cached
+        self.age_files()
+        self.wd = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.wd,"md5sums.db")
+
+    def tearDown(self):
+        self.example_dir.delete_directory()
+        shutil.rmtree(self.wd)
+
+    def age_files(self):
+        # Set modification times into the past (using whole
+        # seconds so they can be restored exactly)
+        t = int(time.time()) - 3600
+        for f in self.example_dir.filelist(full_path=True):
+            if not os.path.islink(f):
+                os.utime(f,(t,t))
+
+    def test_md5cache_miss_then_hit(self):
+        """Md5Cache returns cached MD5 sum on second lookup
+        """
+        f = self.example_dir.path("hello")
+        cache = Md5Cache(self.db_file)
+        self.assertEqual(cache.md5sum(f),md5sum(f))
+        self.assertEqual((cache.hits,cache.misses,cache.bytes_avoided),
+                         (0,1,0))
+        self.assertEqual(cache.md5sum(f),md5sum(f))
+        self.assertEqual((cache.hits,cache.misses,cache.bytes_avoided),
+                         (1,1,os.path.getsize(f)))
+        cache.close()
+        # Persists when cache is reopened
+        cache = Md5Cache(self.db_file)
+        self.assertEqual(md5sum(f,cache=cache),md5sum(f))
+        self.assertEqual((cache.hits,cache.misses),(1,0))
+        cache.close()
+
+    def test_md5cache_changed_file(self):
+        """Md5Cache recomputes MD5 sum for changed file
+        """
+        f = self.example_dir.path("hello")
+        cache = Md5Cache(self.db_file)
+        cache.md5sum(f)
+        self.example_dir.add_file("hello","Hello there!")
+        self.age_files()
+        self.assertEqual(cache.md5sum(f),md5sum(f))
+        self.assertEqual((cache.hits,cache.misses),(0,2))
+        cache.close()
+
+    def test_md5cache_recently_modified_file_not_cached(self):
+        """Md5Cache doesn't store MD5 sum for recently modified file
+        """
+        self.example_dir.add_file("new","Brand new!")
+        f = self.example_dir.path("new")
+        cache = Md5Cache(self.db_file)
+        self.assertEqual(cache.md5sum(f),md5sum(f))
+        self.assertEqual(cache.md5sum(f),md5sum(f))
+        self.assertEqual((cache.hits,cache.misses),(0,2))
+        cache.close()
+
+    def test_md5cache_verify_detects_mismatch(self):
+        """Md5Cache with verify=True detects content changed without metadata
+        """
+        f = self.example_dir.path("hello")
+        cache = Md5Cache(self.db_file)
+        cache.md5sum(f)
+        cache.close()
+        # Corrupt file without changing the size or mtime
+        st = os.stat(f)
+        fp = open(f,'r+b')
+        fp.write('J')
+        fp.close()
+        os.utime(f,(st.st_atime,st.st_mtime))
+        # Trusting the cache returns the stale value
+        cache = Md5Cache(self.db_file)
+        self.assertNotEqual(cache.md5sum(f),md5sum(f))
+        cache.close()
+        # Verifying detects the mismatch and updates the cache
+        cache = Md5Cache(self.db_file,verify=True)
+        self.assertEqual(cache.md5sum(f),md5sum(f))
+        self.assertEqual(cache.mismatches,1)
+        self.assertEqual(cache.md5sum(f),md5sum(f))
+        self.assertEqual(cache.mismatches,1)
+        self.assertEqual(cache.bytes_avoided,0)
+        cache.close()
+
+    def test_md5cache_missing_file_raises_ioerror(self):
+        """Md5Cache raises IOError for missing file
+        """
+        cache = Md5Cache(self.db_file)
+        self.assertRaises(IOError,cache.md5sum,
+                          self.example_dir.path("missing"))
+        cache.close()
+
+    def test_md5cache_prune(self):
+        """Md5Cache.prune removes entries for missing and changed files
+        """
+        cache = Md5Cache(self.db_file)
+        for f in self.example_dir.filelist(full_path=True):
+            cache.md5sum(f)
+        os.remove(self.example_dir.path("spanish/hola"))
+        self.example_dir.add_file("goodbye","Goooooodbyeeee!")
+        self.assertEqual(cache.prune(),2)
+        self.assertEqual(cache.prune(),0)
+        cache.close()
+
+    def test_compute_md5sums_with_cache(self):
+        """Md5Checker.compute_md5sums uses Md5Cache
+        """
+        expected = list(Md5Checker.compute_md5sums(self.example_dir.dirn))
+        cache = Md5Cache(self.db_file)
+        self.assertEqual(list(Md5Checker.compute_md5sums(
+            self.example_dir.dirn,cache=cache)),expected)
+        hits,misses = cache.hits,cache.misses
+        self.assertNotEqual(misses,0)
+        self.assertEqual(list(Md5Checker.compute_md5sums(
+            self.example_dir.dirn,threads=4,cache=cache)),expected)
+        self.assertEqual(cache.hits,hits+len(expected))
+        self.assertEqual(cache.misses,misses)
+        cache.close()
+
 class TestMd5CheckReporter(unittest.TestCase):
     """Test the Md5CheckReporter class
 
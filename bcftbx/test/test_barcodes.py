@@ -0,0 +1,262 @@
+#######################################################################
+# Tests for barcodes.py module
+#######################################################################
+from bcftbx.barcodes import *
+import unittest
+
+class TestBarcodeTable(unittest.TestCase):
+
+    def test_exact_match(self):
+        """BarcodeTable: exact matches only
+        """
+        table = BarcodeTable(['ATTAGA','CGATGT'],max_mismatches=0)
+        self.assertEqual(table.lookup('ATTAGA'),'ATTAGA')
+        self.assertEqual(table.lookup('CGATGT'),'CGATGT')
+        self.assertEqual(table.lookup('ATTCGA'),None)
+        self.assertEqual(len(table),2)
+
+    def test_one_mismatch(self):
+        """BarcodeTable: allow one mismatch
+        """
+        table = BarcodeTable(['ATTAGA','CGATGT'],max_mismatches=1)
+        self.assertEqual(table.lookup('ATTAGA'),'ATTAGA')
+        self.assertEqual(table.lookup('ATTCGA'),'ATTAGA')
+        self.assertEqual(table.lookup('ATTNGA'),'ATTAGA')
+        self.assertEqual(table.lookup('ATCCGA'),None)
+        self.assertEqual(table.match('ATTAGA'),('ATTAGA',0))
+        self.assertEqual(table.match('ATTCGA'),('ATTAGA',1))
+        self.assertEqual(table.collisions,[])
+
+    def test_longer_index(self):
+        """BarcodeTable: index sequence longer than barcode
+        """
+        table = BarcodeTable(['ATTAGA'],max_mismatches=1)
+        self.assertEqual(table.lookup('ATTAGAAT'),'ATTAGA')
+        self.assertEqual(table.lookup('ATTCGAAT'),'ATTAGA')
+        self.assertEqual(table.lookup('ATTAG'),None)
+
+    def test_dual_index(self):
+        """BarcodeTable: handle dual index barcodes
+        """
+        table = BarcodeTable(['CGATGT-TTAGGC'],max_mismatches=1)
+        self.assertEqual(table.lookup('CGATGT+TTAGGC'),'CGATGT-TTAGGC')
+        self.assertEqual(table.lookup('CGATGT-TTAGGC'),'CGATGT-TTAGGC')
+        self.assertEqual(table.lookup('CGATGTTTAGGC'),'CGATGT-TTAGGC')
+        # One mismatch in each index
+        self.assertEqual(table.match('CGATGA+TTAGGA'),('CGATGT-TTAGGC',2))
+        # Two mismatches in one index
+        self.assertEqual(table.lookup('CGATAA+TTAGGC'),None)
+        # Missing second index
+        self.assertEqual(table.lookup('CGATGT'),None)
+
+    def test_mixed_single_and_dual_index(self):
+        """BarcodeTable: mixture of single and dual index barcodes
+        """
+        table = BarcodeTable(['ATTAGA','CGATGT-TTAGGC'],max_mismatches=1)
+        self.assertEqual(table.lookup('ATTAGA+GGGGGG'),'ATTAGA')
+        self.assertEqual(table.lookup('ATTAGAGGGGGG'),'ATTAGA')
+        self.assertEqual(table.lookup('CGATGT+TTAGGC'),'CGATGT-TTAGGC')
+
+    def test_collisions(self):
+        """BarcodeTable: detect barcodes within mismatch distance
+        """
+        table = BarcodeTable(['ACGTAC','ACGTAA'],max_mismatches=1)
+        collisions = dict(table.collisions)
+        self.assertEqual(sorted(collisions.keys()),
+                         ['ACGTAG','ACGTAN','ACGTAT'])
+        self.assertEqual(collisions['ACGTAT'],['ACGTAC','ACGTAA'])
+        # Ambiguous sequences aren't assigned
+        self.assertEqual(table.lookup('ACGTAT'),None)
+        # Exact matches take priority
+        self.assertEqual(table.lookup('ACGTAC'),'ACGTAC')
+        self.assertEqual(table.lookup('ACGTAA'),'ACGTAA')
+
+    def test_closest_barcode_wins(self):
+        """BarcodeTable: assign to the closest barcode
+        """
+        table = BarcodeTable(['AAAAAA','AAAATT'],max_mismatches=2)
+        self.assertEqual(table.match('AAAAAC'),('AAAAAA',1))
+        self.assertEqual(table.match('AAAATC'),('AAAATT',1))
+        self.assertEqual(table.lookup('AAAAAT'),None)
+
+    def test_scanning(self):
+        """BarcodeTable: compare with each barcode if table is too large
+        """
+        barcodes = ['ATTAGA','ACGTAC','ACGTAA','CGATGT-TTAGGC',
+                    'CGATGA-TTAGGC','GCCAAT-AGTTCC']
+        indexes = ['ATTAGA','ATTCGA','ATTAGAAT','ACGTAT','ACGTAC',
+                   'ACGNAA','ACG.AA','CGATGT+TTAGGC','CGATGTTTAGGC',
+                   'CGATGC-TTAGGC','CGAAGT+TTAGCC','GCCAAT-AGTTCA',
+                   'GCAAAT-AGTTCA','TTTTTT','CGAT']
+        for max_mismatches in (0,1,2):
+            table = BarcodeTable(barcodes,max_mismatches=max_mismatches)
+            scan = BarcodeTable(barcodes,max_mismatches=max_mismatches,
+                                max_table_size=0)
+            self.assertFalse(table.scanning)
+            self.assertTrue(scan.scanning)
+            self.assertEqual(scan.barcodes,table.barcodes)
+            self.assertEqual(scan.collisions,[])
+            for index in indexes:
+                self.assertEqual(scan.match(index),table.match(index),
+                                 "%s (%d mismatches)" % (index,
+                                                         max_mismatches))
+
+class TestBarcodeDistances(unittest.TestCase):
+
+    def setUp(self):
+        import bcftbx.barcodes
+        self.numpy = bcftbx.barcodes.numpy
+
+    def tearDown(self):
+        import bcftbx.barcodes
+        bcftbx.barcodes.numpy = self.numpy
+
+    def _distances(self,barcodes,use_numpy,**kws):
+        # Get BarcodeDistances with or without numpy
+        import bcftbx.barcodes
+        if use_numpy:
+            if self.numpy is None:
+                raise unittest.SkipTest("numpy not available")
+            bcftbx.barcodes.numpy = self.numpy
+        else:
+            bcftbx.barcodes.numpy = None
+        return BarcodeDistances(barcodes,**kws)
+
+    def _check_distances(self,use_numpy):
+        # Single index barcodes
+        distances = self._distances(['ATTAGA','CGATGT','ATTCGA'],use_numpy)
+        self.assertEqual(distances.distances,[1,5,1])
+        self.assertEqual(distances.nearest,[2,0,0])
+        self.assertEqual(distances.min_distance,1)
+        self.assertEqual(distances.max_mismatches,0)
+        self.assertEqual(distances.closest_pairs,[('ATTAGA','ATTCGA')])
+        # Dual index barcodes: distance is the larger of the
+        # distances for each component
+        distances = self._distances(['AAAAAA-CCCCCC',
+                                     'AAAAAA-CCCTTT',
+                                     'AAATTT-CCCCCC',
+                                     'AAAATT-CCCCTT'],use_numpy)
+        self.assertEqual(distances.distances,[2,2,2,2])
+        self.assertEqual(distances.nearest,[3,3,3,0])
+        self.assertEqual(distances.min_distance,2)
+        self.assertEqual(distances.max_mismatches,0)
+        self.assertEqual(distances.closest_pairs,[('AAAAAA-CCCCCC',
+                                                   'AAAATT-CCCCTT'),
+                                                  ('AAAAAA-CCCTTT',
+                                                   'AAAATT-CCCCTT'),
+                                                  ('AAATTT-CCCCCC',
+                                                   'AAAATT-CCCCTT')])
+        distances = self._distances(['AAAAAA-CCCCCC',
+                                     'AAAAAA-CCCTTT',
+                                     'AAATTT-CCCCCC'],use_numpy)
+        self.assertEqual(distances.min_distance,3)
+        self.assertEqual(distances.max_mismatches,1)
+        self.assertEqual(distances.closest_pairs,[('AAAAAA-CCCCCC',
+                                                   'AAAAAA-CCCTTT'),
+                                                  ('AAAAAA-CCCCCC',
+                                                   'AAATTT-CCCCCC'),
+                                                  ('AAAAAA-CCCTTT',
+                                                   'AAATTT-CCCCCC')])
+        # Truncated barcodes
+        distances = self._distances(['AAAAAA-CCCCCC',
+                                     'AAAAAA-CCCTTT',
+                                     'AAATTT-CCCCCC'],use_numpy,length=8)
+        self.assertEqual(distances.barcodes,['AAAAAA-CC',
+                                             'AAAAAA-CC',
+                                             'AAATTT-CC'])
+        self.assertEqual(distances.min_distance,0)
+        self.assertEqual(distances.max_mismatches,-1)
+        # Different lengths and missing components
+        distances = self._distances(['ATTAGA','ATTAGACG','ATTAGA-CCCC'],
+                                    use_numpy)
+        self.assertEqual(distances.distances,[0,0,0])
+        # Limit the number of pairs
+        distances = self._distances(['AAAA','AAAT','AATT','ATTT'],
+                                    use_numpy,max_pairs=2)
+        self.assertEqual(distances.closest_pairs,[('AAAA','AAAT'),
+                                                  ('AAAT','AATT')])
+        # Fewer than two barcodes
+        distances = self._distances(['ATTAGA'],use_numpy)
+        self.assertEqual(distances.min_distance,None)
+        self.assertEqual(distances.max_mismatches,None)
+        self.assertEqual(distances.closest_pairs,[])
+
+    def test_barcode_distances(self):
+        """BarcodeDistances: find minimum distances
+        """
+        self._check_distances(use_numpy=False)
+
+    def test_barcode_distances_numpy(self):
+        """BarcodeDistances: find minimum distances using numpy
+        """
+        self._check_distances(use_numpy=True)
+
+    def test_barcode_distances_large_set(self):
+        """BarcodeDistances: numpy and pure Python results agree
+        """
+        import random
+        rng = random.Random(1)
+        i7 = [''.join([rng.choice('ACGT') for i in xrange(8)])
+              for j in xrange(24)]
+        i5 = [''.join([rng.choice('ACGT') for i in xrange(8)])
+              for j in xrange(16)]
+        barcodes = ["%s-%s" % (a,b) for a in i7 for b in i5]
+        python = self._distances(barcodes,use_numpy=False)
+        numpy = self._distances(barcodes,use_numpy=True)
+        self.assertEqual(numpy.distances,python.distances)
+        self.assertEqual(numpy.min_distance,python.min_distance)
+        self.assertEqual(numpy.closest_pairs,python.closest_pairs)
+        # Compare sequences directly rather than using tables
+        import bcftbx.barcodes
+        max_table_size = bcftbx.barcodes.MAX_DISTANCE_TABLE_SIZE
+        try:
+            bcftbx.barcodes.MAX_DISTANCE_TABLE_SIZE = 0
+            direct = self._distances(barcodes,use_numpy=True)
+        finally:
+            bcftbx.barcodes.MAX_DISTANCE_TABLE_SIZE = max_table_size
+        self.assertEqual(direct.distances,python.distances)
+        self.assertEqual(direct.closest_pairs,python.closest_pairs)
+
+class TestMismatchNeighbourhood(unittest.TestCase):
+
+    def test_mismatch_neighbourhood(self):
+        """mismatch_neighbourhood: generate sequences
+        """
+        seqs = dict(mismatch_neighbourhood('AC',1))
+        self.assertEqual(len(seqs),9)
+        self.assertEqual(seqs['AC'],0)
+        self.assertEqual(seqs['NC'],1)
+        self.assertEqual(seqs['AG'],1)
+        seqs = dict(mismatch_neighbourhood('ACGTACGT',2))
+        self.assertEqual(len(seqs),1+8*4+28*16)
+        self.assertEqual(seqs['TCGTACGA'],2)
+
+    def test_neighbourhood_size(self):
+        """neighbourhood_size: count sequences in neighbourhood
+        """
+        for seq in ('A','AC','ACGTACGT'):
+            for max_mismatches in (0,1,2,3):
+                self.assertEqual(
+                    neighbourhood_size(len(seq),max_mismatches),
+                    len(list(mismatch_neighbourhood(seq,max_mismatches))))
+        self.assertEqual(neighbourhood_size(8,2),481)
+
+class TestSplitBarcode(unittest.TestCase):
+
+    def test_split_barcode(self):
+        """split_barcode: split into components
+        """
+        self.assertEqual(split_barcode('ATTAGA'),['ATTAGA'])
+        self.assertEqual(split_barcode('CGATGT-TTAGGC'),['CGATGT','TTAGGC'])
+        self.assertEqual(split_barcode('CGATGT+TTAGGC'),['CGATGT','TTAGGC'])
+
+class TestTruncateBarcode(unittest.TestCase):
+
+    def test_truncate_barcode(self):
+        """truncate_barcode: truncate single and dual index barcodes
+        """
+        self.assertEqual(truncate_barcode('CGTACTAG',6),'CGTACT')
+        self.assertEqual(truncate_barcode('CGTACTAG',10),'CGTACTAG')
+        self.assertEqual(truncate_barcode('AGGCAGAA-TAGATCGC',6),'AGGCAG')
+        self.assertEqual(truncate_barcode('AGGCAGAA-TAGATCGC',10),
+                         'AGGCAGAA-TA')
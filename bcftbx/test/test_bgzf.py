@@ -0,0 +1,228 @@
+#######################################################################
+# Tests for bgzf.py module
+#######################################################################
+from bcftbx.bgzf import *
+from bcftbx.FASTQFile import FastqIterator,get_fastq_file_handle
+import bcftbx.utils
+import unittest
+import os
+import gzip
+import shutil
+import tempfile
+from multiprocessing.pool import ThreadPool
+
+fastq_data = """@73D9FA:3:FC:1:1:7507:1000 1:N:0:
+NACAACCTGATTAGCGGCGTTGACAGATGTATCCAT
++
+#))))55445@@@@@C@@@@@@@@@:::::<<:::<
+@73D9FA:3:FC:1:1:15740:1000 1:N:0:
+NTCTTGCTTGGTGGCGCTGGTTTCGTGACAGAGTTC
++
+#+.)))+)@@@@@7@@@@@@@@@;;;;;@<<@@@@@
+"""
+
+class BaseBgzfTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.wd = tempfile.mkdtemp()
+        # Enough data to fill multiple blocks
+        self.data = fastq_data*5000
+
+    def tearDown(self):
+        shutil.rmtree(self.wd)
+
+    def write_bgzf(self,name,data,threads=2):
+        filen = os.path.join(self.wd,name)
+        fp = BgzfWriter(filen,threads=threads)
+        # Write in odd-sized pieces
+        for i in xrange(0,len(data),10000):
+            fp.write(data[i:i+10000])
+        fp.close()
+        return filen
+
+class TestBgzfWriter(BaseBgzfTestCase):
+
+    def test_write_is_valid_gzip(self):
+        """BgzfWriter: output can be read by gzip module
+        """
+        filen = self.write_bgzf("test.fastq.gz",self.data)
+        self.assertEqual(gzip.open(filen,'rb').read(),self.data)
+
+    def test_write_single_thread(self):
+        """BgzfWriter: output is the same using one thread
+        """
+        filen1 = self.write_bgzf("test1.fastq.gz",self.data,threads=1)
+        filen2 = self.write_bgzf("test2.fastq.gz",self.data,threads=4)
+        self.assertEqual(open(filen1,'rb').read(),open(filen2,'rb').read())
+
+    def test_write_shared_pool(self):
+        """BgzfWriter: writers can share a thread pool
+        """
+        filen = self.write_bgzf("test.fastq.gz",self.data,threads=1)
+        pool = ThreadPool(2)
+        try:
+            filens = [os.path.join(self.wd,"test%d.fastq.gz" % i)
+                      for i in xrange(3)]
+            fps = [BgzfWriter(f,threads=2,pool=pool) for f in filens]
+            for i in xrange(0,len(self.data),10000):
+                for fp in fps:
+                    fp.write(self.data[i:i+10000])
+            for fp in fps:
+                fp.close()
+            # Pool is still usable after the writers are closed
+            self.assertEqual(pool.map(len,['a','bb']),[1,2])
+        finally:
+            pool.close()
+            pool.join()
+        for f in filens:
+            self.assertEqual(open(f,'rb').read(),open(filen,'rb').read())
+
+    def test_write_has_eof_marker(self):
+        """BgzfWriter: output ends with BGZF EOF marker
+        """
+        filen = self.write_bgzf("test.fastq.gz",self.data)
+        data = open(filen,'rb').read()
+        self.assertTrue(data.endswith(BGZF_EOF))
+        self.assertTrue(is_bgzf(filen))
+
+    def test_write_empty_file(self):
+        """BgzfWriter: empty output contains only EOF marker
+        """
+        filen = self.write_bgzf("test.fastq.gz","")
+        self.assertEqual(open(filen,'rb').read(),BGZF_EOF)
+        self.assertEqual(gzip.open(filen,'rb').read(),"")
+
+class TestBgzfReader(BaseBgzfTestCase):
+
+    def test_read_bgzf(self):
+        """BgzfReader: read all data from BGZF file
+        """
+        filen = self.write_bgzf("test.fastq.gz",self.data)
+        fp = BgzfReader(filen,threads=2)
+        self.assertEqual(fp.read(),self.data)
+        fp.close()
+
+    def test_read_bgzf_in_chunks(self):
+        """BgzfReader: read data from BGZF file in chunks
+        """
+        filen = self.write_bgzf("test.fastq.gz",self.data)
+        chunks = []
+        with BgzfReader(filen,threads=2) as fp:
+            while True:
+                data = fp.read(12345)
+                if not data:
+                    break
+                chunks.append(data)
+        self.assertEqual(''.join(chunks),self.data)
+
+    def test_read_lines(self):
+        """BgzfReader: iterate over lines
+        """
+        filen = self.write_bgzf("test.fastq.gz",self.data)
+        with BgzfReader(filen) as fp:
+            lines = [line for line in fp]
+        self.assertEqual(lines,self.data.splitlines(True))
+
+    def test_readinto(self):
+        """BgzfReader: read data using readinto
+        """
+        filen = self.write_bgzf("test.fastq.gz",fastq_data)
+        buf = bytearray(100)
+        with BgzfReader(filen) as fp:
+            n = fp.readinto(buf)
+        self.assertEqual(n,100)
+        self.assertEqual(str(buf),fastq_data[:100])
+
+    def test_read_gzip(self):
+        """BgzfReader: read data from ordinary gzip file
+        """
+        filen = os.path.join(self.wd,"test.fastq.gz")
+        fp = gzip.open(filen,'wb')
+        fp.write(self.data)
+        fp.close()
+        self.assertFalse(is_bgzf(filen))
+        with BgzfReader(filen) as fp:
+            self.assertEqual(fp.read(),self.data)
+
+    def test_read_multi_member_gzip(self):
+        """BgzfReader: read data from multi-member gzip file
+        """
+        filen = os.path.join(self.wd,"test.fastq.gz")
+        for data in (self.data,fastq_data,self.data):
+            fp = gzip.open(filen,'ab')
+            fp.write(data)
+            fp.close()
+        with BgzfReader(filen) as fp:
+            self.assertEqual(fp.read(),self.data+fastq_data+self.data)
+
+    def test_close_before_eof(self):
+        """BgzfReader: close before reading all the data
+        """
+        filen = self.write_bgzf("test.fastq.gz",self.data*4)
+        fp = BgzfReader(filen,queue_size=1)
+        fp.readline()
+        fp.close()
+        self.assertTrue(fp.closed)
+
+    def test_truncated_bgzf_raises_ioerror(self):
+        """BgzfReader: raise IOError for truncated BGZF file
+        """
+        filen = self.write_bgzf("test.fastq.gz",self.data)
+        data = open(filen,'rb').read()
+        open(filen,'wb').write(data[:len(data)//2])
+        fp = BgzfReader(filen)
+        self.assertRaises(IOError,fp.read)
+        fp.close()
+
+    def test_truncated_gzip_raises_ioerror(self):
+        """BgzfReader: raise IOError for truncated ordinary gzip file
+        """
+        filen = os.path.join(self.wd,"test.fastq.gz")
+        fp = gzip.open(filen,'wb')
+        fp.write(self.data)
+        fp.close()
+        data = open(filen,'rb').read()
+        # Truncated part way through and just before the end
+        for size in (len(data)//2,len(data)-4):
+            open(filen,'wb').write(data[:size])
+            fp = BgzfReader(filen)
+            self.assertRaises(IOError,fp.read)
+            fp.close()
+
+class TestBgzfFastqHandling(BaseBgzfTestCase):
+
+    def test_get_fastq_file_handle_bgzf(self):
+        """get_fastq_file_handle: returns BgzfReader for BGZF file
+        """
+        filen = self.write_bgzf("test.fastq.gz",self.data)
+        fp = get_fastq_file_handle(filen)
+        self.assertTrue(isinstance(fp,BgzfReader))
+        fp.close()
+
+    def test_fastq_iterator_bgzf(self):
+        """FastqIterator: iterate over reads in BGZF file
+        """
+        filen = self.write_bgzf("test.fastq.gz",self.data)
+        nreads = 0
+        for read in FastqIterator(filen):
+            nreads += 1
+        self.assertEqual(nreads,10000)
+
+    def test_concatenate_fastq_files_bgzf(self):
+        """concatenate_fastq_files: write BGZF output
+        """
+        fastqs = []
+        for name in ("PB1.fastq.gz","PB2.fastq"):
+            filen = os.path.join(self.wd,name)
+            if name.endswith('.gz'):
+                fp = gzip.open(filen,'wb')
+            else:
+                fp = open(filen,'wb')
+            fp.write(self.data)
+            fp.close()
+            fastqs.append(filen)
+        merged = os.path.join(self.wd,"merged.fastq.gz")
+        bcftbx.utils.concatenate_fastq_files(merged,fastqs,bgzf=True,
+                                             verbose=False)
+        self.assertTrue(is_bgzf(merged))
+        self.assertEqual(gzip.open(merged,'rb').read(),self.data*2)
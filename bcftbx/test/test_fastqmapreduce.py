@@ -0,0 +1,264 @@
+#######################################################################
+# Tests for fastqmapreduce.py module
+#######################################################################
+from bcftbx.fastqmapreduce import *
+from bcftbx.fastqmapreduce import _data_chunks
+from bcftbx.bgzf import BgzfWriter
+from bcftbx.gzindex import get_index
+from bcftbx.FASTQFile import nreads
+from bcftbx.FASTQFile import validate_fastq
+from bcftbx.test.mock_data import make_fastq_data
+import unittest
+import os
+import gzip
+import shutil
+import operator
+import tempfile
+
+# Quality lines can start with '@' or '+' (to check records
+# are located correctly)
+FASTQ_DATA_ARGS = dict(lengths=(1,40),quality='@+#AEFJ',
+                       indexes=('CGATGT','TTAGGC'))
+
+def count_reads(chunk):
+    return sum(1 for r in chunk.reads())
+
+def first_read_name(chunk):
+    for r in chunk.reads():
+        return str(r.seqid)
+
+class TestGetChunks(unittest.TestCase):
+
+    def setUp(self):
+        self.wd = tempfile.mkdtemp()
+        self.data = make_fastq_data(2000,**FASTQ_DATA_ARGS)
+
+    def tearDown(self):
+        shutil.rmtree(self.wd)
+
+    def make_fastq(self,name,data=None):
+        if data is None:
+            data = self.data
+        fastq = os.path.join(self.wd,name)
+        if name.endswith('.gz'):
+            fp = gzip.open(fastq,'wb')
+        else:
+            fp = open(fastq,'wb')
+        fp.write(data)
+        fp.close()
+        return fastq
+
+    def test_plain_chunks(self):
+        """get_chunks: split uncompressed FASTQ into chunks
+        """
+        fastq = self.make_fastq("test.fastq")
+        for chunk_size in (1,97,1000,len(self.data)*2):
+            chunks = list(get_chunks(fastq,chunk_size=chunk_size))
+            self.assertEqual(''.join([c.data() for c in chunks]),self.data)
+            self.assertEqual([c.number for c in chunks],range(len(chunks)))
+
+    def test_plain_chunks_no_trailing_newline(self):
+        """get_chunks: handle FASTQ with no final newline
+        """
+        fastq = self.make_fastq("test.fastq",self.data[:-1])
+        chunks = list(get_chunks(fastq,chunk_size=333))
+        self.assertEqual(''.join([c.data() for c in chunks]),self.data)
+
+    def test_plain_chunks_empty_file(self):
+        """get_chunks: handle empty FASTQ
+        """
+        fastq = self.make_fastq("test.fastq","")
+        chunks = list(get_chunks(fastq))
+        self.assertEqual(''.join([c.data() for c in chunks]),"")
+
+    def test_bgzf_chunks(self):
+        """get_chunks: split BGZF FASTQ into chunks
+        """
+        fastq = os.path.join(self.wd,"test.fastq.gz")
+        fp = BgzfWriter(fastq)
+        for i in xrange(10):
+            fp.write(self.data)
+        fp.close()
+        chunks = list(get_chunks(fastq,chunk_size=1))
+        self.assertTrue(len(chunks) > 1)
+        self.assertEqual(''.join([c.data() for c in chunks]),self.data*10)
+
+    def test_indexed_chunks(self):
+        """get_chunks: split gzipped FASTQ into chunks using index
+        """
+        fastq = self.make_fastq("test.fastq.gz",self.data*10)
+        # Build index with checkpoints closer than the default
+        get_index(fastq,span=10000)
+        chunks = list(get_chunks(fastq,chunk_size=1))
+        self.assertTrue(len(chunks) > 1)
+        self.assertEqual(''.join([c.data() for c in chunks]),self.data*10)
+        self.assertTrue(os.path.exists(fastq+".gzidx"))
+
+    def test_gzip_chunks_without_index(self):
+        """get_chunks: gzipped FASTQ without index is read sequentially
+        """
+        fastq = self.make_fastq("test.fastq.gz")
+        chunks = list(get_chunks(fastq,chunk_size=1000))
+        self.assertTrue(len(chunks) > 1)
+        self.assertEqual(''.join([c.data() for c in chunks]),self.data)
+        self.assertFalse(os.path.exists(fastq+".gzidx"))
+
+    def test_data_chunks(self):
+        """get_chunks: split gzipped FASTQ by reading sequentially
+        """
+        fastq = self.make_fastq("test.fastq.gz")
+        chunks = list(_data_chunks(fastq,1000))
+        self.assertTrue(len(chunks) > 1)
+        self.assertEqual(''.join([c.data() for c in chunks]),self.data)
+
+class TestFastqMapReduce(unittest.TestCase):
+
+    def setUp(self):
+        self.wd = tempfile.mkdtemp()
+        self.data = make_fastq_data(2000,**FASTQ_DATA_ARGS)
+        self.fastq = os.path.join(self.wd,"test.fastq")
+        with open(self.fastq,'w') as fp:
+            fp.write(self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.wd)
+
+    def test_fastq_map_preserves_order(self):
+        """fastq_map: results are returned in chunk order
+        """
+        expected = [first_read_name(c)
+                    for c in get_chunks(self.fastq,chunk_size=5000)]
+        for nprocs in (1,2):
+            self.assertEqual(list(fastq_map(self.fastq,first_read_name,
+                                            nprocs=nprocs,
+                                            chunk_size=5000)),
+                             expected)
+
+    def test_fastq_map_reduce(self):
+        """fastq_map_reduce: count reads in parallel
+        """
+        for nprocs in (1,2,4):
+            self.assertEqual(fastq_map_reduce(self.fastq,count_reads,
+                                              operator.add,nprocs=nprocs,
+                                              chunk_size=5000),2000)
+
+    def test_fastq_map_reduce_initial(self):
+        """fastq_map_reduce: use initial value for reduction
+        """
+        self.assertEqual(fastq_map_reduce(self.fastq,count_reads,
+                                          operator.add,initial=10,
+                                          nprocs=2,chunk_size=5000),2010)
+
+    def test_nreads(self):
+        """nreads: count reads in chunks
+        """
+        self.assertEqual(nreads(self.fastq),2000)
+        self.assertEqual(nreads(self.fastq,nprocs=2),2000)
+        gz_fastq = self.fastq+".gz"
+        fp = gzip.open(gz_fastq,'wb')
+        fp.write(self.data)
+        fp.close()
+        self.assertEqual(nreads(gz_fastq,nprocs=2),2000)
+        # Count for gzipped FASTQ comes from the index
+        self.assertTrue(os.path.exists(gz_fastq+".gzidx"))
+        self.assertEqual(get_index(gz_fastq).nlines,8000)
+        self.assertEqual(nreads(gz_fastq),2000)
+
+class TestValidateFastq(unittest.TestCase):
+
+    def setUp(self):
+        self.wd = tempfile.mkdtemp()
+        self.data = make_fastq_data(2000,**FASTQ_DATA_ARGS)
+        self.lines = self.data.split('\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.wd)
+
+    def make_fastq(self,name,data):
+        fastq = os.path.join(self.wd,name)
+        if name.endswith('.gz'):
+            fp = gzip.open(fastq,'wb')
+        else:
+            fp = open(fastq,'wb')
+        fp.write(data)
+        fp.close()
+        return fastq
+
+    def test_validate_fastq(self):
+        """validate_fastq: check valid FASTQs
+        """
+        for name in ("test.fastq","test.fastq.gz"):
+            fastq = self.make_fastq(name,self.data)
+            for nprocs in (1,2):
+                result = validate_fastq(fastq,nprocs=nprocs,
+                                        chunk_size=5000)
+                self.assertTrue(result.valid)
+                self.assertEqual(result.nreads,2000)
+                self.assertEqual(result.error,None)
+                self.assertEqual(result.metadata.nreads,2000)
+
+    def test_validate_fastq_bad_separator(self):
+        """validate_fastq: detect bad separator line
+        """
+        self.lines[4*1234+2] = 'x'
+        data = '\n'.join(self.lines)
+        fastq = self.make_fastq("test.fastq",data)
+        for nprocs in (1,2):
+            result = validate_fastq(fastq,nprocs=nprocs,chunk_size=5000)
+            self.assertFalse(result.valid)
+            self.assertEqual(result.nreads,2000)
+            self.assertEqual(result.read_number,1235)
+            self.assertEqual(data[result.offset:].split('\n')[0],
+                             self.lines[4*1234])
+
+    def test_validate_fastq_length_mismatch(self):
+        """validate_fastq: detect sequence/quality length mismatch
+        """
+        self.lines[4*777+3] += 'A'
+        fastq = self.make_fastq("test.fastq",'\n'.join(self.lines))
+        for nprocs in (1,2):
+            result = validate_fastq(fastq,nprocs=nprocs,chunk_size=5000)
+            self.assertFalse(result.valid)
+            self.assertEqual(result.read_number,778)
+
+    def test_validate_fastq_truncated(self):
+        """validate_fastq: detect truncated FASTQ
+        """
+        # Remove the quality line from the last read
+        fastq = self.make_fastq("test.fastq",
+                                '\n'.join(self.lines[:-2])+'\n')
+        result = validate_fastq(fastq,nprocs=2,chunk_size=5000)
+        self.assertFalse(result.valid)
+        self.assertEqual(result.nreads,1999)
+        self.assertEqual(result.read_number,2000)
+
+    def test_validate_fastq_truncated_gzip(self):
+        """validate_fastq: detect truncated gzipped FASTQ
+        """
+        gz_data = open(self.make_fastq("test.fastq.gz",self.data),
+                       'rb').read()
+        fastq = self.make_fastq("truncated.fastq.gz.part",
+                                gz_data[:len(gz_data)//2])
+        fastq_gz = os.path.join(self.wd,"truncated.fastq.gz")
+        os.rename(fastq,fastq_gz)
+        results = [validate_fastq(fastq_gz,nprocs=nprocs,chunk_size=5000)
+                   for nprocs in (1,2,4)]
+        for result in results:
+            self.assertFalse(result.valid)
+            self.assertTrue(result.error.startswith("Error reading data"))
+            self.assertTrue(result.nreads < 2000)
+        # Same result regardless of the number of processes
+        self.assertEqual(len(set([(r.nreads,r.read_number,r.error)
+                                  for r in results])),1)
+
+    def test_validate_fastq_quality_range(self):
+        """validate_fastq: check quality values
+        """
+        fastq = self.make_fastq("test.fastq",self.data)
+        result = validate_fastq(fastq,quality_range=(33,126),nprocs=2,
+                                chunk_size=5000)
+        self.assertTrue(result.valid)
+        result = validate_fastq(fastq,quality_range=(33,70),nprocs=2,
+                                chunk_size=5000)
+        self.assertFalse(result.valid)
+        self.assertEqual(result.nreads,2000)
@@ -0,0 +1,174 @@
+#######################################################################
+# Tests for fastqmeta.py module
+#######################################################################
+from bcftbx.fastqmeta import *
+from bcftbx.FASTQFile import FastqIterator
+from bcftbx.FASTQFile import FastqAttributes
+from bcftbx.FASTQFile import iter_batches
+from bcftbx.FASTQFile import nreads
+from bcftbx.utils import concatenate_fastq_files
+from bcftbx.test.mock_data import make_fastq_data
+import unittest
+import os
+import gzip
+import time
+import shutil
+import tempfile
+
+class TestFastqMetadata(unittest.TestCase):
+
+    def setUp(self):
+        self.wd = tempfile.mkdtemp()
+        self.data = make_fastq_data(1000)
+        self.fastq = os.path.join(self.wd,"test.fastq.gz")
+        fp = gzip.open(self.fastq,'wb')
+        fp.write(self.data)
+        fp.close()
+        # Expected values
+        lines = self.data.split('\n')
+        seqs = lines[1::4][:1000]
+        quals = ''.join(lines[3::4])
+        self.expected = dict(nreads=1000,
+                             nbases=sum([len(s) for s in seqs]),
+                             min_length=min([len(s) for s in seqs]),
+                             max_length=max([len(s) for s in seqs]),
+                             min_quality=ord(min(quals)),
+                             max_quality=ord(max(quals)))
+
+    def tearDown(self):
+        shutil.rmtree(self.wd)
+
+    def check_metadata(self,metadata):
+        for attr in self.expected:
+            self.assertEqual(getattr(metadata,attr),self.expected[attr],
+                             "%s: %s != %s" % (attr,
+                                               getattr(metadata,attr),
+                                               self.expected[attr]))
+
+    def test_add_read(self):
+        """FastqMetadata: accumulate statistics from reads
+        """
+        metadata = FastqMetadata()
+        for read in FastqIterator(self.fastq):
+            metadata.add_read(read)
+        self.check_metadata(metadata)
+        self.assertEqual(metadata.encoding,'Phred+33')
+
+    def test_add_batch(self):
+        """FastqMetadata: accumulate statistics from batches
+        """
+        import bcftbx.FASTQFile
+        if bcftbx.FASTQFile.numpy is None:
+            raise unittest.SkipTest("numpy not available")
+        metadata = FastqMetadata()
+        for batch in iter_batches(self.fastq,batch_size=300):
+            metadata.add_batch(batch)
+        self.check_metadata(metadata)
+
+    def test_merge(self):
+        """FastqMetadata: merge statistics
+        """
+        metadata1 = FastqMetadata()
+        metadata2 = FastqMetadata()
+        for i,read in enumerate(FastqIterator(self.fastq)):
+            if i < 400:
+                metadata1.add_read(read)
+            else:
+                metadata2.add_read(read)
+        self.check_metadata(metadata1.merge(metadata2))
+        self.check_metadata(FastqMetadata().merge(metadata1))
+
+    def test_build_metadata(self):
+        """build_metadata: generate metadata in parallel
+        """
+        metadata = build_metadata(self.fastq,nprocs=2)
+        self.check_metadata(metadata)
+        self.assertTrue(metadata.is_current())
+
+    def test_get_metadata(self):
+        """get_metadata: metadata is cached and reused
+        """
+        metadata = get_metadata(self.fastq)
+        self.check_metadata(metadata)
+        self.assertTrue(os.path.exists(self.fastq+META_EXT))
+        metadata = cached_metadata(self.fastq)
+        self.assertNotEqual(metadata,None)
+        self.check_metadata(metadata)
+        self.assertEqual(metadata.encoding,'Phred+33')
+
+    def test_metadata_out_of_date(self):
+        """cached_metadata: metadata is ignored if file changes
+        """
+        get_metadata(self.fastq)
+        self.assertNotEqual(cached_metadata(self.fastq),None)
+        # Replace the file
+        time.sleep(0.01)
+        fp = gzip.open(self.fastq,'wb')
+        fp.write(make_fastq_data(10))
+        fp.close()
+        self.assertEqual(cached_metadata(self.fastq),None)
+        self.assertEqual(get_metadata(self.fastq).nreads,10)
+
+    def test_bad_metadata_file(self):
+        """cached_metadata: bad metadata file is ignored
+        """
+        with open(self.fastq+META_EXT,'w') as fp:
+            fp.write("not metadata\n")
+        self.assertEqual(cached_metadata(self.fastq),None)
+        self.check_metadata(get_metadata(self.fastq))
+
+    def test_metadata_file_in_cache_dir(self):
+        """metadata_file: use cache dir for read-only directory
+        """
+        if os.geteuid() == 0:
+            raise unittest.SkipTest("directories are always writable "
+                                    "for root")
+        os.chmod(self.wd,0555)
+        try:
+            meta_file = metadata_file(self.fastq,cache_dir="/cache")
+        finally:
+            os.chmod(self.wd,0755)
+        self.assertTrue(meta_file.startswith("/cache/"))
+        self.assertTrue(meta_file.endswith(META_EXT))
+
+    def test_nreads_uses_metadata(self):
+        """nreads: read count is taken from cached metadata
+        """
+        metadata = FastqMetadata(nreads=12345)
+        save_metadata(self.fastq,metadata)
+        self.assertEqual(nreads(self.fastq),12345)
+        self.assertEqual(FastqAttributes(self.fastq).nreads,12345)
+
+    def test_concatenate_fastq_files(self):
+        """concatenate_fastq_files: metadata for merged FASTQ
+        """
+        fastq2 = os.path.join(self.wd,"test2.fastq.gz")
+        fp = gzip.open(fastq2,'wb')
+        fp.write(make_fastq_data(10,seed=54321))
+        fp.close()
+        merged_fastq = os.path.join(self.wd,"merged.fastq.gz")
+        # No metadata for inputs
+        concatenate_fastq_files(merged_fastq,[self.fastq,fastq2],
+                                verbose=False)
+        self.assertEqual(cached_metadata(merged_fastq),None)
+        # Metadata for inputs
+        os.remove(merged_fastq)
+        get_metadata(self.fastq)
+        get_metadata(fastq2)
+        concatenate_fastq_files(merged_fastq,[self.fastq,fastq2],
+                                verbose=False)
+        metadata = cached_metadata(merged_fastq)
+        self.assertNotEqual(metadata,None)
+        self.assertEqual(metadata.nreads,1010)
+        self.assertEqual(metadata.nbases,build_metadata(merged_fastq).nbases)
+
+class TestDetectEncoding(unittest.TestCase):
+
+    def test_detect_encoding(self):
+        """detect_encoding: identify quality encodings
+        """
+        self.assertEqual(detect_encoding(ord('#'),ord('J')),'Phred+33')
+        self.assertEqual(detect_encoding(ord(';'),ord('h')),'Solexa+64')
+        self.assertEqual(detect_encoding(ord('B'),ord('h')),'Phred+64')
+        self.assertEqual(detect_encoding(ord('A'),ord('J')),None)
+        self.assertEqual(detect_encoding(None,None),None)
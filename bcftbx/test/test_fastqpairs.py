@@ -0,0 +1,189 @@
+#######################################################################
+# Tests for fastqpairs.py module
+#######################################################################
+from bcftbx.fastqpairs import *
+from bcftbx.FASTQFile import FastqIterator
+import bcftbx.fastqpairs as fastqpairs
+import unittest
+import os
+import gzip
+import shutil
+import random
+import tempfile
+
+def make_read(name,read_number,seq='ACGTACGT'):
+    return "@%s %d:N:0:CGATGT\n%s\n+\n%s\n" % (name,read_number,seq,'E'*len(seq))
+
+def read_names(fastq):
+    return [r.raw_seqid.split()[0] for r in FastqIterator(fastq)]
+
+class TestReadIndexSet(unittest.TestCase):
+
+    def test_read_index_set(self):
+        """ReadIndexSet: add and check read positions
+        """
+        s = ReadIndexSet(20)
+        self.assertEqual(len(s),0)
+        s.add(0)
+        s.add(9)
+        s.add(19)
+        s.add(9)
+        self.assertEqual(len(s),3)
+        self.assertTrue(0 in s)
+        self.assertTrue(9 in s)
+        self.assertTrue(19 in s)
+        self.assertFalse(1 in s)
+        self.assertFalse(8 in s)
+
+class TestReadName(unittest.TestCase):
+
+    def test_read_name(self):
+        """read_name: extract name from read headers
+        """
+        self.assertEqual(read_name("@HWI-ST1:1:FC:1:1:1:1 1:N:0:ACG"),
+                         "@HWI-ST1:1:FC:1:1:1:1")
+        self.assertEqual(read_name("@HWI-ST1:1:FC:1:1:1:1 2:N:0:ACG"),
+                         "@HWI-ST1:1:FC:1:1:1:1")
+        self.assertEqual(read_name("@HWUSI-EAS100R:6:73:941:1973#0/1"),
+                         "@HWUSI-EAS100R:6:73:941:1973#0")
+        self.assertEqual(read_name("@VAB_1_1_6_F3"),"@VAB_1_1_6_F3")
+
+class TestSingletons(unittest.TestCase):
+
+    def setUp(self):
+        self.wd = tempfile.mkdtemp()
+        # Interleaved pairs in random order, with singletons
+        rng = random.Random(1234)
+        reads = []
+        self.singles = set()
+        for i in xrange(500):
+            name = "RUN:1:FC:1:1101:%d:1000" % i
+            if i%7 == 0:
+                reads.append(make_read(name,rng.choice((1,2))))
+                self.singles.add("@"+name)
+            else:
+                reads.append(make_read(name,1))
+                reads.append(make_read(name,2))
+        rng.shuffle(reads)
+        self.fastq = os.path.join(self.wd,"test.fastq")
+        with open(self.fastq,'w') as fp:
+            fp.write(''.join(reads))
+        self.names = read_names(self.fastq)
+        self.numpy = fastqpairs.numpy
+
+    def tearDown(self):
+        fastqpairs.numpy = self.numpy
+        shutil.rmtree(self.wd)
+
+    def check_singletons(self,singles):
+        self.assertEqual(singles.nreads,len(self.names))
+        self.assertEqual(len(singles),len(self.singles))
+        for i,name in enumerate(self.names):
+            self.assertEqual(i in singles,name in self.singles)
+
+    def test_find_singletons(self):
+        """find_singletons: locate singleton reads
+        """
+        self.check_singletons(find_singletons(self.fastq))
+
+    def test_find_singletons_spill_to_disk(self):
+        """find_singletons: locate singletons with keys spilled to disk
+        """
+        tmp_dir = os.path.join(self.wd,"tmp")
+        os.mkdir(tmp_dir)
+        singles = find_singletons(self.fastq,
+                                  max_memory=100*KEY_RECORD_SIZE,
+                                  partitions=4,
+                                  tmp_dir=tmp_dir)
+        self.check_singletons(singles)
+        self.assertEqual(os.listdir(tmp_dir),[])
+
+    def test_find_singletons_hash_collisions(self):
+        """find_singletons: resolve read names with colliding keys
+        """
+        # Replace the hashing with one which collides a lot
+        fastqpairs.hash = lambda name: len(name)
+        try:
+            self.check_singletons(find_singletons(self.fastq))
+        finally:
+            del fastqpairs.hash
+
+    def test_find_singletons_no_numpy(self):
+        """find_singletons: locate singletons without numpy
+        """
+        fastqpairs.numpy = None
+        self.check_singletons(find_singletons(self.fastq))
+        tmp_dir = os.path.join(self.wd,"tmp")
+        os.mkdir(tmp_dir)
+        self.check_singletons(
+            find_singletons(self.fastq,
+                            max_memory=100*KEY_RECORD_SIZE_NO_NUMPY,
+                            partitions=4,
+                            tmp_dir=tmp_dir))
+        fastqpairs.hash = lambda name: len(name)
+        try:
+            self.check_singletons(find_singletons(self.fastq))
+        finally:
+            del fastqpairs.hash
+
+    def test_remove_singletons(self):
+        """remove_singletons: write paired and singleton reads
+        """
+        paired = os.path.join(self.wd,"paired.fastq")
+        singles = os.path.join(self.wd,"singles.fastq.gz")
+        npaired,nsingles = remove_singletons(self.fastq,paired,singles)
+        self.assertEqual(nsingles,len(self.singles))
+        self.assertEqual(npaired,len(self.names)-len(self.singles))
+        self.assertEqual(read_names(paired),
+                         [n for n in self.names if n not in self.singles])
+        self.assertEqual(sorted(read_names(singles)),sorted(self.singles))
+
+class TestResyncPairs(unittest.TestCase):
+
+    def setUp(self):
+        self.wd = tempfile.mkdtemp()
+        self.fastq1 = os.path.join(self.wd,"test_R1.fastq.gz")
+        self.fastq2 = os.path.join(self.wd,"test_R2.fastq")
+        names = ["@RUN:1:FC:1:1101:%04d:1000" % i for i in xrange(100)]
+        self.pairs = [n for i,n in enumerate(names) if i%5 and i%7]
+        # Reads which are missing from just one of the inputs
+        self.singles = [n for i,n in enumerate(names)
+                        if bool(i%5) != bool(i%7)]
+        fp1 = gzip.open(self.fastq1,'wb')
+        fp2 = open(self.fastq2,'w')
+        for i,name in enumerate(names):
+            if i%5:
+                fp1.write(make_read(name[1:],1))
+            if i%7:
+                fp2.write(make_read(name[1:],2))
+        fp1.close()
+        fp2.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.wd)
+
+    def test_resync_pairs(self):
+        """resync_pairs: re-synchronise sorted R1/R2 FASTQs
+        """
+        out1 = os.path.join(self.wd,"out_R1.fastq")
+        out2 = os.path.join(self.wd,"out_R2.fastq.gz")
+        singles = os.path.join(self.wd,"singles.fastq")
+        npairs,nsingles = resync_pairs(self.fastq1,self.fastq2,
+                                       out1,out2,singles)
+        self.assertEqual(npairs,len(self.pairs))
+        self.assertEqual(nsingles,len(self.singles))
+        self.assertEqual(read_names(out1),self.pairs)
+        self.assertEqual(read_names(out2),self.pairs)
+        self.assertEqual(read_names(singles),self.singles)
+
+    def test_resync_pairs_not_sorted(self):
+        """resync_pairs: raise exception for unsorted FASTQ
+        """
+        with open(self.fastq2,'w') as fp:
+            fp.write(make_read("RUN:1:FC:1:1101:0002:1000",2))
+            fp.write(make_read("RUN:1:FC:1:1101:0001:1000",2))
+        self.assertRaises(Exception,
+                          resync_pairs,
+                          self.fastq1,self.fastq2,
+                          os.path.join(self.wd,"out_R1.fastq"),
+                          os.path.join(self.wd,"out_R2.fastq"))
@@ -0,0 +1,111 @@
+#######################################################################
+# Tests for fastqsort.py module
+#######################################################################
+from bcftbx.fastqsort import *
+from bcftbx.FASTQFile import FastqIterator
+from bcftbx.test.mock_data import make_fastq_data
+import unittest
+import os
+import gzip
+import shutil
+import tempfile
+
+def read_names(fastq):
+    return [r.raw_seqid.split()[0] for r in FastqIterator(fastq)]
+
+class TestSortFastq(unittest.TestCase):
+
+    def setUp(self):
+        self.wd = tempfile.mkdtemp()
+        # Reads from several tiles in random order
+        self.data = make_fastq_data(2000,lengths=(20,20),bases='ACGT',
+                                    quality='E',tiles=(1101,1102,2101))
+        self.fastq = os.path.join(self.wd,"test.fastq")
+        with open(self.fastq,'w') as fp:
+            fp.write(self.data)
+        self.names = read_names(self.fastq)
+
+    def tearDown(self):
+        shutil.rmtree(self.wd)
+
+    def check_sorted(self,sorted_fastq,key):
+        self.assertEqual(read_names(sorted_fastq),
+                         sorted(self.names,key=key))
+        self.assertEqual(sorted([str(r) for r in FastqIterator(sorted_fastq)]),
+                         sorted([str(r) for r in FastqIterator(self.fastq)]))
+
+    def test_sort_fastq_by_name(self):
+        """sort_fastq: sort reads into lexical order
+        """
+        sorted_fastq = os.path.join(self.wd,"sorted.fastq")
+        self.assertEqual(sort_fastq(self.fastq,sorted_fastq),2000)
+        self.check_sorted(sorted_fastq,name_key)
+
+    def test_sort_fastq_illumina(self):
+        """sort_fastq: sort reads into natural Illumina order
+        """
+        sorted_fastq = os.path.join(self.wd,"sorted.fastq.gz")
+        self.assertEqual(sort_fastq(self.fastq,sorted_fastq,key='illumina'),
+                         2000)
+        self.check_sorted(sorted_fastq,illumina_key)
+
+    def test_sort_fastq_multiple_runs(self):
+        """sort_fastq: sort using multiple runs and merge levels
+        """
+        fastq = os.path.join(self.wd,"test.fastq.gz")
+        fp = gzip.open(fastq,'wb')
+        fp.write(self.data)
+        fp.close()
+        sorted_fastq = os.path.join(self.wd,"sorted.fastq")
+        tmp_dir = os.path.join(self.wd,"tmp")
+        os.mkdir(tmp_dir)
+        self.assertEqual(sort_fastq(fastq,sorted_fastq,key='illumina',
+                                    run_size=4096,tmp_dir=tmp_dir,
+                                    max_merge=3),2000)
+        self.check_sorted(sorted_fastq,illumina_key)
+        self.assertEqual(os.listdir(tmp_dir),[])
+
+    def test_sort_fastq_parallel(self):
+        """sort_fastq: sort runs in multiple processes
+        """
+        sorted_fastq = os.path.join(self.wd,"sorted.fastq")
+        self.assertEqual(sort_fastq(self.fastq,sorted_fastq,
+                                    run_size=8192,nprocs=2),2000)
+        self.check_sorted(sorted_fastq,name_key)
+
+    def test_sort_fastq_is_stable(self):
+        """sort_fastq: reads with the same name keep their order
+        """
+        with open(self.fastq,'w') as fp:
+            for i in xrange(20):
+                fp.write("@READ%d/%d\nACGT\n+\n%s\n" % (i%2,i%2+1,chr(65+i)*4))
+        sorted_fastq = os.path.join(self.wd,"sorted.fastq")
+        sort_fastq(self.fastq,sorted_fastq,run_size=50)
+        quals = [r.quality[0] for r in FastqIterator(sorted_fastq)]
+        self.assertEqual(quals,[chr(65+i) for i in range(0,20,2)] +
+                         [chr(65+i) for i in range(1,20,2)])
+
+    def test_sort_fastq_unknown_key(self):
+        """sort_fastq: raise exception for unknown key
+        """
+        self.assertRaises(Exception,
+                          sort_fastq,
+                          self.fastq,os.path.join(self.wd,"sorted.fastq"),
+                          key='unknown')
+
+class TestSortKeys(unittest.TestCase):
+
+    def test_illumina_key(self):
+        """illumina_key: natural key for Illumina read names
+        """
+        self.assertEqual(illumina_key("@EAS139:136:FC706VJ:2:2104:15343:197393"),
+                         ('@EAS139',136,'FC706VJ',2,2104,15343,197393))
+        self.assertEqual(illumina_key("@HWUSI-EAS100R:6:73:941:1973#0"),
+                         ('@HWUSI-EAS100R',6,73,941,1973,0))
+        self.assertTrue(illumina_key("@A:1:FC:1:1101:9:100") <
+                        illumina_key("@A:1:FC:1:1101:10:100"))
+
+    def test_name_key(self):
+        """name_key: lexical key for read names
+        """
+        self.assertEqual(name_key("@READ1"),"@READ1")
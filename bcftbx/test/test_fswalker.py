@@ -0,0 +1,114 @@
+#######################################################################
+# Tests for fswalker.py module
+#######################################################################
+from bcftbx.fswalker import *
+from bcftbx.fswalker import _DirEntry
+from bcftbx.test.mock_data import ExampleDirLanguages
+import unittest
+import os
+
+def os_walk_names(top,followlinks=False):
+    # Reference results from os.walk
+    return [(dirpath,sorted(dirnames),sorted(filenames))
+            for dirpath,dirnames,filenames in os.walk(top,
+                                                      followlinks=followlinks)]
+
+def walk_names(top,**kws):
+    # Results from walk, converted to names
+    return [(dirpath,sorted([d.name for d in dirs]),
+             sorted([f.name for f in files]))
+            for dirpath,dirs,files in walk(top,**kws)]
+
+class TestScandir(unittest.TestCase):
+
+    def setUp(self):
+        self.example_dir = ExampleDirLanguages()
+        self.example_dir.create_directory()
+        self.example_dir.add_link("broken","missing.txt")
+
+    def tearDown(self):
+        self.example_dir.delete_directory()
+
+    def test_scandir(self):
+        """scandir returns entries for directory
+        """
+        entries = scandir(self.example_dir.dirn)
+        self.assertEqual([e.name for e in entries],
+                         os.listdir(self.example_dir.dirn))
+        for e in entries:
+            self.assertEqual(e.path,os.path.join(self.example_dir.dirn,
+                                                 e.name))
+            self.assertEqual(e.is_dir(),os.path.isdir(e.path))
+            self.assertEqual(e.is_file(),os.path.isfile(e.path))
+            self.assertEqual(e.is_symlink(),os.path.islink(e.path))
+
+    def test_fallback_direntry(self):
+        """_DirEntry has the same type information as os.path functions
+        """
+        for name in os.listdir(self.example_dir.dirn):
+            path = os.path.join(self.example_dir.dirn,name)
+            e = _DirEntry(self.example_dir.dirn,name)
+            self.assertEqual(e.name,name)
+            self.assertEqual(e.path,path)
+            self.assertEqual(e.is_dir(),os.path.isdir(path))
+            self.assertEqual(e.is_dir(follow_symlinks=False),
+                             os.path.isdir(path) and not os.path.islink(path))
+            self.assertEqual(e.is_file(),os.path.isfile(path))
+            self.assertEqual(e.is_symlink(),os.path.islink(path))
+            self.assertEqual(e.inode(),os.lstat(path).st_ino)
+            if os.path.exists(path):
+                self.assertEqual(e.stat(),os.stat(path))
+            else:
+                self.assertRaises(OSError,e.stat)
+
+class TestWalk(unittest.TestCase):
+
+    def setUp(self):
+        self.example_dir = ExampleDirLanguages()
+        self.example_dir.create_directory()
+        self.example_dir.add_link("broken","missing.txt")
+
+    def tearDown(self):
+        self.example_dir.delete_directory()
+
+    def test_walk(self):
+        """walk returns the same results as os.walk
+        """
+        expected = os_walk_names(self.example_dir.dirn)
+        for threads in (None,1,4):
+            self.assertEqual(walk_names(self.example_dir.dirn,
+                                        threads=threads),
+                             expected)
+
+    def test_walk_followlinks(self):
+        """walk returns the same results as os.walk when following links
+        """
+        expected = os_walk_names(self.example_dir.dirn,followlinks=True)
+        for threads in (None,4):
+            self.assertEqual(walk_names(self.example_dir.dirn,
+                                        followlinks=True,
+                                        threads=threads),
+                             expected)
+
+    def test_walk_prune_dirs(self):
+        """walk doesn't descend into subdirectories removed from list
+        """
+        for threads in (None,4):
+            dirpaths = []
+            for dirpath,dirs,files in walk(self.example_dir.dirn,
+                                           threads=threads):
+                dirpaths.append(os.path.relpath(dirpath,
+                                                self.example_dir.dirn))
+                dirs[:] = [d for d in dirs if d.name != "welsh"]
+            self.assertEqual(sorted(dirpaths),
+                             ['.','countries','icelandic','spanish'])
+
+    def test_walk_missing_dir(self):
+        """walk reports error for missing directory via onerror
+        """
+        missing = os.path.join(self.example_dir.dirn,"missing")
+        errors = []
+        self.assertEqual(list(walk(missing)),[])
+        self.assertEqual(list(walk(missing,onerror=errors.append)),[])
+        self.assertEqual(len(errors),1)
+        self.assertTrue(isinstance(errors[0],OSError))
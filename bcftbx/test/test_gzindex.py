@@ -0,0 +1,125 @@
+#######################################################################
+# Tests for gzindex.py module
+#######################################################################
+from bcftbx.gzindex import *
+from bcftbx.bgzf import BgzfWriter
+from bcftbx.test.mock_data import make_fastq_data
+import unittest
+import os
+import gzip
+import shutil
+import random
+import tempfile
+import itertools
+
+class TestGzipIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.wd = tempfile.mkdtemp()
+        self.data = make_fastq_data(5000,lengths=(50,50))
+        self.lines = self.data.split('\n')[:-1]
+        self.fastq = os.path.join(self.wd,"test.fastq.gz")
+        fp = gzip.open(self.fastq,'wb')
+        fp.write(self.data)
+        fp.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.wd)
+
+    def check_lines(self,idx,lines):
+        for start in [0,1,4,len(lines)-1] + \
+            [c.nlines for c in idx.checkpoints] + \
+            [c.nlines+1 for c in idx.checkpoints] + \
+            random.sample(xrange(len(lines)),20):
+            self.assertEqual(list(itertools.islice(idx.getlines(start),5)),
+                             lines[start:start+5])
+
+    def test_build_index(self):
+        """build_index: creates checkpoints and counts lines
+        """
+        idx = build_index(self.fastq,span=32768)
+        self.assertTrue(len(idx.checkpoints) > 5)
+        self.assertEqual(idx.nlines,len(self.lines))
+        self.assertEqual(idx.usize,len(self.data))
+        self.assertTrue(idx.is_current())
+
+    def test_getlines(self):
+        """GzipIndex: getlines returns lines from arbitrary positions
+        """
+        idx = build_index(self.fastq,span=32768)
+        self.check_lines(idx,self.lines)
+        self.assertEqual(list(idx.getlines(0)),self.lines)
+
+    def test_getlines_no_trailing_newline(self):
+        """GzipIndex: getlines handles missing final newline
+        """
+        fp = gzip.open(self.fastq,'wb')
+        fp.write(self.data[:-1])
+        fp.close()
+        idx = build_index(self.fastq,span=32768)
+        self.assertEqual(idx.nlines,len(self.lines))
+        self.assertEqual(list(idx.getlines(len(self.lines)-2)),
+                         self.lines[-2:])
+
+    def test_multi_member_gzip(self):
+        """GzipIndex: handles multi-member gzip file
+        """
+        for i in xrange(2):
+            fp = gzip.open(self.fastq,'ab')
+            fp.write(self.data)
+            fp.close()
+        lines = self.lines*3
+        idx = build_index(self.fastq,span=32768)
+        self.assertEqual(idx.nlines,len(lines))
+        self.check_lines(idx,lines)
+
+    def test_bgzf(self):
+        """GzipIndex: handles BGZF file
+        """
+        fp = BgzfWriter(self.fastq)
+        fp.write(self.data)
+        fp.close()
+        idx = build_index(self.fastq,span=32768)
+        self.assertEqual(idx.nlines,len(self.lines))
+        self.check_lines(idx,self.lines)
+
+    def test_save_and_load(self):
+        """GzipIndex: save index and reload it
+        """
+        idx = build_index(self.fastq,span=32768)
+        idx_file = os.path.join(self.wd,"test.gzidx")
+        idx.save(idx_file)
+        idx2 = GzipIndex.load(self.fastq,idx_file)
+        self.assertEqual(idx2.nlines,idx.nlines)
+        self.assertEqual(idx2.checkpoints,idx.checkpoints)
+        self.check_lines(idx2,self.lines)
+
+    def test_load_bad_index_file(self):
+        """GzipIndex: loading bad index file raises GzipIndexError
+        """
+        idx_file = os.path.join(self.wd,"test.gzidx")
+        open(idx_file,'w').write("not an index")
+        self.assertRaises(GzipIndexError,GzipIndex.load,self.fastq,idx_file)
+
+    def test_get_index_creates_sidecar(self):
+        """get_index: builds and caches index next to file
+        """
+        idx = get_index(self.fastq,span=32768)
+        self.assertEqual(index_file(self.fastq),self.fastq+".gzidx")
+        self.assertTrue(os.path.exists(self.fastq+".gzidx"))
+        self.assertEqual(get_index(self.fastq).checkpoints,idx.checkpoints)
+
+    def test_get_index_rebuilds_stale_index(self):
+        """get_index: rebuilds index when file changes
+        """
+        idx = get_index(self.fastq,span=32768)
+        fp = gzip.open(self.fastq,'wb')
+        fp.write(self.data*2)
+        fp.close()
+        # Make sure the modification time changes
+        st = os.stat(self.fastq)
+        os.utime(self.fastq,(st.st_atime,st.st_mtime+10))
+        self.assertFalse(idx.is_current())
+        idx = get_index(self.fastq,span=32768)
+        self.assertEqual(idx.nlines,2*len(self.lines))
+        self.assertTrue(idx.is_current())
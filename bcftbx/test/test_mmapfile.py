@@ -0,0 +1,176 @@
+#######################################################################
+# Tests for mmapfile.py module
+#######################################################################
+from bcftbx.mmapfile import *
+from bcftbx.FASTQFile import FastqIterator
+from bcftbx.utils import getlines
+import unittest
+import os
+import shutil
+import tempfile
+
+fastq_data = """@73D9FA:3:FC:1:1:7507:1000 1:N:0:
+NACAACCTGATTAGCGGCGTTGACAGATGTATCCAT
++
+#))))55445@@@@@C@@@@@@@@@:::::<<:::<
+@73D9FA:3:FC:1:1:15740:1000 1:N:0:
+NTCTTGCTTGGTGGCGCTGGTTTCGTGACAGAGTTC
++
+#+.)))+)@@@@@7@@@@@@@@@;;;;;@<<@@@@@
+"""
+
+class BaseMappedFileTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.wd = tempfile.mkdtemp()
+        self.data = fastq_data*5000
+
+    def tearDown(self):
+        shutil.rmtree(self.wd)
+
+    def write_file(self,name,data):
+        filen = os.path.join(self.wd,name)
+        with open(filen,'wb') as fp:
+            fp.write(data)
+        return filen
+
+class TestMappedFile(BaseMappedFileTestCase):
+
+    def test_read_all(self):
+        """MappedFile: read all data
+        """
+        filen = self.write_file("test.fastq",self.data)
+        with MappedFile(filen) as fp:
+            self.assertEqual(fp.read(),self.data)
+            self.assertEqual(fp.read(),'')
+
+    def test_read_in_chunks_across_windows(self):
+        """MappedFile: read data in chunks spanning multiple windows
+        """
+        filen = self.write_file("test.fastq",self.data)
+        chunks = []
+        with MappedFile(filen,window_size=1) as fp:
+            while True:
+                data = fp.read(12345)
+                if not data:
+                    break
+                chunks.append(data)
+        self.assertEqual(''.join(chunks),self.data)
+
+    def test_readinto(self):
+        """MappedFile: read data using readinto
+        """
+        filen = self.write_file("test.fastq",fastq_data)
+        buf = bytearray(100)
+        with MappedFile(filen) as fp:
+            n = fp.readinto(buf)
+        self.assertEqual(n,100)
+        self.assertEqual(str(buf),fastq_data[:100])
+
+    def test_read_lines(self):
+        """MappedFile: iterate over lines across windows
+        """
+        filen = self.write_file("test.fastq",self.data)
+        with MappedFile(filen,window_size=1) as fp:
+            lines = [line for line in fp]
+        self.assertEqual(lines,self.data.splitlines(True))
+
+    def test_readline_no_trailing_newline(self):
+        """MappedFile: read final line without trailing newline
+        """
+        filen = self.write_file("test.txt","first\nsecond")
+        with MappedFile(filen) as fp:
+            self.assertEqual(fp.readline(),"first\n")
+            self.assertEqual(fp.readline(),"second")
+            self.assertEqual(fp.readline(),"")
+
+    def test_blocks(self):
+        """MappedFile: blocks end on line boundaries
+        """
+        filen = self.write_file("test.fastq",self.data)
+        with MappedFile(filen,window_size=1) as fp:
+            blocks = list(fp.blocks(1000))
+        self.assertTrue(len(blocks) > 1)
+        for block in blocks:
+            self.assertTrue(block.endswith('\n'))
+        self.assertEqual(''.join(blocks),self.data)
+
+    def test_blocks_long_lines(self):
+        """MappedFile: blocks hold complete lines longer than block size
+        """
+        data = "a"*50 + "\n" + "b"*50 + "\nc"
+        filen = self.write_file("test.txt",data)
+        with MappedFile(filen) as fp:
+            blocks = list(fp.blocks(20))
+        self.assertEqual(blocks,["a"*50 + "\n","b"*50 + "\n","c"])
+
+    def test_seek_and_tell(self):
+        """MappedFile: seek to new positions
+        """
+        filen = self.write_file("test.fastq",fastq_data)
+        with MappedFile(filen) as fp:
+            fp.seek(10)
+            self.assertEqual(fp.tell(),10)
+            self.assertEqual(fp.read(5),fastq_data[10:15])
+            fp.seek(-5,os.SEEK_END)
+            self.assertEqual(fp.read(),fastq_data[-5:])
+            fp.seek(-10,os.SEEK_CUR)
+            self.assertEqual(fp.read(3),fastq_data[-10:-7])
+
+    def test_read_closed_file(self):
+        """MappedFile: raise ValueError reading closed file
+        """
+        filen = self.write_file("test.fastq",fastq_data)
+        fp = MappedFile(filen)
+        fp.close()
+        self.assertRaises(ValueError,fp.read)
+
+class TestOpenMapped(BaseMappedFileTestCase):
+
+    def test_open_mapped(self):
+        """open_mapped: returns MappedFile for non-empty file
+        """
+        filen = self.write_file("test.fastq",fastq_data)
+        fp = open_mapped(filen)
+        self.assertTrue(isinstance(fp,MappedFile))
+        self.assertEqual(fp.read(),fastq_data)
+        fp.close()
+
+    def test_open_mapped_empty_file(self):
+        """open_mapped: returns ordinary file for empty file
+        """
+        filen = self.write_file("test.fastq","")
+        fp = open_mapped(filen)
+        self.assertFalse(isinstance(fp,MappedFile))
+        self.assertEqual(fp.read(),"")
+        fp.close()
+
+class TestMappedReaders(BaseMappedFileTestCase):
+
+    def test_getlines(self):
+        """getlines: uncompressed file via memory mapping
+        """
+        filen = self.write_file("test.fastq",self.data)
+        self.assertEqual(list(getlines(filen)),self.data.split('\n')[:-1])
+
+    def test_fastq_iterator(self):
+        """FastqIterator: uncompressed file via memory mapping
+        """
+        filen = self.write_file("test.fastq",self.data)
+        reads = [str(r) for r in FastqIterator(filen,bufsize=1000)]
+        self.assertEqual(len(reads),10000)
+        self.assertEqual('\n'.join(reads)+'\n',self.data)
+
+    def test_fastq_iterator_no_trailing_newline(self):
+        """FastqIterator: mapped file without trailing newline
+        """
+        filen = self.write_file("test.fastq",fastq_data[:-1])
+        reads = [str(r) for r in FastqIterator(filen)]
+        self.assertEqual('\n'.join(reads)+'\n',fastq_data)
+
+    def test_fastq_iterator_carriage_returns(self):
+        """FastqIterator: mapped file with carriage returns
+        """
+        filen = self.write_file("test.fastq",fastq_data.replace('\n','\r\n'))
+        reads = [str(r) for r in FastqIterator(filen)]
+        self.assertEqual('\n'.join(reads)+'\n',fastq_data)
@@ -145,6 +145,35 @@ AAF#FJJJJJJJJJJJ
                            for i in (0,8)]
         for r1,r2 in zip(reference_reads,fastq_reads):
             self.assertEqual(r1,r2)
+    def test_getreads_subset_gzipped_fastq(self):
+        """getreads: get subset of reads from gzipped Fastq file
+        """
+        # Make an example file
+        example_fastq = os.path.join(self.wd,"example.fastq.gz")
+        with gzip.open(example_fastq,'w') as fp:
+            fp.write(self.example_fastq_data)
+        # Get subset
+        fastq_reads = getreads_subset(example_fastq,
+                                      indices=(2,0))
+        reference_reads = [self.example_fastq_data.split('\n')[i:i+4]
+                           for i in (0,8)]
+        self.assertEqual(list(fastq_reads),reference_reads)
+        # Index should have been created
+        self.assertTrue(os.path.exists(example_fastq+".gzidx"))
+    def test_getreads_subset_gzipped_fastq_index_out_of_range(self):
+        """getreads: requesting non-existent read from gzipped Fastq
+        """
+        # Make an example file
+        example_fastq = os.path.join(self.wd,"example.fastq.gz")
+        with gzip.open(example_fastq,'w') as fp:
+            fp.write(self.example_fastq_data)
+        try:
+            [r for r in getreads_subset(example_fastq,indices=(0,3))]
+            failed = True
+        except Exception:
+            # This is expected, test passes
+            failed = False
+        self.assertFalse(failed,"Exception not raised")
     def test_getreads_subset_fastq_index_out_of_range(self):
         """getreads: requesting non-existent read raises exception
         """
@@ -205,3 +234,112 @@ AAF#FJJJJJJJJJJJ
                            for i in (0,)]
         for r1,r2 in zip(reference_reads,fastq_reads):
             self.assertEqual(r1,r2)
+
+class TestCountReadsFunction(unittest.TestCase):
+    """Tests for the 'count_reads' function
+    """
+    def setUp(self):
+        self.wd = tempfile.mkdtemp()
+        self.example_csfasta_data = """# Cwd: /home/pipeline
+# Title: solid0127_20121204_FRAG_BC_Run_56_pool_LC_CK
+>1_51_38_F3
+T3..3.213.12211.01..000..111.0210202221221121011..0
+>1_51_301_F3
+T0..3.222.21233.00..022..110.0210022323223202211..2
+>1_52_339_F3
+T1.311202211102.331233332113.23332233002223222312.2
+"""
+    def tearDown(self):
+        shutil.rmtree(self.wd)
+    def test_count_reads_csfasta(self):
+        """count_reads: count reads in csfasta file
+        """
+        example_csfasta = os.path.join(self.wd,"example.csfasta")
+        with open(example_csfasta,'w') as fp:
+            fp.write(self.example_csfasta_data)
+        self.assertEqual(count_reads(example_csfasta),3)
+    def test_count_reads_gzipped_csfasta(self):
+        """count_reads: count reads in gzipped csfasta file
+        """
+        example_csfasta = os.path.join(self.wd,"example.csfasta.gz")
+        with gzip.open(example_csfasta,'w') as fp:
+            fp.write(self.example_csfasta_data)
+        self.assertEqual(count_reads(example_csfasta),3)
+        reads = list(getreads_subset(example_csfasta,(1,)))
+        self.assertEqual(reads,[self.example_csfasta_data.split('\n')[4:6]])
+
+class TestGetreadsSampleFunction(unittest.TestCase):
+    """Tests for the 'getreads_sample' function
+    """
+    def setUp(self):
+        self.wd = tempfile.mkdtemp()
+        self.r1 = os.path.join(self.wd,"example_R1.fastq")
+        self.r2 = os.path.join(self.wd,"example_R2.fastq")
+        for fastq,read in ((self.r1,1),(self.r2,2)):
+            with open(fastq,'w') as fp:
+                for i in xrange(1000):
+                    fp.write("@K00311:43:HL3LWBBXX:8:1101:%d:1121 %d:N:0:CNATGT\n"
+                             "GCCNGACAGCAGAAAT\n+\nAAF#FJJJJJJJJJJJ\n" %
+                             (i,read))
+    def tearDown(self):
+        shutil.rmtree(self.wd)
+    def test_getreads_sample_n(self):
+        """getreads_sample: sample fixed number of reads
+        """
+        sample = list(getreads_sample((self.r1,),n=10,seed=1))
+        self.assertEqual(len(sample),10)
+        # Reads are unique and in file order
+        names = [r[0][0] for r in sample]
+        self.assertEqual(len(set(names)),10)
+        self.assertEqual(names,
+                         sorted(names,key=lambda x: int(x.split(':')[5])))
+    def test_getreads_sample_seed(self):
+        """getreads_sample: same seed gives same sample
+        """
+        sample1 = list(getreads_sample((self.r1,),n=10,seed=1))
+        sample2 = list(getreads_sample((self.r1,),n=10,seed=1))
+        sample3 = list(getreads_sample((self.r1,),n=10,seed=2))
+        self.assertEqual(sample1,sample2)
+        self.assertNotEqual(sample1,sample3)
+    def test_getreads_sample_pairs(self):
+        """getreads_sample: same reads are sampled from R1/R2 pair
+        """
+        for r1,r2 in getreads_sample((self.r1,self.r2),n=20,seed=1):
+            self.assertEqual(r1[0].split()[0],r2[0].split()[0])
+            self.assertEqual(r1[0].split()[1][0],'1')
+            self.assertEqual(r2[0].split()[1][0],'2')
+    def test_getreads_sample_fraction(self):
+        """getreads_sample: sample fraction of reads
+        """
+        sample = list(getreads_sample((self.r1,),fraction=0.5,seed=1))
+        self.assertTrue(400 < len(sample) < 600)
+        self.assertEqual(sample,
+                         list(getreads_sample((self.r1,),fraction=0.5,
+                                              seed=1)))
+    def test_getreads_sample_all_reads(self):
+        """getreads_sample: sample of all reads returns every read
+        """
+        sample = list(getreads_sample((self.r1,),n=1000,seed=1))
+        self.assertEqual(sample,[(r,) for r in getreads(self.r1)])
+    def test_getreads_sample_too_many_reads(self):
+        """getreads_sample: requesting too many reads raises exception
+        """
+        try:
+            list(getreads_sample((self.r1,),n=1001))
+            failed = True
+        except Exception:
+            # This is expected, test passes
+            failed = False
+        self.assertFalse(failed,"Exception not raised")
+    def test_getreads_sample_inconsistent_files(self):
+        """getreads_sample: files with different numbers of reads
+        """
+        with open(self.r2,'a') as fp:
+            fp.write("@extra\nA\n+\nA\n")
+        try:
+            list(getreads_sample((self.r1,self.r2),n=5))
+            failed = True
+        except Exception:
+            # This is expected, test passes
+            failed = False
+        self.assertFalse(failed,"Exception not raised")
@@ -92,6 +92,10 @@ import grp
 import datetime
 import re
 import socket
+import bgzf as _bgzf
+import mmapfile as _mmapfile
+import fastqmeta as _fastqmeta
+import fswalker as _fswalker
 
 #######################################################################
 # Module constants
@@ -235,7 +239,7 @@ def getlines(filen):
 
     The file can be gzipped; this function should handle
     this invisibly provided that the file extension is
-    '.gz'.
+    '.gz'. Uncompressed files are read via memory mapping.
 
     Arguments:
       filen (str): path of the file to read lines from
@@ -245,9 +249,18 @@ def getlines(filen):
         newline character removed.
     """
     if filen.split('.')[-1] == 'gz':
-        fp = gzip.open(filen,'rb')
+        fp = _bgzf.open_gzipped(filen)
     else:
-        fp = open(filen,'rb')
+        fp = _mmapfile.open_mapped(filen)
+    if hasattr(fp,'blocks'):
+        # Memory mapped: split blocks of complete lines
+        for block in fp.blocks(CHUNKSIZE):
+            if block[-1] == '\n':
+                block = block[:-1]
+            for line in block.split('\n'):
+                yield line
+        fp.close()
+        return
     # Read in data in chunks
     buf = ''
     lines = []
@@ -871,11 +884,11 @@ def get_hostname():
     """
     return socket.getfqdn()
 
-def walk(dirn,include_dirs=True,pattern=None):
+def walk(dirn,include_dirs=True,pattern=None,threads=None):
     """Traverse the directory, subdirectories and files
 
     Essentially this 'walk' function is a convenience wrapper
-    for the 'os.walk' function.
+    for the 'fswalker.walk' function.
 
     Arguments:
       dirn: top-level directory to start traversal from
@@ -885,6 +898,8 @@ def walk(dirn,include_dirs=True,pattern=None):
         pattern which restricts the set of yielded files and
         directories to a subset of those which match the
         pattern
+      threads: (optional) number of threads to use to scan
+        directories in parallel
         
     """
     if pattern is not None:
@@ -892,16 +907,14 @@ def walk(dirn,include_dirs=True,pattern=None):
     if include_dirs:
         if pattern is None or matcher.match(dirn):
             yield dirn
-    for dirpath,dirnames,filenames in os.walk(dirn):
+    for dirpath,dirs,files in _fswalker.walk(dirn,threads=threads):
         if include_dirs:
-            for d in dirnames:
-                d1 = os.path.join(dirpath,d)
-                if pattern is None or matcher.match(d1):
-                    yield d1
-        for f in filenames:
-            f1 = os.path.join(dirpath,f)
-            if pattern is None or matcher.match(f1):
-                yield f1
+            for d in dirs:
+                if pattern is None or matcher.match(d.path):
+                    yield d.path
+        for f in files:
+            if pattern is None or matcher.match(f.path):
+                yield f.path
 
 def list_dirs(parent,matches=None,startswith=None):
     """Return list of subdirectories relative to 'parent'
@@ -918,8 +931,9 @@ def list_dirs(parent,matches=None,startswith=None):
 
     """
     dirs = []
-    for d in os.listdir(parent):
-        if os.path.isdir(os.path.join(parent,d)):
+    for entry in _fswalker.scandir(parent):
+        if entry.is_dir():
+            d = entry.name
             if startswith is None or d.startswith(startswith):
                 if matches is None or d == matches:
                     dirs.append(d)
@@ -1080,17 +1094,15 @@ def links(dirn):
       Yields the name and full path for each symbolic link under 'dirn'.
 
     """
-    for d in os.walk(dirn):
-        if os.path.islink(d[0]):
-            yield d[0]
-        for sd in d[1]:
-            path = os.path.join(d[0],sd)
-            if os.path.islink(path):
-                yield path
-        for f in d[2]:
-            path = os.path.join(d[0],f)
-            if os.path.islink(path):
-                yield path
+    if os.path.islink(dirn):
+        yield dirn
+    for dirpath,dirs,files in _fswalker.walk(dirn):
+        for d in dirs:
+            if d.is_symlink():
+                yield d.path
+        for f in files:
+            if f.is_symlink():
+                yield f.path
 
 #######################################################################
 # Sample/library name utilities
@@ -1259,13 +1271,18 @@ def name_matches(name,pattern):
 #######################################################################
 
 def concatenate_fastq_files(merged_fastq,fastq_files,bufsize=10240,
-                            overwrite=False,verbose=True):
+                            overwrite=False,verbose=True,bgzf=False,
+                            threads=None):
     """Create a single FASTQ file by concatenating one or more FASTQs
 
     Given a list or tuple of FASTQ files (which can be compressed or
     uncompressed or a combination), creates a single output FASTQ by
     concatenating the contents.
 
+    If there is up-to-date cached metadata (read counts etc) for all
+    the input FASTQs then the metadata for the output FASTQ is also
+    cached (see the 'fastqmeta' module).
+
     Arguments:
       merged_fastq: name of output FASTQ file (mustn't exist beforehand)
       fastq_files:  list of FASTQ files to concatenate
@@ -1274,6 +1291,11 @@ def concatenate_fastq_files(merged_fastq,fastq_files,bufsize=10240,
         already exists (otherwise raise OSError); default is False
       verbose: (optional) if True then report operations to stdout,
         otherwise operate quietly
+      bgzf: (optional) if True and the output FASTQ is gzipped then
+        write it in BGZF format (default is False)
+      threads: (optional) number of threads to use for BGZF
+        compression and decompression (defaults to the number of
+        CPUs)
 
     """
     if verbose: print "Creating merged fastq file '%s'" % merged_fastq
@@ -1283,7 +1305,21 @@ def concatenate_fastq_files(merged_fastq,fastq_files,bufsize=10240,
     # Create temporary name
     merged_fastq_part = merged_fastq+'.part'
     # Open for writing
-    if is_gzipped_file(merged_fastq):
+    if is_gzipped_file(merged_fastq) and bgzf:
+        if is_gzipped_file(fastq_files[0]) and \
+           _bgzf.is_bgzf(fastq_files[0]):
+            # Copy first file in list directly and open for append
+            if verbose: print "Copying %s" % fastq_files[0]
+            shutil.copy(fastq_files[0],merged_fastq_part)
+            first_file = 1
+            fq_merged = _bgzf.BgzfWriter(merged_fastq_part,'ab',
+                                         threads=threads)
+        else:
+            # Open for write
+            first_file = 0
+            fq_merged = _bgzf.BgzfWriter(merged_fastq_part,'wb',
+                                         threads=threads)
+    elif is_gzipped_file(merged_fastq):
         if is_gzipped_file(fastq_files[0]):
             # Copy first file in list directly and open for append
             if verbose: print "Copying %s" % fastq_files[0]
@@ -1315,16 +1351,24 @@ def concatenate_fastq_files(merged_fastq,fastq_files,bufsize=10240,
         if not is_gzipped_file(fastq):
             fq = open(fastq,'rb')
         else:
-            fq = gzip.GzipFile(fastq,'rb')
+            fq = _bgzf.open_gzipped(fastq,threads=threads)
         # Read and append data
         while True:
-            data = fq.read(10240)
+            data = fq.read(bufsize)
             if not data: break
             fq_merged.write(data)
         fq.close()
     # Finished, clean up
     fq_merged.close()
     os.rename(merged_fastq_part,merged_fastq)
+    # Combine metadata from the inputs
+    metadata = _fastqmeta.FastqMetadata()
+    for fastq in fastq_files:
+        fastq_metadata = _fastqmeta.cached_metadata(fastq)
+        if fastq_metadata is None:
+            return
+        metadata.merge(fastq_metadata)
+    _fastqmeta.save_metadata(merged_fastq,metadata)
 
 #######################################################################
 # Text manipulations
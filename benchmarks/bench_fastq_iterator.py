@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+#
+#     bench_fastq_iterator.py: benchmark FASTQ record iteration
+#     Copyright (C) University of Manchester 2018 Peter Briggs
+#
+########################################################################
+#
+# bench_fastq_iterator.py
+#
+#########################################################################
+
+"""bench_fastq_iterator.py
+
+Report reads/sec for iterating over FASTQ files using the legacy
+line-splitting iterator (reproduced here for comparison) and the
+buffer-scanning FastqReader engine in bcftbx.FASTQFile.
+
+"""
+
+#######################################################################
+# Imports
+#######################################################################
+
+import sys
+import os
+import time
+import gzip
+import random
+import shutil
+import tempfile
+import optparse
+
+# Put .. onto Python search path for modules
+SHARE_DIR = os.path.abspath(
+    os.path.normpath(
+        os.path.join(os.path.dirname(sys.argv[0]),'..')))
+sys.path.insert(0,SHARE_DIR)
+import bcftbx.FASTQFile as FASTQFile
+
+__version__ = "0.0.1"
+
+#######################################################################
+# Legacy implementation
+#######################################################################
+
+def legacy_fastq_iterator(fastq_file,bufsize=FASTQFile.CHUNKSIZE):
+    """Iterate over FASTQ records using the original algorithm
+
+    Reproduces the buffer concatenation and line splitting from
+    the original FastqIterator.next method, yielding FastqRead
+    objects.
+
+    """
+    fp = FASTQFile.get_fastq_file_handle(fastq_file)
+    buf = ''
+    lines = []
+    ip = 0
+    while True:
+        while len(lines) < 4:
+            data = fp.read(bufsize)
+            if not data:
+                fp.close()
+                return
+            buf = buf + data
+            if buf[-1] != '\n':
+                i = buf.rfind('\n')
+                if i == -1:
+                    continue
+                else:
+                    lines.extend(buf[:i].split('\n'))
+                    buf = buf[i+1:]
+            else:
+                lines.extend(buf[:-1].split('\n'))
+                buf = ''
+        read = lines[ip:ip + 4]
+        ip = ip + 4
+        if (len(lines) - ip) < 4:
+            lines = lines[ip:]
+            ip = 0
+        yield FASTQFile.FastqRead(*read)
+
+#######################################################################
+# Functions
+#######################################################################
+
+def make_fastq(dirn,nreads,length=100,seed=12345):
+    """Write synthetic plain and gzipped FASTQs, return their paths
+
+    """
+    rng = random.Random(seed)
+    fastq = os.path.join(dirn,"synthetic.fastq")
+    with open(fastq,'wb') as fp:
+        for i in xrange(nreads):
+            fp.write("@SYN01:1:FC001:1:%d:%d:%d 1:N:0:ACGTACGT\n%s\n+\n%s\n" %
+                     (1101+i%16,i%30000,i,
+                      ''.join(rng.choice('ACGTN') for j in xrange(length)),
+                      ''.join(rng.choice('#<AFJ') for j in xrange(length))))
+    fastq_gz = fastq + ".gz"
+    with open(fastq,'rb') as fp_in:
+        fp_out = gzip.open(fastq_gz,'wb')
+        shutil.copyfileobj(fp_in,fp_out)
+        fp_out.close()
+    return (fastq,fastq_gz)
+
+def timed(name,func,repeats=3):
+    """Run func (which returns a read count) and report best reads/sec
+
+    """
+    best = None
+    for i in xrange(repeats):
+        start = time.time()
+        nreads = func()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    print "\t%-32s %10d reads %8.3fs %12.0f reads/sec" % \
+        (name,nreads,best,nreads/best if best else 0.0)
+
+def count(iterable):
+    n = 0
+    for r in iterable:
+        n += 1
+    return n
+
+def benchmark(fastq,repeats=3):
+    """Run the benchmarks for a single FASTQ file
+
+    """
+    print "%s" % fastq
+    timed("legacy iterator",
+          lambda: count(legacy_fastq_iterator(fastq)),repeats)
+    timed("legacy iterator + sequence",
+          lambda: count(r.sequence for r in legacy_fastq_iterator(fastq)),
+          repeats)
+    timed("FastqIterator",
+          lambda: count(FASTQFile.FastqIterator(fastq)),repeats)
+    timed("FastqIterator + sequence",
+          lambda: count(r.sequence for r in FASTQFile.FastqIterator(fastq)),
+          repeats)
+    timed("FastqReader (views only)",
+          lambda: count(FASTQFile.FastqReader(fastq)),repeats)
+    timed("FastqReader + sequence",
+          lambda: count(r.sequence for r in FASTQFile.FastqReader(fastq)),
+          repeats)
+
+#######################################################################
+# Main program
+#######################################################################
+
+if __name__ == "__main__":
+    p = optparse.OptionParser(usage="%prog [OPTIONS] [FASTQ...]",
+                              version="%prog "+__version__,
+                              description="Benchmark FASTQ iteration "
+                              "for the legacy and current bcftbx code. "
+                              "If no FASTQ files are supplied then "
+                              "synthetic plain and gzipped files are "
+                              "generated.")
+    p.add_option('-n','--nreads',action='store',dest='nreads',
+                 type='int',default=200000,
+                 help="number of reads in synthetic data (default: "
+                 "%default)")
+    p.add_option('-r','--repeats',action='store',dest='repeats',
+                 type='int',default=3,
+                 help="number of times to repeat each measurement "
+                 "(best time is reported; default: %default)")
+    options,args = p.parse_args()
+    tmpdir = None
+    if not args:
+        tmpdir = tempfile.mkdtemp()
+        print "Generating %d synthetic reads in %s" % (options.nreads,tmpdir)
+        args = make_fastq(tmpdir,options.nreads)
+    try:
+        for fastq in args:
+            benchmark(fastq,repeats=options.repeats)
+    finally:
+        if tmpdir is not None:
+            shutil.rmtree(tmpdir)
@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+#
+#     bench_fastq_read.py: benchmark FastqRead/SequenceIdentifier
+#     Copyright (C) University of Manchester 2018 Peter Briggs
+#
+########################################################################
+#
+# bench_fastq_read.py
+#
+#########################################################################
+
+"""bench_fastq_read.py
+
+Report the memory used per record and the time taken for common
+operations on FastqRead and SequenceIdentifier objects, for the
+legacy implementations (reproduced here for comparison) and the
+current slots-based classes in bcftbx.FASTQFile.
+
+"""
+
+#######################################################################
+# Imports
+#######################################################################
+
+import sys
+import os
+import time
+import random
+import optparse
+
+# Put .. onto Python search path for modules
+SHARE_DIR = os.path.abspath(
+    os.path.normpath(
+        os.path.join(os.path.dirname(sys.argv[0]),'..')))
+sys.path.insert(0,SHARE_DIR)
+import bcftbx.FASTQFile as FASTQFile
+from bcftbx.FASTQFile import RE_ILLUMINA18
+from bcftbx.FASTQFile import RE_ILLUMINA
+
+__version__ = "0.0.1"
+
+#######################################################################
+# Legacy implementation
+#######################################################################
+
+class LegacyFastqRead(object):
+    """FastqRead using an instance dictionary and eager seqid parsing
+
+    """
+    def __init__(self,seqid_line=None,seq_line=None,optid_line=None,
+                 quality_line=None):
+        self.raw_seqid = seqid_line
+        self.sequence = str(seq_line).rstrip()
+        self.optid = str(optid_line).rstrip()
+        self.quality = str(quality_line).rstrip()
+
+    @property
+    def seqid(self):
+        try:
+            return self._seqid
+        except AttributeError:
+            self._seqid = LegacySequenceIdentifier(self.raw_seqid)
+            return self._seqid
+
+    @property
+    def seqlen(self):
+        try:
+            return self._seqlen
+        except AttributeError:
+            if self.is_colorspace:
+                self._seqlen = len(self.sequence) - 1
+            else:
+                self._seqlen = len(self.sequence)
+            return self._seqlen
+
+    @property
+    def is_colorspace(self):
+        try:
+            return self._is_colorspace
+        except AttributeError:
+            pass
+        if self.seqid.format is None:
+            sequence = self.sequence
+            if sequence.startswith('T'):
+                for c in sequence[1:]:
+                    if c not in '.0123':
+                        self._is_colorspace = False
+                        return self._is_colorspace
+                self._is_colorspace = True
+                return self._is_colorspace
+        self._is_colorspace = False
+        return self._is_colorspace
+
+    def __repr__(self):
+        return '\n'.join((str(self.seqid),
+                          self.sequence,
+                          self.optid,
+                          self.quality))
+
+class LegacySequenceIdentifier:
+    """SequenceIdentifier which matches regular expressions on creation
+
+    """
+    def __init__(self,seqid):
+        self.__seqid = str(seqid).rstrip()
+        self.instrument_name = None
+        self.run_id = None
+        self.flowcell_id = None
+        self.flowcell_lane = None
+        self.tile_no = None
+        self.x_coord = None
+        self.y_coord = None
+        self.multiplex_index_no = None
+        self.pair_id =  None
+        self.bad_read = None
+        self.control_bit_flag = None
+        self.index_sequence = None
+        self.format = None
+        m = RE_ILLUMINA18.match(self.__seqid)
+        if m:
+            self.format = 'illumina18'
+            (self.instrument_name,
+             self.run_id,
+             self.flowcell_id,
+             self.flowcell_lane,
+             self.tile_no,
+             self.x_coord,
+             self.y_coord,
+             self.pair_id,
+             self.bad_read,
+             self.control_bit_flag,
+             self.index_sequence) = m.groups()
+        else:
+            m = RE_ILLUMINA.match(self.__seqid)
+            if m:
+                self.format = 'illumina'
+                (self.instrument_name,
+                 self.flowcell_lane,
+                 self.tile_no,
+                 self.x_coord,
+                 self.y_coord,
+                 self.multiplex_index_no,
+                 self.pair_id) = m.groups()
+
+    def __repr__(self):
+        if self.format == 'illumina18':
+            return "@%s:%s:%s:%s:%s:%s:%s %s:%s:%s:%s" % \
+                (self.instrument_name,self.run_id,self.flowcell_id,
+                 self.flowcell_lane,self.tile_no,self.x_coord,
+                 self.y_coord,self.pair_id,self.bad_read,
+                 self.control_bit_flag,self.index_sequence)
+        return self.__seqid
+
+#######################################################################
+# Functions
+#######################################################################
+
+def make_records(nreads,length=100,seed=12345):
+    """Return a list of synthetic FASTQ records (as lists of lines)
+
+    """
+    rng = random.Random(seed)
+    records = []
+    for i in xrange(nreads):
+        records.append(["@SYN01:1:FC001:1:%d:%d:%d 1:N:0:ACGTACGT" %
+                        (1101+i%16,i%30000,i),
+                        ''.join(rng.choice('ACGTN') for j in xrange(length)),
+                        "+",
+                        ''.join(rng.choice('#<AFJ') for j in xrange(length))])
+    return records
+
+def object_size(obj):
+    """Return the size of an object and its instance dictionary
+
+    The sizes of the strings referenced by the object are
+    excluded as they're the same for both implementations.
+
+    """
+    size = sys.getsizeof(obj)
+    try:
+        size += sys.getsizeof(obj.__dict__)
+    except AttributeError:
+        pass
+    return size
+
+def memory(name,read_class,records):
+    """Report the bytes per record before and after parsing the seqid
+
+    """
+    reads = [read_class(*r) for r in records]
+    unparsed = sum([object_size(r) for r in reads])
+    for r in reads:
+        r.seqlen
+    parsed = sum([object_size(r) + object_size(r.seqid) for r in reads])
+    print "\t%-32s %8.1f bytes/read %8.1f bytes/read (seqid parsed)" % \
+        (name,float(unparsed)/len(reads),float(parsed)/len(reads))
+
+def timed(name,func,nreads,repeats=3):
+    """Run func and report the best time per record
+
+    """
+    best = None
+    for i in xrange(repeats):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    print "\t%-32s %8.3fs %8.2f usec/read" % (name,best,best*1.0e6/nreads)
+
+def benchmark(records,repeats=3):
+    """Run the benchmarks for the records
+
+    """
+    nreads = len(records)
+    print "Memory (excluding strings):"
+    memory("legacy FastqRead",LegacyFastqRead,records)
+    memory("FastqRead",FASTQFile.FastqRead,records)
+    for name,read_class in (("legacy",LegacyFastqRead),
+                            ("current",FASTQFile.FastqRead)):
+        print "Timings (%s):" % name
+        timed("create",
+              lambda: [read_class(*r) for r in records],
+              nreads,repeats)
+        timed("create + index_sequence",
+              lambda: [read_class(*r).seqid.index_sequence
+                       for r in records],
+              nreads,repeats)
+        timed("create + seqlen",
+              lambda: [read_class(*r).seqlen for r in records],
+              nreads,repeats)
+        timed("create + str",
+              lambda: [str(read_class(*r)) for r in records],
+              nreads,repeats)
+
+#######################################################################
+# Main program
+#######################################################################
+
+if __name__ == "__main__":
+    p = optparse.OptionParser(usage="%prog [OPTIONS]",
+                              version="%prog "+__version__,
+                              description="Benchmark memory and parsing "
+                              "time of FASTQ read records for the legacy "
+                              "and current bcftbx code, using synthetic "
+                              "data.")
+    p.add_option('-n','--nreads',action='store',dest='nreads',
+                 type='int',default=200000,
+                 help="number of synthetic reads (default: %default)")
+    p.add_option('-r','--repeats',action='store',dest='repeats',
+                 type='int',default=3,
+                 help="number of times to repeat each measurement "
+                 "(best time is reported; default: %default)")
+    options,args = p.parse_args()
+    print "Generating %d synthetic reads" % options.nreads
+    benchmark(make_records(options.nreads),repeats=options.repeats)
@@ -9,7 +9,7 @@ Provides functionality for analysing data from an Illumina sequencer run.
 
 """
 
-__version__ = "0.1.12"
+__version__ = "0.1.15"
 
 #######################################################################
 # Import modules
@@ -29,8 +29,37 @@ SHARE_DIR = os.path.abspath(
 sys.path.append(SHARE_DIR)
 import bcftbx.IlluminaData as IlluminaData
 import bcftbx.FASTQFile as FASTQFile
+import bcftbx.fastqmeta as fastqmeta
 import bcftbx.utils as bcf_utils
 
+#######################################################################
+# Functions
+#######################################################################
+
+def count_reads(fastq):
+    """Return the number of reads in a FASTQ file
+
+    If there is up-to-date cached metadata for the file then
+    the read count is taken from that; otherwise the records
+    in the file are also checked, and a warning is reported
+    if there are problems (e.g. the file is truncated or
+    corrupted).
+
+    Arguments:
+      fastq: fastq(.gz) file
+
+    Returns:
+      Number of reads.
+
+    """
+    metadata = fastqmeta.cached_metadata(fastq)
+    if metadata is not None:
+        return metadata.nreads
+    result = FASTQFile.validate_fastq(fastq)
+    if not result.valid:
+        logging.warning("%s" % result)
+    return result.nreads
+
 #######################################################################
 # Main program
 #######################################################################
@@ -56,6 +85,8 @@ if __name__ == "__main__":
                  help="copy fastq.gz files matching COPY_PATTERN to current directory")
     p.add_option("--merge-fastqs",action="store_true",dest="merge_fastqs",
                  help="Merge multiple fastqs for samples")
+    p.add_option("--bgzf",action="store_true",dest="bgzf",default=False,
+                 help="Write merged fastqs in BGZF format (use with --merge-fastqs)")
     p.add_option("--verify",action="store",dest="sample_sheet",default=None,
                  help="check CASAVA outputs against those expected for SAMPLE_SHEET")
     p.add_option("--stats",action="store_true",dest="stats",
@@ -121,7 +152,7 @@ if __name__ == "__main__":
                 for sample in project.samples:
                     for fastq in sample.fastq:
                         fq = os.path.join(sample.dirn,fastq)
-                        nreads = FASTQFile.nreads(fq)
+                        nreads = count_reads(fq)
                         fsize = os.path.getsize(fq)
                         print "%s\t%s\t%d" % (fastq,
                                               bcf_utils.format_file_size(fsize),
@@ -138,7 +169,7 @@ if __name__ == "__main__":
         for lane in illumina_data.undetermined.samples:
             for fastq in lane.fastq:
                 fq = os.path.join(lane.dirn,fastq)
-                nreads = FASTQFile.nreads(fq)
+                nreads = count_reads(fq)
                 fsize = os.path.getsize(fq)
                 print "%s\t%s\t%d" % (fastq,
                                   bcf_utils.format_file_size(fsize),
@@ -194,7 +225,8 @@ if __name__ == "__main__":
                     bcf_utils.concatenate_fastq_files(fastq_merged,
                                                       sample.fastq_subset(read_number=read,
                                                                           full_path=True),
-                                                      bufsize=1024*1024)
+                                                      bufsize=1024*1024,
+                                                      bgzf=options.bgzf)
 
 
                     
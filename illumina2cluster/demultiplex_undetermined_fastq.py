@@ -19,17 +19,25 @@ This program was originally written to deal with HiSEQ data where
 dual-indexed and single indexed barcoding protocols were mixed in the same
 sequencing run.
 
+The FASTQ files are processed in parallel, with the reads for each
+barcode collected in memory and written out in large blocks; the
+outputs can optionally be compressed (gzip or BGZF). A summary of
+the number of reads assigned to each barcode is written at the end.
+
 """
 
 #######################################################################
 # Import modules that this module depends on
 #######################################################################
 
-__version__ = "0.0.1"
+__version__ = "0.0.5"
 
 import os
 import sys
+import gzip
 import optparse
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 
 # Put .. onto Python search path for modules
 SHARE_DIR = os.path.abspath(
@@ -38,70 +46,218 @@ SHARE_DIR = os.path.abspath(
 sys.path.append(SHARE_DIR)
 import bcftbx.IlluminaData as IlluminaData
 import bcftbx.FASTQFile as FASTQFile
+import bcftbx.bgzf as bgzf
+import bcftbx.fastqmeta as fastqmeta
+from bcftbx.barcodes import BarcodeTable
+
+#######################################################################
+# Module constants
+#######################################################################
+
+# Default size of the buffer for each output file (bytes)
+BUFFER_SIZE = 4*1024*1024
+
+# Default limit on the total size of the buffers for all the
+# output files (bytes)
+MAX_BUFFERED = 64*1024*1024
+
+# Default name for the summary file
+SUMMARY_FILE = "demultiplex_summary.txt"
 
 #######################################################################
 # Class definitions
 #######################################################################
 
-class BarcodeMatcher:
-    """BarcodeMatcher
+class OutputPool(object):
+    """Pool of buffered output FASTQ files
+
+    Records written to each file are collected in memory and
+    only written out once the buffer for that file exceeds a
+    specified size, so that the data is written (and
+    compressed) in large blocks. If the total size of all the
+    buffers exceeds a limit then all the buffers are written
+    out, so the memory used doesn't grow with the number of
+    files.
 
-    Class for testing whether a sequence matches a barcode.
+    For BGZF output the files share a single pool of threads
+    for compression.
 
     Example usage:
-    >>> b = BarcodeMatcher("ACCTAG")
-    >>> b.match("ACCTAC") # returns False, exact match required
-    >>> b.match("ACCTAC",max_mismatches=1) # returns True, one mismatch
 
-    """
+    >>> outputs = OutputPool(compression='bgzf')
+    >>> outputs.open('PB1','PB1.fastq.gz')
+    >>> outputs.write('PB1',read)
+    >>> outputs.close()
+
+    The number of reads written to each file is available via
+    the 'count' method once the pool has been closed, and the
+    metadata for each file is also cached (see the 'fastqmeta'
+    module).
 
-    def __init__(self,barcode):
-        """Create a new BarcodeMatcher
+    """
+    def __init__(self,compression=None,buffer_size=BUFFER_SIZE,threads=1,
+                 max_buffered=MAX_BUFFERED):
+        """Create a new OutputPool
 
         Arguments:
-          barcode: barcode (i.e. index) sequence to test against
+          compression: (optional) either None (uncompressed
+            FASTQ, the default), 'gzip' or 'bgzf'
+          buffer_size: (optional) size of the buffer for each
+            file (bytes)
+          threads: (optional) total number of threads to use
+            for BGZF compression (shared by all the files)
+          max_buffered: (optional) limit on the total size of
+            the buffers for all the files (bytes)
 
         """
-        self.__barcode = barcode
+        if compression not in (None,'gzip','bgzf'):
+            raise Exception("Unknown compression type '%s'" % compression)
+        self._compression = compression
+        self._buffer_size = buffer_size
+        self._max_buffered = max_buffered
+        self._buffered = 0
+        self._threads = max(int(threads),1)
+        if compression == 'bgzf' and self._threads > 1:
+            self._pool = ThreadPool(self._threads)
+        else:
+            self._pool = None
+        self._fp = {}
+        self._filen = {}
+        self._buffer = {}
+        self._buflen = {}
+        self._metadata = {}
 
     @property
-    def barcode(self):
-        """Return the stored barcode/index sequence.
+    def extension(self):
+        """Return the file extension for the output files
+        """
+        if self._compression is None:
+            return "fastq"
+        return "fastq.gz"
+
+    def open(self,key,filen):
+        """Open a new output file
+
+        Arguments:
+          key: name to refer to the output file by
+          filen: path of the output file
 
         """
-        return self.__barcode
+        if self._compression == 'bgzf':
+            fp = bgzf.BgzfWriter(filen,threads=self._threads,
+                                 pool=self._pool)
+        elif self._compression == 'gzip':
+            fp = gzip.GzipFile(filen,'wb')
+        else:
+            fp = open(filen,'wb')
+        self._fp[key] = fp
+        self._filen[key] = filen
+        self._buffer[key] = []
+        self._buflen[key] = 0
+        self._metadata[key] = fastqmeta.FastqMetadata()
+
+    def write(self,key,read):
+        """Write a read to an output file
 
-    def match(self,test_barcode,max_mismatches=0):
-        """Test a barcode/index sequence against the stored sequence
+        Arguments:
+          key: name of the output file
+          read: FastqRead instance
+
+        """
+        record = str(read)
+        self._buffer[key].append(record)
+        self._buflen[key] += len(record) + 1
+        self._buffered += len(record) + 1
+        self._metadata[key].add_read(read)
+        if self._buflen[key] >= self._buffer_size:
+            self.flush(key)
+        elif self._buffered >= self._max_buffered:
+            self.flush()
+
+    def flush(self,key=None):
+        """Write out the buffered records
 
         Arguments:
-          test_barcode: barcode/index sequence being tested
-          max_mismatches: maximum number of mismatches allowed while
-            still considering the two sequences to match (default is
-            zero i.e. no mismatches)
+          key: (optional) name of the output file to flush
+            (default is to flush all files)
 
-        Returns:
-          True if test barcode matches the reference, False otherwise.
+        """
+        if key is None:
+            for key in self._fp:
+                self.flush(key)
+            return
+        buf = self._buffer[key]
+        if buf:
+            buf.append('')
+            self._fp[key].write('\n'.join(buf))
+            self._buffered -= self._buflen[key]
+            self._buffer[key] = []
+            self._buflen[key] = 0
+
+    def count(self,key):
+        """Return the number of reads written to an output file
+
+        Arguments:
+          key: name of the output file
 
         """
-        if test_barcode.startswith(self.__barcode):
-            return True
-        nmismatches = 0
-        try:
-            for i in range(len(self.__barcode)):
-                if test_barcode[i] != self.__barcode[i]:
-                    nmismatches += 1
-                    if nmismatches > max_mismatches:
-                        return False
-        except IndexError:
-            return False
-        return True
+        return self._metadata[key].nreads
+
+    def close(self):
+        """Flush and close all the output files
+
+        """
+        for key in self._fp:
+            self.flush(key)
+            self._fp[key].close()
+            fastqmeta.save_metadata(self._filen[key],self._metadata[key])
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
 
 #######################################################################
 # Module Functions
 #######################################################################
 
-def demultiplex_fastq(fastq_file,barcodes,nmismatches):
+def output_file_names(fastq_file,barcodes,ext="fastq"):
+    """Return the names of the output files for a FASTQ file
+
+    Arguments:
+      fastq_file: FASTQ file to be demultiplexed
+      barcodes: list of barcodes to use for demultiplexing
+      ext: (optional) extension for the output files
+
+    Returns:
+      List of tuples (barcode,filename) for each barcode
+      associated with the lane for the FASTQ, followed by
+      (None,filename) for the unbinned reads; the list is
+      empty if there are no barcodes for the lane.
+
+    """
+    info = IlluminaData.IlluminaFastq(fastq_file)
+    names = []
+    for barcode in barcodes:
+        if barcode['lane'] != info.lane_number:
+            continue
+        names.append((barcode,
+                      "%s_%s_L%03d_R%d_%03d.%s" % (barcode['name'],
+                                                   barcode['index'],
+                                                   info.lane_number,
+                                                   info.read_number,
+                                                   info.set_number,
+                                                   ext)))
+    if names:
+        names.append((None,
+                      "unbinned_L%03d_R%d_%03d.%s" % (info.lane_number,
+                                                      info.read_number,
+                                                      info.set_number,
+                                                      ext)))
+    return names
+
+def demultiplex_fastq(fastq_file,barcodes,nmismatches,use_bgzf=False,
+                      compression=None,buffer_size=BUFFER_SIZE,threads=1,
+                      max_buffered=MAX_BUFFERED):
     """Perform demultiplexing of a FASTQ file
 
     Demultiplex reads in a FASTQ file given information about a set of 
@@ -110,72 +266,309 @@ def demultiplex_fastq(fastq_file,barcodes,nmismatches):
     Produces a file for each barcode, plus another for 'unbinned'
     reads.
 
+    Reads are assigned to barcodes using a lookup table of all the
+    sequences within 'nmismatches' of each barcode (see the
+    'bcftbx.barcodes' module). Index sequences which are equally
+    close to more than one barcode are reported when the table is
+    built, and reads with those index sequences are unbinned.
+
+    The reads are written via an OutputPool, so the metadata (read
+    counts etc) for each output file is also cached (see the
+    'fastqmeta' module).
+
     Arguments:
       fastq_file: FASTQ file to be demultiplexed (can be gzipped)
       barcodes: list of barcode sequences to use for demultiplexing
+        (dual index barcodes should have the i7 and i5 sequences
+        separated by '-' or '+')
       nmismatches: maxiumum number of mismatched bases allowed when
         testing whether barcode sequences match
+      use_bgzf: if True then write the outputs as BGZF-compressed
+        '.fastq.gz' files (same as setting 'compression' to 'bgzf')
+      compression: (optional) compression for the output files:
+        either None (uncompressed FASTQ, the default), 'gzip' or
+        'bgzf'
+      buffer_size: (optional) size of the buffer for each output
+        file (bytes)
+      threads: (optional) number of threads to use for BGZF
+        compression (shared by all the output files)
+      max_buffered: (optional) limit on the total size of the
+        buffers for all the output files (bytes)
 
     Returns:
-      No return value
+      List of tuples (barcode,filename,nreads) for each output file,
+      where 'barcode' is None for the unbinned reads.
     """
     # Start
     print "Processing %s" % fastq_file
-    info = IlluminaData.IlluminaFastq(fastq_file)
+    if use_bgzf:
+        compression = 'bgzf'
+    outputs = OutputPool(compression=compression,
+                         buffer_size=buffer_size,
+                         threads=threads,
+                         max_buffered=max_buffered)
     # Set up output files
-    output_files = {}
-    # Weed out barcodes that aren't associated with this lane
-    local_barcodes = []
-    for barcode in barcodes:
-        if barcode['lane'] != info.lane_number:
-            continue
-        local_barcodes.append(barcode)
-        output_file_name = "%s_%s_L%03d_R%d_%03d.fastq" % (barcode['name'],
-                                                           barcode['index'],
-                                                           info.lane_number,
-                                                           info.read_number,
-                                                           info.set_number)
-        print "\t%s\t%s" % (barcode['index'],output_file_name)
-        if os.path.exists(output_file_name):
-            print "\t%s: already exists,exiting" % output_file_name
-            sys.exit(1)
-        output_files[barcode['index']] = open(output_file_name,'w')
+    output_files = output_file_names(fastq_file,barcodes,
+                                     ext=outputs.extension)
     # Check if there's anything to do
-    if len(local_barcodes) == 0:
-        return
-    # Also make a file for unbinned reads
-    unbinned_file_name = "unbinned_L%03d_R%d_%03d.fastq" % (info.lane_number,
-                                                            info.read_number,
-                                                            info.set_number)
-    if os.path.exists(unbinned_file_name):
-        print "\t%s: already exists,exiting" % unbinned_file_name
-        sys.exit(1)
-    output_files['unbinned'] = open(unbinned_file_name,'w')
+    if not output_files:
+        outputs.close()
+        return []
+    for barcode,output_file_name in output_files:
+        if os.path.exists(output_file_name):
+            outputs.close()
+            raise Exception("%s: already exists" % output_file_name)
+    local_barcodes = []
+    for barcode,output_file_name in output_files:
+        if barcode is not None:
+            print "\t%s\t%s" % (barcode['index'],output_file_name)
+            local_barcodes.append(barcode)
+            outputs.open(barcode['index'],output_file_name)
+        else:
+            outputs.open('unbinned',output_file_name)
+    # Build the lookup table
+    table = BarcodeTable([barcode['index'] for barcode in local_barcodes],
+                         max_mismatches=nmismatches)
+    output_keys = dict([(barcode['index'].upper(),barcode['index'])
+                        for barcode in local_barcodes])
+    if table.scanning:
+        print "\tNOTE too many mismatched sequences for a lookup table, " \
+            "comparing each index with every barcode"
+    for seq,matching_barcodes in table.collisions:
+        print "\tWARNING %s matches more than one barcode (%s)" % \
+            (seq,', '.join(matching_barcodes))
     # Process reads
     nreads = 0
+    lookup = table.lookup
+    write = outputs.write
     for read in FASTQFile.FastqIterator(fastq_file):
         nreads += 1
-        matched_read = False
         this_barcode = read.seqid.index_sequence
-        for barcode in local_barcodes:
-            if barcode['matcher'].match(this_barcode,nmismatches):
-                ##print "Matched %s against %s" % (this_barcode,barcodes[barcode]['name'])
-                output_files[barcode['index']].write(str(read)+'\n')
-                matched_read = True
-                break
+        if this_barcode:
+            matched_barcode = lookup(this_barcode)
+        else:
+            matched_barcode = None
         # Put in unbinned if no match
-        if not matched_read:
-            output_files['unbinned'].write(str(read)+'\n')
-        ##if nreads > 100: break
+        if matched_barcode is None:
+            write('unbinned',read)
+        else:
+            write(output_keys[matched_barcode],read)
     # Close files
-    for barcode in local_barcodes:
-        output_files[barcode['index']].close()
+    outputs.close()
     print "\tMatched %d reads for %s" % (nreads,os.path.basename(fastq_file))
+    results = []
+    for barcode,output_file_name in output_files:
+        if barcode is not None:
+            nreads = outputs.count(barcode['index'])
+        else:
+            nreads = outputs.count('unbinned')
+        results.append((barcode,output_file_name,nreads))
+    return results
+
+def _demultiplex_fastq_worker(args):
+    """Internal: run 'demultiplex_fastq' in a worker process
+
+    Arguments:
+      args: tuple (fastq_file,barcodes,nmismatches,kwargs)
+
+    Returns:
+      Tuple (fastq_file,results) where 'results' are the
+      results from 'demultiplex_fastq'.
+
+    """
+    fastq_file,barcodes,nmismatches,kwargs = args
+    return (fastq_file,demultiplex_fastq(fastq_file,barcodes,nmismatches,
+                                         **kwargs))
+
+def demultiplex_fastqs(fastqs,barcodes,nmismatches,n_processors=None,
+                       **kwargs):
+    """Perform demultiplexing of multiple FASTQ files in parallel
+
+    Each FASTQ file is demultiplexed by 'demultiplex_fastq' in
+    a separate worker process.
+
+    Arguments:
+      fastqs: list of FASTQ files to be demultiplexed
+      barcodes: list of barcode sequences to use for demultiplexing
+      nmismatches: maxiumum number of mismatched bases allowed when
+        testing whether barcode sequences match
+      n_processors: (optional) number of processes to use (default:
+        all available)
+      kwargs: additional keyword arguments to pass to
+        'demultiplex_fastq'
+
+    Returns:
+      List of tuples (fastq_file,results) for each FASTQ file,
+      in the same order as the input list, where 'results' are
+      the results from 'demultiplex_fastq'.
+
+    """
+    if n_processors is None:
+        n_processors = multiprocessing.cpu_count()
+    n_processors = max(min(n_processors,len(fastqs)),1)
+    if kwargs.get('threads') is None:
+        kwargs['threads'] = max(multiprocessing.cpu_count()//n_processors,1)
+    jobs = [(fastq,barcodes,nmismatches,kwargs) for fastq in fastqs]
+    if n_processors == 1:
+        return map(_demultiplex_fastq_worker,jobs)
+    pool = multiprocessing.Pool(n_processors)
+    try:
+        results = pool.map(_demultiplex_fastq_worker,jobs,chunksize=1)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return results
+
+def write_summary(results,summary_file=None):
+    """Write a summary of the number of reads for each barcode
+
+    The summary has one line for each output file, with the
+    lane, barcode name, index sequence, output file and number
+    of reads (tab-separated).
+
+    Arguments:
+      results: list of tuples (fastq_file,results) returned by
+        'demultiplex_fastqs'
+      summary_file: (optional) file to write the summary to
+        (default is to write to stdout)
+
+    """
+    if summary_file is None:
+        fp = sys.stdout
+    else:
+        fp = open(summary_file,'w')
+    fp.write("#Lane\tName\tIndex\tFile\tReads\n")
+    for fastq_file,output_files in results:
+        lane = IlluminaData.IlluminaFastq(fastq_file).lane_number
+        for barcode,output_file_name,nreads in output_files:
+            if barcode is None:
+                name,index = ('unbinned','')
+            else:
+                name,index = (barcode['name'],barcode['index'])
+            fp.write("%s\t%s\t%s\t%s\t%d\n" % (lane,name,index,
+                                                 output_file_name,nreads))
+    if summary_file is not None:
+        fp.close()
 
 #######################################################################
-# Main program
+# Tests
 #######################################################################
 
+import unittest
+
+class TestDemultiplexFastq(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self.wd = tempfile.mkdtemp()
+        self.pwd = os.getcwd()
+        os.chdir(self.wd)
+        self.barcodes = [{ 'name': 'PB1', 'index': 'CGATGT', 'lane': 1 },
+                         { 'name': 'PB2', 'index': 'TTAGGC', 'lane': 1 },
+                         { 'name': 'PB3', 'index': 'ACAGTG', 'lane': 2 }]
+        # Reads are ordered so that the total buffer limit is hit
+        # (on the third read) as well as the buffer size for a
+        # single file (on the fifth read)
+        indexes = ('CGATGT','TTAGGC','AAAAAA','CGATGA','CGATGT',
+                   'TTAGGC','NNNNNN','CGATGT')
+        self.reads = {}
+        self.fastqs = []
+        for read_number in (1,2):
+            reads = []
+            for i,index in enumerate(indexes):
+                reads.append("@NB500968:70:HCYMKBGX2:1:11101:%d:1000 "
+                             "%d:N:0:%s\n%s\n+\n%s" % (i,read_number,index,
+                                                       'ACGT'*5,'E'*20))
+            fastq = os.path.join(self.wd,
+                                 "Undetermined_S0_L001_R%d_001.fastq" %
+                                 read_number)
+            fp = open(fastq,'w')
+            fp.write('\n'.join(reads)+'\n')
+            fp.close()
+            self.fastqs.append(fastq)
+            self.reads["PB1_CGATGT_L001_R%d_001" % read_number] = \
+                [reads[i] for i in (0,3,4,7)]
+            self.reads["PB2_TTAGGC_L001_R%d_001" % read_number] = \
+                [reads[i] for i in (1,5)]
+            self.reads["unbinned_L001_R%d_001" % read_number] = \
+                [reads[i] for i in (2,6)]
+    def tearDown(self):
+        import shutil
+        os.chdir(self.pwd)
+        shutil.rmtree(self.wd)
+    def _check_outputs(self,results,compression):
+        ext = OutputPool(compression=compression).extension
+        self.assertEqual(len(results),2)
+        for (fastq,output_files),read_number in zip(results,(1,2)):
+            self.assertEqual(fastq,self.fastqs[read_number-1])
+            self.assertEqual(
+                [(b['name'] if b else None,f,n) for b,f,n in output_files],
+                [('PB1',"PB1_CGATGT_L001_R%d_001.%s" % (read_number,ext),4),
+                 ('PB2',"PB2_TTAGGC_L001_R%d_001.%s" % (read_number,ext),2),
+                 (None,"unbinned_L001_R%d_001.%s" % (read_number,ext),2)])
+            for barcode,output_file,nreads in output_files:
+                self.assertEqual(bgzf.is_bgzf(output_file),
+                                 (compression == 'bgzf'))
+                with FASTQFile.get_fastq_file_handle(output_file) as fp:
+                    reads = fp.read().rstrip('\n').split('\n')
+                self.assertEqual(
+                    reads,
+                    '\n'.join(self.reads[output_file[:-len(ext)-1]])
+                    .split('\n'))
+                metadata = fastqmeta.cached_metadata(output_file)
+                self.assertNotEqual(metadata,None)
+                self.assertEqual(metadata.nreads,nreads)
+    def _demultiplex(self,compression):
+        return demultiplex_fastqs(self.fastqs,self.barcodes,1,
+                                  n_processors=2,
+                                  compression=compression,
+                                  buffer_size=100,
+                                  max_buffered=200)
+    def test_demultiplex_fastqs(self):
+        """demultiplex_fastqs: write uncompressed FASTQs
+        """
+        self._check_outputs(self._demultiplex(None),None)
+    def test_demultiplex_fastqs_gzip(self):
+        """demultiplex_fastqs: write gzipped FASTQs
+        """
+        self._check_outputs(self._demultiplex('gzip'),'gzip')
+    def test_demultiplex_fastqs_bgzf(self):
+        """demultiplex_fastqs: write BGZF-compressed FASTQs
+        """
+        self._check_outputs(self._demultiplex('bgzf'),'bgzf')
+    def test_demultiplex_fastq_output_exists(self):
+        """demultiplex_fastq: raise exception if an output exists
+        """
+        open("unbinned_L001_R1_001.fastq",'w').close()
+        self.assertRaises(Exception,demultiplex_fastq,
+                          self.fastqs[0],self.barcodes,1)
+    def test_demultiplex_fastq_no_barcodes_for_lane(self):
+        """demultiplex_fastq: no outputs if no barcodes for the lane
+        """
+        self.assertEqual(demultiplex_fastq(self.fastqs[0],
+                                           self.barcodes[2:],1),[])
+        self.assertEqual(sorted(os.listdir(self.wd)),
+                         [os.path.basename(f) for f in self.fastqs])
+    def test_write_summary(self):
+        """write_summary: write the number of reads for each barcode
+        """
+        summary_file = os.path.join(self.wd,"summary.txt")
+        write_summary(self._demultiplex(None),summary_file)
+        self.assertEqual(open(summary_file).read().split('\n'),
+                         ["#Lane\tName\tIndex\tFile\tReads",
+                          "1\tPB1\tCGATGT\tPB1_CGATGT_L001_R1_001.fastq\t4",
+                          "1\tPB2\tTTAGGC\tPB2_TTAGGC_L001_R1_001.fastq\t2",
+                          "1\tunbinned\t\tunbinned_L001_R1_001.fastq\t2",
+                          "1\tPB1\tCGATGT\tPB1_CGATGT_L001_R2_001.fastq\t4",
+                          "1\tPB2\tTTAGGC\tPB2_TTAGGC_L001_R2_001.fastq\t2",
+                          "1\tunbinned\t\tunbinned_L001_R2_001.fastq\t2",
+                          ""])
+
+#######################################################################
+# Main program
+#######################################################################
 if __name__ == "__main__":
 
     # Create command line parser
@@ -192,6 +585,21 @@ if __name__ == "__main__":
     p.add_option("--samplesheet",action="store",dest="sample_sheet",default=None,
                  help="specify SampleSheet.csv file to read barcodes, sample names and lane "
                  "assignments from (as an alternative to --barcode).")
+    p.add_option("--bgzf",action="store_true",dest="bgzf",default=False,
+                 help="write output FASTQs as BGZF-compressed .fastq.gz files "
+                 "(default is to write uncompressed FASTQs)")
+    p.add_option("--gzip",action="store_true",dest="gzip",default=False,
+                 help="write output FASTQs as gzipped .fastq.gz files "
+                 "(default is to write uncompressed FASTQs)")
+    p.add_option("-n",action="store",dest="n_processors",default=None,
+                 type='int',
+                 help="specify number of cores to use for processing the "
+                 "FASTQs in parallel (default: all available)")
+    p.add_option("--summary",action="store",dest="summary_file",
+                 default=SUMMARY_FILE,
+                 help="write summary of the number of reads assigned to "
+                 "each barcode to SUMMARY_FILE (default: '%s')" %
+                 SUMMARY_FILE)
 
     # Parse command line
     options,args = p.parse_args()
@@ -200,6 +608,14 @@ if __name__ == "__main__":
     if len(args) != 1:
         p.error("expected one argument (location of undetermined index reads)")
     undetermined_dir = os.path.abspath(args[0])
+    if options.bgzf and options.gzip:
+        p.error("--bgzf and --gzip cannot be used together")
+    if options.bgzf:
+        compression = 'bgzf'
+    elif options.gzip:
+        compression = 'gzip'
+    else:
+        compression = None
 
     # Set up barcode data
     barcodes = []
@@ -208,7 +624,6 @@ if __name__ == "__main__":
         print "Assigning barcode '%s' in lane %s to %s" % (barcode,lane,name)
         barcodes.append({ 'name': name,
                           'index': barcode,
-                          'matcher': BarcodeMatcher(barcode),
                           'lane': int(lane)})
 
     # Read from sample sheet (if supplied)
@@ -222,18 +637,33 @@ if __name__ == "__main__":
             print "Assigning barcode '%s' in lane %s to %s" % (barcode,lane,name)
             barcodes.append({ 'name': name,
                               'index': barcode,
-                              'matcher': BarcodeMatcher(barcode),
                               'lane': int(lane) })
     if len(barcodes) < 1:
         p.error("need at least one --barcode and/or --samplesheet assignment")
 
     # Collect input files
     p = IlluminaData.IlluminaProject(undetermined_dir)
-
-    # Loop over "samples" and match barcodes
+    fastqs = []
     for s in p.samples:
         for fq in s.fastq:
-            fastq = os.path.join(s.dirn,fq)
-            demultiplex_fastq(fastq,barcodes,1)
+            fastqs.append(os.path.join(s.dirn,fq))
+
+    # Check outputs don't already exist
+    ext = OutputPool(compression=compression).extension
+    for fastq in fastqs:
+        for barcode,output_file_name in output_file_names(fastq,barcodes,ext):
+            if os.path.exists(output_file_name):
+                print "%s: already exists,exiting" % output_file_name
+                sys.exit(1)
+
+    # Match barcodes
+    results = demultiplex_fastqs(fastqs,barcodes,1,
+                                 n_processors=options.n_processors,
+                                 compression=compression)
+
+    # Write summary
+    if options.summary_file:
+        print "Writing summary to %s" % options.summary_file
+        write_summary(results,options.summary_file)
     print "Finished"
 
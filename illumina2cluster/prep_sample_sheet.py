@@ -15,7 +15,7 @@ Prepare sample sheet file for Illumina sequencers.
 
 """
 
-__version__ = "0.4.0"
+__version__ = "0.5.0"
 
 #######################################################################
 # Imports
@@ -34,30 +34,64 @@ sys.path.append(SHARE_DIR)
 import bcftbx.IlluminaData as IlluminaData
 from bcftbx.utils import parse_lanes
 from bcftbx.utils import parse_named_lanes
+from bcftbx.barcodes import truncate_barcode
 
 #######################################################################
 # Functions
 #######################################################################
 
-def truncate_barcode(seq,length):
-    """Return barcode sequence truncated to requested length
+def report_barcode_distances(data,mismatches=None):
+    """Report the minimum distances between barcodes in each lane
 
-    'seq' is a barcode sequence (note that dual index sequences
-    are of the form e.g. 'AGGTAC-GGCCTT' i.e. the name includes
-    a hyphen) and 'length' is the desired length (i.e. number of
-    bases to keep).
+    Prints the minimum Hamming distance between the barcodes
+    in each lane, and the number of mismatches that can be
+    allowed when demultiplexing (see 'SampleSheet.barcode_distances').
+
+    Arguments:
+      data: SampleSheet instance
+      mismatches: (optional) number of mismatches that will be
+        allowed when demultiplexing; if set then a warning is
+        issued for each lane where the barcodes can't be
+        distinguished at this level
+
+    Returns:
+      Number of lanes where the barcodes can't be distinguished
+      at the specified number of mismatches (or with no
+      mismatches, if 'mismatches' is not set).
 
     """
-    try:
-        i = seq.index('-')
-        # Dual index barcode
-        if i >= length:
-            return seq[:length]
+    if mismatches is None:
+        mismatches = 0
+    nbad_lanes = 0
+    distances = data.barcode_distances()
+    print "Barcode distances:"
+    for lane in sorted(distances.keys()):
+        result = distances[lane]
+        if lane is None:
+            name = "All samples"
+        else:
+            name = "Lane %s" % lane
+        if result.min_distance is None:
+            print "%s: %d barcode(s), no restriction on mismatches" % \
+                (name,len(result.barcodes))
+            continue
+        if result.max_mismatches < 0:
+            allowed = "barcodes are duplicated"
         else:
-            return seq[:length+1]
-    except ValueError:
-        # No hyphen: single index barcode
-        return seq[:length]
+            allowed = "allows up to %d mismatch%s" % \
+                      (result.max_mismatches,
+                       ('es' if result.max_mismatches != 1 else ''))
+        print "%s: %d barcodes, minimum distance %d (%s)" % \
+            (name,len(result.barcodes),result.min_distance,allowed)
+        for barcode1,barcode2 in result.closest_pairs:
+            print "\t%s\t%s" % (barcode1,barcode2)
+        if result.max_mismatches < mismatches:
+            logging.warning("%s: barcodes can't be distinguished allowing "
+                            "%d mismatch%s" % (name,mismatches,
+                                               ('es' if mismatches != 1
+                                                else '')))
+            nbad_lanes += 1
+    return nbad_lanes
 
 #######################################################################
 # Unit tests
@@ -123,6 +157,15 @@ if __name__ == "__main__":
                  "<lanes> part can be a single integer (e.g. 1), a set of integers (e.g. "
                  "1,3,...), a range (e.g. 1-3), or a combination (e.g. 1,3-5,7). If no "
                  "lanes are specified then all samples will have their project set to <name>")
+    p.add_option('--check-barcodes',action="store_true",dest="check_barcodes",
+                 help="report the minimum distance between the barcodes in each "
+                 "lane, and the number of mismatches that can be allowed when "
+                 "demultiplexing")
+    p.add_option('--barcode-mismatches',action="store",dest="barcode_mismatches",
+                 default=None,type='int',
+                 help="check that the barcodes in each lane can be distinguished "
+                 "when allowing BARCODE_MISMATCHES mismatches (implies "
+                 "--check-barcodes)")
     p.add_option('--ignore-warnings',action="store_true",dest="ignore_warnings",default=False,
                  help="ignore warnings about spaces and duplicated sampleID/sampleProject "
                  "combinations when writing new samplesheet.csv file")
@@ -276,6 +319,10 @@ if __name__ == "__main__":
                             (data.sample_id_column,
                              data.sample_project_column,
                              line))
+    # Barcode distances
+    if options.check_barcodes or options.barcode_mismatches is not None:
+        if report_barcode_distances(data,options.barcode_mismatches):
+            check_status = 1
     # Predict outputs
     if check_status == 0 or options.ignore_warnings or options.view:
         # Generate prediction
@@ -303,7 +350,7 @@ if __name__ == "__main__":
                             "S%d" % sample.s_index,
                             barcode,
                             lanes]
-                    prediction.append("%s" % '\t'.join([str(i) for i in line]))
+                    prediction.append("%s" % '\t'.join([str(x) for x in line]))
         prediction = '\n'.join(prediction)
         # Handle paginated output
         if os.isatty(sys.stdout.fileno()):
@@ -14,17 +14,30 @@
 Count and report the barcode/index sequences (AKA tags) in one or more
 Fastq file from an Illumina sequencer.
 
+By default every distinct index sequence is counted exactly. For very
+large files with many distinct sequences (e.g. where a mis-set index
+read has produced random barcodes), the number of sequences that are
+kept can be limited, in which case only the most frequent sequences
+are reported and their counts are approximate (see HeavyHitters).
+
 """
 
 #######################################################################
 # Import modules that this module depends on
 #######################################################################
 
-__version__ = "0.0.2"
+__version__ = "0.0.8"
 
+import os
 import sys
 import optparse
+import itertools
+import functools
 import bcftbx.FASTQFile as FASTQFile
+import bcftbx.fastqmapreduce as fastqmapreduce
+import bcftbx.IlluminaData as IlluminaData
+from bcftbx.barcodes import BarcodeTable
+from bcftbx.barcodes import mismatch_neighbourhood
 
 #######################################################################
 # Class definitions
@@ -33,14 +46,31 @@ import bcftbx.FASTQFile as FASTQFile
 class Barcodes:
     """Class for counting index sequences in Fastq files
 
+    If 'max_sequences' is specified then the counts are
+    collected using a HeavyHitters instance, so that memory
+    use is bounded; in this case the counts returned by
+    'count_for' are lower bounds which can be less than the
+    true counts by up to the value of the 'error' property.
+
     """
-    def __init__(self):
+    def __init__(self,max_sequences=None):
         """Create a new Barcodes instance
 
+        Arguments:
+          max_sequences: (optional) if set then only keep
+            counts for (approximately) this many of the most
+            frequent index sequences
+
         """
         self._counts = {}
+        self._index = None
+        self._max_sequences = max_sequences
+        if max_sequences is not None:
+            self._hitters = HeavyHitters(max_sequences)
+        else:
+            self._hitters = None
 
-    def load(self,fastq=None,fp=None):
+    def load(self,fastq=None,fp=None,n_processors=None,index_reads=False):
         """Read in fastq data and collect index sequence info
 
         The input FASTQ can be either a text file or a compressed (gzipped)
@@ -50,14 +80,74 @@ class Barcodes:
         Arguments:
            fastq_file: name of the FASTQ file to iterate through
            fp: file-like object opened for reading
+           n_processors: number of cores to use for a FASTQ file
+             specified via 'fastq' (default: all available)
+           index_reads: if True then the FASTQ contains index
+             reads, and the read sequences are counted (rather
+             than the index sequences from the read headers)
+
+        FASTQ files specified via 'fastq' are split into chunks
+        which are processed in parallel.
 
         """
-        for read in FASTQFile.FastqIterator(fastq_file=fastq,fp=fp):
-            seq = read.seqid.index_sequence
-            if seq not in self._counts:
-                self._counts[seq] = 1
-            else:
-                self._counts[seq] += 1
+        count_func = functools.partial(count_index_sequences,
+                                       max_sequences=self._max_sequences,
+                                       index_reads=index_reads)
+        if self._hitters is not None:
+            merge_func = merge_heavy_hitters
+        else:
+            merge_func = merge_counts
+        if fastq is not None:
+            counts = fastqmapreduce.fastq_map_reduce(fastq,
+                                                     count_func,
+                                                     merge_func,
+                                                     nprocs=n_processors)
+        else:
+            counts = count_func(fp=fp)
+        self._add_counts(counts)
+
+    def load_index_pair(self,fastq1,fastq2):
+        """Read in index sequences from a pair of index read FASTQs
+
+        The sequences of the corresponding reads in the two
+        FASTQs (e.g. the 'I1' and 'I2' FASTQs from bcl2fastq)
+        are joined with '+' to give dual index sequences.
+
+        Arguments:
+          fastq1: FASTQ with the first (i7) index reads
+          fastq2: FASTQ with the second (i5) index reads
+
+        """
+        self._add_counts(count_index_read_pairs(
+            fastq1,fastq2,max_sequences=self._max_sequences))
+
+    def _add_counts(self,counts):
+        """Internal: add counts to those already loaded
+
+        Arguments:
+          counts: dictionary of counts or HeavyHitters instance
+
+        """
+        if self._hitters is not None:
+            self._hitters.merge(counts)
+            self._counts = self._hitters.counts
+        else:
+            self._counts = merge_counts(self._counts,counts)
+        self._index = None
+
+    @property
+    def error(self):
+        """Return the maximum error in the counts
+
+        Returns:
+          Maximum amount by which the count for any sequence
+          can be less than the true count (always zero unless
+          'max_sequences' was specified).
+
+        """
+        if self._hitters is None:
+            return 0
+        return self._hitters.error
 
     def sequences(self):
         """Return list of barcode sequences
@@ -95,16 +185,273 @@ class Barcodes:
         """Return group of sequences which match the one supplied
 
         Given a sequence, find all sequences which match
-        within the tolerance of allowed mismatches, and
-        return as a list.
+        within the tolerance of allowed mismatches (as
+        determined by 'sequences_match'), and return as a
+        sorted list.
+
+        The matching sequences are found using a
+        MismatchIndex, which is built on the first call
+        after loading data.
+
+        """
+        if self._index is None:
+            self._index = MismatchIndex(self._counts.keys())
+        return sorted(self._index.neighbours(seq,max_mismatches))
+
+class HeavyHitters:
+    """Approximate counts for the most frequent items in a stream
+
+    Implements the Misra-Gries "frequent items" summary: at
+    most 2*'capacity' counters are held at any time, and
+    whenever there are too many the counts are reduced by the
+    count of the ('capacity'+1)'th most frequent item and
+    those which drop to zero are discarded.
+
+    The count for each item is then a lower bound, which is
+    less than the true count by no more than the value of the
+    'error' property; this is at most 'total'/('capacity'+1),
+    so any item occurring more often than that is guaranteed
+    to be retained.
+
+    Summaries from different parts of the data (e.g. chunks,
+    files or lanes) can be combined using the 'merge' method,
+    and the same error bound applies to the merged summary.
+
+    Provides the following properties:
+
+    - capacity: number of counters retained
+    - counts: dictionary with the current counts
+    - total: total count of all items added
+    - error: maximum error in the counts
+
+    """
+    def __init__(self,capacity):
+        """Create a new HeavyHitters instance
+
+        Arguments:
+          capacity: number of items to retain counts for
+
+        """
+        self.capacity = capacity
+        self.counts = {}
+        self.total = 0
+        self.error = 0
+
+    def add(self,item,count=1):
+        """Add occurrences of an item
+
+        Arguments:
+          item: item to add
+          count: (optional) number of occurrences (default: 1)
+
+        """
+        counts = self.counts
+        try:
+            counts[item] += count
+        except KeyError:
+            counts[item] = count
+            if len(counts) > 2*self.capacity:
+                self._prune()
+        self.total += count
+
+    def update(self,counts):
+        """Add the occurrences from a dictionary of counts
+
+        Arguments:
+          counts: dictionary mapping items to counts
+
+        """
+        for item in counts:
+            self.add(item,counts[item])
+
+    def merge(self,hitters):
+        """Combine with the counts from another instance
+
+        Arguments:
+          hitters: HeavyHitters instance to merge
+
+        Returns:
+          This instance.
+
+        """
+        total = self.total
+        self.update(hitters.counts)
+        self.total = total + hitters.total
+        self.error += hitters.error
+        return self
+
+    def bounds(self,item):
+        """Return the bounds on the true count for an item
+
+        Arguments:
+          item: item to get the bounds for
+
+        Returns:
+          Tuple (lower,upper) with the lower and upper bounds.
+
+        """
+        count = self.counts.get(item,0)
+        return (count,count+self.error)
+
+    def top(self,n=None):
+        """Return the most frequent items
+
+        Arguments:
+          n: (optional) number of items to return (default is
+            to return all the retained items)
+
+        Returns:
+          List of tuples (item,count) sorted from highest to
+          lowest count.
+
+        """
+        items = sorted(self.counts.iteritems(),
+                       key=lambda x: x[1],reverse=True)
+        if n is not None:
+            items = items[:n]
+        return items
+
+    def _prune(self):
+        """Internal: reduce the number of counters to 'capacity'
+
+        """
+        if len(self.counts) <= self.capacity:
+            return
+        counts = sorted(self.counts.itervalues(),reverse=True)
+        decrement = counts[self.capacity]
+        self.counts = dict([(item,count-decrement)
+                            for item,count in self.counts.iteritems()
+                            if count > decrement])
+        self.error += decrement
+
+class MismatchIndex:
+    """Index for finding sequences within a number of mismatches
+
+    The indexed sequences are stored in sets according to
+    their lengths. To find the sequences which match a query
+    sequence, every sequence within the allowed number of
+    mismatches of the query is generated (see the
+    'mismatch_neighbourhood' function) and looked up, so the
+    time taken depends on the length of the query and the
+    number of mismatches, rather than on the number of
+    sequences in the index.
+
+    Matches are the same as those from 'sequences_match':
+    an 'N' in either sequence counts as a mismatch (except
+    for exact matches), and sequences of different lengths
+    are compared over the length of the shorter one.
+
+    """
+    def __init__(self,seqs):
+        """Create a new MismatchIndex
+
+        Arguments:
+          seqs: list of sequences to index
+
+        """
+        # Sets of sequences keyed by length
+        self._seqs = {}
+        # Sequences grouped by prefix, keyed by (length,prefix length)
+        self._prefixes = {}
+        bases = set()
+        for seq in seqs:
+            if seq is None:
+                continue
+            self._seqs.setdefault(len(seq),set()).add(seq)
+            bases.update(seq)
+        self._bases = ''.join(sorted(bases))
+
+    def _prefix_index(self,length,prefix_length):
+        """Internal: return sequences of a given length by prefix
+
+        Arguments:
+          length: length of the indexed sequences
+          prefix_length: length of the prefixes
+
+        Returns:
+          Dictionary where the keys are prefixes and the values
+          are lists of the sequences with that prefix.
+
+        """
+        key = (length,prefix_length)
+        try:
+            return self._prefixes[key]
+        except KeyError:
+            prefixes = {}
+            for seq in self._seqs[length]:
+                prefixes.setdefault(seq[:prefix_length],[]).append(seq)
+            self._prefixes[key] = prefixes
+            return prefixes
+
+    def _neighbourhood(self,seq,max_mismatches):
+        """Internal: generate sequences matching a sequence
+
+        Positions with an 'N' in 'seq' always count as
+        mismatches, so any base is allowed there; the
+        remaining mismatches are distributed over the other
+        positions.
+
+        Arguments:
+          seq: sequence to generate the neighbourhood for
+          max_mismatches: maximum number of mismatches
+
+        Returns:
+          Iterator yielding each sequence made from the indexed
+          bases which matches 'seq'.
 
         """
-        grp = []
-        for s in self.sequences():
-            if s not in grp and sequences_match(s,seq,max_mismatches):
-                grp.append(s)
-        grp.sort()
-        return grp
+        n_positions = [i for i,b in enumerate(seq) if b == 'N']
+        if len(n_positions) > max_mismatches:
+            return
+        if not n_positions:
+            for s,n in mismatch_neighbourhood(seq,max_mismatches,self._bases):
+                yield s
+            return
+        other_positions = [i for i,b in enumerate(seq) if b != 'N']
+        other_bases = ''.join([seq[i] for i in other_positions])
+        mismatched = list(seq)
+        for s,n in mismatch_neighbourhood(other_bases,
+                                          max_mismatches-len(n_positions),
+                                          self._bases):
+            for i,b in itertools.izip(other_positions,s):
+                mismatched[i] = b
+            for fill in itertools.product(self._bases,
+                                          repeat=len(n_positions)):
+                for i,b in itertools.izip(n_positions,fill):
+                    mismatched[i] = b
+                yield ''.join(mismatched)
+
+    def neighbours(self,seq,max_mismatches=1):
+        """Return the indexed sequences which match a sequence
+
+        Arguments:
+          seq: sequence to find matches for
+          max_mismatches: maximum number of mismatches allowed
+            (default: 1)
+
+        Returns:
+          List of the indexed sequences which match 'seq'
+          according to 'sequences_match'.
+
+        """
+        if max_mismatches == 0:
+            if seq in self._seqs.get(len(seq),()):
+                return [seq]
+            return []
+        matches = []
+        for length in self._seqs:
+            if length <= len(seq):
+                # Compare indexed sequences with start of query
+                seqs = self._seqs[length]
+                for s in self._neighbourhood(seq[:length],max_mismatches):
+                    if s in seqs:
+                        matches.append(s)
+            else:
+                # Compare start of indexed sequences with query
+                prefixes = self._prefix_index(length,len(seq))
+                for s in self._neighbourhood(seq,max_mismatches):
+                    matches.extend(prefixes.get(s,[]))
+        return matches
 
 #######################################################################
 # Functions
@@ -135,42 +482,314 @@ def sequences_match(seq1,seq2,max_mismatches=0):
                 return False
     return True
 
-def main(fastqs,cutoff):
+def count_index_sequences(chunk=None,fp=None,max_sequences=None,
+                          index_reads=False):
+    """Count the index sequences in FASTQ data
+
+    By default the index sequence for each read is taken from
+    the sequence identifier line. Alternatively if the data
+    are index reads (e.g. from the 'I1' FASTQs produced by
+    bcl2fastq's '--create-fastq-for-index-reads' option) then
+    the read sequences themselves can be counted.
+
+    If numpy is available then the index sequences are
+    counted using batches of reads (with index reads being
+    counted using 2-bit packed sequences, see the
+    'FastqBatch.sequence_counts' method); otherwise the reads
+    are processed one by one.
+
+    Arguments:
+      chunk: FastqChunk with the reads to examine
+      fp: file-like object opened for reading (alternative to
+        'chunk')
+      max_sequences: (optional) if set then collect approximate
+        counts for (approximately) this many of the most
+        frequent sequences
+      index_reads: (optional) if True then count the read
+        sequences rather than the index sequences from the
+        sequence identifiers
+
+    Returns:
+      Dictionary mapping index sequences to read counts or,
+      if 'max_sequences' was set, a HeavyHitters instance.
+
+    """
+    if chunk is not None:
+        fp = chunk.fp()
+    try:
+        batches = FASTQFile.iter_batches(fp=fp)
+    except ImportError:
+        batches = None
+    if batches is not None:
+        if index_reads:
+            batch_counts = (batch.sequence_counts() for batch in batches)
+        else:
+            batch_counts = (batch.index_sequence_counts()
+                            for batch in batches)
+        return tally_counts(batch_counts,max_sequences=max_sequences)
+    reads = FASTQFile.FastqIterator(fp=fp)
+    if index_reads:
+        seqs = (read.sequence for read in reads)
+    else:
+        seqs = (read.seqid.index_sequence for read in reads)
+    return tally_sequences(seqs,max_sequences=max_sequences)
+
+def count_index_read_pairs(fastq1,fastq2,max_sequences=None):
+    """Count the index sequences from a pair of index read FASTQs
+
+    The two FASTQs (e.g. the 'I1' and 'I2' FASTQs produced by
+    bcl2fastq) are read in lock-step, and the sequences of
+    the corresponding reads are joined with '+' to form the
+    dual index sequence for each read (as in the sequence
+    identifier lines).
+
+    Arguments:
+      fastq1: FASTQ with the first (i7) index reads
+      fastq2: FASTQ with the second (i5) index reads
+      max_sequences: (optional) if set then collect approximate
+        counts for (approximately) this many of the most
+        frequent sequences
+
+    Returns:
+      Dictionary mapping index sequences to read counts or,
+      if 'max_sequences' was set, a HeavyHitters instance.
+
+    """
+    try:
+        batches = itertools.izip_longest(FASTQFile.iter_batches(fastq1),
+                                         FASTQFile.iter_batches(fastq2))
+    except ImportError:
+        batches = None
+    if batches is not None:
+        batch_counts = (batch1.sequence_counts(batch2)
+                        for batch1,batch2 in _check_pairs(batches,
+                                                          fastq1,fastq2))
+        return tally_counts(batch_counts,max_sequences=max_sequences)
+    reads = itertools.izip_longest(FASTQFile.FastqIterator(fastq1),
+                                   FASTQFile.FastqIterator(fastq2))
+    seqs = (read1.sequence + '+' + read2.sequence
+            for read1,read2 in _check_pairs(reads,fastq1,fastq2))
+    return tally_sequences(seqs,max_sequences=max_sequences)
+
+def _check_pairs(pairs,fastq1,fastq2):
+    """Internal: check that paired iterators are the same length
+
+    Arguments:
+      pairs: iterator yielding pairs of items (as from
+        'itertools.izip_longest')
+      fastq1: name of the first FASTQ file
+      fastq2: name of the second FASTQ file
+
+    Raises:
+      Exception: if one of the items is None (i.e. one of
+        the FASTQs has fewer reads than the other).
+
+    """
+    for item1,item2 in pairs:
+        if item1 is None or item2 is None:
+            raise Exception("%s and %s have different numbers of reads" %
+                            (fastq1,fastq2))
+        yield (item1,item2)
+
+def tally_sequences(seqs,max_sequences=None):
+    """Count the number of occurrences of each sequence
+
+    Arguments:
+      seqs: iterable yielding sequences
+      max_sequences: (optional) if set then collect approximate
+        counts for (approximately) this many of the most
+        frequent sequences
+
+    Returns:
+      Dictionary mapping sequences to counts or, if
+      'max_sequences' was set, a HeavyHitters instance.
+
+    """
+    if max_sequences is not None:
+        hitters = HeavyHitters(max_sequences)
+        for seq in seqs:
+            hitters.add(seq)
+        return hitters
+    counts = {}
+    for seq in seqs:
+        if seq not in counts:
+            counts[seq] = 1
+        else:
+            counts[seq] += 1
+    return counts
+
+def tally_counts(batch_counts,max_sequences=None):
+    """Combine dictionaries of sequence counts
+
+    Arguments:
+      batch_counts: iterable yielding dictionaries mapping
+        sequences to counts
+      max_sequences: (optional) if set then collect approximate
+        counts for (approximately) this many of the most
+        frequent sequences
+
+    Returns:
+      Dictionary mapping sequences to counts or, if
+      'max_sequences' was set, a HeavyHitters instance.
+
+    """
+    if max_sequences is not None:
+        hitters = HeavyHitters(max_sequences)
+        for counts in batch_counts:
+            hitters.update(counts)
+        return hitters
+    counts = {}
+    for batch in batch_counts:
+        for seq,count in batch.iteritems():
+            if seq not in counts:
+                counts[seq] = count
+            else:
+                counts[seq] += count
+    return counts
+
+def merge_counts(counts1,counts2):
+    """Combine two dictionaries of index sequence counts
+
+    Returns:
+      New dictionary with the combined counts.
+
+    """
+    counts = dict(counts1)
+    for seq in counts2:
+        if seq not in counts:
+            counts[seq] = counts2[seq]
+        else:
+            counts[seq] += counts2[seq]
+    return counts
+
+def group_fastqs(fastqs):
+    """Identify index read FASTQs and pair up I1/I2 FASTQs
+
+    FASTQs containing index reads are identified from their
+    names (see 'IlluminaFastq'); an 'I1' FASTQ is paired with
+    the matching 'I2' FASTQ if that is also in the list.
+
+    Arguments:
+      fastqs: list of FASTQ files
+
+    Returns:
+      List of tuples (fastq1,fastq2,index_reads) in the same
+      order as the input list, where 'fastq2' is the matching
+      'I2' FASTQ for an 'I1' FASTQ (or None), and 'index_reads'
+      is True if the FASTQs contain index reads.
+
+    """
+    index_fastqs = {}
+    for fastq in fastqs:
+        try:
+            info = IlluminaData.IlluminaFastq(fastq)
+        except IlluminaData.IlluminaDataError:
+            continue
+        if info.is_index_read:
+            index_fastqs[fastq] = info.read_number
+    partners = {}
+    for fastq in index_fastqs:
+        if index_fastqs[fastq] == 1:
+            dirn,name = os.path.split(fastq)
+            i = name.rfind('_I1_')
+            partner = os.path.join(dirn,name[:i]+'_I2_'+name[i+4:])
+            if index_fastqs.get(partner) == 2:
+                partners[fastq] = partner
+    paired = set(partners.values())
+    groups = []
+    for fastq in fastqs:
+        if fastq in paired:
+            continue
+        groups.append((fastq,partners.get(fastq),fastq in index_fastqs))
+    return groups
+
+def merge_heavy_hitters(hitters1,hitters2):
+    """Combine two HeavyHitters instances
+
+    Returns:
+      The first instance, updated with the counts from the
+      second.
+
+    """
+    return hitters1.merge(hitters2)
+
+def main(fastqs,cutoff,n_processors=None,expected_barcodes=None,
+         max_sequences=None):
     """Main program
 
     Arguments:
-      fastqs: list of FASTQ files to read sequences from
+      fastqs: list of FASTQ files to read sequences from; index read
+        FASTQs (e.g. 'I1' and 'I2' FASTQs) are identified from their
+        names, and the index sequences are taken from the reads
       cutoff: set the minimum number of reads that a barcode must appear in
         before it is reported
+      n_processors: number of cores to use (default: all available)
+      expected_barcodes: optional list of expected barcode sequences; if
+        supplied then the barcode that each index sequence would be
+        assigned to when demultiplexing (allowing 1 mismatch) is also
+        reported
+      max_sequences: optional maximum number of distinct index sequences
+        to keep counts for; if supplied then only the most frequent
+        sequences are reported, and their counts are approximate
 
     """
-    barcodes = Barcodes()
-    for fastq_file in fastqs:
-        print "Reading in data from %s" % fastq_file
-        barcodes.load(fastq=fastq_file)
-    print "Total # barcode sequences: %d" % len(barcodes.sequences())
+    if expected_barcodes:
+        table = BarcodeTable(expected_barcodes,max_mismatches=1)
+        for seq,matching_barcodes in table.collisions:
+            print "WARNING %s matches more than one expected barcode (%s)" % \
+                (seq,', '.join(matching_barcodes))
+    else:
+        table = None
+    barcodes = Barcodes(max_sequences=max_sequences)
+    for fastq_file,fastq_file2,index_reads in group_fastqs(fastqs):
+        if fastq_file2 is not None:
+            print "Reading in index reads from %s and %s" % (fastq_file,
+                                                             fastq_file2)
+            barcodes.load_index_pair(fastq_file,fastq_file2)
+        elif index_reads:
+            print "Reading in index reads from %s" % fastq_file
+            barcodes.load(fastq=fastq_file,n_processors=n_processors,
+                          index_reads=True)
+        else:
+            print "Reading in data from %s" % fastq_file
+            barcodes.load(fastq=fastq_file,n_processors=n_processors)
+    if max_sequences is None:
+        print "Total # barcode sequences: %d" % len(barcodes.sequences())
+    else:
+        print "# barcode sequences retained: %d" % len(barcodes.sequences())
+        print "Counts may be underestimated by up to %d reads" % \
+            barcodes.error
     print "Determining top barcode sequences"
     ordered_seqs = sorted(barcodes.sequences(),
                           cmp=lambda x,y: cmp(barcodes.count_for(y),
                                               barcodes.count_for(x)))
+    ranks = dict([(seq,i) for i,seq in enumerate(ordered_seqs)])
     print "Rank = position after sorting from most to least common"
     print "Index sequence = the barcode sequence"
     print "Count = number of reads with this exact index sequence"
     print "1 mismatch = number of reads which match this index when allowing 1 mismatch"
     print "2 mismatches = number of reads which match this index allowing 2 mismatches"
     print "Matching indices = list of higher ranked sequences matching this one (if any)"
-    print "Rank\tIndex sequence\tCount\t1 mismatch\t2 mismatches\tMatching indices"
+    header = "Rank\tIndex sequence\tCount\t1 mismatch\t2 mismatches\tMatching indices"
+    if table is not None:
+        print "Assigned barcode = expected barcode that this index matches (if any)"
+        header += "\tAssigned barcode"
+    print header
     for i,seq in enumerate(ordered_seqs):
         n_exact = barcodes.count_for(seq)
         n_1mismatch = barcodes.count_for(*barcodes.group(seq,1))
-        n_2mismatch = barcodes.count_for(*barcodes.group(seq,2))
+        group_2mismatch = barcodes.group(seq,2)
+        n_2mismatch = barcodes.count_for(*group_2mismatch)
         match_seqs = []
-        for i1,seq1 in enumerate(ordered_seqs[:i]):
-            if sequences_match(seq,seq1,2):
-                match_seqs.append("%d:'%s'" % (i1+1,seq1))
-        print "%d\t%s\t%d\t%d\t%d\t[%s]" % (i+1,seq,
-                                          n_exact,n_1mismatch,n_2mismatch,
-                                          ','.join(match_seqs))
+        for i1 in sorted([ranks[seq1] for seq1 in group_2mismatch
+                          if ranks[seq1] < i]):
+            match_seqs.append("%d:'%s'" % (i1+1,ordered_seqs[i1]))
+        line = "%d\t%s\t%d\t%d\t%d\t[%s]" % (i+1,seq,
+                                                n_exact,n_1mismatch,n_2mismatch,
+                                                ','.join(match_seqs))
+        if table is not None:
+            line += "\t%s" % table.lookup(seq)
+        print line
         if n_exact < cutoff:
             print "...remainder occur less than %d times (set by --cutoff)" % cutoff
             break
@@ -212,6 +831,136 @@ GAAACGCGGCACAGA
         group = b.group('CCGTCCAT')
         self.assertEqual(b.count_for(*group),2)
 
+class TestHeavyHitters(unittest.TestCase):
+    def test_heavy_hitters_exact(self):
+        hitters = HeavyHitters(10)
+        for item in 'AABBBCAAD':
+            hitters.add(item)
+        self.assertEqual(hitters.counts,{'A':4,'B':3,'C':1,'D':1})
+        self.assertEqual(hitters.total,9)
+        self.assertEqual(hitters.error,0)
+        self.assertEqual(hitters.top(2),[('A',4),('B',3)])
+        self.assertEqual(hitters.bounds('A'),(4,4))
+    def test_heavy_hitters_bounds(self):
+        import random
+        rng = random.Random(1)
+        stream = ['HEAVY1']*2000 + ['HEAVY2']*1000 + \
+                 ['R%d' % rng.randint(0,100000) for i in xrange(5000)]
+        rng.shuffle(stream)
+        true_counts = {}
+        for item in stream:
+            true_counts[item] = true_counts.get(item,0) + 1
+        hitters1 = HeavyHitters(20)
+        hitters2 = HeavyHitters(20)
+        for item in stream[:3000]:
+            hitters1.add(item)
+        for item in stream[3000:]:
+            hitters2.add(item)
+        hitters = hitters1.merge(hitters2)
+        self.assertEqual(hitters.total,len(stream))
+        self.assertTrue(len(hitters.counts) <= 40)
+        self.assertTrue(hitters.error <= len(stream)/21)
+        self.assertEqual([x[0] for x in hitters.top(2)],['HEAVY1','HEAVY2'])
+        for item in true_counts:
+            lower,upper = hitters.bounds(item)
+            self.assertTrue(lower <= true_counts[item] <= upper)
+    def test_barcodes_max_sequences(self):
+        fastq_data = cStringIO.StringIO(
+"""@HWI-700511R:233:C446JACXX:6:1101:1241:2242 1:N:0:CCGTCCAT
+GAAACGCGGCACAGA
++
+<BBFFBFFBBFFF7B
+@HWI-700511R:233:C446JACXX:6:1101:1280:2080 1:N:0:GTCNNCAT
+CGAGCTCGAATTCAT
++
+<0<<BFF<0BFFFII
+@HWI-700511R:233:C446JACXX:6:1101:1241:2242 1:N:0:CCGTCCAT
+GAAACGCGGCACAGA
++
+<BBFFBFFBBFFF7B
+""")
+        b = Barcodes(max_sequences=1)
+        b.load(fp=fastq_data)
+        self.assertEqual(b.sequences(),['CCGTCCAT','GTCNNCAT'])
+        self.assertEqual(b.count_for('CCGTCCAT'),2)
+        self.assertEqual(b.error,0)
+
+class TestIndexReads(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self.wd = tempfile.mkdtemp()
+        self.i1 = ['CCGTCCAT','CCGTCCAT','GTCNNCAT','CCGTCCAT','ACGT']
+        self.i2 = ['TTAGGC','TTAGGC','TTAGGC','TTAGGA','TTAGGC']
+        for name,seqs in (('I1',self.i1),('I2',self.i2)):
+            fastq = os.path.join(self.wd,
+                                 "Undetermined_S0_L001_%s_001.fastq" % name)
+            fp = open(fastq,'w')
+            for i,seq in enumerate(seqs):
+                fp.write("@NB500968:70:HCYMKBGX2:1:11101:%d:1000 "
+                         "%s:N:0:0\n%s\n+\n%s\n" % (i,name[1],seq,
+                                                      'E'*len(seq)))
+            fp.close()
+        self.fastq1 = os.path.join(self.wd,"Undetermined_S0_L001_I1_001.fastq")
+        self.fastq2 = os.path.join(self.wd,"Undetermined_S0_L001_I2_001.fastq")
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.wd)
+    def test_count_index_reads(self):
+        counts = count_index_sequences(fp=open(self.fastq1),index_reads=True)
+        self.assertEqual(counts,{'CCGTCCAT':3,'GTCNNCAT':1,'ACGT':1})
+    def test_count_index_read_pairs(self):
+        counts = count_index_read_pairs(self.fastq1,self.fastq2)
+        self.assertEqual(counts,{'CCGTCCAT+TTAGGC':2,
+                                 'CCGTCCAT+TTAGGA':1,
+                                 'GTCNNCAT+TTAGGC':1,
+                                 'ACGT+TTAGGC':1})
+        hitters = count_index_read_pairs(self.fastq1,self.fastq2,
+                                         max_sequences=10)
+        self.assertEqual(hitters.counts,counts)
+    def test_count_index_read_pairs_different_lengths(self):
+        fp = open(self.fastq2,'a')
+        fp.write("@NB500968:70:HCYMKBGX2:1:11101:5:1000 2:N:0:0\n"
+                 "TTAGGC\n+\nEEEEEE\n")
+        fp.close()
+        self.assertRaises(Exception,count_index_read_pairs,
+                          self.fastq1,self.fastq2)
+    def test_group_fastqs(self):
+        r1 = os.path.join(self.wd,"Undetermined_S0_L001_R1_001.fastq")
+        self.assertEqual(group_fastqs([r1,self.fastq2,self.fastq1]),
+                         [(r1,None,False),
+                          (self.fastq1,self.fastq2,True)])
+        self.assertEqual(group_fastqs([self.fastq2]),
+                         [(self.fastq2,None,True)])
+        self.assertEqual(group_fastqs(['reads.fastq']),
+                         [('reads.fastq',None,False)])
+    def test_barcodes_load_index_pair(self):
+        b = Barcodes()
+        b.load_index_pair(self.fastq1,self.fastq2)
+        self.assertEqual(b.count_for('CCGTCCAT+TTAGGC'),2)
+        self.assertEqual(b.group('CCGTCCAT+TTAGGC'),['CCGTCCAT+TTAGGA',
+                                                     'CCGTCCAT+TTAGGC'])
+
+class TestMismatchIndex(unittest.TestCase):
+    def test_mismatch_index(self):
+        """MismatchIndex: neighbours are the same as for sequences_match
+        """
+        seqs = ['CCGTCCAT','CCGTGCAT','GTCNNCAT','CCGNCCAT','CCGTCCTT',
+                'ACGTACGA','CCGTCC','CCGTCCATNN','NNNNNNNN']
+        index = MismatchIndex(seqs)
+        self.assertEqual(sorted(index.neighbours('CCGTCCAT',0)),
+                         ['CCGTCCAT'])
+        self.assertEqual(index.neighbours('CCGTCCAA',0),[])
+        for query in seqs + ['CCGTCCAA','CCGNCCNT','GTC','AAAAAAAAAA','']:
+            for max_mismatches in (1,2,3):
+                expected = sorted([s for s in seqs
+                                   if sequences_match(s,query,
+                                                      max_mismatches)])
+                self.assertEqual(sorted(index.neighbours(query,
+                                                         max_mismatches)),
+                                 expected,
+                                 "%s (%d mismatches)" % (query,
+                                                         max_mismatches))
+
 class TestSequencesMatchFunction(unittest.TestCase):
     def test_sequences_match_exact(self):
         self.assertTrue(sequences_match('AGGTCTA','AGGTCTA'))
@@ -244,15 +993,40 @@ if __name__ == "__main__":
                               version="%prog "+__version__,
                               description="Examine barcode sequences from one or more "
                               "Fastq files and report the most prevalent. Sequences will "
-                              "be pooled from all specified Fastqs before being analysed.")
+                              "be pooled from all specified Fastqs before being analysed. "
+                              "Fastqs with index reads (e.g. 'I1' and 'I2' Fastqs from "
+                              "bcl2fastq) are identified from their names, and the "
+                              "sequences are taken from the reads rather than the headers.")
     p.add_option('--cutoff',action='store',dest='cutoff',default=1000000,type='int',
                  help="Minimum number of times a barcode sequence must appear to be "
                  "reported (default is 1000000)")
+    p.add_option('-n',action='store',dest='n_processors',default=None,type='int',
+                 help="specify number of cores to use (default: all available)")
+    p.add_option('--barcode',action='append',dest='expected_barcodes',default=[],
+                 help="specify an expected barcode sequence (can be used multiple "
+                 "times); the expected barcode that each index sequence would be "
+                 "assigned to when demultiplexing is also reported")
+    p.add_option('--samplesheet',action='store',dest='sample_sheet',default=None,
+                 help="read the expected barcode sequences from SAMPLE_SHEET (as an "
+                 "alternative to --barcode)")
+    p.add_option('--max-sequences',action='store',dest='max_sequences',
+                 default=None,type='int',
+                 help="only keep counts for the MAX_SEQUENCES most frequent "
+                 "barcode sequences, using a fixed amount of memory (the "
+                 "reported counts are then approximate)")
     options,args = p.parse_args()
     if len(args) == 0:
         p.error("Must supply at least one Fastq file")
+    expected_barcodes = list(options.expected_barcodes)
+    if options.sample_sheet is not None:
+        for line in IlluminaData.SampleSheet(options.sample_sheet).data:
+            index_seq = IlluminaData.samplesheet_index_sequence(line)
+            if index_seq is not None:
+                expected_barcodes.append(index_seq)
     try:
-        main(args,options.cutoff)
+        main(args,options.cutoff,n_processors=options.n_processors,
+             expected_barcodes=expected_barcodes,
+             max_sequences=options.max_sequences)
     except KeyboardInterrupt:
         print "Terminating following Ctrl-C"
         pass
@@ -16,7 +16,7 @@ the files form an R1/2 pair.
 
 """
 
-__version__ = "1.0.0"
+__version__ = "1.1.0"
 
 #######################################################################
 # Import modules that this module depends on
@@ -47,6 +47,8 @@ if __name__ == "__main__":
                               version="%prog "+__version__,
                               description="Check that read headers for R1 and R2 fastq files "
                               "are in agreement, and that the files form an R1/2 pair.")
+    p.add_option('-q','--quiet',action='store_true',dest='quiet',default=False,
+                 help="don't report progress")
     # Parse command line
     options,args = p.parse_args()
     # Get data directory name
@@ -55,7 +57,8 @@ if __name__ == "__main__":
     fastq_file_r1 = args[0]
     fastq_file_r2 = args[1]
     # Process the data
-    if FASTQFile.fastqs_are_pair(fastq_file_r1,fastq_file_r2):
+    if FASTQFile.fastqs_are_pair(fastq_file_r1,fastq_file_r2,
+                                 verbose=(not options.quiet)):
         sys.exit(0)
     else:
         logging.error("Not R1/R2 pair")
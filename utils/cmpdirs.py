@@ -19,7 +19,7 @@ Compare the contents of two directories.
 # Module metadata
 #######################################################################
 
-__version__ = '0.0.3'
+__version__ = '0.1.1'
 
 #######################################################################
 # Import modules that this module depends on
@@ -30,6 +30,7 @@ import os
 import optparse
 import logging
 import itertools
+import functools
 from multiprocessing import Pool
 
 # Put .. onto Python search path for modules
@@ -38,6 +39,7 @@ SHARE_DIR = os.path.abspath(
         os.path.join(os.path.dirname(sys.argv[0]),'..')))
 sys.path.append(SHARE_DIR)
 import bcftbx.Md5sum as Md5sum
+import bcftbx.fswalker as fswalker
 
 #######################################################################
 # Classes
@@ -85,7 +87,7 @@ class CmpResult:
 # Functions
 #######################################################################
 
-def yield_filepairs(dir1,dir2,include_dirs=False):
+def yield_filepairs(dir1,dir2,include_dirs=False,threads=None):
     """Return pairs of equivalent files under two directories
  
     Walk directory structure under dir1 and iteratively yield
@@ -96,25 +98,35 @@ def yield_filepairs(dir1,dir2,include_dirs=False):
     but the second may not. Also additional files may exist
     under dir2 but these will not be returned.
 
+    'threads' optionally specifies the number of threads to
+    use to scan the directories under dir1 in parallel.
+
     """
     dir1 = os.path.abspath(dir1)
     dir2 = os.path.abspath(dir2)
-    for d in os.walk(dir1,followlinks=True):
-        d1 = os.path.normpath(d[0])
-        if os.path.islink(d1):
+    # Symlinked directories (taken from the entries in their
+    # parent directories, to avoid checking each directory)
+    linked_dirs = set()
+    if os.path.islink(dir1):
+        linked_dirs.add(dir1)
+    for dirpath,dirs,files in fswalker.walk(dir1,followlinks=True,
+                                            threads=threads):
+        d1 = os.path.normpath(dirpath)
+        linked_dirs.update([d.path for d in dirs if d.is_symlink()])
+        if dirpath in linked_dirs:
             yield (d1,os.path.normpath(
                 os.path.join(dir2,os.path.relpath(d1,dir1))))
         else:
             if include_dirs:
                 yield (d1,os.path.normpath(
                     os.path.join(dir2,os.path.relpath(d1,dir1))))
-            for f in d[2]:
+            for f in files:
                 # File in dir1
-                f1 = os.path.join(d1,f)
+                f1 = os.path.join(d1,f.name)
                 f2 = os.path.join(dir2,os.path.relpath(f1,dir1))
                 yield (f1,f2)
 
-def cmp_filepair(file_pair):
+def cmp_filepair(file_pair,stream=False):
     """Compare a pair of files
 
     'file_pair' is a tuple consisting of a pair of file paths
@@ -123,8 +135,14 @@ def cmp_filepair(file_pair):
     The two paths are compared and a CmpResult object is
     returned.
 
+    Files of different sizes are reported as failing without
+    reading them (see 'Md5sum.Md5Checker.md5cmp_files').
+
     Arguments:
       file_pair: tuple 
+      stream: (optional) if True then compare the contents of
+        files directly (stopping at the first difference) rather
+        than computing MD5 sums
 
     """
     f1,f2 = file_pair
@@ -154,10 +172,10 @@ def cmp_filepair(file_pair):
                 result = Md5sum.Md5Checker.TYPES_DIFFER
         else:
             # Compare files
-            result = Md5sum.Md5Checker.md5cmp_files(f1,f2)
+            result = Md5sum.Md5Checker.md5cmp_files(f1,f2,stream=stream)
     return CmpResult(f1,f2,result)
 
-def cmp_dirs(dir1,dir2,n=1):
+def cmp_dirs(dir1,dir2,n=1,stream=False):
     """Compare the contents of a pair of directories
 
     Arguments:
@@ -165,6 +183,8 @@ def cmp_dirs(dir1,dir2,n=1):
       dir2: directory to compare against reference
       n:    number of processors to use (defaults to 1
             i.e. single core)
+      stream: (optional) if True then compare the contents
+            of files directly rather than computing MD5 sums
 
     Returns:
       Dictionary where keys are comparison result codes
@@ -178,7 +198,8 @@ def cmp_dirs(dir1,dir2,n=1):
     else:
         pool = Pool(n)
         mapper = pool.imap
-    for result in mapper(cmp_filepair,yield_filepairs(dir1,dir2)):
+    for result in mapper(functools.partial(cmp_filepair,stream=stream),
+                         yield_filepairs(dir1,dir2)):
         print "%s: %s" % (result.relpath(dir1),result.status_message)
         try:
             counts[result.status] += 1
@@ -198,15 +219,22 @@ if __name__ == '__main__':
                               version="%prog "+__version__,
                               description="Compare contents of DIR1 against "
                               "corresponding files and directories in DIR2. "
-                              "Files are compared using MD5 sums, symlinks "
-                              "using their targets.")
+                              "Files are compared using MD5 sums (or directly "
+                              "if --stream is specified), symlinks using their "
+                              "targets. Files with different sizes are "
+                              "reported as failing without being read.")
     p.add_option('-n',action='store',dest='n_processors',
                  default=1,type='int',
                  help="specify number of cores to use")
+    p.add_option('--stream',action='store_true',dest='stream',default=False,
+                 help="compare file contents directly block by block "
+                 "(stopping at the first difference) rather than "
+                 "computing MD5 sums")
     options,args = p.parse_args()
     if len(args) != 2:
         p.error("supply two directories to compare")
-    counts = cmp_dirs(args[0],args[1],n=options.n_processors)
+    counts = cmp_dirs(args[0],args[1],n=options.n_processors,
+                      stream=options.stream)
     if counts:
         total = sum([counts[x] for x in counts])
     else:
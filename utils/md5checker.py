@@ -13,6 +13,10 @@
 
 Utility for checking files and directories using md5 checksums.
 
+Other types of checksum (e.g. SHA-256) can also be generated and
+verified, and checksums for several algorithms can be generated in
+a single pass through the files.
+
 Uses the 'Md5Checker' and 'Md5Reporter' classes from the Md5sum module
 to perform the underlying operations.
 
@@ -22,7 +26,7 @@ to perform the underlying operations.
 # Module metadata
 #######################################################################
 
-__version__ = "0.3.2"
+__version__ = "0.6.0"
 
 #######################################################################
 # Import modules that this module depends on
@@ -43,7 +47,8 @@ import bcftbx.Md5sum as Md5sum
 # Functions
 #######################################################################
 
-def compute_md5sums(dirn,output_file=None,relative=False):
+def compute_md5sums(dirn,output_file=None,relative=False,threads=None,
+                    cache=None):
     """Compute and write MD5 sums for all files in a directory
 
     Walks the directory tree under the specified directory and
@@ -59,24 +64,58 @@ def compute_md5sums(dirn,output_file=None,relative=False):
       output_file: (optional) name of file to write MD5 sums to
       relative: if True then output file paths relative to
         the supplied directory (otherwise write absolute paths)
+      threads: (optional) number of files to compute MD5 sums
+        for concurrently
+      cache: (optional) Md5Cache instance to look up and store
+        MD5 sums
+
+    Returns:
+      Zero on success, 1 if errors were encountered
+    """
+    return compute_checksums(dirn,('md5',),output_files=(output_file,),
+                             relative=relative,threads=threads,cache=cache)
+
+def compute_checksums(dirn,algorithms,output_files=None,relative=False,
+                      threads=None,cache=None):
+    """Compute and write checksums for all files in a directory
+
+    Walks the directory tree under the specified directory and
+    computes the checksums for each file it finds, for each of
+    the specified algorithms (reading each file only once). The
+    checksums for each algorithm are written along with the names
+    of the files to a separate output file, or to stdout if only
+    a single algorithm is specified.
+
+    Note that the output format is compatible with the '-c'
+    option of the Linux 'md5sum', 'sha256sum' etc programs.
+
+    Arguments:
+      dirn: directory to run the checksum computation on
+      algorithms: list of algorithms to compute checksums for
+      output_files: (optional) list of names of files to write
+        the checksums to (one for each algorithm)
+      relative: if True then output file paths relative to
+        the supplied directory (otherwise write absolute paths)
+      threads: (optional) number of files to compute checksums
+        for concurrently
+      cache: (optional) Md5Cache instance to look up and store
+        MD5 sums
 
     Returns:
       Zero on success, 1 if errors were encountered
     """
     retval = 0
-    if output_file:
-        fp = open(output_file,'w')
-    else:
-        fp = sys.stdout
-    for filen,chksum in Md5sum.Md5Checker.compute_md5sums(dirn):
+    fps = _open_output_files(algorithms,output_files)
+    for filen,chksums in Md5sum.Md5Checker.compute_checksums(
+            dirn,algorithms=algorithms,threads=threads,cache=cache):
         if not relative:
             filen = os.path.join(dirn,filen)
-        fp.write("%s  %s\n" % (chksum,filen))
-    if output_file:
-        fp.close()
+        for fp,chksum in zip(fps,chksums):
+            fp.write("%s  %s\n" % (chksum,filen))
+    _close_output_files(fps)
     return retval
 
-def compute_md5sum_for_file(filen,output_file=None):
+def compute_md5sum_for_file(filen,output_file=None,cache=None):
     """Compute and write MD5 sum for specifed file
 
     Computes the MD5 sum for a file, and writes the sum and the file
@@ -88,55 +127,100 @@ def compute_md5sum_for_file(filen,output_file=None):
     Arguments:
       filen: file to compute the MD5 sum for
       output_file: (optional) name of file to write MD5 sum to
+      cache: (optional) Md5Cache instance to look up and store
+        MD5 sum
 
     Returns:
       Zero on success, 1 if errors were encountered
 
     """
-    retval = 1
-    if output_file:
-        fp = open(output_file,'w')
-    else:
-        fp = sys.stdout
+    return compute_checksums_for_file(filen,('md5',),
+                                      output_files=(output_file,),
+                                      cache=cache)
+
+def compute_checksums_for_file(filen,algorithms,output_files=None,
+                               cache=None):
+    """Compute and write checksums for specifed file
+
+    Computes the checksums for a file for each of the specified
+    algorithms (reading the file only once), and writes the
+    checksums and the file name to a separate output file for
+    each algorithm, or to stdout if only a single algorithm is
+    specified.
+
+    Note that the output format is compatible with the '-c'
+    option of the Linux 'md5sum', 'sha256sum' etc programs.
+
+    Arguments:
+      filen: file to compute the checksums for
+      algorithms: list of algorithms to compute checksums for
+      output_files: (optional) list of names of files to write
+        the checksums to (one for each algorithm)
+      cache: (optional) Md5Cache instance to look up and store
+        MD5 sum
+
+    Returns:
+      Zero on success, 1 if errors were encountered
+
+    """
+    retval = 0
+    fps = _open_output_files(algorithms,output_files)
     try:
-        chksum = Md5sum.md5sum(filen)
-        fp.write("%s  %s\n" % (chksum,filen))
+        chksums = Md5sum.checksums(filen,algorithms,cache=cache)
+        for fp,chksum in zip(fps,chksums):
+            fp.write("%s  %s\n" % (chksum,filen))
     except IOError, ex:
         # Error accessing file, report and skip
-        logging.error("%s: error while generating MD5 sum: '%s'" % (filen,ex))
+        logging.error("%s: error while generating checksums: '%s'" %
+                      (filen,ex))
         retval = 1
-    if output_file:
-        fp.close()
+    _close_output_files(fps)
     return retval
 
-def verify_md5sums(chksum_file,verbose=False):
+def verify_md5sums(chksum_file,verbose=False,threads=None,cache=None):
     """Check the MD5 sums for all entries specified in a file
 
-    For all entries in the supplied file, check the MD5 sum is
+    Wrapper for 'verify_checksums' for MD5 sums.
+
+    """
+    return verify_checksums(chksum_file,'md5',verbose=verbose,
+                            threads=threads,cache=cache)
+
+def verify_checksums(chksum_file,algorithm,verbose=False,threads=None,
+                     cache=None):
+    """Check the checksums for all entries specified in a file
+
+    For all entries in the supplied file, check the checksum is
     the same as that calculated by the function, and report
     whether they match or are different.
 
     The input file can either be output from this program or
-    from the Linux 'md5sum' program.
+    from the Linux 'md5sum', 'sha256sum' etc programs.
 
     Arguments:
-      chksum_file: name of the file containing the MD5 sums
+      chksum_file: name of the file containing the checksums
+      algorithm: algorithm used to generate the checksums
       verbose: (optional) if True then report status for all
         files checked, plus a summary; otherwise only report
         failures
+      threads: (optional) number of files to verify concurrently
+      cache: (optional) Md5Cache instance to look up and store
+        MD5 sums
 
     Returns:
       Zero on success, 1 if errors were encountered
 
     """
     # Set up reporter object
-    reporter = Md5sum.Md5CheckReporter(Md5sum.Md5Checker.verify_md5sums(chksum_file),
-                                       verbose=verbose)
+    reporter = Md5sum.Md5CheckReporter(
+        Md5sum.Md5Checker.verify_checksums(chksum_file,algorithm=algorithm,
+                                           threads=threads,cache=cache),
+        verbose=verbose)
     # Summarise
     if verbose: reporter.summary()
     return reporter.status
 
-def diff_directories(dirn1,dirn2,verbose=False):
+def diff_directories(dirn1,dirn2,verbose=False,threads=None,cache=None):
     """Check one directory against another using MD5 sums
 
     This compares one directory against another by computing the
@@ -157,19 +241,24 @@ def diff_directories(dirn1,dirn2,verbose=False):
       dirn2: "target" directory to be compared to dirn1
       verbose: (optional) if True then report status for all
         files checked; otherwise only report summary
+      threads: (optional) number of files to compare concurrently
+      cache: (optional) Md5Cache instance to look up and store
+        MD5 sums
 
     Returns:
       Zero on success, 1 if errors were encountered
 
     """
     # Set up reporter object
-    reporter = Md5sum.Md5CheckReporter(Md5sum.Md5Checker.md5cmp_dirs(dirn1,dirn2),
-                                       verbose=verbose)
+    reporter = Md5sum.Md5CheckReporter(
+        Md5sum.Md5Checker.md5cmp_dirs(dirn1,dirn2,threads=threads,
+                                      cache=cache),
+        verbose=verbose)
     # Summarise
     if verbose: reporter.summary()
     return reporter.status
 
-def diff_files(filen1,filen2,verbose=False):
+def diff_files(filen1,filen2,verbose=False,cache=None):
     """Check that the MD5 sums of two files match
 
     This compares two files by computing the MD5 sums for each.
@@ -179,6 +268,8 @@ def diff_files(filen1,filen2,verbose=False):
       filen2: "target" file to be compared with filen1
       verbose: (optional) if True then report status for all
         files checked; otherwise only report summary
+      cache: (optional) Md5Cache instance to look up and store
+        MD5 sums
 
     Returns:
       Zero on success, 1 if errors were encountered
@@ -187,7 +278,8 @@ def diff_files(filen1,filen2,verbose=False):
     # Set up reporter object
     reporter = Md5sum.Md5CheckReporter()
     # Compare files
-    reporter.add_result(filen1,Md5sum.Md5Checker.md5cmp_files(filen1,filen2))
+    reporter.add_result(filen1,Md5sum.Md5Checker.md5cmp_files(filen1,filen2,
+                                                                 cache=cache))
     if verbose:
         if reporter.n_ok:
             print "OK: MD5 sums match"
@@ -197,6 +289,62 @@ def diff_files(filen1,filen2,verbose=False):
             print "ERROR: unable to compute one or both MD5 sums"
     return reporter.status
 
+def checksum_file_names(chksum_file,algorithms):
+    """Return names of the output files for checksum algorithms
+
+    If there is only one algorithm then the supplied name is
+    used as-is; otherwise the name of each algorithm is appended
+    as an extension (e.g. 'CHKSUMS.md5', 'CHKSUMS.sha256').
+
+    Arguments:
+      chksum_file: base name for the output files (can be None)
+      algorithms: list of algorithms
+
+    Returns:
+      List of file names (one for each algorithm).
+
+    """
+    if len(algorithms) == 1 or chksum_file is None:
+        return [chksum_file]*len(algorithms)
+    return ["%s.%s" % (chksum_file,a) for a in algorithms]
+
+def checksum_file_algorithm(chksum_file):
+    """Return the checksum algorithm implied by a file name
+
+    The algorithm is taken from the file extension if it is the
+    name of a supported algorithm (e.g. 'CHKSUMS.sha256'),
+    otherwise MD5 is assumed.
+
+    Arguments:
+      chksum_file: name of the checksum file
+
+    Returns:
+      Name of the algorithm.
+
+    """
+    ext = os.path.splitext(chksum_file)[1][1:].lower()
+    if ext in Md5sum.DIGEST_ALGORITHMS:
+        return ext
+    return 'md5'
+
+def _open_output_files(algorithms,output_files):
+    """Internal: open the output streams for each algorithm
+
+    Algorithms without an output file name are written to
+    stdout.
+
+    """
+    if output_files is None:
+        output_files = [None]*len(algorithms)
+    return [open(f,'w') if f else sys.stdout for f in output_files]
+
+def _close_output_files(fps):
+    """Internal: close output streams (except for stdout)
+    """
+    for fp in fps:
+        if fp is not sys.stdout:
+            fp.close()
+
 def report(msg,verbose=False):
     """Write text to stdout
 
@@ -214,9 +362,10 @@ if __name__ == "__main__":
     usage = """
   %prog -d SOURCE_DIR DEST_DIR
   %prog -d FILE1 FILE2
-  %prog [ -o CHKSUM_FILE ] DIR
-  %prog [ -o CHKSUM_FILE ] FILE
-  %prog -c CHKSUM_FILE"""
+  %prog [ --digest ALGORITHMS ] [ -o CHKSUM_FILE ] DIR
+  %prog [ --digest ALGORITHMS ] [ -o CHKSUM_FILE ] FILE
+  %prog [ --digest ALGORITHM ] -c CHKSUM_FILE
+  %prog --cache CACHE_FILE --prune-cache"""
     p = optparse.OptionParser(usage=usage,
                               version="%prog "+__version__,
                               description=
@@ -231,6 +380,40 @@ if __name__ == "__main__":
                  help="read MD5 sums from the specified file and check them")
     p.add_option('-q','--quiet',action="store_false",dest="verbose",default=True,
                  help="suppress output messages and only report failures")
+    p.add_option('-t','--threads',action="store",dest="threads",type="int",
+                 default=Md5sum.MD5_THREADS,
+                 help="number of files to process concurrently (default: "
+                 "%default). Output is always in the same order regardless "
+                 "of the number of threads")
+    p.add_option('--digest',action="store",dest="digests",default=None,
+                 help="comma-separated list of checksum algorithms to generate "
+                 "checksums for, or the algorithm to verify checksums with "
+                 "(one or more of: %s; default: 'md5', or when verifying the "
+                 "extension of CHKSUM_FILE if it is one of these)" %
+                 ', '.join(Md5sum.DIGEST_ALGORITHMS))
+
+    # Checksum cache
+    group = optparse.OptionGroup(p,"Checksum cache",
+                                 "Optionally store MD5 sums in a persistent cache "
+                                 "file, so that they don't have to be recomputed "
+                                 "for files which haven't changed (as determined by "
+                                 "their device, inode, size and modification time) "
+                                 "when running the checker again.")
+    group.add_option('--cache',action="store",dest="cache_file",default=None,
+                     help="look up and store MD5 sums in CACHE_FILE (created "
+                     "if it doesn't already exist)")
+    group.add_option('--trust-cache',action="store_false",dest="verify_cache",
+                     default=False,
+                     help="use cached MD5 sums for unchanged files without "
+                     "reading them (the default)")
+    group.add_option('--verify-cache',action="store_true",dest="verify_cache",
+                     help="compute MD5 sums for all files and report any which "
+                     "don't match the cached values")
+    group.add_option('--prune-cache',action="store_true",dest="prune_cache",
+                     default=False,
+                     help="remove entries for missing or changed files from "
+                     "CACHE_FILE and exit")
+    p.add_option_group(group)
 
     # Directory differencing
     group = optparse.OptionGroup(p,"Directory comparison (-d, --diff)",
@@ -251,7 +434,10 @@ if __name__ == "__main__":
     group.add_option('-o','--output',action="store",dest="chksum_file",default=None,
                      help="optionally write computed MD5 sums to CHKSUM_FILE (otherwise the "
                      "sums are written to stdout). The output format is the same as that used "
-                     "by the Linux 'md5sum' tool.")
+                     "by the Linux 'md5sum' tool. If checksums are generated for more than "
+                     "one algorithm (using --digest) then they are written to separate "
+                     "files called CHKSUM_FILE.ALGORITHM (e.g. CHKSUM_FILE.sha256), in the "
+                     "format used by the equivalent Linux tool (e.g. 'sha256sum').")
     p.add_option_group(group)
 
     # Checksum verification
@@ -267,16 +453,50 @@ if __name__ == "__main__":
     # Set up logging output
     logging.basicConfig(format='%(message)s')
 
+    # Checksum algorithms
+    if options.digests:
+        digests = options.digests.lower().split(',')
+        for digest in digests:
+            if digest not in Md5sum.DIGEST_ALGORITHMS:
+                p.error("--digest: unsupported algorithm '%s'" % digest)
+        if 'crc32c' in digests and Md5sum.crc32c is None:
+            p.error("--digest: 'crc32c' needs the 'crc32c' Python module")
+    else:
+        digests = None
+
+    # Set up checksum cache
+    cache = None
+    if options.cache_file:
+        cache = Md5sum.Md5Cache(options.cache_file,
+                                verify=options.verify_cache)
+    elif options.prune_cache:
+        p.error("--prune-cache: needs --cache")
+
     # Figure out mode of operation
-    if options.check:
+    if options.prune_cache:
+        # Running in "prune cache" mode
+        if arguments:
+            p.error("--prune-cache: doesn't take any arguments")
+        n = cache.prune()
+        report("Removed %d entries from %s" % (n,options.cache_file),
+               options.verbose)
+        status = 0
+    elif options.check:
         # Running in "check" mode
         if len(arguments) != 1:
             p.error("-c: needs single argument (file containing MD5 sums)")
         chksum_file = arguments[0]
         if not os.path.isfile(chksum_file):
             p.error("Checksum '%s' file not found (or is not a file)" % chksum_file)
+        if digests is None:
+            digest = checksum_file_algorithm(chksum_file)
+        elif len(digests) == 1:
+            digest = digests[0]
+        else:
+            p.error("-c: can only verify checksums for one algorithm")
         # Do the verification
-        status = verify_md5sums(chksum_file,verbose=options.verbose)
+        status = verify_checksums(chksum_file,digest,verbose=options.verbose,
+                                  threads=options.threads,cache=cache)
     elif options.diff:
         # Running in "diff" mode
         if len(arguments) != 2:
@@ -293,27 +513,42 @@ if __name__ == "__main__":
             report("Recursively check copies of files in %s against originals in %s" %
                    (target,source),
                    options.verbose)
-            status = diff_directories(source,target,verbose=options.verbose)
+            status = diff_directories(source,target,verbose=options.verbose,
+                                      threads=options.threads,cache=cache)
         elif os.path.isfile(source) and os.path.isfile(target):
             # Compare two files
             report("Checking MD5 sums for %s and %s" % (source,target),options.verbose)
-            status = diff_files(source,target,verbose=options.verbose)
+            status = diff_files(source,target,verbose=options.verbose,
+                                cache=cache)
         else:
             p.error("Supplied arguments must be a pair of directories or a pair of files")
     else:
         # Running in "compute" mode
         if len(arguments) != 1:
             p.error("Needs a single argument (name of directory to generate MD5 sums for)")
+        if digests is None:
+            digests = ['md5']
         # Check if output file was specified
-        output_file = None
-        if options.chksum_file:
-            output_file = options.chksum_file
+        if len(digests) > 1 and not options.chksum_file:
+            p.error("Need to specify -o CHKSUM_FILE to generate checksums "
+                    "for more than one algorithm")
+        output_files = checksum_file_names(options.chksum_file,digests)
         # Generate the checksums
         if os.path.isdir(arguments[0]):
-            status = compute_md5sums(arguments[0],output_file)
+            status = compute_checksums(arguments[0],digests,output_files,
+                                       threads=options.threads,cache=cache)
         elif os.path.isfile(arguments[0]):
-            status = compute_md5sum_for_file(arguments[0],output_file)
+            status = compute_checksums_for_file(arguments[0],digests,
+                                                output_files,cache=cache)
         else:
             p.error("Cannot generate checksums for '%s': not a directory or file" % arguments[0])
+    # Report cache statistics
+    if cache is not None:
+        if options.verbose and not options.prune_cache:
+            cache.summary(fp=sys.stderr)
+        if cache.mismatches:
+            # Cached MD5 sums which don't match the files
+            status = 1
+        cache.close()
     # Finish
     sys.exit(status)
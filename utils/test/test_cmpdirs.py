@@ -69,6 +69,23 @@ class TestCmpFilepair(unittest.TestCase):
         f2 = TestUtils.make_file('test_file2',"lorum ipsum",basedir=self.wd)
         result = cmp_filepair((f1,f2))
         self.assertEqual(result.status,Md5Checker.MD5_FAILED)
+    def test_cmp_filepair_different_files_stream(self):
+        """cmp_filepair flags mismatch between differing files (stream)
+        """
+        f1 = TestUtils.make_file('test_file1',"Lorum ipsum",basedir=self.wd)
+        f2 = TestUtils.make_file('test_file2',"lorum ipsum",basedir=self.wd)
+        f3 = TestUtils.make_file('test_file3',"Lorum ipsum",basedir=self.wd)
+        result = cmp_filepair((f1,f2),stream=True)
+        self.assertEqual(result.status,Md5Checker.MD5_FAILED)
+        result = cmp_filepair((f1,f3),stream=True)
+        self.assertEqual(result.status,Md5Checker.MD5_OK)
+    def test_cmp_filepair_different_sizes(self):
+        """cmp_filepair flags mismatch between files of different sizes
+        """
+        f1 = TestUtils.make_file('test_file1',"Lorum ipsum",basedir=self.wd)
+        f2 = TestUtils.make_file('test_file2',"Lorum ipsum!",basedir=self.wd)
+        result = cmp_filepair((f1,f2))
+        self.assertEqual(result.status,Md5Checker.MD5_FAILED)
     def test_cmp_filepair_identical_links(self):
         """cmp_filepair matches identical links
         """
@@ -139,4 +156,10 @@ class TestCmpDirs(unittest.TestCase):
         self.assertEqual(count[Md5Checker.LINKS_SAME],6)
         self.assertEqual(count[Md5Checker.MD5_FAILED],1)
         self.assertEqual(count[Md5Checker.LINKS_DIFFER],1)
+        # Compare dirs using contents directly
+        count = cmp_dirs(self.dref.dirn,self.dcpy.dirn,n=2,stream=True)
+        self.assertEqual(count[Md5Checker.MD5_OK],7)
+        self.assertEqual(count[Md5Checker.LINKS_SAME],6)
+        self.assertEqual(count[Md5Checker.MD5_FAILED],1)
+        self.assertEqual(count[Md5Checker.LINKS_DIFFER],1)
 
@@ -12,6 +12,11 @@ from md5checker import diff_files
 from md5checker import compute_md5sum_for_file
 from md5checker import compute_md5sums
 from md5checker import verify_md5sums
+from md5checker import compute_checksums
+from md5checker import compute_checksums_for_file
+from md5checker import verify_checksums
+from md5checker import checksum_file_names
+from md5checker import checksum_file_algorithm
 
 class TestMd5sums(unittest.TestCase):
     """Test computing and verifying MD5 sums via files
@@ -67,6 +72,35 @@ class TestMd5sums(unittest.TestCase):
         checksum = open(self.checksum_file,'r').read()
         self.assertEqual("0b26e313ed4a7ca6904b0e9369e5b957  test.txt\n",checksum)
 
+    def test_compute_checksums(self):
+        """compute_checksums makes md5sum and sha256sum files for test directory
+        """
+        output_files = checksum_file_names(self.checksum_file,
+                                           ('md5','sha256'))
+        compute_checksums('.',('md5','sha256'),output_files=output_files,
+                          relative=True)
+        checksums = open(output_files[0],'r').read().split('\n')
+        checksums.sort()
+        reference_checksums = self.reference_checksums.split('\n')
+        reference_checksums.sort()
+        self.assertEqual(checksums,reference_checksums)
+        self.assertEqual(verify_checksums(output_files[1],'sha256'),0)
+        self.assertEqual(verify_checksums(output_files[1],'sha1'),1)
+
+    def test_compute_checksums_for_file(self):
+        """compute_checksums_for_file makes checksum files for single file
+        """
+        output_files = checksum_file_names(self.checksum_file,
+                                           ('md5','crc32'))
+        self.assertEqual(compute_checksums_for_file('test.txt',
+                                                    ('md5','crc32'),
+                                                    output_files=output_files),
+                         0)
+        self.assertEqual("0b26e313ed4a7ca6904b0e9369e5b957  test.txt\n",
+                         open(output_files[0],'r').read())
+        self.assertEqual("066611c9  test.txt\n",
+                         open(output_files[1],'r').read())
+
     def test_broken_links(self):
         """compute_md5sums make md5sum file for test directory with broken links
         """
@@ -161,3 +195,26 @@ class TestDiffDirectoriesFunction(unittest.TestCase):
                                              self.dir2.dirn),0)
         self.assertEqual(diff_directories(self.dir2.dirn,
                                           self.dir1.dirn),0)
+
+class TestChecksumFileNames(unittest.TestCase):
+    """Test naming checksum files (checksum_file_names)
+
+    """
+    def test_single_algorithm(self):
+        self.assertEqual(checksum_file_names('CHKSUMS',('sha256',)),
+                         ['CHKSUMS'])
+        self.assertEqual(checksum_file_names(None,('md5',)),[None])
+
+    def test_multiple_algorithms(self):
+        self.assertEqual(checksum_file_names('CHKSUMS',('md5','sha256')),
+                         ['CHKSUMS.md5','CHKSUMS.sha256'])
+
+class TestChecksumFileAlgorithm(unittest.TestCase):
+    """Test getting algorithm from checksum file name (checksum_file_algorithm)
+
+    """
+    def test_checksum_file_algorithm(self):
+        self.assertEqual(checksum_file_algorithm('CHKSUMS.sha256'),'sha256')
+        self.assertEqual(checksum_file_algorithm('CHKSUMS.MD5'),'md5')
+        self.assertEqual(checksum_file_algorithm('CHKSUMS.txt'),'md5')
+        self.assertEqual(checksum_file_algorithm('CHKSUMS'),'md5')